@@ -0,0 +1,149 @@
+"""
+Campi di form condivisi
+RemoteSelectField / RemoteSelectMultipleField: select con scelte caricate via AJAX
+(ricerca e paginazione lato server, vedi static/js/remote-select.js). Nel markup finiscono
+solo l'opzione vuota e quelle selezionate, e in validazione si verificano con una query
+soltanto gli id inviati: il costo del form non cresce con il catalogo o con i clienti.
+"""
+
+from abc import ABC, abstractmethod
+from flask import url_for
+from wtforms import SelectField, SelectMultipleField
+from wtforms.validators import ValidationError
+from app import db
+
+
+def int_or_none(value):
+    """Converte in int o None se stringa vuota o valore non valido"""
+    if value == '' or value is None:
+        return None
+    if isinstance(value, int):
+        return value
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def risposta_select(pagination, serializza):
+    """
+    Risposta JSON standard per gli endpoint dei campi remoti
+
+    Args:
+        pagination: Pagina di risultati (Flask-SQLAlchemy)
+        serializza: Funzione oggetto -> dict con almeno 'id' e 'text'
+    """
+    return {
+        'results': [serializza(obj) for obj in pagination.items],
+        'has_more': pagination.has_next,
+        'total': pagination.total,
+    }
+
+
+class _SceltaRemota(ABC):
+    """Logica comune: scelte lette solo per gli id selezionati, validazione per id"""
+
+    def _init_remoto(self, model, endpoint, etichetta, vuoto, placeholder, filtro):
+        self.model = model
+        self.filtro = filtro
+        self.endpoint = endpoint
+        self.etichetta = etichetta or str
+        self.vuoto = vuoto
+        self.placeholder = placeholder or (vuoto[1] if vuoto else 'Cerca...')
+        self._oggetti = None
+
+    @abstractmethod
+    def _ids_selezionati(self):
+        """Id attualmente selezionati nel campo"""
+
+    def _ids_iniziali(self):
+        """Id del valore letto dall'oggetto passato al form (obj=...), per i form di modifica"""
+        valori = self.object_data
+        if valori is None:
+            return []
+        if not isinstance(valori, (list, tuple, set)):
+            valori = [valori]
+        return [v.id if isinstance(v, self.model) else v for v in valori if v]
+
+    def _oggetti_selezionati(self):
+        """Oggetti selezionati, con una sola query (memorizzati per la richiesta)"""
+        ids = [i for i in self._ids_selezionati() if i]
+        if self._oggetti is None or set(self._oggetti) != set(ids):
+            if not ids:
+                self._oggetti = {}
+            else:
+                trovati = self.model.query.filter(self.model.id.in_(ids)).all()
+                self._oggetti = {obj.id: obj for obj in trovati}
+        return self._oggetti
+
+    def has_groups(self):
+        return False
+
+    def iter_choices(self):
+        selezionati = set(self._ids_selezionati())
+        if self.vuoto:
+            valore, testo = self.vuoto
+            yield (valore, testo, valore in selezionati or not any(selezionati), {})
+        for obj in self._oggetti_selezionati().values():
+            yield (obj.id, self.etichetta(obj), True, {})
+
+    def pre_validate(self, form):
+        ids = [i for i in self._ids_selezionati() if i and (not self.vuoto or i != self.vuoto[0])]
+        if not ids:
+            return
+
+        query = db.session.query(db.func.count(self.model.id)).filter(self.model.id.in_(ids))
+        if self.filtro is not None:
+            # Il valore già salvato sull'oggetto in modifica resta valido anche se non rispetta
+            # più il filtro (es. ticket di un cliente disattivato in seguito)
+            iniziali = self._ids_iniziali()
+            query = query.filter(db.or_(self.filtro, self.model.id.in_(iniziali)) if iniziali else self.filtro)
+        if query.scalar() != len(set(ids)):
+            raise ValidationError(self.gettext('Scelta non valida'))
+
+    def __call__(self, **kwargs):
+        kwargs.setdefault('data-remote-select', url_for(self.endpoint))
+        kwargs.setdefault('data-placeholder', self.placeholder)
+        if self.vuoto:
+            kwargs.setdefault('data-empty-value', self.vuoto[0])
+            kwargs.setdefault('data-empty-label', self.vuoto[1])
+        return super().__call__(**kwargs)
+
+
+class RemoteSelectField(_SceltaRemota, SelectField):
+    """
+    Select singola con scelte remote
+
+    Args:
+        model: Modello delle scelte (con colonna id)
+        endpoint (str): Endpoint JSON di ricerca (q, page -> risposta_select)
+        etichetta: Funzione oggetto -> testo dell'opzione selezionata
+        vuoto (tuple): Opzione vuota (valore, testo), es. (0, 'Tutti i clienti')
+        placeholder (str): Testo del campo di ricerca
+        filtro: Criterio SQL che le scelte devono rispettare in validazione (es. Cliente.is_active == True);
+            il valore iniziale dell'oggetto in modifica è sempre accettato
+    """
+
+    def __init__(self, label=None, validators=None, model=None, endpoint=None, etichetta=None,
+                 vuoto=None, placeholder=None, filtro=None, coerce=int_or_none, **kwargs):
+        super().__init__(label, validators, coerce=coerce, choices=[], **kwargs)
+        self._init_remoto(model, endpoint, etichetta, vuoto, placeholder, filtro)
+
+    def _ids_selezionati(self):
+        data = self.data
+        # I route a volte assegnano direttamente l'oggetto (es. form.cliente.data = ticket.cliente)
+        if isinstance(data, self.model):
+            data = data.id
+        return [data]
+
+
+class RemoteSelectMultipleField(_SceltaRemota, SelectMultipleField):
+    """Select multipla con scelte remote (stessi argomenti di RemoteSelectField)"""
+
+    def __init__(self, label=None, validators=None, model=None, endpoint=None, etichetta=None,
+                 vuoto=None, placeholder=None, filtro=None, coerce=int_or_none, **kwargs):
+        super().__init__(label, validators, coerce=coerce, choices=[], **kwargs)
+        self._init_remoto(model, endpoint, etichetta, vuoto, placeholder, filtro)
+
+    def _ids_selezionati(self):
+        return list(self.data or [])
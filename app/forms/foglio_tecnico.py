@@ -1,25 +1,10 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, TextAreaField, SelectField, IntegerField, DateTimeField, DecimalField, SubmitField, SelectMultipleField, HiddenField, BooleanField
+from wtforms import StringField, TextAreaField, SelectField, IntegerField, DateField, DateTimeField, DecimalField, SubmitField, SelectMultipleField, HiddenField, BooleanField
 from wtforms.validators import DataRequired, Length, Optional, NumberRange, ValidationError, Email
 from app.models.cliente import Cliente
 from app.models.user import User
-
-
-def safe_int_or_none(value):
-    """Converte in int o None se stringa vuota o valore non valido"""
-    if value == '' or value is None:
-        return None
-    if isinstance(value, int):
-        return value
-    try:
-        return int(value)
-    except (ValueError, TypeError):
-        return None
-
-
-def get_clienti():
-    """Funzione per ottenere tutti i clienti attivi"""
-    return Cliente.query.filter_by(is_active=True).order_by(Cliente.ragione_sociale).all()
+from app.models.department import Department
+from app.forms.fields import RemoteSelectField, int_or_none
 
 
 def get_tecnici():
@@ -27,12 +12,6 @@ def get_tecnici():
     return User.query.filter_by(is_active=True).order_by(User.first_name, User.last_name).all()
 
 
-def get_ricambi():
-    """Funzione per ottenere tutti i ricambi disponibili"""
-    from app.models.ricambio import Ricambio
-    return Ricambio.query.order_by(Ricambio.codice).all()
-
-
 class FoglioTecnicoStep1Form(FlaskForm):
     """Step 1: Informazioni Base del Cliente e Intervento"""
     
@@ -84,7 +63,7 @@ class FoglioTecnicoStep1Form(FlaskForm):
 class FoglioTecnicoStep2Form(FlaskForm):
     """Step 2: Dettagli Tecnici dell'Intervento"""
     
-    macchine = SelectMultipleField('Macchine Coinvolte', choices=[], coerce=safe_int_or_none,
+    macchine = SelectMultipleField('Macchine Coinvolte', choices=[], coerce=int_or_none,
         validators=[Optional()], validate_choice=False,
         description='Seleziona le macchine su cui si è intervenuti')
     
@@ -106,7 +85,7 @@ class FoglioTecnicoStep2Form(FlaskForm):
     description='Specifica che tipo di operazione stai effettuando sulle macchine')
     
     # Campo per macchine sostitutive (quando si fa riparazione con prestito)
-    macchine_sostitutive = SelectMultipleField('Macchine Sostitutive', choices=[], coerce=safe_int_or_none,
+    macchine_sostitutive = SelectMultipleField('Macchine Sostitutive', choices=[], coerce=int_or_none,
         validators=[Optional()], validate_choice=False,
         description='Seleziona le macchine da dare in prestito durante la riparazione (solo per "Riparazione in sede con prestito")')
     
@@ -123,7 +102,7 @@ class FoglioTecnicoStep2Form(FlaskForm):
 class FoglioTecnicoStep3Form(FlaskForm):
     """Step 3: Ricambi Utilizzati"""
     
-    ricambi_utilizzati = SelectMultipleField('Ricambi Utilizzati', choices=[], coerce=safe_int_or_none,
+    ricambi_utilizzati = SelectMultipleField('Ricambi Utilizzati', choices=[], coerce=int_or_none,
         validators=[Optional()], validate_choice=False,
         description='Seleziona i ricambi utilizzati durante l\'intervento')
     
@@ -137,22 +116,8 @@ class FoglioTecnicoStep3Form(FlaskForm):
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # Non popoliamo le choices del SelectMultipleField per migliorare le performance
+        # I ricambi sono cercati via AJAX (api_ricambi_department): nessuna scelta caricata qui
         self.ricambi_utilizzati.choices = []
-        
-        # Carica i dati ricambi solo per JavaScript (limitato ai primi 1000 per performance)
-        from app.models.ricambio import Ricambio
-        ricambi = Ricambio.query.order_by(Ricambio.codice).limit(1000).all()
-        self.ricambi_data = [
-            {
-                'id': ricambio.id,
-                'code': ricambio.codice,
-                'description': ricambio.descrizione,
-                'stock': ricambio.quantita_disponibile,
-                'stock_status': ricambio.stato_disponibilita
-            }
-            for ricambio in ricambi
-        ]
 
 
 class FoglioTecnicoStep4Form(FlaskForm):
@@ -245,7 +210,8 @@ class FoglioTecnicoFilterForm(FlaskForm):
     search = StringField('Ricerca', validators=[Optional()],
                         description='Cerca nel titolo, descrizione o numero foglio')
 
-    cliente = SelectField('Cliente', choices=[], coerce=safe_int_or_none)
+    cliente = RemoteSelectField('Cliente', model=Cliente, endpoint='clients.api_select_clienti',
+        etichetta=lambda c: c.ragione_sociale, vuoto=(0, 'Tutti i clienti'))
     
     stato = SelectField('Stato', choices=[
         ('', 'Tutti gli stati'),
@@ -270,7 +236,7 @@ class FoglioTecnicoFilterForm(FlaskForm):
         ('Altro', 'Altro')
     ])
 
-    tecnico = SelectField('Tecnico', choices=[], coerce=safe_int_or_none)
+    tecnico = SelectField('Tecnico', choices=[], coerce=int_or_none)
     
     modalita_pagamento = SelectField('Modalità Pagamento', choices=[
         ('', 'Tutte le modalità'),
@@ -289,12 +255,6 @@ class FoglioTecnicoFilterForm(FlaskForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
-        # Popola le scelte per i clienti
-        self.cliente.choices = [(0, 'Tutti i clienti')] + [
-            (cliente.id, cliente.ragione_sociale)
-            for cliente in get_clienti()
-        ]
-        
         # Popola le scelte per i tecnici
         self.tecnico.choices = [(0, 'Tutti i tecnici')] + [
             (user.id, f"{user.first_name} {user.last_name}")
@@ -302,6 +262,41 @@ class FoglioTecnicoFilterForm(FlaskForm):
         ]
 
 
+class RaccoltaPdfForm(FlaskForm):
+    """Filtri per la raccolta dei PDF dei fogli tecnici (documento unico o ZIP)"""
+
+    data_da = DateField('Dal', validators=[Optional()])
+    data_a = DateField('Al', validators=[Optional()])
+
+    cliente = RemoteSelectField('Cliente', model=Cliente, endpoint='clients.api_select_clienti',
+        etichetta=lambda c: c.ragione_sociale, vuoto=(0, 'Tutti i clienti'))
+
+    tecnico = SelectField('Tecnico', choices=[], coerce=int_or_none)
+
+    reparto = SelectField('Reparto', choices=[], coerce=int_or_none)
+
+    formato = SelectField('Formato', choices=[
+        ('pdf', 'PDF unico con segnalibri'),
+        ('zip', 'Archivio ZIP (un PDF per foglio)')
+    ], default='pdf')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.tecnico.choices = [(0, 'Tutti i tecnici')] + [
+            (user.id, f"{user.first_name} {user.last_name}")
+            for user in get_tecnici()
+        ]
+        self.reparto.choices = [(0, 'Tutti i reparti')] + [
+            (department.id, department.display_name)
+            for department in Department.query.filter_by(is_active=True).order_by(Department.display_name)
+        ]
+
+    def validate_data_a(self, field):
+        if field.data and self.data_da.data and field.data < self.data_da.data:
+            raise ValidationError('La data finale precede quella iniziale')
+
+
 # Form per la modifica rapida (editing di fogli già esistenti)
 class FoglioTecnicoQuickEditForm(FlaskForm):
     """Form semplificata per editing rapido di fogli esistenti"""
@@ -4,16 +4,7 @@ from wtforms.validators import DataRequired, Optional, Length, NumberRange, Vali
 from app.models.macchina import Macchina, TipoMacchina
 from app.models.cliente import Cliente
 from app.models.department import Department
-
-
-def int_or_none(value):
-    """Converte in int o None se stringa vuota"""
-    if value == '' or value is None:
-        return None
-    try:
-        return int(value)
-    except (ValueError, TypeError):
-        return None
+from app.forms.fields import RemoteSelectField, int_or_none
 
 
 class MacchinaForm(FlaskForm):
@@ -104,7 +95,9 @@ class MacchinaForm(FlaskForm):
         DataRequired(message='Il reparto è obbligatorio')
     ])
 
-    cliente_id = SelectField('Cliente Assegnato', coerce=int_or_none, validators=[Optional()],
+    cliente_id = RemoteSelectField('Cliente Assegnato', model=Cliente, endpoint='clients.api_select_clienti',
+        etichetta=lambda c: c.ragione_sociale, vuoto=('', 'Nessun cliente assegnato'), validators=[Optional()],
+        filtro=Cliente.is_active == True,
         description='Assegna la macchina direttamente a un cliente (opzionale)')
 
     submit = SubmitField('Salva')
@@ -122,11 +115,6 @@ class MacchinaForm(FlaskForm):
             (d.id, d.display_name) for d in Department.query.order_by(Department.display_name).all()
         ]
 
-        # Popola le scelte per cliente_id
-        self.cliente_id.choices = [('', 'Nessun cliente assegnato')] + [
-            (c.id, c.ragione_sociale) for c in Cliente.query.filter_by(is_active=True).order_by(Cliente.ragione_sociale).all()
-        ]
-
     def validate_codice(self, field):
         """Validazione codice univoco"""
         if hasattr(self, 'macchina') and self.macchina:
@@ -171,7 +159,8 @@ class MacchinaFilterForm(FlaskForm):
 
     department_id = SelectField('Reparto', coerce=int_or_none, choices=[('', 'Tutti i reparti')], validators=[Optional()])
 
-    cliente_id = SelectField('Cliente Assegnato', coerce=int_or_none, choices=[('', 'Tutti i clienti')], validators=[Optional()])
+    cliente_id = RemoteSelectField('Cliente Assegnato', model=Cliente, endpoint='clients.api_select_clienti',
+        etichetta=lambda c: c.ragione_sociale, vuoto=('', 'Tutti i clienti'), validators=[Optional()])
 
     submit = SubmitField('Filtra')
 
@@ -185,7 +174,3 @@ class MacchinaFilterForm(FlaskForm):
         # Popola le scelte per department_id
         departments = Department.query.order_by(Department.display_name).all()
         self.department_id.choices = [('', 'Tutti i reparti')] + [(d.id, d.display_name) for d in departments]
-
-        # Popola le scelte per cliente_id
-        clienti = Cliente.query.filter_by(is_active=True).order_by(Cliente.ragione_sociale).all()
-        self.cliente_id.choices = [('', 'Tutti i clienti')] + [(c.id, c.ragione_sociale) for c in clienti]
@@ -7,6 +7,7 @@ from app.models.ricambio import Ricambio
 from app.models.ticket import Ticket
 from app.models.department import Department
 from app.utils.permissions import get_accessible_departments
+from app.forms.fields import RemoteSelectField
 from datetime import datetime
 
 
@@ -76,9 +77,11 @@ class RicambioForm(FlaskForm):
 class MovimentoMagazzinoForm(FlaskForm):
     """Form per registrare movimenti di magazzino"""
     
-    ricambio_id = SelectField('Ricambio', validators=[
+    ricambio_id = RemoteSelectField('Ricambio', validators=[
         DataRequired(message='Seleziona un ricambio')
-    ], coerce=int, choices=[])
+    ], model=Ricambio, endpoint='magazzino.api_select_ricambi',
+        etichetta=lambda r: f"{r.codice} - {r.descrizione[:50]}{'...' if len(r.descrizione) > 50 else ''}",
+        vuoto=(0, 'Seleziona ricambio...'))
     
     tipo_movimento = SelectField('Tipo Movimento', validators=[
         DataRequired(message='Seleziona il tipo di movimento')
@@ -103,12 +106,6 @@ class MovimentoMagazzinoForm(FlaskForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
-        # Popola le scelte per i ricambi
-        self.ricambio_id.choices = [(0, 'Seleziona ricambio...')] + [
-            (r.id, f"{r.codice} - {r.descrizione[:50]}{'...' if len(r.descrizione) > 50 else ''}")
-            for r in Ricambio.query.order_by(Ricambio.codice).all()
-        ]
-        
         # Popola le scelte per i ticket (solo quelli aperti)
         self.ticket_id.choices = [(0, 'Nessun ticket collegato')] + [
             (t.id, f"{t.numero_ticket} - {t.titolo[:30]}{'...' if len(t.titolo) > 30 else ''}")
@@ -301,8 +298,10 @@ class CalendarioPrenotazioniForm(FlaskForm):
         NumberRange(min=2020, max=2030, message='Anno non valido')
     ])
     
-    filtro_ricambio = SelectField('Filtra per Ricambio', validators=[Optional()], 
-                                 coerce=int, choices=[])
+    filtro_ricambio = RemoteSelectField('Filtra per Ricambio', validators=[Optional()],
+        model=Ricambio, endpoint='magazzino.api_select_ricambi',
+        etichetta=lambda r: f"{r.codice} - {r.descrizione[:40]}{'...' if len(r.descrizione) > 40 else ''}",
+        vuoto=(0, 'Tutti i ricambi'))
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -313,9 +312,3 @@ class CalendarioPrenotazioniForm(FlaskForm):
             self.mese.data = now.month
         if not self.anno.data:
             self.anno.data = now.year
-        
-        # Popola le scelte per i ricambi
-        self.filtro_ricambio.choices = [(0, 'Tutti i ricambi')] + [
-            (r.id, f"{r.codice} - {r.descrizione[:40]}{'...' if len(r.descrizione) > 40 else ''}")
-            for r in Ricambio.query.order_by(Ricambio.codice).all()
-        ]
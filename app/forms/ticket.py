@@ -3,23 +3,8 @@ from wtforms import StringField, TextAreaField, SelectField, IntegerField, DateT
 from wtforms.validators import DataRequired, Length, Optional, NumberRange, ValidationError
 from app.models.cliente import Cliente
 from app.models.user import User
-
-
-def safe_int_or_none(value):
-    """Converte in int o None se stringa vuota o valore non valido"""
-    if value == '' or value is None:
-        return None
-    if isinstance(value, int):
-        return value
-    try:
-        return int(value)
-    except (ValueError, TypeError):
-        return None
-
-
-def get_clienti():
-    """Funzione per ottenere tutti i clienti attivi"""
-    return Cliente.query.filter_by(is_active=True).order_by(Cliente.ragione_sociale).all()
+from app.models.ricambio import Ricambio
+from app.forms.fields import RemoteSelectField, RemoteSelectMultipleField, int_or_none
 
 
 def get_users():
@@ -27,12 +12,6 @@ def get_users():
     return User.query.filter_by(is_active=True).order_by(User.first_name, User.last_name).limit(100).all()
 
 
-def get_ricambi():
-    """Funzione per ottenere tutti i ricambi disponibili"""
-    from app.models.ricambio import Ricambio
-    return Ricambio.query.order_by(Ricambio.codice).all()
-
-
 class TicketForm(FlaskForm):
     titolo = StringField('Titolo', validators=[
         DataRequired(message='Il titolo è obbligatorio')
@@ -42,7 +21,8 @@ class TicketForm(FlaskForm):
         DataRequired(message='La descrizione è obbligatoria')
     ])
     
-    cliente = SelectField('Cliente', choices=[], coerce=safe_int_or_none,
+    cliente = RemoteSelectField('Cliente', model=Cliente, endpoint='clients.api_select_clienti',
+        etichetta=lambda c: c.ragione_sociale, vuoto=(0, 'Seleziona cliente...'), filtro=Cliente.is_active == True,
         validators=[DataRequired(message='Seleziona un cliente')])
     
     # Campo alternativo per ricerca cliente
@@ -74,7 +54,7 @@ class TicketForm(FlaskForm):
         ('Chiuso', 'Chiuso')
     ], validators=[DataRequired()])
 
-    assigned_to = SelectField('Assegnato a', choices=[], coerce=safe_int_or_none)
+    assigned_to = SelectField('Assegnato a', choices=[], coerce=int_or_none)
     
     due_date = DateTimeField('Scadenza', validators=[Optional()], format='%Y-%m-%dT%H:%M')
     
@@ -85,7 +65,7 @@ class TicketForm(FlaskForm):
     note_interne = TextAreaField('Note Interne', validators=[Optional()])
     
     # Campo per macchine collegate (supporta selezione multipla)
-    macchine = SelectMultipleField('Macchine Collegate', choices=[], coerce=safe_int_or_none,
+    macchine = SelectMultipleField('Macchine Collegate', choices=[], coerce=int_or_none,
         validators=[Optional()], validate_choice=False, description='Seleziona le macchine coinvolte in questo ticket (opzionale)')
     
     # Campo per il tipo di operazione sulle macchine
@@ -98,22 +78,19 @@ class TicketForm(FlaskForm):
     ], validators=[Optional()], description='Specifica che tipo di operazione stai effettuando sulle macchine')
     
     # Campo per macchine sostitutive (quando si fa riparazione con prestito)
-    macchine_sostitutive = SelectMultipleField('Macchine Sostitutive', choices=[], coerce=safe_int_or_none,
+    macchine_sostitutive = SelectMultipleField('Macchine Sostitutive', choices=[], coerce=int_or_none,
         validators=[Optional()], validate_choice=False, description='Seleziona le macchine da dare in prestito durante la riparazione (solo per "Riparazione in sede con prestito")')
 
     # Campo per ricambi necessari
-    ricambi_necessari = SelectMultipleField('Ricambi Necessari', choices=[], coerce=safe_int_or_none,
-        validators=[Optional()], validate_choice=False, description='Seleziona i ricambi che potrebbero essere necessari per questo ticket')
+    ricambi_necessari = RemoteSelectMultipleField('Ricambi Necessari', model=Ricambio, endpoint='magazzino.api_select_ricambi',
+        etichetta=lambda r: f'{r.codice} - {r.descrizione}',
+        validators=[Optional()], description='Seleziona i ricambi che potrebbero essere necessari per questo ticket')
 
     submit = SubmitField('Salva Ticket')
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
-        # Non popoliamo le scelte per i clienti dato che usiamo autocomplete
-        # Questo migliora significativamente le performance
-        self.cliente.choices = [(0, 'Seleziona cliente...')]
-        
         # Popola le scelte per gli utenti assegnati
         self.assigned_to.choices = [(0, 'Non assegnato')] + [
             (user.id, user.full_name)
@@ -126,31 +103,7 @@ class TicketForm(FlaskForm):
         # Popola le scelte per le macchine sostitutive (inizialmente vuote, verranno caricate dinamicamente)
         self.macchine_sostitutive.choices = []
 
-        # Popola le scelte per i ricambi solo se necessario (per JavaScript)
-        # Non popoliamo le choices del SelectMultipleField per migliorare le performance
-        self.ricambi_necessari.choices = []
-        
-        # Carica i dati ricambi solo per JavaScript (limitato ai primi 1000 per performance)
-        from app.models.ricambio import Ricambio
-        ricambi = Ricambio.query.order_by(Ricambio.codice).limit(1000).all()
-        self.ricambi_data = [
-            {
-                'id': ricambio.id,
-                'code': ricambio.codice,
-                'description': ricambio.descrizione,
-                'stock': ricambio.quantita_disponibile,
-                'stock_status': ricambio.stato_disponibilita
-            }
-            for ricambio in ricambi
-        ]
-    
-    def validate_cliente(self, field):
-        """Validazione personalizzata per il campo cliente"""
-        if field.data and field.data != 0:
-            from app.models.cliente import Cliente
-            cliente = Cliente.query.get(field.data)
-            if not cliente:
-                raise ValidationError('Cliente selezionato non valido')
+        # Clienti e ricambi sono campi remoti: nessuna scelta caricata qui
     
     def validate_macchine(self, field):
         """Validazione personalizzata per il campo macchine"""
@@ -196,7 +149,8 @@ class TicketFilterForm(FlaskForm):
     search = StringField('Ricerca', validators=[Optional()],
                         description='Cerca nel titolo, descrizione o numero ticket')
 
-    cliente = SelectField('Cliente', choices=[], coerce=safe_int_or_none)
+    cliente = RemoteSelectField('Cliente', model=Cliente, endpoint='clients.api_select_clienti',
+        etichetta=lambda c: c.ragione_sociale, vuoto=(0, 'Tutti i clienti'))
     
     stato = SelectField('Stato', choices=[
         ('', 'Tutti gli stati'),
@@ -229,7 +183,7 @@ class TicketFilterForm(FlaskForm):
         ('Formazione', 'Formazione')
     ])
 
-    assigned_to = SelectField('Assegnato a', choices=[], coerce=safe_int_or_none)
+    assigned_to = SelectField('Assegnato a', choices=[], coerce=int_or_none)
 
     submit = SubmitField('Filtra')
     reset = SubmitField('Reset Filtri')
@@ -237,12 +191,6 @@ class TicketFilterForm(FlaskForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
-        # Popola le scelte per i clienti
-        self.cliente.choices = [(0, 'Tutti i clienti')] + [
-            (cliente.id, cliente.ragione_sociale)
-            for cliente in get_clienti()
-        ]
-        
         # Popola le scelte per gli utenti assegnati
         self.assigned_to.choices = [(0, 'Tutti gli utenti')] + [
             (user.id, user.full_name)
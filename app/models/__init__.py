@@ -7,6 +7,10 @@ from .ticket_attachment import TicketAttachment
 from .ticket_subtask import TicketSubtask
 from .foglio_tecnico import FoglioTecnico, foglio_macchine, foglio_ricambi
 from .email_import import EmailImportLog
+from .sincronizzazione_foglio import SincronizzazioneFoglio
+from .email_outbox import EmailOutbox
+from .documento_foglio import DocumentoFoglio
 from .email_draft import EmailDraft
-from .ricambio import Ricambio, MovimentoMagazzino, PrenotazioneRicambio
-from .macchina import TipoMacchina, Macchina, MovimentoMacchina, ticket_macchine, department_tipo_macchina
\ No newline at end of file
+from .ricambio import Ricambio, MovimentoMagazzino, PrenotazioneRicambio, AllarmeScorta, RicambioTrigramma, RiepilogoMovimentiRicambio
+from .macchina import TipoMacchina, Macchina, MovimentoMacchina, MacchinaTrigramma, RiepilogoMovimentiMacchina, ScadenzaMacchina, ticket_macchine, department_tipo_macchina
+from .archivio import ArchivioMovimenti
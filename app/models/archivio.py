@@ -0,0 +1,35 @@
+from datetime import datetime
+from app import db
+
+
+class ArchivioMovimenti(db.Model):
+    """Indice delle tabelle annuali di archivio dei movimenti (magazzino e macchine)"""
+    __tablename__ = 'archivi_movimenti'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tabella_origine = db.Column(db.String(50), nullable=False)  # movimenti_magazzino, movimenti_macchine
+    anno = db.Column(db.Integer, nullable=False)
+    nome_tabella = db.Column(db.String(64), nullable=False, unique=True)
+
+    righe = db.Column(db.Integer, default=0, nullable=False)
+    data_min = db.Column(db.DateTime)
+    data_max = db.Column(db.DateTime)
+
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('tabella_origine', 'anno', name='uq_archivi_movimenti_origine_anno'),
+    )
+
+    def __repr__(self):
+        return f'<ArchivioMovimenti {self.nome_tabella}: {self.righe} righe>'
+
+    def to_dict(self):
+        return {
+            'tabella_origine': self.tabella_origine,
+            'anno': self.anno,
+            'nome_tabella': self.nome_tabella,
+            'righe': self.righe,
+            'data_min': self.data_min.isoformat() if self.data_min else None,
+            'data_max': self.data_max.isoformat() if self.data_max else None,
+        }
@@ -0,0 +1,47 @@
+from datetime import datetime
+from app import db
+
+
+class DocumentoFoglio(db.Model):
+    """
+    Manifesto dei documenti generati dei fogli tecnici (PDF e HTML), suddivisi per
+    anno/mese/reparto. Un documento archiviato è un membro del contenitore ZIP mensile
+    indicato in `contenitore`; `percorso` resta il suo indirizzo logico (app/services/archivio_pdf.py).
+    """
+    __tablename__ = 'documenti_fogli'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(10), nullable=False)  # pdf, html
+    foglio_id = db.Column(db.Integer, db.ForeignKey('fogli_tecnici.id', ondelete='SET NULL'), nullable=True, index=True)
+    numero_foglio = db.Column(db.String(20), nullable=False, index=True)
+    department_id = db.Column(db.Integer, db.ForeignKey('departments.id', ondelete='SET NULL'), nullable=True)
+    anno = db.Column(db.Integer, nullable=False)
+    mese = db.Column(db.Integer, nullable=False)
+
+    # Percorso relativo alla cartella upload (separatore '/'), il nome del file è anche il membro nel contenitore
+    percorso = db.Column(db.String(255), nullable=False, unique=True)
+    dimensione = db.Column(db.Integer)
+
+    # Contenitore ZIP mensile (relativo alla cartella upload); vuoto = file ancora sciolto nella cartella
+    contenitore = db.Column(db.String(255), index=True)
+    dimensione_compressa = db.Column(db.Integer)
+    archiviato_at = db.Column(db.DateTime)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_documenti_fogli_periodo', 'tipo', 'anno', 'mese', 'department_id'),
+    )
+
+    foglio = db.relationship('FoglioTecnico', backref=db.backref('documenti', lazy='dynamic', passive_deletes=True))
+
+    @property
+    def archiviato(self):
+        return self.contenitore is not None
+
+    @property
+    def nome_file(self):
+        return self.percorso.rsplit('/', 1)[-1]
+
+    def __repr__(self):
+        return f'<DocumentoFoglio {self.percorso}{" (archiviato)" if self.archiviato else ""}>'
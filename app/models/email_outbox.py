@@ -0,0 +1,40 @@
+from datetime import datetime
+from app import db
+
+
+class EmailOutbox(db.Model):
+    """Email in uscita: salvata dalla richiesta, spedita in background da app/services/outbox_email.py"""
+    __tablename__ = 'email_outbox'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(30), nullable=False)  # foglio, notifica, promemoria
+    destinatari = db.Column(db.Text, nullable=False)  # Indirizzi separati da virgola
+    oggetto = db.Column(db.String(255), nullable=False)
+    corpo_testo = db.Column(db.Text)
+    corpo_html = db.Column(db.Text)
+
+    # Foglio collegato: allega_pdf = allegare il PDF del foglio al momento dell'invio
+    foglio_id = db.Column(db.Integer, db.ForeignKey('fogli_tecnici.id', ondelete='SET NULL'), nullable=True, index=True)
+    allega_pdf = db.Column(db.Boolean, default=False, nullable=False)
+
+    # Consegna: In coda -> Inviata, oppure Errore dopo l'ultimo tentativo
+    stato = db.Column(db.String(20), nullable=False, default='In coda')
+    tentativi = db.Column(db.Integer, nullable=False, default=0)
+    prossimo_tentativo = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    ultimo_errore = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    inviata_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('idx_email_outbox_stato_prossimo', 'stato', 'prossimo_tentativo'),
+    )
+
+    foglio = db.relationship('FoglioTecnico', backref=db.backref('email_outbox', lazy='dynamic', passive_deletes=True))
+
+    @property
+    def lista_destinatari(self):
+        return [d.strip() for d in self.destinatari.split(',') if d.strip()]
+
+    def __repr__(self):
+        return f'<EmailOutbox {self.id} {self.tipo} {self.stato}>'
@@ -46,6 +46,9 @@ class FoglioTecnico(db.Model):
     inviato_online = db.Column(db.Boolean, default=False)
     email_invio = db.Column(db.String(120))
     data_invio = db.Column(db.DateTime)
+    stato_invio_email = db.Column(db.String(20))  # In coda, Inviata, Errore (outbox email)
+    errore_invio_email = db.Column(db.String(500))  # Ultimo errore di consegna
+    promemoria_inviato_at = db.Column(db.DateTime)  # Ultimo promemoria al tecnico (foglio incompleto)
     
     # Gestione operazioni sulle macchine (come nei ticket)
     tipo_operazione_macchine = db.Column(db.String(50))  # prestito_semplice, riparazione_sede, etc.
@@ -106,17 +109,30 @@ class FoglioTecnico(db.Model):
     
     def _get_prefix_reparto(self):
         """Restituisce il prefisso per la numerazione in base al reparto (sigla reparto o FT)."""
+        return FoglioTecnico._prefisso_reparto(self.department_id)
+
+    @staticmethod
+    def _prefisso_reparto(department_id):
         from app.models.department import Department
-        if not self.department_id:
+        if not department_id:
             return 'FT'
-        dept = Department.query.get(self.department_id)
+        dept = Department.query.get(department_id)
         if not dept:
             return 'FT'
         return dept.get_sigla_foglio()
 
     def _generate_foglio_number(self):
         """Genera un numero foglio unico in formato SIGLA-YYYY-NNNN (es. MEC-2026-0001, GA-2026-0001, IT-2026-0001, FT-2026-0001)."""
-        prefix = self._get_prefix_reparto()
+        return FoglioTecnico.alloca_numeri(self.department_id, 1)[0]
+
+    @staticmethod
+    def alloca_numeri(department_id, quantita):
+        """
+        Restituisce `quantita` numeri foglio liberi per il reparto, con una sola query:
+        prima i buchi della sequenza dell'anno partendo da 1, poi max + 1 (es. importazione
+        o sincronizzazione di più fogli insieme). I numeri non sono riservati fino al commit.
+        """
+        prefix = FoglioTecnico._prefisso_reparto(department_id)
         # Solo caratteri alfanumerici per sicurezza nelle query LIKE
         safe_prefix = ''.join(c for c in prefix if c.isalnum() or c == '-') or 'FT'
         if safe_prefix != prefix:
@@ -135,57 +151,30 @@ class FoglioTecnico(db.Model):
         
         # Estrai tutti i numeri esistenti (solo quelli che hanno senso come progressivi)
         existing_numbers = set()
-        if all_fogli:
-            for foglio in all_fogli:
-                try:
-                    num_part = foglio[0].split('-')[-1]
-                    if num_part.isdigit() and len(num_part) == 4:
-                        # Considera solo numeri con esattamente 4 cifre (formato 0001, 0002, etc.)
-                        current_num = int(num_part)
-                        # Ignora numeri molto alti che sono probabilmente timestamp
-                        # Un numero progressivo ragionevole dovrebbe essere < 1000 nella maggior parte dei casi
-                        # Ma per sicurezza, prendiamo tutti i numeri <= 9999 con formato corretto
-                        if current_num < 10000:
-                            existing_numbers.add(current_num)
-                except (ValueError, IndexError):
-                    continue
+        for foglio in all_fogli:
+            num_part = foglio[0].split('-')[-1]
+            # Considera solo numeri con esattamente 4 cifre (formato 0001, 0002, etc.):
+            # i numeri di fallback a 5 cifre non occupano la sequenza
+            if num_part.isdigit() and len(num_part) == 4:
+                existing_numbers.add(int(num_part))
         
-        # Trova il primo numero disponibile nella sequenza
-        # Strategia: se ci sono numeri esistenti, cerca il primo buco nella sequenza
-        # Se la sequenza è continua, prendi max + 1
-        if existing_numbers:
-            # Ordina i numeri
-            sorted_numbers = sorted(existing_numbers)
-            
-            # Cerca il primo "buco" nella sequenza partendo da 1
-            next_number = 1
-            for num in sorted_numbers:
-                if num == next_number:
-                    next_number += 1
-                elif num > next_number:
-                    # Trovato un buco! Usa next_number
-                    break
-            # Se non ci sono buchi, next_number è già impostato correttamente (max + 1)
-        else:
-            next_number = 1
-            
-        max_attempts = 100
-        for attempt in range(max_attempts):
-            candidate_number = f'{safe_prefix}-{year_str}-{next_number:04d}'
-            existing = db.session.query(FoglioTecnico.id).filter(
-                FoglioTecnico.numero_foglio == candidate_number
-            ).first()
-            
-            if not existing:
-                return candidate_number
-            
+        # Riempie prima i "buchi" nella sequenza, poi prosegue oltre il massimo
+        numeri = []
+        next_number = 1
+        while len(numeri) < quantita and next_number < 10000:
+            if next_number not in existing_numbers:
+                numeri.append(f'{safe_prefix}-{year_str}-{next_number:04d}')
             next_number += 1
         
         # Fallback: usa un timestamp, ma con un prefisso diverso per distinguerlo
         # Invece di usare 4 cifre, usiamo 5 cifre con prefisso 9
-        import time
-        timestamp_suffix = 90000 + (int(time.time() * 1000) % 10000)
-        return f'{safe_prefix}-{year_str}-{timestamp_suffix}'
+        if len(numeri) < quantita:
+            import time
+            base = int(time.time() * 1000)
+            for i in range(quantita - len(numeri)):
+                numeri.append(f'{safe_prefix}-{year_str}-{90000 + (base + i) % 10000}')
+        
+        return numeri
     
     @property
     def full_name(self):
@@ -243,6 +232,7 @@ foglio_macchine = db.Table('foglio_macchine',
     db.Column('foglio_id', db.Integer, db.ForeignKey('fogli_tecnici.id'), primary_key=True),
     db.Column('macchina_id', db.Integer, db.ForeignKey('macchine.id'), primary_key=True),
     db.Column('created_at', db.DateTime, default=datetime.utcnow),
+    db.Index('idx_foglio_macchine_macchina', 'macchina_id'),
     extend_existing=True
 )
 
@@ -1,5 +1,11 @@
 from datetime import datetime
+import threading
+import time
+from sqlalchemy import bindparam, event, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.util import identity_key
 from app import db
+from app.utils.ricerca import normalizza_codice, trigrammi_documento
 
 
 # Tabella di associazione per reparti e tipi di macchina
@@ -11,6 +17,12 @@ department_tipo_macchina = db.Table('department_tipo_macchina',
 )
 
 
+# Cache reparto -> id dei tipi di macchina visibili; la scadenza copre le modifiche fatte da altri processi
+CACHE_TIPI_REPARTO_SECONDI = 300
+_cache_tipi_reparto = {}
+_cache_tipi_reparto_lock = threading.Lock()
+
+
 class TipoMacchina(db.Model):
     __tablename__ = 'tipi_macchine'
     
@@ -36,6 +48,32 @@ class TipoMacchina(db.Model):
     def __repr__(self):
         return f'<TipoMacchina {self.nome}>'
     
+    @classmethod
+    def ids_per_reparto(cls, department_id):
+        """
+        Id dei tipi di macchina associati a un reparto, in cache per processo.
+        Le associazioni cambiano solo dalle impostazioni reparti, che invalidano la cache.
+        """
+        adesso = time.monotonic()
+        with _cache_tipi_reparto_lock:
+            voce = _cache_tipi_reparto.get(department_id)
+            if voce and adesso - voce[0] < CACHE_TIPI_REPARTO_SECONDI:
+                return voce[1]
+        
+        ids = frozenset(
+            tipo_id for (tipo_id,) in db.session.query(department_tipo_macchina.c.tipo_macchina_id)
+            .filter(department_tipo_macchina.c.department_id == department_id)
+        )
+        with _cache_tipi_reparto_lock:
+            _cache_tipi_reparto[department_id] = (adesso, ids)
+        return ids
+    
+    @staticmethod
+    def invalida_cache_reparti():
+        """Svuota la cache reparto -> tipi di macchina (da chiamare dopo aver modificato le associazioni)"""
+        with _cache_tipi_reparto_lock:
+            _cache_tipi_reparto.clear()
+    
     def to_dict(self):
         """Serializzazione per JSON"""
         return {
@@ -53,6 +91,7 @@ ticket_macchine = db.Table('ticket_macchine',
     db.Column('ticket_id', db.Integer, db.ForeignKey('tickets.id'), primary_key=True),
     db.Column('macchina_id', db.Integer, db.ForeignKey('macchine.id'), primary_key=True),
     db.Column('created_at', db.DateTime, default=datetime.utcnow),
+    db.Index('idx_ticket_macchine_macchina', 'macchina_id'),
     extend_existing=True
 )
 
@@ -66,6 +105,10 @@ class Macchina(db.Model):
     marca = db.Column(db.String(100), nullable=False)
     numero_serie = db.Column(db.String(100), unique=True, index=True)
     
+    # Codice e matricola senza punteggiatura e in minuscolo, per ricerca esatta e per prefisso
+    codice_normalizzato = db.Column(db.String(50), index=True)
+    numero_serie_normalizzato = db.Column(db.String(100), index=True)
+    
     # Tipo di macchina
     tipo_macchina_id = db.Column(db.Integer, db.ForeignKey('tipi_macchine.id'), nullable=False, index=True)
     
@@ -110,6 +153,12 @@ class Macchina(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Indici per la coda delle scadenze (range su data, filtro su stato)
+    __table_args__ = (
+        db.Index('idx_macchine_manutenzione_stato', 'prossima_manutenzione', 'stato'),
+        db.Index('idx_macchine_garanzia_stato', 'data_scadenza_garanzia', 'stato'),
+    )
+    
     # Relazioni
     cliente = db.relationship('Cliente', backref='macchine_assegnate')
     movimenti = db.relationship('MovimentoMacchina', backref='macchina', lazy='dynamic', cascade='all, delete-orphan')
@@ -534,6 +583,12 @@ class MovimentoMacchina(db.Model):
     # Timestamp
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     
+    # Indici per i movimenti recenti (ORDER BY created_at DESC LIMIT n) e per la timeline di una macchina
+    __table_args__ = (
+        db.Index('idx_movimenti_macchine_created', 'created_at'),
+        db.Index('idx_movimenti_macchine_macchina_created', 'macchina_id', 'created_at'),
+    )
+    
     # Relazioni
     cliente = db.relationship('Cliente', foreign_keys=[cliente_id])
     cliente_originale = db.relationship('Cliente', foreign_keys=[cliente_originale_id])
@@ -555,6 +610,91 @@ class MovimentoMacchina(db.Model):
         }
         return descrizioni.get(self.tipo_movimento, self.tipo_movimento)
     
+    def valori_originali(self):
+        """Stato completo della macchina prima di questo movimento, come colonne di Macchina"""
+        return {
+            'stato': self.stato_precedente,
+            'cliente_id': self.cliente_originale_id,
+            'ubicazione': self.ubicazione_originale,
+            'data_assegnazione': self.data_assegnazione_originale,
+            'data_vendita': self.data_vendita_originale,
+            'prezzo_vendita': self.prezzo_vendita_originale,
+            'prossima_manutenzione': self.prossima_manutenzione_originale,
+        }
+    
+    @classmethod
+    def primi_movimenti(cls, *criteri, tipi=None):
+        """
+        Primo movimento di ogni macchina tra quelli che soddisfano i criteri (es. un ticket o un
+        foglio), insieme allo stato attuale della macchina. È lo snapshot da cui ripristinare:
+        una sola query per tutte le macchine coinvolte.
+        
+        Returns:
+            list: righe (movimento, stato_attuale, codice)
+        """
+        primi = select(func.min(cls.id)).where(*criteri)
+        if tipi:
+            primi = primi.where(cls.tipo_movimento.in_(tipi))
+        primi = primi.group_by(cls.macchina_id)
+        
+        return db.session.query(cls, Macchina.stato, Macchina.codice)\
+            .join(Macchina, Macchina.id == cls.macchina_id)\
+            .filter(cls.id.in_(primi))\
+            .order_by(cls.id).all()
+    
+    @classmethod
+    def movimenti_con_stato(cls, *criteri, tipi=None):
+        """
+        Tutti i movimenti che soddisfano i criteri, in ordine cronologico, insieme allo stato
+        attuale della macchina: una sola query per tutte le macchine coinvolte.
+        
+        Returns:
+            list: righe (movimento, stato_attuale, codice)
+        """
+        query = db.session.query(cls, Macchina.stato, Macchina.codice)\
+            .join(Macchina, Macchina.id == cls.macchina_id)\
+            .filter(*criteri)
+        if tipi:
+            query = query.filter(cls.tipo_movimento.in_(tipi))
+        return query.order_by(cls.created_at, cls.id).all()
+    
+    @classmethod
+    def applica_ripristini(cls, ripristini, movimenti):
+        """
+        Applica in blocco i ripristini calcolati da primi_movimenti/movimenti_con_stato
+        
+        Args:
+            ripristini (dict): macchina_id -> colonne di Macchina da reimpostare
+            movimenti (list): righe (dict) dei movimenti di ripristino da registrare
+        """
+        # Le modifiche ORM in sospeso vanno scritte prima degli UPDATE/INSERT diretti, altrimenti
+        # il flush successivo le applicherebbe sopra il ripristino (o troverebbe righe mancanti)
+        db.session.flush()
+        
+        # Un UPDATE executemany per ogni insieme di colonne
+        tabella = Macchina.__table__
+        gruppi = {}
+        for macchina_id, valori in ripristini.items():
+            gruppi.setdefault(tuple(sorted(valori)), []).append(
+                {'m_id': macchina_id, **{f'v_{c}': v for c, v in valori.items()}}
+            )
+        for colonne, righe in gruppi.items():
+            db.session.execute(
+                tabella.update()
+                .where(tabella.c.id == bindparam('m_id'))
+                .values({c: bindparam(f'v_{c}') for c in colonne}),
+                righe
+            )
+        
+        if movimenti:
+            db.session.execute(cls.__table__.insert(), movimenti)
+        
+        # Le macchine già caricate nella sessione vanno rilette dal database
+        for macchina_id, valori in ripristini.items():
+            macchina = db.session.identity_map.get(identity_key(Macchina, macchina_id))
+            if macchina is not None:
+                db.session.expire(macchina, list(valori) + ['updated_at'])
+    
     def __repr__(self):
         return f'<MovimentoMacchina {self.tipo_movimento}: {self.macchina.codice}>'
     
@@ -579,3 +719,141 @@ class MovimentoMacchina(db.Model):
             'costo': float(self.costo) if self.costo else None,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
+
+
+class MacchinaTrigramma(db.Model):
+    """Indice trigrammi di codice, matricola, marca e modello, usato per la ricerca fuzzy delle macchine"""
+    __tablename__ = 'macchine_trigrammi'
+    
+    trigramma = db.Column(db.String(3), primary_key=True)
+    macchina_id = db.Column(db.Integer, db.ForeignKey('macchine.id', ondelete='CASCADE'), primary_key=True, index=True)
+    
+    def __repr__(self):
+        return f'<MacchinaTrigramma {self.trigramma} macchina={self.macchina_id}>'
+
+
+class RiepilogoMovimentiMacchina(db.Model):
+    """Totali annuali per tipo dei movimenti archiviati di una macchina (vedi services/archivio_movimenti)"""
+    __tablename__ = 'movimenti_macchine_riepilogo'
+    
+    macchina_id = db.Column(db.Integer, db.ForeignKey('macchine.id', ondelete='CASCADE'), primary_key=True)
+    anno = db.Column(db.Integer, primary_key=True)
+    tipo_movimento = db.Column(db.String(30), primary_key=True)
+    
+    numero_movimenti = db.Column(db.Integer, default=0, nullable=False)
+    costo_totale = db.Column(db.Numeric(12, 2), default=0, nullable=False)
+    ultimo_movimento_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<RiepilogoMovimentiMacchina macchina={self.macchina_id} {self.anno} {self.tipo_movimento}>'
+
+
+class ScadenzaMacchina(db.Model):
+    """Coda delle manutenzioni e delle garanzie in scadenza, ricalcolata ogni giorno dallo scheduler"""
+    __tablename__ = 'scadenze_macchine'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    macchina_id = db.Column(db.Integer, db.ForeignKey('macchine.id'), nullable=False)
+    tipo = db.Column(db.String(20), nullable=False)  # Manutenzione, Garanzia
+    data_scadenza = db.Column(db.Date, nullable=False)
+    
+    # Assegnazione: reparto della macchina e tecnico dell'ultimo ticket collegato
+    department_id = db.Column(db.Integer, db.ForeignKey('departments.id'), nullable=False)
+    tecnico_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+    
+    # Ticket creato in automatico per la scadenza (opzionale)
+    ticket_id = db.Column(db.Integer, db.ForeignKey('tickets.id', ondelete='SET NULL'))
+    
+    calcolata_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('macchina_id', 'tipo', name='uq_scadenze_macchine_macchina_tipo'),
+        db.Index('idx_scadenze_macchine_reparto_data', 'department_id', 'tipo', 'data_scadenza'),
+    )
+    
+    macchina = db.relationship('Macchina', backref=db.backref('scadenze', lazy='dynamic', cascade='all, delete-orphan'))
+    tecnico = db.relationship('User')
+    ticket = db.relationship('Ticket')
+    
+    @property
+    def giorni_alla_scadenza(self):
+        return (self.data_scadenza - datetime.now().date()).days
+    
+    @property
+    def scaduta(self):
+        return self.giorni_alla_scadenza < 0
+    
+    def __repr__(self):
+        return f'<ScadenzaMacchina {self.tipo} macchina={self.macchina_id} {self.data_scadenza}>'
+    
+    def to_dict(self):
+        """Serializzazione per JSON"""
+        return {
+            'id': self.id,
+            'tipo': self.tipo,
+            'data_scadenza': self.data_scadenza.isoformat(),
+            'giorni_alla_scadenza': self.giorni_alla_scadenza,
+            'scaduta': self.scaduta,
+            'macchina_id': self.macchina_id,
+            'macchina_codice': self.macchina.codice if self.macchina else None,
+            'macchina_nome': self.macchina.nome_completo if self.macchina else None,
+            'macchina_stato': self.macchina.stato if self.macchina else None,
+            'cliente_nome': self.macchina.cliente.ragione_sociale if self.macchina and self.macchina.cliente else None,
+            'department_id': self.department_id,
+            'tecnico_id': self.tecnico_id,
+            'tecnico_nome': self.tecnico.full_name if self.tecnico else None,
+            'ticket_id': self.ticket_id,
+            'ticket_numero': self.ticket.numero_ticket if self.ticket else None,
+        }
+
+
+def trigrammi_macchina(macchina):
+    """Trigrammi indicizzati per una macchina (oggetto o riga con codice, numero_serie, marca, modello)"""
+    return trigrammi_documento(
+        macchina.codice, f'{macchina.marca or ""} {macchina.modello or ""}',
+        macchina.numero_serie, macchina.modello
+    )
+
+
+# Campi indicizzati per la ricerca
+_CAMPI_RICERCA = ('codice', 'numero_serie', 'marca', 'modello')
+
+
+@event.listens_for(Session, 'before_flush')
+def _prepara_indice_ricerca(session, flush_context, instances):
+    """Aggiorna codice e matricola normalizzati e segna le macchine da reindicizzare"""
+    da_indicizzare = session.info.setdefault('macchine_da_indicizzare', set())
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Macchina):
+            continue
+        
+        if obj not in session.new:
+            stato = db.inspect(obj)
+            if not any(stato.attrs[campo].history.has_changes() for campo in _CAMPI_RICERCA):
+                continue
+        
+        obj.codice_normalizzato = normalizza_codice(obj.codice)
+        obj.numero_serie_normalizzato = normalizza_codice(obj.numero_serie) or None
+        da_indicizzare.add(obj)
+
+
+@event.listens_for(Session, 'after_flush')
+def _aggiorna_indice_ricerca(session, flush_context):
+    """Riscrive i trigrammi delle macchine modificate (gli id delle nuove macchine sono ora disponibili)"""
+    da_indicizzare = session.info.pop('macchine_da_indicizzare', None) or set()
+    eliminate = [obj.id for obj in session.deleted if isinstance(obj, Macchina)]
+    if not da_indicizzare and not eliminate:
+        return
+    
+    ids = [obj.id for obj in da_indicizzare if obj.id is not None] + eliminate
+    righe = [
+        {'trigramma': t, 'macchina_id': obj.id}
+        for obj in da_indicizzare if obj.id is not None
+        for t in trigrammi_macchina(obj)
+    ]
+    
+    tabella = MacchinaTrigramma.__table__
+    connection = session.connection()
+    connection.execute(tabella.delete().where(tabella.c.macchina_id.in_(ids)))
+    if righe:
+        connection.execute(tabella.insert(), righe)
@@ -1,5 +1,8 @@
 from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 from app import db
+from app.utils.ricerca import normalizza_codice, trigrammi_documento
 
 
 class Ricambio(db.Model):
@@ -9,11 +12,20 @@ class Ricambio(db.Model):
     codice = db.Column(db.String(50), unique=True, nullable=False, index=True)
     descrizione = db.Column(db.String(200), nullable=False)
     
+    # Codice senza punteggiatura e in minuscolo, per ricerca esatta e per prefisso
+    codice_normalizzato = db.Column(db.String(50), index=True)
+    
     # Quantità
     quantita_disponibile = db.Column(db.Integer, default=0, nullable=False)
     quantita_prenotata = db.Column(db.Integer, default=0, nullable=False)
     quantita_minima = db.Column(db.Integer, default=0, nullable=False)  # Soglia sotto scorta
     
+    # Stato sotto scorta calcolato dal database (colonna generata STORED, indicizzata)
+    sotto_scorta = db.Column(
+        db.Boolean,
+        db.Computed('quantita_minima > 0 AND quantita_disponibile <= quantita_minima', persisted=True)
+    )
+    
     # Ubicazione
     ubicazione = db.Column(db.String(100))  # Es: "Scaffale A-3-2"
     
@@ -35,11 +47,13 @@ class Ricambio(db.Model):
     # Indice composto per performance query
     __table_args__ = (
         db.Index('idx_ricambi_codice_dept', 'codice', 'department_id'),
+        db.Index('idx_ricambi_sotto_scorta', 'sotto_scorta', 'quantita_disponibile'),
     )
     
     # Relazioni
     movimenti = db.relationship('MovimentoMagazzino', backref='ricambio', lazy='dynamic', cascade='all, delete-orphan')
     prenotazioni = db.relationship('PrenotazioneRicambio', backref='ricambio', lazy='dynamic', cascade='all, delete-orphan')
+    allarme_scorta = db.relationship('AllarmeScorta', backref='ricambio', uselist=False, cascade='all, delete-orphan')
     
     @property
     def quantita_effettiva(self):
@@ -129,6 +143,16 @@ class Ricambio(db.Model):
         
         return movimento
     
+    def sincronizza_allarme_scorta(self):
+        """Apre o chiude l'allarme sotto scorta in base alle quantità correnti"""
+        soglia = self.quantita_minima or 0
+        sotto_scorta = soglia > 0 and (self.quantita_disponibile or 0) <= soglia
+        
+        if sotto_scorta and self.allarme_scorta is None:
+            self.allarme_scorta = AllarmeScorta(quantita_rilevata=self.quantita_disponibile or 0)
+        elif not sotto_scorta and self.allarme_scorta is not None:
+            self.allarme_scorta = None
+    
     def __repr__(self):
         return f'<Ricambio {self.codice}: {self.descrizione}>'
     
@@ -234,6 +258,11 @@ class PrenotazioneRicambio(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Indice per la ricerca delle prenotazioni scadute (job di scadenza)
+    __table_args__ = (
+        db.Index('idx_prenotazioni_stato_scadenza', 'stato', 'data_scadenza'),
+    )
+    
     # Relazioni
     ticket = db.relationship('Ticket')
     user = db.relationship('User')
@@ -315,3 +344,118 @@ class PrenotazioneRicambio(db.Model):
             'created_at': self.created_at.isoformat() if hasattr(self.created_at, 'isoformat') else self.created_at,
             'updated_at': self.updated_at.isoformat() if hasattr(self.updated_at, 'isoformat') else self.updated_at
         }
+
+
+
+class AllarmeScorta(db.Model):
+    """Coda degli allarmi sotto scorta, aggiornata ad ogni movimento dei ricambi coinvolti"""
+    __tablename__ = 'allarmi_scorta'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    ricambio_id = db.Column(db.Integer, db.ForeignKey('ricambi.id'), unique=True, nullable=False)
+    
+    quantita_rilevata = db.Column(db.Integer, nullable=False)  # Disponibilità quando è scattato l'allarme
+    notificato_at = db.Column(db.DateTime, index=True)  # Incluso in un digest email
+    
+    # Timestamp (inizio del periodo sotto scorta)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    @property
+    def giorni_sotto_scorta(self):
+        return (datetime.utcnow() - self.created_at).days
+    
+    def __repr__(self):
+        return f'<AllarmeScorta ricambio={self.ricambio_id} dal {self.created_at}>'
+
+
+class RicambioTrigramma(db.Model):
+    """Indice trigrammi di codice e descrizione, usato per la ricerca fuzzy dei ricambi"""
+    __tablename__ = 'ricambi_trigrammi'
+    
+    trigramma = db.Column(db.String(3), primary_key=True)
+    ricambio_id = db.Column(db.Integer, db.ForeignKey('ricambi.id', ondelete='CASCADE'), primary_key=True, index=True)
+    
+    def __repr__(self):
+        return f'<RicambioTrigramma {self.trigramma} ricambio={self.ricambio_id}>'
+
+
+class RiepilogoMovimentiRicambio(db.Model):
+    """Totali mensili dei movimenti archiviati di un ricambio (vedi services/archivio_movimenti)"""
+    __tablename__ = 'movimenti_magazzino_riepilogo'
+    
+    ricambio_id = db.Column(db.Integer, db.ForeignKey('ricambi.id', ondelete='CASCADE'), primary_key=True)
+    anno = db.Column(db.Integer, primary_key=True)
+    mese = db.Column(db.Integer, primary_key=True)
+    
+    carichi = db.Column(db.Integer, default=0, nullable=False)  # Somma delle quantità positive
+    scarichi = db.Column(db.Integer, default=0, nullable=False)  # Somma assoluta delle quantità negative
+    numero_movimenti = db.Column(db.Integer, default=0, nullable=False)
+    
+    @property
+    def saldo(self):
+        return self.carichi - self.scarichi
+    
+    def __repr__(self):
+        return f'<RiepilogoMovimentiRicambio ricambio={self.ricambio_id} {self.anno}-{self.mese:02d}>'
+
+
+# Campi che influenzano lo stato sotto scorta
+_CAMPI_SCORTA = ('quantita_disponibile', 'quantita_minima')
+
+
+@event.listens_for(Session, 'before_flush')
+def _aggiorna_allarmi_scorta(session, flush_context, instances):
+    """Ricalcola lo stato sotto scorta solo per i ricambi modificati nella transazione"""
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Ricambio):
+            continue
+        
+        if obj not in session.new:
+            stato = db.inspect(obj)
+            if not any(stato.attrs[campo].history.has_changes() for campo in _CAMPI_SCORTA):
+                continue
+        
+        obj.sincronizza_allarme_scorta()
+
+
+# Campi indicizzati per la ricerca
+_CAMPI_RICERCA = ('codice', 'descrizione')
+
+
+@event.listens_for(Session, 'before_flush')
+def _prepara_indice_ricerca(session, flush_context, instances):
+    """Aggiorna il codice normalizzato e segna i ricambi da reindicizzare"""
+    da_indicizzare = session.info.setdefault('ricambi_da_indicizzare', set())
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Ricambio):
+            continue
+        
+        if obj not in session.new:
+            stato = db.inspect(obj)
+            if not any(stato.attrs[campo].history.has_changes() for campo in _CAMPI_RICERCA):
+                continue
+        
+        obj.codice_normalizzato = normalizza_codice(obj.codice)
+        da_indicizzare.add(obj)
+
+
+@event.listens_for(Session, 'after_flush')
+def _aggiorna_indice_ricerca(session, flush_context):
+    """Riscrive i trigrammi dei ricambi modificati (gli id dei nuovi ricambi sono ora disponibili)"""
+    da_indicizzare = session.info.pop('ricambi_da_indicizzare', None) or set()
+    eliminati = [obj.id for obj in session.deleted if isinstance(obj, Ricambio)]
+    if not da_indicizzare and not eliminati:
+        return
+    
+    ids = [obj.id for obj in da_indicizzare if obj.id is not None] + eliminati
+    righe = [
+        {'trigramma': t, 'ricambio_id': obj.id}
+        for obj in da_indicizzare if obj.id is not None
+        for t in trigrammi_documento(obj.codice, obj.descrizione)
+    ]
+    
+    tabella = RicambioTrigramma.__table__
+    connection = session.connection()
+    connection.execute(tabella.delete().where(tabella.c.ricambio_id.in_(ids)))
+    if righe:
+        connection.execute(tabella.insert(), righe)
@@ -0,0 +1,22 @@
+from datetime import datetime
+from app import db
+
+
+class SincronizzazioneFoglio(db.Model):
+    """Chiave di idempotenza di un foglio caricato dalla sincronizzazione offline"""
+    __tablename__ = 'sincronizzazioni_fogli'
+
+    id = db.Column(db.Integer, primary_key=True)
+    chiave = db.Column(db.String(64), nullable=False)  # Generata dal client, univoca per utente
+    foglio_id = db.Column(db.Integer, db.ForeignKey('fogli_tecnici.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'chiave', name='uq_sincronizzazioni_fogli_utente_chiave'),
+    )
+
+    foglio = db.relationship('FoglioTecnico', backref=db.backref('sincronizzazioni', cascade='all, delete-orphan'))
+
+    def __repr__(self):
+        return f'<SincronizzazioneFoglio {self.chiave} foglio={self.foglio_id}>'
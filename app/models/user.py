@@ -1,3 +1,4 @@
+import secrets
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
@@ -25,6 +26,9 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     last_login = db.Column(db.DateTime)
     
+    # Token segreto del feed iCalendar delle scadenze (i client calendario non hanno la sessione)
+    calendario_token = db.Column(db.String(64), unique=True, index=True)
+    
     # Indice composto per performance query
     __table_args__ = (
         db.Index('idx_users_active_name', 'is_active', 'first_name', 'last_name'),
@@ -66,6 +70,11 @@ class User(UserMixin, db.Model):
         """Restituisce il nome completo"""
         return f"{self.first_name} {self.last_name}"
     
+    def rigenera_calendario_token(self):
+        """Genera un nuovo token del feed calendario: l'indirizzo precedente smette di funzionare"""
+        self.calendario_token = secrets.token_urlsafe(32)
+        return self.calendario_token
+    
     def update_last_login(self):
         """Aggiorna timestamp ultimo login"""
         self.last_login = datetime.utcnow()
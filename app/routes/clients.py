@@ -7,6 +7,7 @@ from app.models.ticket import Ticket
 from app.models.macchina import Macchina
 from app.forms.cliente import ClienteForm, ClienteFilterForm
 from app.utils.permissions import PermissionManager
+from app.forms.fields import risposta_select
 
 clients_bp = Blueprint('clients', __name__)
 
@@ -329,3 +330,27 @@ def api_search_clients():
         'email': c.email,
         'text': c.ragione_sociale
     } for c in clienti])
+
+
+@clients_bp.route('/api/select')
+@login_required
+def api_select_clienti():
+    """Scelte paginate per i campi cliente remoti (RemoteSelectField)"""
+    query = Cliente.query.filter(Cliente.is_active == True)
+    termine = request.args.get('q', '').strip()
+    if termine:
+        search_pattern = f"%{termine}%"
+        query = query.filter(or_(
+            Cliente.ragione_sociale.like(search_pattern),
+            Cliente.email.like(search_pattern),
+            Cliente.partita_iva.like(search_pattern)
+        ))
+
+    pagination = query.order_by(Cliente.ragione_sociale).paginate(
+        page=request.args.get('page', 1, type=int), per_page=20, error_out=False
+    )
+    return jsonify(risposta_select(pagination, lambda c: {
+        'id': c.id,
+        'text': c.ragione_sociale,
+        'subtitle': c.email or ''
+    }))
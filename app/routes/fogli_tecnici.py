@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, abort, send_from_directory
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, abort, send_from_directory, send_file
 from flask_login import login_required, current_user
 from sqlalchemy import or_, and_, func, extract, desc
 from app import db
@@ -7,15 +7,20 @@ from app.models.cliente import Cliente
 from app.models.user import User
 from app.models.macchina import Macchina
 from app.models.ricambio import Ricambio
+from app.services.ricerca_ricambi import filtra_ricerca, rilevanza
+from app.services.pdf_generator import rimuovi_pdf_superati
+from app.services.archivio_pdf import apri_documento, documento_disponibile
+from app.services.firme import salva_firma, elimina_firma_se_inutilizzata
+from app.services.operazioni_macchine import applica_operazione_macchine, presta_macchine_sostitutive
+from app.services.modifiche_fogli import applica_modifiche, aggiorna_macchine_collegate, aggiorna_ricambi_utilizzati
 from app.forms.foglio_tecnico import (
     FoglioTecnicoStep1Form, FoglioTecnicoStep2Form, FoglioTecnicoStep3Form,
     FoglioTecnicoStep4Form, FoglioTecnicoStep5Form, FoglioTecnicoFinalizeForm,
-    FoglioTecnicoFilterForm, FoglioTecnicoQuickEditForm
+    FoglioTecnicoFilterForm, FoglioTecnicoQuickEditForm, RaccoltaPdfForm
 )
 from app.utils.permissions import filter_by_department_access, PermissionManager, require_permission
 from datetime import datetime, timedelta
 import os
-import base64
 from werkzeug.utils import secure_filename
 
 fogli_tecnici_bp = Blueprint('fogli_tecnici', __name__)
@@ -218,153 +223,34 @@ def step2(id):
         form.macchine.data = macchine_ids
     
     if form.validate_on_submit():
-        # Import necessari
-        from app.models.foglio_tecnico import foglio_macchine
-        
         # Aggiorna foglio
         foglio.tipo_operazione_macchine = form.tipo_operazione_macchine.data
         foglio.macchina_manuale = form.macchina_manuale.data
         foglio.updated_at = datetime.utcnow()
         
-        # Aggiorna macchine collegate
-        # Rimuovi tutte le associazioni esistenti
-        db.session.execute(
-            foglio_macchine.delete().where(foglio_macchine.c.foglio_id == foglio.id)
-        )
-        
-        # Aggiungi nuove associazioni se presenti
+        # Aggiorna macchine collegate (solo le associazioni cambiate)
         macchine_selezionate = request.form.get('macchine', '')
-        if macchine_selezionate:
-            macchine_ids = [int(mid) for mid in macchine_selezionate.split(',') if mid.strip().isdigit()]
-            for macchina_id in macchine_ids:
-                macchina = Macchina.query.get(macchina_id)
-                if macchina and PermissionManager.can_view_machine(current_user, macchina):
-                    foglio.macchine_collegate.append(macchina)
+        macchine_ids = [int(mid) for mid in macchine_selezionate.split(',') if mid.strip().isdigit()]
+        macchine_operazione, _ = aggiorna_macchine_collegate(foglio, macchine_ids, current_user)
 
         # Gestisci operazioni sulle macchine (solo se specificato tipo operazione)
-        if macchine_selezionate and form.tipo_operazione_macchine.data:
-            tipo_operazione = form.tipo_operazione_macchine.data
-            
-            for macchina_id in macchine_ids:
-                macchina = Macchina.query.get(macchina_id)
-                if macchina and PermissionManager.can_view_machine(current_user, macchina):
-                    try:
-                        if tipo_operazione == 'prestito_semplice':
-                            # Presta macchina al cliente (anche se attiva presso altro cliente)
-                            if macchina.is_disponibile or macchina.is_attiva:
-                                if macchina.is_disponibile:
-                                    # Macchina disponibile - usa metodo standard
-                                    movimento = macchina.assegna_a_cliente(
-                                        foglio.cliente_id, 
-                                        'In prestito', 
-                                        f'Prestito semplice per foglio tecnico {foglio.numero_foglio}'
-                                    )
-                                else:
-                                    # Macchina attiva - usa prestito temporaneo
-                                    movimento = macchina.presta_temporaneamente(
-                                        foglio.cliente_id,
-                                        f'Prestito semplice per foglio tecnico {foglio.numero_foglio}'
-                                    )
-                                movimento.foglio_id = foglio.id
-                                movimento.user_id = current_user.id
-                        elif tipo_operazione == 'riparazione_sede':
-                            # Porta macchina in sede per riparazione (solo ritiro)
-                            if not macchina.is_in_riparazione:
-                                movimento = macchina.invia_in_riparazione(
-                                    f'Riparazione in sede per foglio tecnico {foglio.numero_foglio}'
-                                )
-                                movimento.foglio_id = foglio.id
-                                movimento.user_id = current_user.id
-                        elif tipo_operazione == 'riparazione_sede_con_prestito':
-                            # Porta macchina del cliente in riparazione (solo se non già in riparazione)
-                            if not macchina.is_in_riparazione:
-                                movimento = macchina.invia_in_riparazione(
-                                    f'Riparazione in sede con prestito per foglio tecnico {foglio.numero_foglio}'
-                                )
-                                movimento.foglio_id = foglio.id
-                                movimento.user_id = current_user.id
-                        elif tipo_operazione == 'riparazione_cliente':
-                            # Riparazione presso cliente - non cambia stato ma registra movimento
-                            from app.models.macchina import MovimentoMacchina
-                            movimento = MovimentoMacchina(
-                                macchina_id=macchina.id,
-                                tipo_movimento='Riparazione presso cliente',
-                                stato_precedente=macchina.stato,
-                                stato_nuovo=macchina.stato,
-                                cliente_id=foglio.cliente_id,
-                                foglio_id=foglio.id,
-                                user_id=current_user.id,
-                                note=f'Riparazione presso cliente per foglio tecnico {foglio.numero_foglio}'
-                            )
-                            db.session.add(movimento)
-                        elif tipo_operazione == 'ritiro_riparazione':
-                            # Ritira macchina per riparazione
-                            if not macchina.is_in_riparazione:
-                                movimento = macchina.invia_in_riparazione(
-                                    f'Ritiro per riparazione - foglio tecnico {foglio.numero_foglio}'
-                                )
-                                movimento.foglio_id = foglio.id
-                                movimento.user_id = current_user.id
-                        elif tipo_operazione == 'consegna_riparata':
-                            # Consegna macchina riparata
-                            if macchina.is_in_riparazione:
-                                movimento = macchina.completa_riparazione(
-                                    f'Consegna macchina riparata - foglio tecnico {foglio.numero_foglio}'
-                                )
-                                movimento.foglio_id = foglio.id
-                                movimento.user_id = current_user.id
-                        elif tipo_operazione == 'rientro_prestito':
-                            # Rientro da prestito - riporta in magazzino
-                            if macchina.is_in_prestito:
-                                movimento = macchina.riporta_in_magazzino(
-                                    f'Rientro da prestito - foglio tecnico {foglio.numero_foglio}'
-                                )
-                                movimento.foglio_id = foglio.id
-                                movimento.user_id = current_user.id
-                        elif tipo_operazione == 'rientro_riparazione':
-                            # Rientro da riparazione - macchina riparata torna disponibile
-                            if macchina.is_in_riparazione:
-                                movimento = macchina.completa_riparazione(
-                                    f'Rientro da riparazione - foglio tecnico {foglio.numero_foglio}'
-                                )
-                                movimento.foglio_id = foglio.id
-                                movimento.user_id = current_user.id
-                        elif tipo_operazione == 'altro':
-                            # Movimento generico
-                            from app.models.macchina import MovimentoMacchina
-                            movimento = MovimentoMacchina(
-                                macchina_id=macchina.id,
-                                tipo_movimento='Altro',
-                                stato_precedente=macchina.stato,
-                                stato_nuovo=macchina.stato,
-                                cliente_id=foglio.cliente_id,
-                                foglio_id=foglio.id,
-                                user_id=current_user.id,
-                                note=f'Operazione per foglio tecnico {foglio.numero_foglio}'
-                            )
-                            db.session.add(movimento)
-                    except Exception as e:
-                        flash(f'Errore nell\'operazione sulla macchina {macchina.codice}: {str(e)}', 'warning')
-                        current_app.logger.error(f'Errore operazione macchina {macchina.id}: {str(e)}')
+        if macchine_operazione and form.tipo_operazione_macchine.data:
+            for errore in applica_operazione_macchine(
+                foglio, macchine_operazione, form.tipo_operazione_macchine.data, current_user.id
+            ):
+                flash(errore, 'warning')
         
         # Gestisci macchine sostitutive per riparazione con prestito
         if form.tipo_operazione_macchine.data == 'riparazione_sede_con_prestito':
             macchine_sostitutive_selezionate = request.form.get('macchine_sostitutive', '')
             if macchine_sostitutive_selezionate:
                 macchine_sostitutive_ids = [int(mid) for mid in macchine_sostitutive_selezionate.split(',') if mid.strip().isdigit()]
-                for macchina_sostitutiva_id in macchine_sostitutive_ids:
-                    macchina_sostitutiva = Macchina.query.get(macchina_sostitutiva_id)
-                    if macchina_sostitutiva and macchina_sostitutiva.is_disponibile and PermissionManager.can_view_machine(current_user, macchina_sostitutiva):
-                        try:
-                            movimento = macchina_sostitutiva.assegna_a_cliente(
-                                foglio.cliente_id,
-                                'In prestito',
-                                f'Prestito sostitutivo durante riparazione per foglio tecnico {foglio.numero_foglio}'
-                            )
-                            movimento.foglio_id = foglio.id
-                            movimento.user_id = current_user.id
-                        except Exception as e:
-                            flash(f'Errore nell\'assegnazione della macchina sostitutiva {macchina_sostitutiva.codice}: {str(e)}', 'warning')
+                macchine_sostitutive = [
+                    macchina for macchina in Macchina.query.filter(Macchina.id.in_(macchine_sostitutive_ids)).all()
+                    if PermissionManager.can_view_machine(current_user, macchina)
+                ]
+                for errore in presta_macchine_sostitutive(foglio, macchine_sostitutive, current_user.id):
+                    flash(errore, 'warning')
         
         # Marca step come completato
         foglio.mark_step_completato(2)
@@ -408,21 +294,11 @@ def step3(id):
         foglio.ricambio_manuale = form.ricambio_manuale.data
         foglio.updated_at = datetime.utcnow()
         
-        # Aggiorna ricambi utilizzati
-        # Rimuovi tutte le associazioni esistenti
-        from app.models.foglio_tecnico import foglio_ricambi
-        db.session.execute(
-            foglio_ricambi.delete().where(foglio_ricambi.c.foglio_id == foglio.id)
-        )
-        
-        # Aggiungi nuove associazioni se presenti
+        # Aggiorna ricambi utilizzati (solo le righe cambiate, quantità registrate invariate)
         ricambi_selezionati = request.form.get('ricambi_utilizzati', '')
-        if ricambi_selezionati:
-            ricambi_ids = [int(rid) for rid in ricambi_selezionati.split(',') if rid.strip().isdigit()]
-            for ricambio_id in ricambi_ids:
-                ricambio = Ricambio.query.get(ricambio_id)
-                if ricambio:
-                    foglio.ricambi_utilizzati.append(ricambio)
+        aggiorna_ricambi_utilizzati(
+            foglio, dict.fromkeys(int(rid) for rid in ricambi_selezionati.split(',') if rid.strip().isdigit())
+        )
         
         # Marca step come completato
         foglio.mark_step_completato(3)
@@ -559,29 +435,21 @@ def finalize(id):
                 foglio.completed_at = datetime.utcnow()
                 
             elif azione == 'genera_pdf':
-                from app.services.pdf_generator import genera_pdf_foglio_tecnico
-                pdf_path = genera_pdf_foglio_tecnico(foglio.id)
+                from app.services.coda_pdf import accoda_pdf_foglio
                 foglio.stato = 'Completato'
                 foglio.completed_at = datetime.utcnow()
+                # Rendering in background: il PDF sarà disponibile dalla pagina del foglio
+                accoda_pdf_foglio(foglio.id)
                 
-            elif azione == 'invia_email':
+            elif azione in ('invia_email', 'genera_e_invia'):
+                # Il PDF viene generato in background e allegato dal sender dell'outbox
                 from app.services.email_sender import invia_foglio_per_email
                 invia_foglio_per_email(
                     foglio.id, 
                     form.email_destinatario.data,
                     form.note_finali.data
                 )
-                
-            elif azione == 'genera_e_invia':
-                from app.services.pdf_generator import genera_pdf_foglio_tecnico
-                from app.services.email_sender import invia_foglio_per_email
-                
-                pdf_path = genera_pdf_foglio_tecnico(foglio.id)
-                invia_foglio_per_email(
-                    foglio.id,
-                    form.email_destinatario.data, 
-                    form.note_finali.data
-                )
+                flash(f'Invio a {form.email_destinatario.data} in corso: lo stato è visibile nella pagina del foglio', 'info')
             
             db.session.commit()
             return redirect(url_for('fogli_tecnici.view', id=foglio.id))
@@ -770,16 +638,12 @@ def delete(id):
         # PRIMA DI ELIMINARE: Ripristina stati originali delle macchine
         _ripristina_stati_macchine_foglio(foglio)
         
-        # Elimina file firme se esistono
-        if foglio.firma_tecnico_path and os.path.exists(foglio.firma_tecnico_path):
-            os.remove(foglio.firma_tecnico_path)
-        
-        if foglio.firma_cliente_path and os.path.exists(foglio.firma_cliente_path):
-            os.remove(foglio.firma_cliente_path)
+        # Elimina file firme se esistono e nessun altro foglio li usa
+        for firma_path in {foglio.firma_tecnico_path, foglio.firma_cliente_path}:
+            elimina_firma_se_inutilizzata(firma_path, escludi_foglio_id=foglio.id)
         
-        # Elimina PDF se esiste
-        if foglio.pdf_path and os.path.exists(foglio.pdf_path):
-            os.remove(foglio.pdf_path)
+        # Elimina PDF se esiste (tutte le versioni del foglio; le copie archiviate restano nei contenitori)
+        rimuovi_pdf_superati(foglio.numero_foglio)
         
         numero_foglio = foglio.numero_foglio
         db.session.delete(foglio)
@@ -795,6 +659,70 @@ def delete(id):
 
 
 # API Routes
+@fogli_tecnici_bp.route('/api/sincronizza', methods=['POST'])
+@login_required
+def api_sincronizza_fogli():
+    """
+    Carica uno o più fogli compilati offline (JSON: {"fogli": [...]}, una lista o un singolo foglio).
+    Ogni foglio porta una "chiave" di idempotenza: ripetere l'invio non crea duplicati.
+    """
+    from app.services.sincronizzazione_fogli import sincronizza_fogli
+    
+    if not PermissionManager.can_create_foglio_tecnico(current_user):
+        return jsonify({'success': False, 'message': 'Non autorizzato'}), 403
+    
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        fogli = payload['fogli'] if isinstance(payload.get('fogli'), list) else [payload]
+    elif isinstance(payload, list):
+        fogli = payload
+    else:
+        return jsonify({'success': False, 'message': 'Richiesta JSON non valida'}), 400
+    
+    try:
+        risultati = sincronizza_fogli(fogli, current_user)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    return jsonify({
+        'success': all(r['esito'] != 'errore' for r in risultati),
+        'risultati': risultati
+    })
+
+
+@fogli_tecnici_bp.route('/api/<int:id>', methods=['PATCH'])
+@login_required
+def api_aggiorna_foglio(id):
+    """
+    Modifica parziale del foglio (salvataggio automatico del wizard): il JSON contiene
+    solo i campi cambiati, vengono scritte solo le colonne e le associazioni diverse.
+    """
+    foglio = FoglioTecnico.query.get_or_404(id)
+    
+    if not PermissionManager.can_edit_foglio_tecnico(current_user, foglio):
+        return jsonify({'success': False, 'message': 'Non autorizzato'}), 403
+    
+    modifiche = request.get_json(silent=True)
+    if not isinstance(modifiche, dict):
+        return jsonify({'success': False, 'message': 'Richiesta JSON non valida'}), 400
+    
+    try:
+        modificati, errori = applica_modifiche(foglio, modifiche, current_user)
+        if modificati:
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f'Errore salvataggio automatico foglio {foglio.id}: {str(e)}')
+        return jsonify({'success': False, 'message': 'Errore durante il salvataggio'}), 500
+    
+    return jsonify({
+        'success': not errori,
+        'modificati': modificati,
+        'errori': errori,
+        'updated_at': foglio.updated_at.isoformat() if foglio.updated_at else None
+    })
+
+
 @fogli_tecnici_bp.route('/api/client_machines/<int:cliente_id>')
 @login_required
 def get_client_machines(cliente_id):
@@ -913,16 +841,18 @@ def quick_create_client():
 @fogli_tecnici_bp.route('/api/get_available_machines')
 @login_required
 def get_available_machines():
-    """API per ottenere le macchine disponibili per prestito sostitutivo"""
+    """API per ottenere le macchine disponibili per prestito sostitutivo (ricerca paginata)"""
     try:
-        # Ottieni solo le macchine disponibili
-        macchine = Macchina.query.filter_by(stato='Disponibile').order_by(Macchina.codice).all()
+        from app.services.ricerca_macchine import cerca_macchine, metadati_pagina
         
-        # Filtra per permessi e dipartimento
-        macchine_filtrate = [
-            macchina for macchina in macchine 
-            if PermissionManager.can_view_machine(current_user, macchina)
-        ]
+        # Solo le macchine disponibili, filtrate per dipartimento
+        query = filter_by_department_access(Macchina.query, Macchina).filter(Macchina.stato == 'Disponibile')
+        
+        pagination = cerca_macchine(
+            request.args.get('q', '').strip(), query,
+            page=request.args.get('page', 1, type=int),
+            per_page=request.args.get('per_page', 50, type=int)
+        )
         
         machines_data = [
             {
@@ -933,12 +863,13 @@ def get_available_machines():
                 'stato': macchina.stato,
                 'ubicazione': macchina.ubicazione or 'Magazzino'
             }
-            for macchina in macchine_filtrate
+            for macchina in pagination.items
         ]
         
         return jsonify({
             'success': True,
-            'machines': machines_data
+            'machines': machines_data,
+            **metadati_pagina(pagination)
         })
         
     except Exception as e:
@@ -1031,31 +962,46 @@ def get_client_ongoing_operations(cliente_id):
 @fogli_tecnici_bp.route('/download_pdf/<int:id>')
 @login_required
 def download_pdf(id):
-    """Scarica il PDF di un foglio tecnico"""
+    """Scarica il PDF di un foglio tecnico (se manca lo accoda e attende qualche secondo, poi risponde 202)"""
     foglio = FoglioTecnico.query.get_or_404(id)
     
     if not PermissionManager.can_view_foglio_tecnico(current_user, foglio):
         abort(403)
     
-    # Verifica che il PDF esista
-    if not foglio.pdf_generato or not foglio.pdf_path or not os.path.exists(foglio.pdf_path):
-        # Genera PDF se non esiste
-        try:
-            from app.services.pdf_generator import genera_pdf_foglio_tecnico
-            pdf_path = genera_pdf_foglio_tecnico(foglio.id)
-        except Exception as e:
-            flash(f'Errore nella generazione del PDF: {str(e)}', 'error')
+    # Verifica che il PDF esista (nella cartella del foglio o nel contenitore di archivio)
+    if not foglio.pdf_generato or not documento_disponibile(foglio.pdf_path):
+        from app.services.coda_pdf import accoda_pdf_foglio, attendi_pdf
+        
+        job_id = accoda_pdf_foglio(foglio.id)
+        job = attendi_pdf(job_id, current_app.config.get('PDF_ATTESA_DOWNLOAD_SECONDI', 5))
+        
+        if job['stato'] == 'Errore':
+            flash(job['errore'], 'error')
             return redirect(url_for('fogli_tecnici.view', id=foglio.id))
+        
+        if job['stato'] != 'Completato':
+            stato_url = url_for('fogli_tecnici.stato_pdf', job_id=job_id)
+            if request.accept_mimetypes.best == 'application/json':
+                return jsonify({'success': True, 'stato': job['stato'], 'job_id': job_id, 'stato_url': stato_url}), 202
+            return render_template(
+                'fogli_tecnici/pdf_in_preparazione.html',
+                foglio=foglio,
+                stato_url=stato_url
+            ), 202
+        
+        pdf_path = job['pdf_path']
     else:
         pdf_path = foglio.pdf_path
     
-    # Invia file
-    directory = os.path.dirname(pdf_path)
-    filename = os.path.basename(pdf_path)
+    # Invia file (letto dalla cartella o dal contenitore di archivio)
+    try:
+        documento = apri_documento(pdf_path)
+    except FileNotFoundError:
+        abort(404)
     
-    return send_from_directory(
-        directory, 
-        filename, 
+    return send_file(
+        documento,
+        mimetype='application/pdf',
         as_attachment=True,
         download_name=f"FoglioTecnico_{foglio.numero_foglio}.pdf"
     )
@@ -1064,23 +1010,136 @@ def download_pdf(id):
 @fogli_tecnici_bp.route('/generate_pdf/<int:id>')
 @login_required
 def generate_pdf(id):
-    """Genera il PDF di un foglio tecnico"""
+    """Genera il PDF di un foglio tecnico tramite la coda di rendering"""
     foglio = FoglioTecnico.query.get_or_404(id)
     
     if not PermissionManager.can_view_foglio_tecnico(current_user, foglio):
         abort(403)
     
-    try:
-        from app.services.pdf_generator import genera_pdf_foglio_tecnico
-        pdf_path = genera_pdf_foglio_tecnico(foglio.id)
+    from app.services.coda_pdf import accoda_pdf_foglio, attendi_pdf
+    
+    job = attendi_pdf(accoda_pdf_foglio(foglio.id), current_app.config.get('PDF_ATTESA_DOWNLOAD_SECONDI', 5))
+    if job['stato'] == 'Completato':
         flash('PDF generato con successo!', 'success')
-        
-    except Exception as e:
-        flash(f'Errore nella generazione del PDF: {str(e)}', 'error')
+    elif job['stato'] == 'Errore':
+        flash(job['errore'], 'error')
+    else:
+        flash('Generazione del PDF in corso: sarà disponibile tra qualche istante.', 'info')
     
     return redirect(url_for('fogli_tecnici.view', id=foglio.id))
 
 
+@fogli_tecnici_bp.route('/pdf/stato/<job_id>')
+@login_required
+def stato_pdf(job_id):
+    """Stato di un job della coda PDF"""
+    from app.services.coda_pdf import get_pdf_job
+    
+    job = get_pdf_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Generazione PDF non trovata'}), 404
+    
+    foglio = FoglioTecnico.query.get_or_404(job['foglio_id'])
+    if not PermissionManager.can_view_foglio_tecnico(current_user, foglio):
+        abort(403)
+    
+    risposta = {'success': True, 'stato': job['stato'], 'errore': job['errore']}
+    if job['stato'] == 'Completato':
+        risposta['download_url'] = url_for('fogli_tecnici.download_pdf', id=foglio.id)
+    return jsonify(risposta)
+
+
+@fogli_tecnici_bp.route('/raccolta')
+@login_required
+def raccolta_pdf():
+    """Raccolta dei PDF dei fogli di un periodo, cliente, tecnico o reparto"""
+    form = RaccoltaPdfForm()
+    return render_template('fogli_tecnici/raccolta.html', form=form, title='Raccolta PDF Fogli Tecnici')
+
+
+@fogli_tecnici_bp.route('/raccolta/avvia', methods=['POST'])
+@login_required
+def avvia_raccolta_pdf():
+    """Seleziona i fogli secondo i filtri e avvia la raccolta in background"""
+    from app.services.raccolta_pdf import filtra_fogli, avvia_raccolta_in_background
+    
+    form = RaccoltaPdfForm()
+    if not form.validate():
+        errori = [errore for errori_campo in form.errors.values() for errore in errori_campo]
+        return jsonify({'success': False, 'message': '; '.join(errori)}), 400
+    
+    query = filtra_fogli(
+        filter_by_department_access(FoglioTecnico.query, FoglioTecnico),
+        data_da=form.data_da.data,
+        data_a=form.data_a.data,
+        cliente_id=form.cliente.data or None,
+        tecnico_id=form.tecnico.data or None,
+        department_id=form.reparto.data or None
+    )
+    foglio_ids = [foglio_id for (foglio_id,) in query.with_entities(FoglioTecnico.id)]
+    if not foglio_ids:
+        return jsonify({'success': False, 'message': 'Nessun foglio tecnico corrisponde ai filtri'}), 400
+    
+    try:
+        job_id = avvia_raccolta_in_background(foglio_ids, form.formato.data, current_user.id)
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'totale': len(foglio_ids),
+            'stato_url': url_for('fogli_tecnici.stato_raccolta_pdf', job_id=job_id)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+def _job_raccolta_utente(job_id):
+    """Job di raccolta visibile all'utente corrente (chi l'ha avviato o un admin)"""
+    from app.services.raccolta_pdf import get_raccolta_job
+    
+    job = get_raccolta_job(job_id)
+    if job and job['user_id'] != current_user.id and not current_user.is_admin:
+        abort(403)
+    return job
+
+
+@fogli_tecnici_bp.route('/raccolta/stato/<job_id>')
+@login_required
+def stato_raccolta_pdf(job_id):
+    """Avanzamento ed esito di una raccolta PDF"""
+    job = _job_raccolta_utente(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Raccolta non trovata o scaduta'}), 404
+    
+    risposta = {
+        'success': True,
+        'stato': job['stato'],
+        'elaborati': job['elaborati'],
+        'totale': job['totale'],
+        'risultato': job['risultato'],
+        'errore': job['errore']
+    }
+    if job['stato'] == 'Completato':
+        risposta['download_url'] = url_for('fogli_tecnici.scarica_raccolta_pdf', job_id=job_id)
+    return jsonify(risposta)
+
+
+@fogli_tecnici_bp.route('/raccolta/scarica/<job_id>')
+@login_required
+def scarica_raccolta_pdf(job_id):
+    """Scarica il file di una raccolta completata"""
+    job = _job_raccolta_utente(job_id)
+    if not job or job['stato'] != 'Completato' or not os.path.exists(job['path']):
+        flash('Raccolta non trovata o scaduta.', 'error')
+        return redirect(url_for('fogli_tecnici.raccolta_pdf'))
+    
+    return send_from_directory(
+        os.path.dirname(job['path']),
+        os.path.basename(job['path']),
+        as_attachment=True,
+        download_name=f"FogliTecnici_{job['created_at'].strftime('%Y%m%d_%H%M')}.{job['formato']}"
+    )
+
+
 @fogli_tecnici_bp.route('/preview_html/<int:id>')
 @login_required
 def preview_html(id):
@@ -1109,7 +1168,7 @@ def send_email(id):
         try:
             from app.services.email_sender import invia_foglio_per_email
             invia_foglio_per_email(foglio.id, email_destinatario, note_aggiuntive)
-            flash(f'Foglio inviato con successo a {email_destinatario}', 'success')
+            flash(f'Invio del foglio a {email_destinatario} in corso: lo stato è visibile qui sotto', 'info')
             return redirect(url_for('fogli_tecnici.view', id=foglio.id))
             
         except Exception as e:
@@ -1135,18 +1194,19 @@ def api_ricambi_department():
         from app.utils.permissions import filter_by_department_access
         ricambi_query = filter_by_department_access(Ricambio.query, Ricambio)
 
-        # Aggiungi filtri aggiuntivi se necessario
+        # Ricerca su codice normalizzato e trigrammi, paginata lato server
         search_term = request.args.get('search', '').strip()
         if search_term:
-            ricambi_query = ricambi_query.filter(
-                or_(
-                    Ricambio.codice.ilike(f'%{search_term}%'),
-                    Ricambio.descrizione.ilike(f'%{search_term}%')
-                )
-            )
+            ricambi_query = filtra_ricerca(ricambi_query, search_term).order_by(rilevanza(search_term), Ricambio.codice)
+        else:
+            ricambi_query = ricambi_query.order_by(Ricambio.codice)
 
-        # Limita risultati per performance
-        ricambi = ricambi_query.order_by(Ricambio.codice).limit(1000).all()
+        pagination = ricambi_query.paginate(
+            page=request.args.get('page', 1, type=int),
+            per_page=min(request.args.get('per_page', 50, type=int), 200),
+            error_out=False
+        )
+        ricambi = pagination.items
 
         results = []
         for ricambio in ricambi:
@@ -1164,7 +1224,8 @@ def api_ricambi_department():
         return jsonify({
             'success': True,
             'ricambi': results,
-            'total': len(results)
+            'total': pagination.total,
+            'has_more': pagination.has_next
         })
 
     except Exception as e:
@@ -1203,114 +1264,78 @@ def view_signature(id, tipo):
 
 
 def _save_signature(foglio, tipo, signature_data):
-    """Salva una firma su file"""
+    """Salva una firma su file (ritagliata, compressa e archiviata per contenuto)"""
     try:
-        # Decodifica base64
-        if signature_data.startswith('data:image/png;base64,'):
-            signature_data = signature_data.replace('data:image/png;base64,', '')
-        
-        signature_bytes = base64.b64decode(signature_data)
-        
-        # Crea cartella se non esiste
-        signatures_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'signatures')
-        os.makedirs(signatures_dir, exist_ok=True)
+        filepath = salva_firma(signature_data)
         
-        # Nome file sicuro
-        filename = f"{foglio.numero_foglio}_{tipo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-        filepath = os.path.join(signatures_dir, filename)
-        
-        # Salva file
-        with open(filepath, 'wb') as f:
-            f.write(signature_bytes)
-        
-        # Aggiorna foglio
+        # Aggiorna foglio, eliminando la firma precedente se non più usata
         if tipo == 'tecnico':
+            precedente, altra = foglio.firma_tecnico_path, foglio.firma_cliente_path
             foglio.firma_tecnico_path = filepath
         else:
+            precedente, altra = foglio.firma_cliente_path, foglio.firma_tecnico_path
             foglio.firma_cliente_path = filepath
+        # I file sono condivisi tra firme identiche: l'altra firma dello stesso foglio può usarlo ancora
+        if precedente and precedente not in (filepath, altra):
+            try:
+                elimina_firma_se_inutilizzata(precedente, escludi_foglio_id=foglio.id)
+            except OSError:
+                pass
         
         return filepath
         
     except Exception as e:
+        current_app.logger.warning(f"Firma {tipo} non salvata per foglio {foglio.numero_foglio}: {str(e)}")
         return None
 
 
 def _ripristina_stati_macchine_foglio(foglio):
     """
     Ripristina gli stati originali delle macchine quando si elimina un foglio tecnico.
-    Utilizza i dati salvati nei MovimentoMacchina per ripristinare lo stato precedente.
+    Utilizza i dati salvati nel primo MovimentoMacchina del foglio per ogni macchina (lo stato
+    prima dell'intervento): una query per tutte le macchine e aggiornamenti in blocco.
     """
     from app.models.macchina import MovimentoMacchina
     
     try:
-        # Trova tutti i movimenti collegati a questo foglio
-        movimenti = MovimentoMacchina.query.filter_by(foglio_id=foglio.id).order_by(MovimentoMacchina.created_at.desc()).all()
+        snapshot = MovimentoMacchina.primi_movimenti(MovimentoMacchina.foglio_id == foglio.id)
         
-        macchine_ripristinate = set()
-        
-        for movimento in movimenti:
-            macchina = movimento.macchina
-            if not macchina:
-                # Salta movimenti con macchina non esistente (eliminata)
-                current_app.logger.warning(f'Macchina ID {movimento.macchina_id} non trovata per ripristino foglio {foglio.numero_foglio}')
-                continue
-
-            if macchina.id in macchine_ripristinate:
-                # Salta macchine già ripristinate
-                continue
-                
-            # Ripristina lo stato originale della macchina
+        ripristini = {}
+        movimenti = []
+        for movimento, stato_attuale, codice in snapshot:
             if movimento.cliente_originale_id is not None:
                 # La macchina aveva un cliente originale - ripristina stato completo
-                macchina.cliente_id = movimento.cliente_originale_id
-                macchina.stato = 'Attiva' if movimento.cliente_originale_id else 'Disponibile'
-                macchina.ubicazione = movimento.ubicazione_originale
-                macchina.data_assegnazione = movimento.data_assegnazione_originale
-                macchina.data_vendita = movimento.data_vendita_originale
-                macchina.prezzo_vendita = movimento.prezzo_vendita_originale
-                macchina.prossima_manutenzione = movimento.prossima_manutenzione_originale
-                
-                # Crea movimento di ripristino
-                movimento_ripristino = MovimentoMacchina(
-                    macchina_id=macchina.id,
-                    tipo_movimento='Ripristino automatico',
-                    stato_precedente=macchina.stato,
-                    stato_nuovo='Attiva' if movimento.cliente_originale_id else 'Disponibile',
-                    cliente_id=movimento.cliente_originale_id,
-                    user_id=current_user.id,
-                    note=f'Ripristino automatico per eliminazione foglio {foglio.numero_foglio}'
-                )
-                db.session.add(movimento_ripristino)
+                ripristini[movimento.macchina_id] = dict(movimento.valori_originali(), stato='Attiva')
+                stato_nuovo = 'Attiva'
+            elif movimento.stato_precedente:
+                # Ripristina solo lo stato precedente
+                stato_nuovo = movimento.stato_precedente
+                ripristini[movimento.macchina_id] = {'stato': stato_nuovo}
                 
+                # Se era disponibile, rimuovi cliente
+                if stato_nuovo == 'Disponibile':
+                    ripristini[movimento.macchina_id].update(cliente_id=None, ubicazione='Magazzino')
             else:
-                # Ripristina solo lo stato precedente
-                if movimento.stato_precedente:
-                    macchina.stato = movimento.stato_precedente
-                    
-                    # Se era disponibile, rimuovi cliente
-                    if movimento.stato_precedente == 'Disponibile':
-                        macchina.cliente_id = None
-                        macchina.ubicazione = 'Magazzino'
-                    
-                    # Crea movimento di ripristino
-                    movimento_ripristino = MovimentoMacchina(
-                        macchina_id=macchina.id,
-                        tipo_movimento='Ripristino automatico',
-                        stato_precedente=macchina.stato,
-                        stato_nuovo=movimento.stato_precedente,
-                        user_id=current_user.id,
-                        note=f'Ripristino automatico per eliminazione foglio {foglio.numero_foglio}'
-                    )
-                    db.session.add(movimento_ripristino)
+                continue
             
-            macchine_ripristinate.add(macchina.id)
-            current_app.logger.info(f'Ripristinato stato macchina {macchina.codice} per eliminazione foglio {foglio.numero_foglio}')
+            movimenti.append({
+                'macchina_id': movimento.macchina_id,
+                'tipo_movimento': 'Ripristino automatico',
+                'stato_precedente': stato_attuale,
+                'stato_nuovo': stato_nuovo,
+                'cliente_id': movimento.cliente_originale_id,
+                'user_id': current_user.id,
+                'note': f'Ripristino automatico per eliminazione foglio {foglio.numero_foglio}',
+            })
         
-        # Elimina i movimenti originali del foglio
-        MovimentoMacchina.query.filter_by(foglio_id=foglio.id).delete()
+        with db.session.begin_nested():
+            MovimentoMacchina.applica_ripristini(ripristini, movimenti)
+            
+            # Elimina i movimenti originali del foglio
+            MovimentoMacchina.query.filter_by(foglio_id=foglio.id).delete()
         
-        if macchine_ripristinate:
-            current_app.logger.info(f'Ripristinati stati di {len(macchine_ripristinate)} macchine per eliminazione foglio {foglio.numero_foglio}')
+        if ripristini:
+            current_app.logger.info(f'Ripristinati stati di {len(ripristini)} macchine per eliminazione foglio {foglio.numero_foglio}')
             
     except Exception as e:
         current_app.logger.error(f'Errore nel ripristino stati macchine per foglio {foglio.numero_foglio}: {str(e)}')
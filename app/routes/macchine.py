@@ -1,46 +1,57 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, abort
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, abort, make_response, current_app
 from flask_login import login_required, current_user
-from sqlalchemy import or_
+from sqlalchemy import or_, func, case
+from sqlalchemy.orm import joinedload, contains_eager
 from app import db
-from app.models.macchina import Macchina, TipoMacchina, MovimentoMacchina
+from app.models.macchina import Macchina, TipoMacchina, MovimentoMacchina, ScadenzaMacchina
 from app.models.cliente import Cliente
 from app.models.ticket import Ticket
 from app.models.department import Department
+from app.models.user import User
 from app.forms.macchina import MacchinaForm, MacchinaFilterForm
 from app.forms.tipo_macchina import TipoMacchinaForm
 from app.utils.permissions import PermissionManager
+from app.services.immagini import invia_foto, elimina_foto
+from app.services.archivio_movimenti import entita_movimenti, movimenti_archiviati_macchina, data_limite_archivio, archivio_presente
+from app.services.scadenze_macchine import aggiorna_coda_scadenze, query_scadenze, genera_calendario_ics
+from app.services.timeline_macchine import timeline_macchina, CursoreNonValido
+from app.services.ricerca_macchine import cerca_macchine
 import os
+from datetime import datetime, timedelta
 
 macchine_bp = Blueprint('macchine', __name__)
 
 
-@macchine_bp.route('/')
-@login_required
-def index():
-    """Lista macchine con statistiche e filtri"""
-    form = MacchinaFilterForm()
+def _tipi_macchina_visibili(user=None):
+    """Id dei tipi di macchina visibili all'utente (default: utente corrente; None = tutti)"""
+    user = user or current_user
+    if user.has_permission('can_view_all_departments') or not user.department_id:
+        return None
+    return TipoMacchina.ids_per_reparto(user.department_id)
 
-    # Query base - filtra per reparto utente se non è admin
-    query = Macchina.query
-    if not current_user.has_permission('can_view_all_departments'):
-        if current_user.department_id:
-            # Filtra per tipi di macchina associati al reparto dell'utente
-            from app.models.department import Department
-            user_department = Department.query.get(current_user.department_id)
-            if user_department:
-                allowed_tipo_ids = [t.id for t in user_department.tipi_macchine.all()]
-                if allowed_tipo_ids:
-                    query = query.filter(Macchina.tipo_macchina_id.in_(allowed_tipo_ids))
-                else:
-                    # Se il reparto non ha tipi associati, non mostra nessuna macchina
-                    query = query.filter(Macchina.id == -1)
+
+def _filtri_elenco(form):
+    """
+    Condizioni SQL dell'elenco macchine dai parametri URL (reparto utente, ricerca,
+    tipo, stato, reparto e cliente), condivise da elenco ed export
+    """
+    filtri = []
+
+    # Filtra per reparto utente se non è admin (tipi di macchina del reparto, in cache)
+    allowed_tipo_ids = _tipi_macchina_visibili()
+    if allowed_tipo_ids is not None:
+        if allowed_tipo_ids:
+            filtri.append(Macchina.tipo_macchina_id.in_(allowed_tipo_ids))
+        else:
+            # Se il reparto non ha tipi associati, non mostra nessuna macchina
+            filtri.append(Macchina.id == -1)
 
     # Applica filtri da parametri URL
     search_term = request.args.get('search', '').strip()
     if search_term:
         form.search.data = search_term
         search_pattern = f"%{search_term}%"
-        query = query.filter(or_(
+        filtri.append(or_(
             Macchina.codice.like(search_pattern),
             Macchina.modello.like(search_pattern),
             Macchina.marca.like(search_pattern),
@@ -52,21 +63,21 @@ def index():
         try:
             tipo_id = int(tipo_filter)
             form.tipo_macchina_id.data = tipo_id
-            query = query.filter(Macchina.tipo_macchina_id == tipo_id)
+            filtri.append(Macchina.tipo_macchina_id == tipo_id)
         except ValueError:
             pass  # Ignora valori non validi
 
     stato_filter = request.args.get('stato', '').strip()
     if stato_filter:
         form.stato.data = stato_filter
-        query = query.filter(Macchina.stato == stato_filter)
+        filtri.append(Macchina.stato == stato_filter)
 
     department_filter = request.args.get('department_id', '').strip()
     if department_filter and department_filter != '':
         try:
             dept_id = int(department_filter)
             form.department_id.data = dept_id
-            query = query.filter(Macchina.department_id == dept_id)
+            filtri.append(Macchina.department_id == dept_id)
         except ValueError:
             pass  # Ignora valori non validi
 
@@ -75,38 +86,60 @@ def index():
         try:
             cliente_id = int(cliente_filter)
             form.cliente_id.data = cliente_id
-            query = query.filter(Macchina.cliente_id == cliente_id)
+            filtri.append(Macchina.cliente_id == cliente_id)
         except ValueError:
             pass  # Ignora valori non validi
 
-    # Statistiche per la dashboard
-    total_macchine = query.count()
-    macchine_disponibili = query.filter_by(stato='Disponibile').count()
-    macchine_in_prestito = query.filter_by(stato='In prestito').count()
-    macchine_in_riparazione = query.filter_by(stato='In riparazione').count()
+    return filtri
 
-    # Macchine con manutenzione prossima (30 giorni)
-    from datetime import datetime, timedelta
-    data_limite = datetime.now().date() + timedelta(days=30)
-    macchine_manutenzione = query.filter(
-        Macchina.prossima_manutenzione <= data_limite
-    ).count()
 
-    # Paginazione
+@macchine_bp.route('/')
+@login_required
+def index():
+    """Lista macchine con statistiche e filtri"""
+    form = MacchinaFilterForm()
+
+    # Filtri comuni a statistiche, elenco e movimenti recenti
+    filtri = _filtri_elenco(form)
+
+    query = Macchina.query.filter(*filtri)
+
+    # Statistiche per la dashboard: un solo GROUP BY stato, con il conteggio delle
+    # manutenzioni prossime (30 giorni) calcolato nella stessa scansione
+    data_limite = datetime.now().date() + timedelta(days=30)
+    conteggi = db.session.query(
+        Macchina.stato,
+        func.count(Macchina.id),
+        func.sum(case((Macchina.prossima_manutenzione <= data_limite, 1), else_=0))
+    ).filter(*filtri).group_by(Macchina.stato).all()
+
+    per_stato = {stato: totale for stato, totale, _ in conteggi}
+    total_macchine = sum(per_stato.values())
+    macchine_disponibili = per_stato.get('Disponibile', 0)
+    macchine_in_prestito = per_stato.get('In prestito', 0)
+    macchine_in_riparazione = per_stato.get('In riparazione', 0)
+    macchine_manutenzione = sum(int(manutenzione or 0) for _, _, manutenzione in conteggi)
+
+    # Paginazione (il totale è già noto dal GROUP BY: niente COUNT aggiuntivo)
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
 
-    pagination = query.order_by(Macchina.codice).paginate(
-        page=page, per_page=per_page, error_out=False
+    pagination = query.options(
+        joinedload(Macchina.tipo_macchina),
+        joinedload(Macchina.cliente)
+    ).order_by(Macchina.codice).paginate(
+        page=page, per_page=per_page, error_out=False, count=False
     )
+    pagination.total = total_macchine
 
     macchine = pagination.items
 
-    # Movimenti recenti (solo per le macchine visibili)
-    macchine_ids = [m.id for m in macchine] if macchine else []
-    movimenti_recenti = MovimentoMacchina.query.filter(
-        MovimentoMacchina.macchina_id.in_(macchine_ids)
-    ).order_by(MovimentoMacchina.created_at.desc()).limit(10).all() if macchine_ids else []
+    # Movimenti recenti delle macchine filtrate: join sull'indice per data, senza lista di id
+    movimenti_recenti = MovimentoMacchina.query.join(MovimentoMacchina.macchina)\
+        .filter(*filtri)\
+        .options(contains_eager(MovimentoMacchina.macchina))\
+        .order_by(MovimentoMacchina.created_at.desc())\
+        .limit(10).all()
 
     return render_template('macchine/index.html',
                          macchine=macchine,
@@ -188,6 +221,95 @@ def create_macchina():
                          action_url=url_for('macchine.create_macchina'))
 
 
+@macchine_bp.route('/export')
+@login_required
+def export_macchine():
+    """Esporta in CSV il parco macchine filtrato, con stato attuale, inviato in streaming"""
+    from flask import stream_with_context
+    from app.services.import_macchine import genera_csv_parco
+
+    filtri = _filtri_elenco(MacchinaFilterForm())
+    response = current_app.response_class(stream_with_context(genera_csv_parco(*filtri)), mimetype='text/csv')
+    response.headers['Content-Disposition'] = \
+        f'attachment; filename=parco_macchine_{datetime.now().strftime("%Y%m%d")}.csv'
+    return response
+
+
+@macchine_bp.route('/import')
+@login_required
+def import_macchine():
+    """Importazione del parco macchine da file CSV/XLSX"""
+    if not PermissionManager.can_create_machine(current_user):
+        abort(403)
+
+    tipi = TipoMacchina.query.order_by(TipoMacchina.nome).all()
+    departments = Department.query.filter_by(is_active=True).order_by(Department.display_name).all()
+    return render_template('macchine/import.html', tipi=tipi, departments=departments)
+
+
+@macchine_bp.route('/import/avvia', methods=['POST'])
+@login_required
+def avvia_import_macchine():
+    """Carica il file e avvia l'importazione delle macchine in background"""
+    if not PermissionManager.can_create_machine(current_user):
+        return jsonify({'success': False, 'message': 'Non autorizzato'}), 403
+
+    from werkzeug.utils import secure_filename
+    from app.services.import_macchine import avvia_import_in_background
+    import uuid
+
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({'success': False, 'message': 'Nessun file selezionato'}), 400
+
+    estensione = os.path.splitext(file.filename)[1].lower()
+    if estensione not in ('.csv', '.txt', '.xlsx', '.xlsm'):
+        return jsonify({'success': False, 'message': 'Formato non supportato (usa CSV o XLSX)'}), 400
+
+    try:
+        import_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'import_macchine')
+        os.makedirs(import_dir, exist_ok=True)
+        path = os.path.join(import_dir, f"{uuid.uuid4().hex}_{secure_filename(file.filename)}")
+        file.save(path)
+
+        job_id = avvia_import_in_background(
+            path,
+            tipo_macchina_id=request.form.get('tipo_macchina_id', type=int),
+            department_id=request.form.get('department_id', type=int),
+            user_id=current_user.id,
+            dry_run=request.form.get('dry_run') == '1'
+        )
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'stato_url': url_for('macchine.stato_import_macchine', job_id=job_id)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@macchine_bp.route('/import/stato/<job_id>')
+@login_required
+def stato_import_macchine(job_id):
+    """Avanzamento ed esito di un'importazione macchine"""
+    if not PermissionManager.can_create_machine(current_user):
+        return jsonify({'success': False, 'message': 'Non autorizzato'}), 403
+
+    from app.services.import_macchine import get_import_job
+
+    job = get_import_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Importazione non trovata'}), 404
+
+    return jsonify({
+        'success': True,
+        'stato': job['stato'],
+        'righe_elaborate': job['righe_elaborate'],
+        'risultato': job['risultato'],
+        'errore': job['errore']
+    })
+
+
 @macchine_bp.route('/<int:macchina_id>')
 @login_required
 def detail_macchina(macchina_id):
@@ -268,6 +390,13 @@ def edit_macchina(macchina_id):
                          action_url=url_for('macchine.edit_macchina', macchina_id=macchina.id))
 
 
+@macchine_bp.route('/foto/<filename>')
+@login_required
+def foto_macchina(filename):
+    """Serve le foto delle macchine (?variante=thumb|medium|full)"""
+    return invia_foto('macchine', filename, request.args.get('variante'))
+
+
 @macchine_bp.route('/<int:macchina_id>/delete', methods=['POST'])
 @login_required
 def delete_macchina(macchina_id):
@@ -279,11 +408,8 @@ def delete_macchina(macchina_id):
         abort(403)
 
     try:
-        # Elimina foto se esiste
-        if macchina.foto_filename:
-            foto_path = os.path.join('app/static/uploads/macchine', macchina.foto_filename)
-            if os.path.exists(foto_path):
-                os.remove(foto_path)
+        # Elimina foto e varianti se esiste
+        elimina_foto('macchine', macchina.foto_filename)
 
         db.session.delete(macchina)
         db.session.commit()
@@ -424,26 +550,129 @@ def attiva_macchina(macchina_id):
 @macchine_bp.route('/api/search')
 @login_required
 def api_search_macchine():
-    """API per ricerca macchine (usato nei form)"""
+    """API per ricerca macchine (usato nei form): codice, matricola, marca e modello, per rilevanza"""
     q = request.args.get('q', '').strip()
     if not q or len(q) < 2:
         return jsonify([])
 
-    macchine = Macchina.query.filter(
-        or_(
-            Macchina.codice.like(f'%{q}%'),
-            Macchina.modello.like(f'%{q}%'),
-            Macchina.marca.like(f'%{q}%')
-        )
-    ).limit(10).all()
+    query = Macchina.query
+    allowed_tipo_ids = _tipi_macchina_visibili()
+    if allowed_tipo_ids is not None:
+        query = query.filter(Macchina.tipo_macchina_id.in_(allowed_tipo_ids or [-1]))
+    stato = request.args.get('stato')
+    if stato:
+        query = query.filter(Macchina.stato == stato)
+
+    pagination = cerca_macchine(
+        q, query,
+        page=request.args.get('page', 1, type=int),
+        per_page=request.args.get('per_page', 10, type=int)
+    )
 
     return jsonify([{
         'id': m.id,
         'codice': m.codice,
         'modello': m.modello,
         'marca': m.marca,
+        'numero_serie': m.numero_serie,
+        'stato': m.stato,
         'text': f'{m.codice} - {m.marca} {m.modello}'
-    } for m in macchine])
+    } for m in pagination.items])
+
+
+@macchine_bp.route('/api/scadenze')
+@login_required
+def api_scadenze():
+    """Coda paginata delle scadenze (manutenzioni e garanzie) calcolata dal job giornaliero"""
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 50, type=int), 200)
+
+    pagination = query_scadenze(
+        tipo=request.args.get('tipo') or None,
+        department_id=request.args.get('department_id', type=int),
+        tecnico_id=request.args.get('tecnico_id', type=int),
+        solo_scadute=request.args.get('scadute') == '1',
+        tipi_macchina_ids=_tipi_macchina_visibili()
+    ).options(
+        joinedload(ScadenzaMacchina.macchina).joinedload(Macchina.cliente),
+        joinedload(ScadenzaMacchina.tecnico),
+        joinedload(ScadenzaMacchina.ticket)
+    ).paginate(page=page, per_page=per_page, error_out=False)
+
+    return jsonify({
+        'success': True,
+        'scadenze': [s.to_dict() for s in pagination.items],
+        'total': pagination.total,
+        'pages': pagination.pages,
+        'current_page': pagination.page
+    })
+
+
+@macchine_bp.route('/scadenze/calendario/<token>.ics')
+def calendario_scadenze(token):
+    """
+    Feed iCalendar delle scadenze, con gli stessi filtri dell'API. Senza login: i client
+    calendario si autenticano con il token personale nell'indirizzo (vedi api_calendario_scadenze)
+    """
+    user = User.query.filter_by(calendario_token=token, is_active=True).first() if token else None
+    if user is None:
+        abort(404)
+
+    scadenze = query_scadenze(
+        tipo=request.args.get('tipo') or None,
+        department_id=request.args.get('department_id', type=int),
+        tecnico_id=request.args.get('tecnico_id', type=int),
+        tipi_macchina_ids=_tipi_macchina_visibili(user)
+    ).options(
+        joinedload(ScadenzaMacchina.macchina).joinedload(Macchina.cliente),
+        joinedload(ScadenzaMacchina.tecnico),
+        joinedload(ScadenzaMacchina.ticket)
+    ).all()
+
+    response = make_response(genera_calendario_ics(scadenze))
+    response.headers['Content-Type'] = 'text/calendar; charset=utf-8'
+    response.headers['Content-Disposition'] = 'inline; filename=scadenze_macchine.ics'
+    return response
+
+
+@macchine_bp.route('/api/scadenze/calendario')
+@login_required
+def api_calendario_scadenze():
+    """Indirizzo personale del feed calendario (il token viene creato al primo accesso)"""
+    if not current_user.calendario_token:
+        current_user.rigenera_calendario_token()
+        db.session.commit()
+    return jsonify({
+        'success': True,
+        'url': url_for('macchine.calendario_scadenze', token=current_user.calendario_token, _external=True)
+    })
+
+
+@macchine_bp.route('/api/scadenze/calendario/rigenera', methods=['POST'])
+@login_required
+def rigenera_calendario_scadenze():
+    """Sostituisce il token del feed calendario: il vecchio indirizzo smette di funzionare"""
+    current_user.rigenera_calendario_token()
+    db.session.commit()
+    return jsonify({
+        'success': True,
+        'url': url_for('macchine.calendario_scadenze', token=current_user.calendario_token, _external=True)
+    })
+
+
+@macchine_bp.route('/api/scadenze/aggiorna', methods=['POST'])
+@login_required
+def aggiorna_scadenze():
+    """Ricalcola subito la coda delle scadenze (solo admin)"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Permessi insufficienti'}), 403
+
+    try:
+        risultato = aggiorna_coda_scadenze(crea_ticket=request.args.get('crea_ticket') == '1' or None)
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Errore durante il calcolo delle scadenze: {str(e)}'}), 500
+
+    return jsonify({'success': True, 'risultato': risultato})
 
 
 @macchine_bp.route('/<int:macchina_id>/movimenti')
@@ -460,8 +689,12 @@ def movimenti_macchina(macchina_id):
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 25, type=int)
 
-    pagination = MovimentoMacchina.query.filter_by(macchina_id=macchina_id)\
-        .order_by(MovimentoMacchina.created_at.desc())\
+    # Con storico=completo la timeline include anche i movimenti archiviati
+    storico_completo = request.args.get('storico') == 'completo'
+    Movimento = entita_movimenti(MovimentoMacchina, completo=storico_completo)
+
+    pagination = db.session.query(Movimento).filter(Movimento.macchina_id == macchina_id)\
+        .order_by(Movimento.created_at.desc())\
         .paginate(page=page, per_page=per_page, error_out=False)
 
     movimenti = pagination.items
@@ -469,7 +702,9 @@ def movimenti_macchina(macchina_id):
     return render_template('macchine/movimenti_macchina.html',
                          macchina=macchina,
                          movimenti=movimenti,
-                         pagination=pagination)
+                         pagination=pagination,
+                         storico_completo=storico_completo,
+                         movimenti_archiviati=movimenti_archiviati_macchina(macchina_id))
 
 
 @macchine_bp.route('/<int:macchina_id>/api/movimenti')
@@ -484,8 +719,9 @@ def api_movimenti_macchina(macchina_id):
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
 
-    pagination = MovimentoMacchina.query.filter_by(macchina_id=macchina_id)\
-        .order_by(MovimentoMacchina.created_at.desc())\
+    Movimento = entita_movimenti(MovimentoMacchina, completo=request.args.get('storico') == 'completo')
+    pagination = db.session.query(Movimento).filter(Movimento.macchina_id == macchina_id)\
+        .order_by(Movimento.created_at.desc())\
         .paginate(page=page, per_page=per_page, error_out=False)
 
     return jsonify({
@@ -496,6 +732,28 @@ def api_movimenti_macchina(macchina_id):
     })
 
 
+@macchine_bp.route('/<int:macchina_id>/api/timeline')
+@login_required
+def api_timeline_macchina(macchina_id):
+    """Timeline unificata (movimenti, ticket, fogli tecnici) con paginazione a cursore"""
+    macchina = Macchina.query.get_or_404(macchina_id)
+
+    if not PermissionManager.can_view_machine(current_user, macchina):
+        abort(403)
+
+    try:
+        pagina = timeline_macchina(
+            macchina_id,
+            cursore=request.args.get('cursor') or None,
+            limite=request.args.get('limit', type=int),
+            completo=request.args.get('storico') == 'completo'
+        )
+    except CursoreNonValido as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    return jsonify({'success': True, **pagina})
+
+
 # ========== CRUD TipoMacchina ==========
 
 @macchine_bp.route('/movimenti')
@@ -513,14 +771,29 @@ def movimenti_generale():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 50, type=int)
 
+    # Filtro per periodo (opzionale): se include mesi archiviati interroga anche gli archivi
+    data_da = data_a = None
+    try:
+        if request.args.get('data_da'):
+            data_da = datetime.strptime(request.args.get('data_da'), '%Y-%m-%d')
+        if request.args.get('data_a'):
+            data_a = datetime.strptime(request.args.get('data_a'), '%Y-%m-%d') + timedelta(days=1)
+    except ValueError:
+        pass
+
+    Movimento = entita_movimenti(MovimentoMacchina, data_da, data_a)
+    query = db.session.query(Movimento)
+
     # Filtro per macchina specifica (opzionale)
     macchina_id = request.args.get('macchina_id', type=int)
     if macchina_id:
-        query = MovimentoMacchina.query.filter_by(macchina_id=macchina_id)
-    else:
-        query = MovimentoMacchina.query
+        query = query.filter(Movimento.macchina_id == macchina_id)
+    if data_da:
+        query = query.filter(Movimento.created_at >= data_da)
+    if data_a:
+        query = query.filter(Movimento.created_at <= data_a)
 
-    pagination = query.order_by(MovimentoMacchina.created_at.desc())\
+    pagination = query.order_by(Movimento.created_at.desc())\
         .paginate(page=page, per_page=per_page, error_out=False)
 
     movimenti = pagination.items
@@ -532,7 +805,9 @@ def movimenti_generale():
                          movimenti=movimenti,
                          pagination=pagination,
                          macchine=macchine,
-                         filtro_macchina_id=macchina_id)
+                         filtro_macchina_id=macchina_id,
+                         data_limite_archivio=data_limite_archivio(),
+                         archivio_presente=archivio_presente(MovimentoMacchina.__tablename__))
 
 
 @macchine_bp.route('/tipi')
@@ -623,6 +898,7 @@ def delete_tipo_macchina(tipo_id):
     try:
         db.session.delete(tipo)
         db.session.commit()
+        TipoMacchina.invalida_cache_reparti()
 
         flash('Tipo di macchina eliminato con successo!', 'success')
         return redirect(url_for('macchine.list_tipi_macchina'))
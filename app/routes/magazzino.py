@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, send_from_directory, abort
 from flask_login import login_required, current_user
 from sqlalchemy import or_, and_, desc, asc
+from sqlalchemy.orm import joinedload
 from werkzeug.utils import secure_filename
 from app import db
 from app.models.ricambio import Ricambio, MovimentoMagazzino, PrenotazioneRicambio
@@ -11,6 +12,10 @@ from app.forms.magazzino import (
     CalendarioPrenotazioniForm
 )
 from app.utils.permissions import filter_by_department_access
+from app.forms.fields import risposta_select
+from app.services.ricerca_ricambi import cerca_ricambi, filtra_ricerca, rilevanza
+from app.services.immagini import invia_foto, genera_varianti_sicuro, elimina_foto
+from app.services.archivio_movimenti import entita_movimenti, consumi_mensili_ricambio, data_limite_archivio, archivio_presente
 from datetime import datetime, timedelta
 import os
 import uuid
@@ -30,12 +35,9 @@ def index():
     query = filter_by_department_access(Ricambio.query, Ricambio)
     
     # Applica filtri se presenti
-    if request.args.get('search'):
-        search_term = request.args.get('search')
-        query = query.filter(or_(
-            Ricambio.codice.ilike(f'%{search_term}%'),
-            Ricambio.descrizione.ilike(f'%{search_term}%')
-        ))
+    search_term = request.args.get('search', '').strip()
+    if search_term:
+        query = filtra_ricerca(query, search_term)
         search_form.search.data = search_term
     
     if request.args.get('filtro_stato'):
@@ -47,10 +49,7 @@ def index():
         elif filtro == 'prenotati':
             query = query.filter(Ricambio.quantita_prenotata > 0)
         elif filtro == 'sotto_scorta':
-            query = query.filter(
-                Ricambio.quantita_minima > 0,
-                Ricambio.quantita_disponibile <= Ricambio.quantita_minima
-            )
+            query = query.filter(Ricambio.sotto_scorta == True)
         elif filtro == 'esauriti':
             query = query.filter(Ricambio.quantita_disponibile <= Ricambio.quantita_prenotata)
     
@@ -64,11 +63,13 @@ def index():
         query = query.filter(Ricambio.fornitore.ilike(f'%{fornitore}%'))
         search_form.fornitore.data = fornitore
     
-    # Ordinamento
-    sort_by = request.args.get('sort', 'codice')
+    # Ordinamento (con una ricerca attiva, di default per rilevanza)
+    sort_by = request.args.get('sort', 'rilevanza' if search_term else 'codice')
     sort_dir = request.args.get('dir', 'asc')
     
-    if sort_by == 'codice':
+    if sort_by == 'rilevanza' and search_term:
+        query = query.order_by(rilevanza(search_term), asc(Ricambio.codice))
+    elif sort_by == 'codice':
         query = query.order_by(asc(Ricambio.codice) if sort_dir == 'asc' else desc(Ricambio.codice))
     elif sort_by == 'descrizione':
         query = query.order_by(asc(Ricambio.descrizione) if sort_dir == 'asc' else desc(Ricambio.descrizione))
@@ -88,10 +89,7 @@ def index():
     ricambi_query = filter_by_department_access(Ricambio.query, Ricambio)
     stats = {
         'totale_ricambi': ricambi_query.count(),
-        'sotto_scorta': ricambi_query.filter(
-            Ricambio.quantita_minima > 0,
-            Ricambio.quantita_disponibile <= Ricambio.quantita_minima
-        ).count(),
+        'sotto_scorta': ricambi_query.filter(Ricambio.sotto_scorta == True).count(),
         'con_prenotazioni': ricambi_query.filter(Ricambio.quantita_prenotata > 0).count(),
         'esauriti': ricambi_query.filter(Ricambio.quantita_disponibile <= Ricambio.quantita_prenotata).count()
     }
@@ -179,6 +177,7 @@ def nuovo_ricambio():
                     foto_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'ricambi', unique_filename)
                     os.makedirs(os.path.dirname(foto_path), exist_ok=True)
                     foto_file.save(foto_path)
+                    genera_varianti_sicuro(foto_path)
                     
                     ricambio.foto_filename = unique_filename
             
@@ -240,11 +239,8 @@ def modifica_ricambio(id):
             
             # Gestione upload foto
             if form.foto.data and form.foto.data.filename:
-                # Elimina la foto precedente se esiste
-                if ricambio.foto_filename:
-                    old_foto_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'ricambi', ricambio.foto_filename)
-                    if os.path.exists(old_foto_path):
-                        os.remove(old_foto_path)
+                # Elimina la foto precedente (e le sue varianti) se esiste
+                elimina_foto('ricambi', ricambio.foto_filename)
                 
                 # Salva la nuova foto
                 foto_file = form.foto.data
@@ -257,6 +253,7 @@ def modifica_ricambio(id):
                 foto_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'ricambi', unique_filename)
                 os.makedirs(os.path.dirname(foto_path), exist_ok=True)
                 foto_file.save(foto_path)
+                genera_varianti_sicuro(foto_path)
                 
                 ricambio.foto_filename = unique_filename
             
@@ -301,11 +298,8 @@ def elimina_ricambio(id):
         abort(403)
     
     try:
-        # Elimina la foto se esiste
-        if ricambio.foto_filename:
-            foto_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'ricambi', ricambio.foto_filename)
-            if os.path.exists(foto_path):
-                os.remove(foto_path)
+        # Elimina la foto e le sue varianti se esiste
+        elimina_foto('ricambi', ricambio.foto_filename)
         
         # Il database eliminerà automaticamente i movimenti e prenotazioni collegati
         # grazie al cascade='all, delete-orphan' definito nel modello
@@ -452,38 +446,46 @@ def carica_ricambio(id):
 def movimenti():
     """Elenco movimenti magazzino"""
     
-    # Query base
-    query = MovimentoMagazzino.query.join(Ricambio)
-    
-    # Filtri
-    if request.args.get('ricambio_id'):
-        query = query.filter(MovimentoMagazzino.ricambio_id == request.args.get('ricambio_id'))
-    
-    if request.args.get('tipo'):
-        query = query.filter(MovimentoMagazzino.tipo_movimento == request.args.get('tipo'))
-    
+    data_da = data_a = None
     if request.args.get('data_da'):
         try:
             data_da = datetime.strptime(request.args.get('data_da'), '%Y-%m-%d')
-            query = query.filter(MovimentoMagazzino.created_at >= data_da)
         except ValueError:
             pass
     
     if request.args.get('data_a'):
         try:
-            data_a = datetime.strptime(request.args.get('data_a'), '%Y-%m-%d')
-            query = query.filter(MovimentoMagazzino.created_at <= data_a + timedelta(days=1))
+            data_a = datetime.strptime(request.args.get('data_a'), '%Y-%m-%d') + timedelta(days=1)
         except ValueError:
             pass
     
+    # Movimenti attivi, uniti agli archivi annuali se il periodo richiesto li include
+    Movimento = entita_movimenti(MovimentoMagazzino, data_da, data_a)
+    query = db.session.query(Movimento).join(Ricambio, Movimento.ricambio_id == Ricambio.id)
+    
+    # Filtri
+    if request.args.get('ricambio_id'):
+        query = query.filter(Movimento.ricambio_id == request.args.get('ricambio_id'))
+    
+    if request.args.get('tipo'):
+        query = query.filter(Movimento.tipo_movimento == request.args.get('tipo'))
+    
+    if data_da:
+        query = query.filter(Movimento.created_at >= data_da)
+    
+    if data_a:
+        query = query.filter(Movimento.created_at <= data_a)
+    
     # Ordinamento
-    query = query.order_by(desc(MovimentoMagazzino.created_at))
+    query = query.order_by(desc(Movimento.created_at))
     
     # Paginazione
     page = request.args.get('page', 1, type=int)
     movimenti = query.paginate(page=page, per_page=50, error_out=False)
     
-    return render_template('magazzino/movimenti.html', movimenti=movimenti, active_tab='movimenti')
+    return render_template('magazzino/movimenti.html', movimenti=movimenti, active_tab='movimenti',
+                         data_limite_archivio=data_limite_archivio(),
+                         archivio_presente=archivio_presente(MovimentoMagazzino.__tablename__))
 
 
 @magazzino_bp.route('/prenotazioni')
@@ -499,10 +501,11 @@ def prenotazioni():
     if stato_filtro == 'attive':
         query = query.filter(PrenotazioneRicambio.stato == 'Attiva')
     elif stato_filtro == 'scadute':
-        query = query.filter(
-            PrenotazioneRicambio.stato == 'Attiva',
-            PrenotazioneRicambio.data_scadenza < datetime.utcnow()
-        )
+        # Scadute dal job di scadenza o scadute dopo l'ultima esecuzione
+        query = query.filter(or_(
+            PrenotazioneRicambio.stato == 'Scaduta',
+            and_(PrenotazioneRicambio.stato == 'Attiva', PrenotazioneRicambio.data_scadenza < datetime.utcnow())
+        ))
     elif stato_filtro != 'tutte':
         query = query.filter(PrenotazioneRicambio.stato == stato_filtro.title())
     
@@ -525,6 +528,39 @@ def prenotazioni():
                          active_tab='prenotazioni')
 
 
+@magazzino_bp.route('/api/prenotazioni/scadenze')
+@login_required
+def api_metriche_scadenze():
+    """Metriche del job di scadenza automatica delle prenotazioni (solo admin)"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'error': 'Non autorizzato'}), 403
+    
+    from app.services.scadenza_prenotazioni import get_metriche_scadenze
+    
+    metriche = get_metriche_scadenze()
+    metriche['prenotazioni_da_scadere'] = PrenotazioneRicambio.query.filter(
+        PrenotazioneRicambio.stato == 'Attiva',
+        PrenotazioneRicambio.data_scadenza < datetime.utcnow()
+    ).count()
+    return jsonify({'success': True, 'metriche': metriche})
+
+
+@magazzino_bp.route('/api/prenotazioni/scadenze/esegui', methods=['POST'])
+@login_required
+def api_esegui_scadenze():
+    """Esegue subito la scadenza delle prenotazioni (solo admin)"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'error': 'Non autorizzato'}), 403
+    
+    from app.services.scadenza_prenotazioni import scadi_prenotazioni
+    
+    try:
+        esecuzione = scadi_prenotazioni()
+        return jsonify({'success': True, 'esecuzione': esecuzione})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @magazzino_bp.route('/calendario')
 @login_required
 def calendario():
@@ -536,6 +572,7 @@ def calendario():
     mese = request.args.get('mese', datetime.now().month, type=int)
     anno = request.args.get('anno', datetime.now().year, type=int)
     ricambio_id = request.args.get('filtro_ricambio', 0, type=int)
+    form.filtro_ricambio.data = ricambio_id
     
     # Calcola primo e ultimo giorno del mese
     primo_giorno = datetime(anno, mese, 1)
@@ -617,10 +654,7 @@ def api_ricambi_search():
     if len(term) < 2:
         return jsonify([])
     
-    ricambi = Ricambio.query.filter(or_(
-        Ricambio.codice.ilike(f'%{term}%'),
-        Ricambio.descrizione.ilike(f'%{term}%')
-    )).limit(10).all()
+    ricambi = cerca_ricambi(term, limit=10)
     
     results = []
     for ricambio in ricambi:
@@ -637,6 +671,29 @@ def api_ricambi_search():
     return jsonify(results)
 
 
+@magazzino_bp.route('/api/ricambi/select')
+@login_required
+def api_select_ricambi():
+    """Scelte paginate per i campi ricambio remoti (RemoteSelectField), ordinate per rilevanza"""
+    query = filter_by_department_access(Ricambio.query, Ricambio)
+    termine = request.args.get('q', '').strip()
+    if termine:
+        query = filtra_ricerca(query, termine).order_by(rilevanza(termine), Ricambio.codice)
+    else:
+        query = query.order_by(Ricambio.codice)
+
+    pagination = query.paginate(page=request.args.get('page', 1, type=int), per_page=20, error_out=False)
+    return jsonify(risposta_select(pagination, lambda r: {
+        'id': r.id,
+        'text': f"{r.codice} - {r.descrizione}",
+        'codice': r.codice,
+        'descrizione': r.descrizione,
+        'quantita': r.quantita_disponibile,
+        'stato': r.stato_disponibilita,
+        'ubicazione': r.ubicazione or ''
+    }))
+
+
 @magazzino_bp.route('/api/ricambi/filter')
 @login_required
 def api_ricambi_filter():
@@ -648,10 +705,7 @@ def api_ricambi_filter():
     # Applica filtri
     search_term = request.args.get('search', '').strip()
     if search_term:
-        query = query.filter(or_(
-            Ricambio.codice.ilike(f'%{search_term}%'),
-            Ricambio.descrizione.ilike(f'%{search_term}%')
-        ))
+        query = filtra_ricerca(query, search_term)
     
     filtro_stato = request.args.get('filtro_stato', '')
     if filtro_stato == 'disponibili':
@@ -659,10 +713,7 @@ def api_ricambi_filter():
     elif filtro_stato == 'prenotati':
         query = query.filter(Ricambio.quantita_prenotata > 0)
     elif filtro_stato == 'sotto_scorta':
-        query = query.filter(
-            Ricambio.quantita_minima > 0,
-            Ricambio.quantita_disponibile <= Ricambio.quantita_minima
-        )
+        query = query.filter(Ricambio.sotto_scorta == True)
     elif filtro_stato == 'esauriti':
         query = query.filter(Ricambio.quantita_disponibile <= Ricambio.quantita_prenotata)
     
@@ -674,11 +725,13 @@ def api_ricambi_filter():
     if fornitore:
         query = query.filter(Ricambio.fornitore.ilike(f'%{fornitore}%'))
     
-    # Ordinamento
-    sort_by = request.args.get('sort', 'codice')
+    # Ordinamento (con una ricerca attiva, di default per rilevanza)
+    sort_by = request.args.get('sort', 'rilevanza' if search_term else 'codice')
     sort_dir = request.args.get('dir', 'asc')
     
-    if sort_by == 'codice':
+    if sort_by == 'rilevanza' and search_term:
+        query = query.order_by(rilevanza(search_term), asc(Ricambio.codice))
+    elif sort_by == 'codice':
         query = query.order_by(asc(Ricambio.codice) if sort_dir == 'asc' else desc(Ricambio.codice))
     elif sort_by == 'descrizione':
         query = query.order_by(asc(Ricambio.descrizione) if sort_dir == 'asc' else desc(Ricambio.descrizione))
@@ -731,10 +784,7 @@ def api_stats():
     
     stats = {
         'totale_ricambi': Ricambio.query.count(),
-        'sotto_scorta': Ricambio.query.filter(
-            Ricambio.quantita_minima > 0,
-            Ricambio.quantita_disponibile <= Ricambio.quantita_minima
-        ).count(),
+        'sotto_scorta': Ricambio.query.filter(Ricambio.sotto_scorta == True).count(),
         'con_prenotazioni': Ricambio.query.filter(Ricambio.quantita_prenotata > 0).count(),
         'esauriti': Ricambio.query.filter(Ricambio.quantita_disponibile <= Ricambio.quantita_prenotata).count(),
         'prenotazioni_attive': PrenotazioneRicambio.query.filter_by(stato='Attiva').count(),
@@ -752,11 +802,10 @@ def api_stats():
 def api_soglie_scorta():
     """API per monitoraggio soglie di scorta"""
     
-    # Ricambi sotto scorta
-    sotto_scorta = Ricambio.query.filter(
-        Ricambio.quantita_disponibile <= Ricambio.quantita_minima,
-        Ricambio.quantita_minima > 0
-    ).order_by(asc(Ricambio.quantita_disponibile)).all()
+    # Ricambi sotto scorta (lookup sull'indice della colonna generata)
+    sotto_scorta = Ricambio.query.filter(Ricambio.sotto_scorta == True)\
+                                 .options(joinedload(Ricambio.allarme_scorta))\
+                                 .order_by(asc(Ricambio.quantita_disponibile)).all()
     
     # Ricambi in via di esaurimento (quantità <= soglia + 2)
     in_esaurimento = Ricambio.query.filter(
@@ -775,7 +824,7 @@ def api_soglie_scorta():
             'quantita_effettiva': r.quantita_effettiva,
             'ubicazione': r.ubicazione,
             'fornitore': r.fornitore,
-            'giorni_sotto_scorta': (datetime.utcnow() - r.updated_at).days if r.quantita_disponibile <= r.quantita_minima else 0
+            'giorni_sotto_scorta': r.allarme_scorta.giorni_sotto_scorta if r.allarme_scorta else 0
         } for r in sotto_scorta],
         
         'in_esaurimento': [{
@@ -851,10 +900,8 @@ def reports():
     """Report e statistiche magazzino"""
 
     # Ricambi sotto scorta
-    sotto_scorta = Ricambio.query.filter(
-        Ricambio.quantita_minima > 0,
-        Ricambio.quantita_disponibile <= Ricambio.quantita_minima
-    ).order_by(asc(Ricambio.quantita_disponibile)).all()
+    sotto_scorta = Ricambio.query.filter(Ricambio.sotto_scorta == True)\
+                                 .order_by(asc(Ricambio.quantita_disponibile)).all()
 
     # Top 10 ricambi più utilizzati (ultimi 30 giorni)
     data_limite = datetime.utcnow() - timedelta(days=30)
@@ -904,165 +951,74 @@ def reports():
 @login_required
 def export_reports():
     """Pagina di stampa report magazzino (non download CSV)"""
-    from flask import render_template_string
+    from flask import stream_template, stream_with_context
+    from app.services.report_magazzino import (
+        iter_righe_report, conta_righe_report, valore_totale_magazzino, valorizzazione_per_gruppo
+    )
 
-    # Ricambi con prezzo definito
-    ricambi = Ricambio.query.filter(Ricambio.prezzo_unitario.isnot(None)).all()
+    # Totali e raggruppamenti calcolati dal database, righe inviate man mano che vengono lette
+    return current_app.response_class(stream_with_context(stream_template(
+        'magazzino/report_stampa.html',
+        righe=iter_righe_report(),
+        totale_ricambi=conta_righe_report(),
+        valore_totale=valore_totale_magazzino(),
+        valorizzazione=valorizzazione_per_gruppo(),
+        data_oggi=datetime.now().strftime('%d/%m/%Y %H:%M')
+    )))
 
-    # Calcola valore totale
-    valore_totale = sum(
-        (r.quantita_disponibile - r.quantita_prenotata) * r.prezzo_unitario
-        for r in ricambi
-        if (r.quantita_disponibile - r.quantita_prenotata) > 0
-    )
 
-    # Template HTML per la stampa
-    html_template = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Report Magazzino - DB-Desk</title>
-        <meta charset="utf-8">
-        <style>
-            body {
-                font-family: Arial, sans-serif;
-                font-size: 12px;
-                margin: 20px;
-            }
-            .header {
-                text-align: center;
-                margin-bottom: 30px;
-                border-bottom: 2px solid #333;
-                padding-bottom: 10px;
-            }
-            .header h1 {
-                margin: 0;
-                font-size: 24px;
-                color: #333;
-            }
-            .header .subtitle {
-                margin: 5px 0 0 0;
-                font-size: 14px;
-                color: #666;
-            }
-            .summary {
-                margin-bottom: 20px;
-                padding: 15px;
-                background-color: #f8f9fa;
-                border: 1px solid #dee2e6;
-                border-radius: 5px;
-            }
-            table {
-                width: 100%;
-                border-collapse: collapse;
-                margin-top: 20px;
-            }
-            th, td {
-                border: 1px solid #333;
-                padding: 8px;
-                text-align: left;
-            }
-            th {
-                background-color: #f8f9fa;
-                font-weight: bold;
-            }
-            tr:nth-child(even) {
-                background-color: #f9f9f9;
-            }
-            .text-right {
-                text-align: right;
-            }
-            .text-center {
-                text-align: center;
-            }
-            .footer {
-                margin-top: 30px;
-                text-align: center;
-                font-size: 10px;
-                color: #666;
-                border-top: 1px solid #ccc;
-                padding-top: 10px;
-            }
-            @media print {
-                body { margin: 0; }
-                .no-print { display: none; }
-            }
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <h1>Report Magazzino</h1>
-            <div class="subtitle">DB-Desk - Sistema Gestione Ricambi</div>
-            <div class="subtitle">Generato il: {{ data_oggi }}</div>
-        </div>
-
-        <div class="summary">
-            <strong>Riepilogo:</strong><br>
-            Totale Ricambi: {{ ricambi|length }}<br>
-            Valore Totale Magazzino: €{{ "%.2f"|format(valore_totale) }}
-        </div>
-
-        <table>
-            <thead>
-                <tr>
-                    <th>Codice</th>
-                    <th>Descrizione</th>
-                    <th class="text-center">Disp.</th>
-                    <th class="text-center">Pren.</th>
-                    <th class="text-center">Eff.</th>
-                    <th class="text-center">Min.</th>
-                    <th class="text-right">Prezzo</th>
-                    <th class="text-right">Valore</th>
-                    <th>Fornitore</th>
-                    <th>Ubicazione</th>
-                    <th>Stato</th>
-                </tr>
-            </thead>
-            <tbody>
-                {% for ricambio in ricambi %}
-                <tr>
-                    <td>{{ ricambio.codice }}</td>
-                    <td>{{ ricambio.descrizione }}</td>
-                    <td class="text-center">{{ ricambio.quantita_disponibile }}</td>
-                    <td class="text-center">{{ ricambio.quantita_prenotata }}</td>
-                    <td class="text-center">{{ ricambio.quantita_disponibile - ricambio.quantita_prenotata }}</td>
-                    <td class="text-center">{{ ricambio.quantita_minima }}</td>
-                    <td class="text-right">€{{ "%.2f"|format(ricambio.prezzo_unitario) }}</td>
-                    <td class="text-right">€{{ "%.2f"|format((ricambio.quantita_disponibile - ricambio.quantita_prenotata) * ricambio.prezzo_unitario) }}</td>
-                    <td>{{ ricambio.fornitore or '-' }}</td>
-                    <td>{{ ricambio.ubicazione or '-' }}</td>
-                    <td>{{ ricambio.stato_disponibilita }}</td>
-                </tr>
-                {% endfor %}
-            </tbody>
-        </table>
-
-        <div class="footer">
-            Report generato automaticamente da DB-Desk - {{ data_oggi }}
-        </div>
-
-        <script>
-            // Avvia automaticamente la stampa quando la pagina si carica
-            window.onload = function() {
-                window.print();
-            };
-        </script>
-    </body>
-    </html>
-    """
-
-    return render_template_string(html_template,
-                                ricambi=ricambi,
-                                valore_totale=valore_totale,
-                                data_oggi=datetime.now().strftime('%d/%m/%Y %H:%M'))
+@magazzino_bp.route('/reports/export/<formato>', methods=['POST'])
+@login_required
+def avvia_export_reports(formato):
+    """Avvia la generazione in background del report in CSV o PDF"""
+    from app.services.report_magazzino import avvia_export_report
+
+    try:
+        job_id = avvia_export_report(formato)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'stato_url': url_for('magazzino.stato_export_reports', job_id=job_id)
+    })
+
+
+@magazzino_bp.route('/reports/export/stato/<job_id>')
+@login_required
+def stato_export_reports(job_id):
+    """Stato di un export report in background"""
+    from app.services.report_magazzino import get_export_job
+
+    job = get_export_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Export non trovato'}), 404
+
+    risposta = {'success': True, 'stato': job['stato'], 'formato': job['formato'], 'errore': job['errore']}
+    if job['stato'] == 'Completato':
+        risposta['download_url'] = url_for('magazzino.download_export_reports', job_id=job_id)
+    return jsonify(risposta)
+
+
+@magazzino_bp.route('/reports/export/download/<job_id>')
+@login_required
+def download_export_reports(job_id):
+    """Scarica il file di un export report completato"""
+    from app.services.report_magazzino import get_export_job
+
+    job = get_export_job(job_id)
+    if not job or job['stato'] != 'Completato':
+        abort(404)
+
+    return send_from_directory(os.path.dirname(job['path']), job['filename'], as_attachment=True)
 
 
 @magazzino_bp.route('/ricambi/foto/<filename>')
 @login_required
 def foto_ricambio(filename):
-    """Serve le immagini dei ricambi dalla cartella uploads/ricambi"""
-    ricambi_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], 'ricambi')
-    return send_from_directory(ricambi_folder, filename)
+    """Serve le immagini dei ricambi dalla cartella uploads/ricambi (?variante=thumb|medium|full)"""
+    return invia_foto('ricambi', filename, request.args.get('variante'))
 
 
 @magazzino_bp.route('/api/suggerisci-soglia/<int:ricambio_id>')
@@ -1075,13 +1031,10 @@ def suggerisci_soglia_scorta(ricambio_id):
     # Analizza gli ultimi 90 giorni di movimenti
     data_limite = datetime.utcnow() - timedelta(days=90)
     
-    movimenti_scarico = MovimentoMagazzino.query.filter(
-        MovimentoMagazzino.ricambio_id == ricambio_id,
-        MovimentoMagazzino.created_at >= data_limite,
-        MovimentoMagazzino.quantita < 0  # Solo scarichi
-    ).all()
+    # Scarichi aggregati per mese (include i mesi già archiviati)
+    utilizzi_mensili = consumi_mensili_ricambio(ricambio_id, data_limite)
     
-    if not movimenti_scarico:
+    if not utilizzi_mensili:
         return jsonify({
             'suggerimento': ricambio.quantita_minima or 1,
             'motivo': 'Nessun movimento di scarico negli ultimi 90 giorni',
@@ -1094,17 +1047,9 @@ def suggerisci_soglia_scorta(ricambio_id):
         })
     
     # Calcola statistiche utilizzo
-    utilizzo_totale = sum(abs(m.quantita) for m in movimenti_scarico)
+    utilizzo_totale = sum(utilizzi_mensili.values())
     utilizzo_medio_mensile = utilizzo_totale / 3  # 90 giorni = 3 mesi
     
-    # Calcola utilizzo per mese
-    utilizzi_mensili = {}
-    for movimento in movimenti_scarico:
-        mese_key = movimento.created_at.strftime('%Y-%m')
-        if mese_key not in utilizzi_mensili:
-            utilizzi_mensili[mese_key] = 0
-        utilizzi_mensili[mese_key] += abs(movimento.quantita)
-    
     utilizzo_massimo_mensile = max(utilizzi_mensili.values()) if utilizzi_mensili else 0
     
     # Suggerimento basato su utilizzo massimo + buffer del 20%
@@ -1146,6 +1091,6 @@ def suggerisci_soglia_scorta(ricambio_id):
             'scorta_lead_time': scorta_lead_time,
             'raccomandazione': raccomandazione,
             'periodo_analisi': '90 giorni',
-            'movimenti_analizzati': len(movimenti_scarico)
+            'mesi_con_scarichi': len(utilizzi_mensili)
         }
     })
@@ -6,6 +6,7 @@ from app.models.role import Role
 from app.models.department import Department
 from app.models.ticket import Ticket
 from app.models.cliente import Cliente
+from app.models.macchina import TipoMacchina
 from app.forms.auth import ChangePasswordForm
 from app.models.email_import import EmailImportLog
 from app.models.email_draft import EmailDraft
@@ -173,6 +174,7 @@ def new_department():
                 department.tipi_macchine.append(tipo)
             
             db.session.commit()
+            TipoMacchina.invalida_cache_reparti()
             flash(f'Reparto "{department.display_name}" creato con successo!', 'success')
             return redirect(url_for('settings.departments'))
         except Exception as e:
@@ -252,6 +254,7 @@ def edit_department(id):
         
         try:
             db.session.commit()
+            TipoMacchina.invalida_cache_reparti()
             flash(f'Reparto "{department.display_name}" aggiornato con successo!', 'success')
             return redirect(url_for('settings.view_department', id=department.id))
         except Exception as e:
@@ -297,6 +300,7 @@ def delete_department(id):
     try:
         db.session.delete(department)
         db.session.commit()
+        TipoMacchina.invalida_cache_reparti()
         flash(f'Reparto "{department_name}" eliminato con successo.', 'success')
     except Exception as e:
         db.session.rollback()
@@ -852,6 +856,88 @@ def ignore_email_draft(draft_id):
     return jsonify({'success': True, 'message': 'Email ignorata'})
 
 
+@settings_bp.route('/import_catalogo')
+@login_required
+def import_catalogo():
+    """Importazione listini ricambi da file CSV/XLSX (solo admin)"""
+    if not current_user.is_admin:
+        flash('Non hai i permessi per accedere a questa sezione.', 'error')
+        return redirect(url_for('settings.index'))
+    
+    from app.services.estrazione_listini_pdf import nomi_profili
+    
+    departments = Department.query.filter_by(is_active=True).order_by(Department.display_name).all()
+    return render_template('settings/import_catalogo.html', departments=departments, profili_pdf=nomi_profili())
+
+
+@settings_bp.route('/import_catalogo/avvia', methods=['POST'])
+@login_required
+def avvia_import_catalogo():
+    """Carica il listino e avvia l'importazione in background (solo admin)"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Non autorizzato'}), 403
+    
+    from werkzeug.utils import secure_filename
+    from app.services.import_catalogo import avvia_import_in_background
+    import uuid
+    
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({'success': False, 'message': 'Nessun file selezionato'}), 400
+    
+    estensione = os.path.splitext(file.filename)[1].lower()
+    if estensione not in ('.csv', '.txt', '.xlsx', '.xlsm', '.pdf'):
+        return jsonify({'success': False, 'message': 'Formato non supportato (usa CSV, XLSX o PDF)'}), 400
+    
+    department = Department.query.get(request.form.get('department_id', type=int) or 0)
+    if not department:
+        return jsonify({'success': False, 'message': 'Reparto non valido'}), 400
+    
+    try:
+        import_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'import_listini')
+        os.makedirs(import_dir, exist_ok=True)
+        path = os.path.join(import_dir, f"{uuid.uuid4().hex}_{secure_filename(file.filename)}")
+        file.save(path)
+        
+        job_id = avvia_import_in_background(
+            path,
+            department.id,
+            profilo_pdf=request.form.get('profilo_pdf') or 'generico',
+            fornitore=request.form.get('fornitore', '').strip() or None,
+            dry_run=request.form.get('dry_run') == '1',
+            aggiorna_esistenti=request.form.get('solo_nuovi') != '1'
+        )
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'stato_url': url_for('settings.stato_import_catalogo', job_id=job_id)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@settings_bp.route('/import_catalogo/stato/<job_id>')
+@login_required
+def stato_import_catalogo(job_id):
+    """Avanzamento ed esito di un'importazione listino (solo admin)"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Non autorizzato'}), 403
+    
+    from app.services.import_catalogo import get_import_job
+    
+    job = get_import_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Importazione non trovata'}), 404
+    
+    return jsonify({
+        'success': True,
+        'stato': job['stato'],
+        'righe_elaborate': job['righe_elaborate'],
+        'risultato': job['risultato'],
+        'errore': job['errore']
+    })
+
+
 @settings_bp.route('/profile', methods=['GET', 'POST'])
 @login_required
 def profile():
@@ -149,38 +149,43 @@ def list_tickets():
 @tickets_bp.route('/api/macchine_disponibili')
 @login_required
 def get_macchine_disponibili():
-    """API endpoint per ottenere le macchine disponibili per il prestito"""
+    """API endpoint per ottenere le macchine disponibili per il prestito (ricerca paginata)"""
     try:
         from app.models.macchina import Macchina
         from app.utils.permissions import filter_by_department_access
+        from app.services.ricerca_macchine import cerca_macchine, metadati_pagina
 
         # Ottieni il cliente_id dai parametri della richiesta (se fornito)
         cliente_id = request.args.get('cliente_id', type=int)
 
-        # Ottieni le macchine disponibili e attive del reparto dell'utente (per prestiti d'uso)
+        # Macchine disponibili e attive del reparto dell'utente (per prestiti d'uso)
         query = filter_by_department_access(Macchina.query, Macchina)
-        macchine = query.filter(Macchina.stato.in_(['Disponibile', 'Attiva'])).order_by(Macchina.codice).all()
+        query = query.filter(Macchina.stato.in_(['Disponibile', 'Attiva']))
 
         # Escludi le macchine del cliente selezionato (se specificato)
         if cliente_id:
-            macchine = [m for m in macchine if m.cliente_id != cliente_id]
-        
-        macchine_data = []
-        for macchina in macchine:
-            if PermissionManager.can_view_machine(current_user, macchina):
-                macchine_data.append({
-                    'id': macchina.id,
-                    'codice': macchina.codice,
-                    'modello': macchina.modello,
-                    'marca': macchina.marca,
-                    'stato': macchina.stato,
-                    'text': f"{macchina.codice} - {macchina.marca} {macchina.modello}",
-                    'stato_badge': macchina.stato
-                })
+            query = query.filter(or_(Macchina.cliente_id.is_(None), Macchina.cliente_id != cliente_id))
+
+        pagination = cerca_macchine(
+            request.args.get('q', '').strip(), query,
+            page=request.args.get('page', 1, type=int),
+            per_page=request.args.get('per_page', 50, type=int)
+        )
+
+        macchine_data = [{
+            'id': macchina.id,
+            'codice': macchina.codice,
+            'modello': macchina.modello,
+            'marca': macchina.marca,
+            'stato': macchina.stato,
+            'text': f"{macchina.codice} - {macchina.marca} {macchina.modello}",
+            'stato_badge': macchina.stato
+        } for macchina in pagination.items]
 
         return jsonify({
             'success': True,
-            'macchine': macchine_data
+            'macchine': macchine_data,
+            **metadati_pagina(pagination)
         })
 
     except Exception as e:
@@ -281,12 +286,6 @@ def new_ticket():
                 # Aggiorna le scelte del campo macchine
                 form.macchine.choices = macchine_filtrate
                 
-                # Aggiorna anche le scelte del cliente per la validazione
-                from app.models.cliente import Cliente
-                cliente = Cliente.query.get(cliente_id)
-                if cliente:
-                    form.cliente.choices = [(0, 'Seleziona cliente...'), (cliente.id, cliente.ragione_sociale)]
-                
             except (ValueError, TypeError):
                 pass
         
@@ -537,12 +536,6 @@ def edit_ticket(id):
                 # Aggiorna le scelte del campo macchine
                 form.macchine.choices = macchine_filtrate
                 
-                # Aggiorna anche le scelte del cliente per la validazione
-                from app.models.cliente import Cliente
-                cliente = Cliente.query.get(cliente_id)
-                if cliente:
-                    form.cliente.choices = [(0, 'Seleziona cliente...'), (cliente.id, cliente.ragione_sociale)]
-                
             except (ValueError, TypeError):
                 pass
         
@@ -1356,121 +1349,96 @@ def _ripristina_stati_macchine_ticket(ticket):
     """
     Ripristina gli stati originali delle macchine quando un ticket viene chiuso.
     Gestisce sia le macchine in riparazione che quelle in prestito sostitutivo.
+    I movimenti del ticket vengono riletti in ordine cronologico come in origine, ma con una
+    query per tutte le macchine e aggiornamenti in blocco: lo stato di ogni macchina viene
+    aggiornato in memoria dopo ogni ripristino calcolato.
     """
-    from app.models.macchina import Macchina, MovimentoMacchina
+    from app.models.macchina import MovimentoMacchina
     from flask_login import current_user
     
-    # Trova tutti i movimenti collegati a questo ticket
-    movimenti_ticket = MovimentoMacchina.query.filter_by(ticket_id=ticket.id).order_by(MovimentoMacchina.created_at).all()
+    righe = MovimentoMacchina.movimenti_con_stato(
+        MovimentoMacchina.ticket_id == ticket.id, tipi=('Riparazione', 'Assegnazione')
+    )
+    if not righe:
+        return
     
-    if not movimenti_ticket:
+    stati = {}
+    ripristini = {}
+    movimenti = []
+    messaggi = []
+    for movimento, stato_db, codice in righe:
+        stato_attuale = stati.get(movimento.macchina_id, stato_db)
+        # Identifica se è una macchina sostitutiva dalle note
+        is_macchina_sostitutiva = 'sostitutiv' in (movimento.note or '').lower()
+        ripristino = {
+            'macchina_id': movimento.macchina_id,
+            'ticket_id': ticket.id,
+            'user_id': current_user.id,
+        }
+        
+        if stato_attuale == 'In riparazione' and movimento.tipo_movimento == 'Riparazione':
+            # Macchina che era in riparazione - RIPRISTINA STATO ORIGINALE COMPLETO
+            stato_originale = movimento.stato_precedente
+            valori = movimento.valori_originali()
+            movimenti.append(dict(
+                ripristino,
+                tipo_movimento='Ripristino',
+                stato_precedente='In riparazione',
+                stato_nuovo=stato_originale,
+                cliente_id=movimento.cliente_originale_id,
+                note=f'Ripristino stato {stato_originale} dopo riparazione - chiusura ticket {ticket.numero_ticket}'
+            ))
+            messaggi.append(f'Macchina {codice} ripristinata da In riparazione a {stato_originale}')
+        
+        elif stato_attuale == 'In prestito' and movimento.tipo_movimento == 'Assegnazione' and is_macchina_sostitutiva:
+            # Macchina sostitutiva - DEVE tornare disponibile (non ha stato originale da ripristinare)
+            valori = {
+                'stato': 'Disponibile',
+                'cliente_id': None,
+                'ubicazione': 'Magazzino',
+                'data_assegnazione': None,
+            }
+            movimenti.append(dict(
+                ripristino,
+                tipo_movimento='Rientro',
+                stato_precedente='In prestito',
+                stato_nuovo='Disponibile',
+                cliente_id=None,
+                note=f'Ripristino macchina sostitutiva a Disponibile - chiusura ticket {ticket.numero_ticket}'
+            ))
+            messaggi.append(f'Macchina sostitutiva {codice} ripristinata da In prestito a Disponibile')
+        
+        elif stato_attuale == 'In prestito' and movimento.tipo_movimento == 'Assegnazione':
+            # Prestito semplice - RIPRISTINA STATO ORIGINALE COMPLETO
+            stato_originale = movimento.stato_precedente
+            valori = movimento.valori_originali()
+            movimenti.append(dict(
+                ripristino,
+                tipo_movimento='Ripristino',
+                stato_precedente='In prestito',
+                stato_nuovo=stato_originale,
+                cliente_id=movimento.cliente_originale_id,
+                note=f'Ripristino stato {stato_originale} dopo prestito semplice - chiusura ticket {ticket.numero_ticket}'
+            ))
+            messaggi.append(f'Macchina {codice} ripristinata da In prestito a {stato_originale}')
+        
+        else:
+            continue
+        
+        ripristini.setdefault(movimento.macchina_id, {}).update(valori)
+        stati[movimento.macchina_id] = valori['stato']
+    
+    if not ripristini:
         return
     
-    # Debug: mostra i movimenti trovati
-    flash(f'Debug: Trovati {len(movimenti_ticket)} movimenti per il ticket {ticket.numero_ticket}', 'info')
+    try:
+        # Savepoint: un errore nel ripristino non blocca la chiusura del ticket
+        with db.session.begin_nested():
+            MovimentoMacchina.applica_ripristini(ripristini, movimenti)
+    except Exception as e:
+        current_app.logger.error(f'Errore nel ripristino macchine per ticket {ticket.numero_ticket}: {str(e)}')
+        flash(f'Errore nel ripristino delle macchine: {str(e)}', 'danger')
+        return
     
-    for movimento in movimenti_ticket:
-        macchina = movimento.macchina
-        if not macchina:
-            continue
-            
-        try:
-            # Debug: mostra stato attuale della macchina
-            flash(f'Debug: Macchina {macchina.codice} - Stato attuale: {macchina.stato}, Movimento: {movimento.tipo_movimento}, Note: {movimento.note}', 'info')
-            
-            # Identifica se è una macchina sostitutiva dalle note
-            is_macchina_sostitutiva = ('sostitutiv' in (movimento.note or '').lower() or 
-                                     'prestito sostitutivo' in (movimento.note or '').lower())
-            
-            if macchina.is_in_riparazione and movimento.tipo_movimento == 'Riparazione':
-                # Macchina che era in riparazione - RIPRISTINA STATO ORIGINALE COMPLETO
-                stato_originale = movimento.stato_precedente
-                cliente_originale_id = movimento.cliente_originale_id
-                ubicazione_originale = movimento.ubicazione_originale
-                data_assegnazione_originale = movimento.data_assegnazione_originale
-                data_vendita_originale = movimento.data_vendita_originale
-                prezzo_vendita_originale = movimento.prezzo_vendita_originale
-                prossima_manutenzione_originale = movimento.prossima_manutenzione_originale
-                
-                # RIPRISTINA STATO COMPLETO ESATTAMENTE COME ERA (TUTTI I CAMPI)
-                macchina.stato = stato_originale
-                macchina.cliente_id = cliente_originale_id
-                macchina.ubicazione = ubicazione_originale  # Ripristina esatto, anche se None
-                macchina.data_assegnazione = data_assegnazione_originale
-                macchina.data_vendita = data_vendita_originale
-                macchina.prezzo_vendita = prezzo_vendita_originale
-                macchina.prossima_manutenzione = prossima_manutenzione_originale
-                
-                # Registra il movimento di ripristino
-                movimento_ripristino = MovimentoMacchina(
-                    macchina_id=macchina.id,
-                    tipo_movimento='Ripristino',
-                    stato_precedente='In riparazione',
-                    stato_nuovo=stato_originale,
-                    cliente_id=cliente_originale_id,
-                    note=f'Ripristino stato {stato_originale} dopo riparazione - chiusura ticket {ticket.numero_ticket}',
-                    ticket_id=ticket.id,
-                    user_id=current_user.id
-                )
-                db.session.add(movimento_ripristino)
-                
-                flash(f'Macchina {macchina.codice} ripristinata da In riparazione a {stato_originale}', 'success')
-                
-            elif macchina.is_in_prestito and movimento.tipo_movimento == 'Assegnazione' and is_macchina_sostitutiva:
-                # Macchina sostitutiva - DEVE tornare disponibile (non ha stato originale da ripristinare)
-                macchina.stato = 'Disponibile'
-                macchina.cliente_id = None
-                macchina.ubicazione = 'Magazzino'
-                macchina.data_assegnazione = None
-                
-                # Registra il movimento di ripristino
-                movimento_ripristino = MovimentoMacchina(
-                    macchina_id=macchina.id,
-                    tipo_movimento='Rientro',
-                    stato_precedente='In prestito',
-                    stato_nuovo='Disponibile',
-                    note=f'Ripristino macchina sostitutiva a Disponibile - chiusura ticket {ticket.numero_ticket}',
-                    ticket_id=ticket.id,
-                    user_id=current_user.id
-                )
-                db.session.add(movimento_ripristino)
-                
-                flash(f'Macchina sostitutiva {macchina.codice} ripristinata da In prestito a Disponibile', 'success')
-                
-            elif macchina.is_in_prestito and movimento.tipo_movimento == 'Assegnazione' and not is_macchina_sostitutiva:
-                # Prestito semplice - RIPRISTINA STATO ORIGINALE COMPLETO
-                stato_originale = movimento.stato_precedente
-                cliente_originale_id = movimento.cliente_originale_id
-                ubicazione_originale = movimento.ubicazione_originale
-                data_assegnazione_originale = movimento.data_assegnazione_originale
-                data_vendita_originale = movimento.data_vendita_originale
-                prezzo_vendita_originale = movimento.prezzo_vendita_originale
-                prossima_manutenzione_originale = movimento.prossima_manutenzione_originale
-                
-                # RIPRISTINA STATO COMPLETO ESATTAMENTE COME ERA (TUTTI I CAMPI)
-                macchina.stato = stato_originale
-                macchina.cliente_id = cliente_originale_id
-                macchina.ubicazione = ubicazione_originale  # Ripristina esatto, anche se None
-                macchina.data_assegnazione = data_assegnazione_originale
-                macchina.data_vendita = data_vendita_originale
-                macchina.prezzo_vendita = prezzo_vendita_originale
-                macchina.prossima_manutenzione = prossima_manutenzione_originale
-                
-                # Registra il movimento di ripristino
-                movimento_ripristino = MovimentoMacchina(
-                    macchina_id=macchina.id,
-                    tipo_movimento='Ripristino',
-                    stato_precedente='In prestito',
-                    stato_nuovo=stato_originale,
-                    cliente_id=cliente_originale_id,
-                    note=f'Ripristino stato {stato_originale} dopo prestito semplice - chiusura ticket {ticket.numero_ticket}',
-                    ticket_id=ticket.id,
-                    user_id=current_user.id
-                )
-                db.session.add(movimento_ripristino)
-                
-                flash(f'Macchina {macchina.codice} ripristinata da In prestito a {stato_originale}', 'success')
-                    
-        except Exception as e:
-            # Log dell'errore ma continua con le altre macchine
-            flash(f'Errore nel ripristino della macchina {macchina.codice}: {str(e)}', 'danger')
\ No newline at end of file
+    for messaggio in messaggi:
+        flash(messaggio, 'success')
\ No newline at end of file
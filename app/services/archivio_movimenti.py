@@ -0,0 +1,308 @@
+"""
+Servizio di archiviazione dei movimenti di magazzino e macchine
+I movimenti più vecchi dell'orizzonte configurato (ARCHIVIO_MOVIMENTI_MESI) sono spostati
+in tabelle annuali con le stesse colonne e gli stessi id (movimenti_magazzino_2023, ...)
+e sommati nelle tabelle di riepilogo, così i totali per ricambio e macchina restano completi.
+Le viste storiche interrogano anche gli archivi solo quando l'intervallo di date lo richiede.
+"""
+
+from flask import current_app
+from datetime import datetime
+from sqlalchemy import Column, Index, MetaData, Table, delete, extract, func, select, union_all
+from sqlalchemy.orm import aliased
+from app import db
+from app.models.ricambio import MovimentoMagazzino, RiepilogoMovimentiRicambio
+from app.models.macchina import MovimentoMacchina, RiepilogoMovimentiMacchina
+from app.models.archivio import ArchivioMovimenti
+
+# Movimenti spostati per transazione
+CHUNK_SIZE = 5000
+
+# Tabelle archiviabili: modello e colonna di riferimento (ricambio o macchina) per gli indici
+_ORIGINI = {
+    'movimenti_magazzino': (MovimentoMagazzino, 'ricambio_id'),
+    'movimenti_macchine': (MovimentoMacchina, 'macchina_id'),
+}
+
+# Le tabelle di archivio non fanno parte di db.metadata: vengono create solo quando servono
+_metadata_archivio = MetaData()
+
+
+def data_limite_archivio(mesi=None, adesso=None):
+    """
+    Inizio dell'orizzonte dei movimenti attivi: il primo giorno del mese di `mesi` mesi fa.
+    L'allineamento al mese fa sì che ogni mese sia interamente attivo o interamente archiviato.
+    """
+    if mesi is None:
+        mesi = current_app.config.get('ARCHIVIO_MOVIMENTI_MESI', 24)
+    adesso = adesso or datetime.utcnow()
+    indice = adesso.year * 12 + adesso.month - 1 - mesi
+    return datetime(indice // 12, indice % 12 + 1, 1)
+
+
+def tabella_archivio(tabella_origine, anno):
+    """Tabella di archivio di un anno: stesse colonne dell'origine, senza chiavi esterne"""
+    nome = f'{tabella_origine}_{anno}'
+    if nome in _metadata_archivio.tables:
+        return _metadata_archivio.tables[nome]
+
+    modello, colonna_rif = _ORIGINI[tabella_origine]
+    colonne = [
+        Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable, autoincrement=False)
+        for c in modello.__table__.columns
+    ]
+    return Table(
+        nome, _metadata_archivio, *colonne,
+        Index(f'idx_{nome}_{colonna_rif}', colonna_rif, 'created_at'),
+        Index(f'idx_{nome}_created', 'created_at')
+    )
+
+
+def _query_da_archiviare(tabella_origine, limite):
+    origine = _ORIGINI[tabella_origine][0].__table__
+    query = select(origine).where(origine.c.created_at < limite)
+    if tabella_origine == 'movimenti_macchine':
+        # L'ultimo movimento di ogni macchina resta attivo: lo usano i fogli tecnici
+        # per ricostruire lo stato corrente della macchina
+        ultimi = select(func.max(origine.c.id)).group_by(origine.c.macchina_id)
+        query = query.where(origine.c.id.not_in(ultimi))
+    return query
+
+
+def _aggiorna_indice_archivi(tabella_origine, anno, righe):
+    archivio = ArchivioMovimenti.query.filter_by(tabella_origine=tabella_origine, anno=anno).first()
+    if not archivio:
+        archivio = ArchivioMovimenti(
+            tabella_origine=tabella_origine,
+            anno=anno,
+            nome_tabella=tabella_archivio(tabella_origine, anno).name,
+            righe=0
+        )
+        db.session.add(archivio)
+
+    date = [r['created_at'] for r in righe]
+    archivio.righe = (archivio.righe or 0) + len(righe)
+    archivio.data_min = min(date + ([archivio.data_min] if archivio.data_min else []))
+    archivio.data_max = max(date + ([archivio.data_max] if archivio.data_max else []))
+
+
+def _aggiorna_riepilogo_ricambi(righe):
+    totali = {}
+    for r in righe:
+        chiave = (r['ricambio_id'], r['created_at'].year, r['created_at'].month)
+        t = totali.setdefault(chiave, {'carichi': 0, 'scarichi': 0, 'numero_movimenti': 0})
+        if r['quantita'] > 0:
+            t['carichi'] += r['quantita']
+        else:
+            t['scarichi'] += -r['quantita']
+        t['numero_movimenti'] += 1
+
+    esistenti = {
+        (e.ricambio_id, e.anno, e.mese): e
+        for e in RiepilogoMovimentiRicambio.query.filter(
+            RiepilogoMovimentiRicambio.ricambio_id.in_({k[0] for k in totali}),
+            RiepilogoMovimentiRicambio.anno.in_({k[1] for k in totali})
+        )
+    }
+    for (ricambio_id, anno, mese), t in totali.items():
+        riepilogo = esistenti.get((ricambio_id, anno, mese))
+        if riepilogo is None:
+            db.session.add(RiepilogoMovimentiRicambio(ricambio_id=ricambio_id, anno=anno, mese=mese, **t))
+        else:
+            riepilogo.carichi += t['carichi']
+            riepilogo.scarichi += t['scarichi']
+            riepilogo.numero_movimenti += t['numero_movimenti']
+
+
+def _aggiorna_riepilogo_macchine(righe):
+    totali = {}
+    for r in righe:
+        chiave = (r['macchina_id'], r['created_at'].year, r['tipo_movimento'])
+        t = totali.setdefault(chiave, {'numero_movimenti': 0, 'costo_totale': 0, 'ultimo_movimento_at': None})
+        t['numero_movimenti'] += 1
+        t['costo_totale'] += r['costo'] or 0
+        if t['ultimo_movimento_at'] is None or r['created_at'] > t['ultimo_movimento_at']:
+            t['ultimo_movimento_at'] = r['created_at']
+
+    esistenti = {
+        (e.macchina_id, e.anno, e.tipo_movimento): e
+        for e in RiepilogoMovimentiMacchina.query.filter(
+            RiepilogoMovimentiMacchina.macchina_id.in_({k[0] for k in totali}),
+            RiepilogoMovimentiMacchina.anno.in_({k[1] for k in totali})
+        )
+    }
+    for (macchina_id, anno, tipo), t in totali.items():
+        riepilogo = esistenti.get((macchina_id, anno, tipo))
+        if riepilogo is None:
+            db.session.add(RiepilogoMovimentiMacchina(macchina_id=macchina_id, anno=anno, tipo_movimento=tipo, **t))
+        else:
+            riepilogo.numero_movimenti += t['numero_movimenti']
+            riepilogo.costo_totale += t['costo_totale']
+            if riepilogo.ultimo_movimento_at is None or t['ultimo_movimento_at'] > riepilogo.ultimo_movimento_at:
+                riepilogo.ultimo_movimento_at = t['ultimo_movimento_at']
+
+
+def _archivia_blocco(tabella_origine, limite, chunk_size):
+    """Sposta un blocco di movimenti nell'archivio in una sola transazione; restituisce le righe spostate"""
+    origine = _ORIGINI[tabella_origine][0].__table__
+    righe = [
+        dict(r) for r in db.session.execute(
+            _query_da_archiviare(tabella_origine, limite).order_by(origine.c.id).limit(chunk_size)
+        ).mappings()
+    ]
+    if not righe:
+        return 0
+
+    per_anno = {}
+    for r in righe:
+        per_anno.setdefault(r['created_at'].year, []).append(r)
+
+    # DDL prima di qualsiasi scrittura: su MySQL CREATE TABLE chiude la transazione corrente
+    for anno in per_anno:
+        tabella_archivio(tabella_origine, anno).create(db.session.connection(), checkfirst=True)
+
+    for anno, righe_anno in per_anno.items():
+        db.session.execute(tabella_archivio(tabella_origine, anno).insert(), righe_anno)
+        _aggiorna_indice_archivi(tabella_origine, anno, righe_anno)
+
+    if tabella_origine == 'movimenti_magazzino':
+        _aggiorna_riepilogo_ricambi(righe)
+    else:
+        _aggiorna_riepilogo_macchine(righe)
+
+    db.session.execute(delete(origine).where(origine.c.id.in_([r['id'] for r in righe])))
+    db.session.commit()
+    return len(righe)
+
+
+def archivia_movimenti(mesi=None, chunk_size=CHUNK_SIZE, dry_run=False, progress=None):
+    """
+    Archivia i movimenti di magazzino e macchine precedenti all'orizzonte
+
+    Args:
+        mesi (int): Mesi di movimenti da lasciare attivi (default: ARCHIVIO_MOVIMENTI_MESI)
+        chunk_size (int): Movimenti spostati per transazione
+        dry_run (bool): Conta soltanto i movimenti da archiviare
+        progress (callable): Chiamata con (tabella_origine, movimenti archiviati finora)
+
+    Returns:
+        dict: Data limite e movimenti archiviati per tabella
+    """
+    limite = data_limite_archivio(mesi)
+    risultato = {'data_limite': limite.isoformat(), 'dry_run': dry_run}
+
+    for tabella_origine in _ORIGINI:
+        if dry_run:
+            risultato[tabella_origine] = db.session.execute(
+                select(func.count()).select_from(_query_da_archiviare(tabella_origine, limite).subquery())
+            ).scalar()
+            continue
+
+        totale = 0
+        while True:
+            try:
+                spostati = _archivia_blocco(tabella_origine, limite, chunk_size)
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.error(f"Errore durante l'archiviazione di {tabella_origine}: {str(e)}")
+                raise
+            if not spostati:
+                break
+            totale += spostati
+            if progress:
+                progress(tabella_origine, totale)
+        risultato[tabella_origine] = totale
+
+    if not dry_run and (risultato['movimenti_magazzino'] or risultato['movimenti_macchine']):
+        current_app.logger.info(
+            f"Archiviazione movimenti precedenti al {limite:%d/%m/%Y}: "
+            f"{risultato['movimenti_magazzino']} di magazzino, {risultato['movimenti_macchine']} di macchine"
+        )
+    return risultato
+
+
+# ========== Lettura trasparente dello storico ==========
+
+def archivio_presente(tabella_origine):
+    """True se esiste almeno una tabella di archivio con movimenti della tabella indicata"""
+    return db.session.query(ArchivioMovimenti.query.filter(
+        ArchivioMovimenti.tabella_origine == tabella_origine,
+        ArchivioMovimenti.righe > 0
+    ).exists()).scalar()
+
+
+def archivi_nel_periodo(tabella_origine, data_da=None, data_a=None, completo=False):
+    """
+    Tabelle di archivio con movimenti nell'intervallo indicato.
+    Senza data iniziale lo storico è quello attivo, salvo `completo=True`.
+    """
+    if data_da is None and not completo:
+        return []
+
+    query = ArchivioMovimenti.query.filter(
+        ArchivioMovimenti.tabella_origine == tabella_origine,
+        ArchivioMovimenti.righe > 0
+    )
+    if data_da is not None:
+        query = query.filter(ArchivioMovimenti.data_max >= data_da)
+    if data_a is not None:
+        query = query.filter(ArchivioMovimenti.data_min <= data_a)
+    return [tabella_archivio(tabella_origine, a.anno) for a in query.order_by(ArchivioMovimenti.anno)]
+
+
+def entita_movimenti(modello, data_da=None, data_a=None, completo=False):
+    """
+    Entità da interrogare per lo storico dei movimenti: il modello stesso, oppure un alias
+    del modello sull'unione con le tabelle di archivio se l'intervallo di date le include.
+    Le righe archiviate mantengono l'id originale, quindi restano istanze del modello.
+    """
+    archivi = archivi_nel_periodo(modello.__tablename__, data_da, data_a, completo)
+    if not archivi:
+        return modello
+
+    origine = modello.__table__
+    unione = union_all(
+        select(origine),
+        *[select(*[archivio.c[c.name] for c in origine.columns]) for archivio in archivi]
+    ).subquery(f'{origine.name}_storico')
+    return aliased(modello, unione)
+
+
+def movimenti_archiviati_macchina(macchina_id):
+    """Numero di movimenti archiviati di una macchina (dai riepiloghi)"""
+    return db.session.query(
+        func.coalesce(func.sum(RiepilogoMovimentiMacchina.numero_movimenti), 0)
+    ).filter(RiepilogoMovimentiMacchina.macchina_id == macchina_id).scalar()
+
+
+def consumi_mensili_ricambio(ricambio_id, data_da):
+    """
+    Pezzi scaricati per mese ('AAAA-MM') da `data_da` in poi, sommando i movimenti
+    attivi e i riepiloghi dei mesi già archiviati
+    """
+    anno = extract('year', MovimentoMagazzino.created_at)
+    mese = extract('month', MovimentoMagazzino.created_at)
+    attivi = db.session.query(
+        anno, mese, func.sum(-MovimentoMagazzino.quantita)
+    ).filter(
+        MovimentoMagazzino.ricambio_id == ricambio_id,
+        MovimentoMagazzino.created_at >= data_da,
+        MovimentoMagazzino.quantita < 0
+    ).group_by(anno, mese).all()
+
+    consumi = {}
+    for a, m, totale in attivi:
+        chiave = f'{int(a):04d}-{int(m):02d}'
+        consumi[chiave] = consumi.get(chiave, 0) + int(totale or 0)
+
+    # Riepiloghi archiviati: il mese di data_da è incluso per intero
+    archiviati = RiepilogoMovimentiRicambio.query.filter(
+        RiepilogoMovimentiRicambio.ricambio_id == ricambio_id,
+        RiepilogoMovimentiRicambio.anno * 12 + RiepilogoMovimentiRicambio.mese >= data_da.year * 12 + data_da.month,
+        RiepilogoMovimentiRicambio.scarichi > 0
+    ).all()
+    for r in archiviati:
+        chiave = f'{r.anno:04d}-{r.mese:02d}'
+        consumi[chiave] = consumi.get(chiave, 0) + r.scarichi
+
+    return consumi
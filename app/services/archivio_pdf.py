@@ -0,0 +1,426 @@
+"""
+Archivio dei documenti generati dei fogli tecnici (PDF e vecchi HTML)
+I file sono salvati in cartelle anno/mese/reparto (es. fogli_tecnici_pdf/2025/03/reparto_2/)
+in base alla data di creazione del foglio, e registrati nel manifesto documenti_fogli.
+I mesi precedenti all'orizzonte configurato (ARCHIVIO_PDF_MESI) vengono spostati in un
+contenitore ZIP compresso per mese e reparto (fogli_tecnici_pdf/2025/03/reparto_2.zip):
+l'indice centrale dello ZIP permette di leggere un solo documento senza decomprimere il resto.
+Il percorso di un documento non cambia con l'archiviazione: apri_documento() lo legge dalla
+cartella o dal contenitore.
+"""
+
+from flask import current_app
+import io
+import os
+import shutil
+import time
+import zipfile
+from datetime import datetime, timedelta
+from sqlalchemy import and_, func, or_, update
+from app import db
+from app.models.documento_foglio import DocumentoFoglio
+from app.models.foglio_tecnico import FoglioTecnico
+from app.services.archivio_movimenti import data_limite_archivio
+
+# Cartelle dei documenti per tipo, dentro la cartella upload
+RADICI = {'pdf': 'fogli_tecnici_pdf', 'html': 'fogli_tecnici_html'}
+
+# Cartella dei documenti di fogli senza reparto (o non più presenti)
+SENZA_REPARTO = 'senza_reparto'
+
+# Un contenitore bloccato da più tempo è considerato abbandonato (processo terminato)
+DURATA_BLOCCO = timedelta(hours=1)
+
+
+def cartella_documenti(foglio):
+    """Sottocartella anno/mese/reparto dei documenti di un foglio (dalla data di creazione)"""
+    data = foglio.created_at or datetime.utcnow()
+    reparto = f'reparto_{foglio.department_id}' if foglio.department_id else SENZA_REPARTO
+    return f'{data.year:04d}/{data.month:02d}/{reparto}'
+
+
+def cartella_assoluta(tipo, cartella):
+    """Percorso della sottocartella per un tipo di documento (creata se manca)"""
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], RADICI[tipo], *cartella.split('/'))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _relativo(path):
+    """Percorso relativo alla cartella upload con separatore '/', None se fuori dalla cartella"""
+    try:
+        relativo = os.path.relpath(os.path.abspath(path), os.path.abspath(current_app.config['UPLOAD_FOLDER']))
+    except ValueError:
+        # Windows: unità diversa da quella della cartella upload
+        return None
+    if relativo.startswith('..'):
+        return None
+    return relativo.replace(os.sep, '/')
+
+
+def _assoluto(relativo):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], *relativo.split('/'))
+
+
+def _reparto_id(cartella_reparto):
+    """ID del reparto dal nome della cartella (reparto_3 -> 3), None per SENZA_REPARTO"""
+    if cartella_reparto.startswith('reparto_'):
+        try:
+            return int(cartella_reparto[len('reparto_'):])
+        except ValueError:
+            pass
+    return None
+
+
+def _contenitore(documento):
+    """Contenitore ZIP del mese e reparto di un documento, relativo alla cartella upload"""
+    radice, anno, mese, reparto = documento.percorso.split('/')[:4]
+    return f'{radice}/{anno}/{mese}/{reparto}.zip'
+
+
+def registra_documento(path, numero_foglio, foglio_id=None, tipo='pdf'):
+    """
+    Registra nel manifesto un documento salvato nelle cartelle anno/mese/reparto (commit al chiamante).
+    I file fuori da queste cartelle (vecchia cartella unica) vengono ignorati.
+
+    Returns:
+        DocumentoFoglio | None: Voce del manifesto
+    """
+    relativo = _relativo(path)
+    parti = relativo.split('/') if relativo else []
+    if len(parti) != 5 or parti[0] != RADICI[tipo]:
+        return None
+
+    documento = DocumentoFoglio.query.filter_by(percorso=relativo).first()
+    if documento is None:
+        documento = DocumentoFoglio(
+            tipo=tipo,
+            numero_foglio=numero_foglio,
+            department_id=_reparto_id(parti[3]),
+            anno=int(parti[1]),
+            mese=int(parti[2]),
+            percorso=relativo
+        )
+        db.session.add(documento)
+    elif documento.archiviato:
+        # Documento riscritto nella cartella: torna sciolto, la prossima archiviazione
+        # trova il membro già nel contenitore ed elimina il file
+        documento.contenitore = None
+        documento.dimensione_compressa = None
+        documento.archiviato_at = None
+    documento.foglio_id = foglio_id
+    documento.dimensione = os.path.getsize(path)
+    return documento
+
+
+def _documento_archiviato(path):
+    relativo = _relativo(path) if path else None
+    if relativo is None:
+        return None
+    return DocumentoFoglio.query.filter(
+        DocumentoFoglio.percorso == relativo,
+        DocumentoFoglio.contenitore.isnot(None)
+    ).first()
+
+
+def documento_disponibile(path):
+    """True se il documento esiste nella sua cartella o in un contenitore di archivio"""
+    if not path:
+        return False
+    if os.path.exists(path):
+        return True
+    documento = _documento_archiviato(path)
+    return documento is not None and os.path.exists(_assoluto(documento.contenitore))
+
+
+def apri_documento(path):
+    """
+    Apre un documento in lettura binaria dalla sua cartella o dal contenitore di archivio
+
+    Returns:
+        file: File aperto (da chiudere), o copia in memoria del membro archiviato
+
+    Raises:
+        FileNotFoundError: Se il documento non esiste in nessuna delle due posizioni
+    """
+    try:
+        return open(path, 'rb')
+    except FileNotFoundError:
+        documento = _documento_archiviato(path)
+        if documento is None:
+            raise
+    with zipfile.ZipFile(_assoluto(documento.contenitore)) as contenitore:
+        return io.BytesIO(contenitore.read(documento.nome_file))
+
+
+def leggi_documento(path):
+    """Contenuto di un documento, dalla sua cartella o dal contenitore di archivio"""
+    with apri_documento(path) as f:
+        return f.read()
+
+
+def percorsi_sciolti(numero_foglio, tipo='pdf'):
+    """Percorsi dei documenti di un foglio ancora presenti come file nelle cartelle"""
+    return [
+        _assoluto(percorso) for (percorso,) in db.session.query(DocumentoFoglio.percorso).filter(
+            DocumentoFoglio.numero_foglio == numero_foglio,
+            DocumentoFoglio.tipo == tipo,
+            DocumentoFoglio.contenitore.is_(None)
+        )
+    ]
+
+
+def rimuovi_documenti(paths):
+    """
+    Elimina i file indicati e le loro voci del manifesto (commit al chiamante).
+    Le copie già archiviate nei contenitori restano.
+
+    Returns:
+        int: Numero di file eliminati
+    """
+    eliminati = 0
+    rimossi = []
+    for path in paths:
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+                eliminati += 1
+        except OSError as e:
+            # Es. file ancora aperto da un invio email: verrà eliminato alla prossima generazione
+            current_app.logger.warning(f"Documento non eliminato {path}: {str(e)}")
+            continue
+        relativo = _relativo(path)
+        if relativo:
+            rimossi.append(relativo)
+    if rimossi:
+        DocumentoFoglio.query.filter(
+            DocumentoFoglio.percorso.in_(rimossi),
+            DocumentoFoglio.contenitore.is_(None)
+        ).delete(synchronize_session=False)
+    return eliminati
+
+
+def _prendi_blocco(contenitore):
+    """Blocco su file del contenitore, condiviso tra processi (server e script)"""
+    blocco = f'{contenitore}.lock'
+    try:
+        os.close(os.open(blocco, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        if time.time() - os.path.getmtime(blocco) < DURATA_BLOCCO.total_seconds():
+            return False
+    os.remove(blocco)
+    return _prendi_blocco(contenitore)
+
+
+def _archivia_gruppo(documenti, contenitore_rel):
+    """
+    Aggiunge al contenitore ZIP i documenti sciolti di un mese e reparto.
+    Il contenitore è riscritto su una copia e sostituito in modo atomico; i file sciolti
+    vengono eliminati solo dopo il commit del manifesto.
+
+    Returns:
+        tuple: (documenti archiviati, byte dei file, byte nel contenitore), o None se il
+        contenitore è occupato da un'altra archiviazione
+    """
+    contenitore = _assoluto(contenitore_rel)
+    if not _prendi_blocco(contenitore):
+        return None
+    tmp_path = f'{contenitore}.{os.getpid()}.tmp'
+    try:
+        if os.path.exists(contenitore):
+            shutil.copyfile(contenitore, tmp_path)
+        archiviati = []
+        with zipfile.ZipFile(tmp_path, 'a', zipfile.ZIP_DEFLATED, compresslevel=9) as archivio:
+            presenti = set(archivio.namelist())
+            for documento in documenti:
+                path = _assoluto(documento.percorso)
+                if documento.nome_file not in presenti:
+                    if not os.path.exists(path):
+                        current_app.logger.warning(f"Documento mancante rimosso dal manifesto: {documento.percorso}")
+                        db.session.delete(documento)
+                        continue
+                    archivio.write(path, arcname=documento.nome_file)
+                archiviati.append(documento)
+            compressi = {info.filename: info.compress_size for info in archivio.infolist()}
+        os.replace(tmp_path, contenitore)
+
+        adesso = datetime.utcnow()
+        for documento in archiviati:
+            documento.contenitore = contenitore_rel
+            documento.dimensione_compressa = compressi[documento.nome_file]
+            documento.archiviato_at = adesso
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        os.remove(f'{contenitore}.lock')
+
+    for documento in archiviati:
+        path = _assoluto(documento.percorso)
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            # La copia sciolta resta leggibile e identica al membro archiviato
+            current_app.logger.warning(f"File archiviato non eliminato {path}: {str(e)}")
+    try:
+        os.rmdir(os.path.splitext(contenitore)[0])
+    except OSError:
+        pass  # Cartella non vuota (documenti del mese generati nel frattempo)
+
+    return (
+        len(archiviati),
+        sum(documento.dimensione or 0 for documento in archiviati),
+        sum(documento.dimensione_compressa or 0 for documento in archiviati)
+    )
+
+
+def archivia_documenti(mesi=None, dry_run=False, progress=None):
+    """
+    Sposta nei contenitori ZIP mensili i documenti sciolti dei mesi precedenti all'orizzonte
+
+    Args:
+        mesi (int, optional): Mesi di documenti lasciati nelle cartelle (default ARCHIVIO_PDF_MESI)
+        dry_run (bool): Conta i documenti da archiviare senza spostarli
+        progress (callable, optional): Chiamata come progress(contenitore, documenti)
+
+    Returns:
+        dict: Data limite, contenitori aggiornati, documenti archiviati, byte prima e dopo, errori
+    """
+    if mesi is None:
+        mesi = current_app.config.get('ARCHIVIO_PDF_MESI', 12)
+    limite = data_limite_archivio(mesi)
+    risultato = {
+        'data_limite': limite.isoformat(),
+        'contenitori': 0,
+        'documenti': 0,
+        'byte_prima': 0,
+        'byte_dopo': 0,
+        'errori': 0,
+    }
+
+    gruppi = db.session.query(
+        DocumentoFoglio.tipo, DocumentoFoglio.anno, DocumentoFoglio.mese, DocumentoFoglio.department_id,
+        func.count(DocumentoFoglio.id), func.sum(DocumentoFoglio.dimensione)
+    ).filter(
+        DocumentoFoglio.contenitore.is_(None),
+        or_(
+            DocumentoFoglio.anno < limite.year,
+            and_(DocumentoFoglio.anno == limite.year, DocumentoFoglio.mese < limite.month)
+        )
+    ).group_by(
+        DocumentoFoglio.tipo, DocumentoFoglio.anno, DocumentoFoglio.mese, DocumentoFoglio.department_id
+    ).order_by(DocumentoFoglio.anno, DocumentoFoglio.mese).all()
+
+    for tipo, anno, mese, department_id, quanti, dimensione in gruppi:
+        if dry_run:
+            risultato['contenitori'] += 1
+            risultato['documenti'] += quanti
+            risultato['byte_prima'] += dimensione or 0
+            continue
+
+        documenti = DocumentoFoglio.query.filter(
+            DocumentoFoglio.tipo == tipo,
+            DocumentoFoglio.anno == anno,
+            DocumentoFoglio.mese == mese,
+            DocumentoFoglio.department_id == department_id,
+            DocumentoFoglio.contenitore.is_(None)
+        ).order_by(DocumentoFoglio.percorso).all()
+        # Un reparto eliminato lascia i documenti nella sua cartella: contenitore per cartella
+        per_contenitore = {}
+        for documento in documenti:
+            per_contenitore.setdefault(_contenitore(documento), []).append(documento)
+
+        for contenitore_rel, del_contenitore in per_contenitore.items():
+            try:
+                esito = _archivia_gruppo(del_contenitore, contenitore_rel)
+            except Exception as e:
+                current_app.logger.error(f"Errore archiviazione {contenitore_rel}: {str(e)}")
+                risultato['errori'] += 1
+                continue
+            if esito is None:
+                current_app.logger.info(f"Contenitore {contenitore_rel} in uso, archiviazione rimandata")
+                continue
+            archiviati, prima, dopo = esito
+            risultato['contenitori'] += 1
+            risultato['documenti'] += archiviati
+            risultato['byte_prima'] += prima
+            risultato['byte_dopo'] += dopo
+            if progress:
+                progress(contenitore_rel, archiviati)
+
+    if risultato['documenti'] and not dry_run:
+        current_app.logger.info(
+            f"Archiviati {risultato['documenti']} documenti in {risultato['contenitori']} contenitori "
+            f"({risultato['byte_prima'] // 1024} KiB -> {risultato['byte_dopo'] // 1024} KiB)"
+        )
+    return risultato
+
+
+def migra_cartelle_piatte(dry_run=False, progress=None):
+    """
+    Sposta i documenti della vecchia cartella unica nelle cartelle anno/mese/reparto e li
+    registra nel manifesto, aggiornando il percorso del PDF dei fogli. Rilanciabile.
+
+    Args:
+        dry_run (bool): Conta i file da spostare senza modificarli
+        progress (callable, optional): Chiamata come progress(spostati)
+
+    Returns:
+        dict: File spostati, file senza foglio corrispondente, errori
+    """
+    fogli = {
+        riga.numero_foglio: riga for riga in db.session.query(
+            FoglioTecnico.id, FoglioTecnico.numero_foglio, FoglioTecnico.created_at,
+            FoglioTecnico.department_id, FoglioTecnico.pdf_path
+        )
+    }
+    risultato = {'spostati': 0, 'senza_foglio': 0, 'errori': 0}
+
+    for tipo, radice_nome in RADICI.items():
+        radice = os.path.join(current_app.config['UPLOAD_FOLDER'], radice_nome)
+        if not os.path.isdir(radice):
+            continue
+        for nome in sorted(os.listdir(radice)):
+            path = os.path.join(radice, nome)
+            if not os.path.isfile(path) or not nome.lower().endswith(f'.{tipo}'):
+                continue
+
+            numero_foglio = nome.split('_', 1)[0]
+            foglio = fogli.get(numero_foglio)
+            if foglio is None:
+                risultato['senza_foglio'] += 1
+                cartella = datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y/%m/') + SENZA_REPARTO
+            else:
+                cartella = cartella_documenti(foglio)
+            if dry_run:
+                risultato['spostati'] += 1
+                continue
+
+            destinazione = os.path.join(cartella_assoluta(tipo, cartella), nome)
+            try:
+                os.replace(path, destinazione)
+            except OSError as e:
+                current_app.logger.warning(f"Documento non spostato {path}: {str(e)}")
+                risultato['errori'] += 1
+                continue
+            registra_documento(destinazione, numero_foglio[:20], foglio.id if foglio else None, tipo=tipo)
+            if tipo == 'pdf' and foglio and foglio.pdf_path and \
+                    os.path.normcase(os.path.abspath(foglio.pdf_path)) == os.path.normcase(os.path.abspath(path)):
+                db.session.execute(
+                    update(FoglioTecnico)
+                    .where(FoglioTecnico.id == foglio.id)
+                    .values(pdf_path=destinazione, updated_at=FoglioTecnico.updated_at)
+                    .execution_options(synchronize_session=False)
+                )
+            # Un commit per file: un'interruzione non lascia file spostati fuori dal manifesto
+            db.session.commit()
+            risultato['spostati'] += 1
+            if progress:
+                progress(risultato['spostati'])
+
+    return risultato
@@ -0,0 +1,206 @@
+"""
+Coda di rendering dei PDF dei fogli tecnici
+I dati del foglio vengono letti nel thread della richiesta, il disegno ReportLab gira in un
+pool di processi (il lavoro CPU non occupa il GIL dei thread di waitress). Richieste
+concorrenti per lo stesso foglio con gli stessi dati (stessa impronta nel percorso del PDF)
+condividono lo stesso job, interrogabile per job_id.
+Se il foglio punta già al PDF con la stessa impronta il job si chiude subito senza rendering.
+"""
+
+from flask import current_app
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from app import db
+from app.models.foglio_tecnico import FoglioTecnico
+from app.services.pdf_generator import (
+    dati_pdf_foglio, disegna_pdf_foglio, percorso_pdf, pdf_gia_registrato, registra_pdf_foglio
+)
+
+# Per quanto tempo restano interrogabili i job conclusi
+DURATA_JOB_CONCLUSI = timedelta(hours=1)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Stato dei job (job_id -> dizionario stato), job in corso per (foglio, percorso PDF) ed eventi di completamento
+_pdf_jobs = {}
+_job_per_foglio = {}
+_eventi = {}
+_jobs_lock = threading.Lock()
+
+
+def _get_pool(app):
+    """Pool di processi condiviso, creato alla prima richiesta"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            processi = app.config.get('PDF_RENDER_PROCESSES') or os.cpu_count() or 1
+            _pool = ProcessPoolExecutor(max_workers=processi)
+        return _pool
+
+
+def _scarta_pool(pool):
+    """Sostituisce un pool rotto (es. processo terminato) alla prossima richiesta"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _invia_al_pool(app, dati, pdf_path):
+    pool = _get_pool(app)
+    try:
+        return pool.submit(disegna_pdf_foglio, dati, pdf_path)
+    except (BrokenProcessPool, RuntimeError):
+        _scarta_pool(pool)
+        return _get_pool(app).submit(disegna_pdf_foglio, dati, pdf_path)
+
+
+def _pulisci_job_conclusi():
+    """Rimuove i job conclusi da più di DURATA_JOB_CONCLUSI (da chiamare con _jobs_lock)"""
+    limite = datetime.utcnow() - DURATA_JOB_CONCLUSI
+    for job_id in [j for j, job in _pdf_jobs.items() if job['completed_at'] and job['completed_at'] < limite]:
+        del _pdf_jobs[job_id]
+        _eventi.pop(job_id, None)
+
+
+def _concludi(job_id, pdf_path=None, errore=None):
+    with _jobs_lock:
+        job = _pdf_jobs[job_id]
+        job.update({
+            'stato': 'Errore' if errore else 'Completato',
+            'pdf_path': pdf_path,
+            'errore': errore,
+            'completed_at': datetime.utcnow()
+        })
+        if _job_per_foglio.get(job['chiave']) == job_id:
+            del _job_per_foglio[job['chiave']]
+        evento = _eventi.get(job_id)
+    if evento:
+        evento.set()
+
+
+def _completa(app, job_id, foglio_id, pdf_path, future):
+    """Callback di fine rendering: collega il PDF al foglio e chiude il job"""
+    try:
+        future.result()
+        with app.app_context():
+            try:
+                registra_pdf_foglio(foglio_id, pdf_path)
+            finally:
+                db.session.remove()
+    except Exception as e:
+        if isinstance(e, BrokenProcessPool):
+            _scarta_pool(_pool)
+        app.logger.error(f"Errore generazione PDF per foglio {foglio_id}: {str(e)}")
+        _concludi(job_id, errore=f"Errore nella generazione del PDF: {str(e)}")
+        return
+    _concludi(job_id, pdf_path=pdf_path)
+
+
+def accoda_pdf_foglio(foglio_id):
+    """
+    Accoda la generazione del PDF di un foglio, o restituisce il job già in corso per gli
+    stessi dati (un foglio modificato nel frattempo ha un'altra impronta e un nuovo job)
+
+    Args:
+        foglio_id (int): ID del foglio tecnico
+
+    Returns:
+        str: ID del job da usare con get_pdf_job / attendi_pdf
+    """
+    app = current_app._get_current_object()
+
+    errore = None
+    try:
+        foglio = FoglioTecnico.query.get(foglio_id)
+        if not foglio:
+            raise ValueError(f"Foglio tecnico {foglio_id} non trovato")
+        # I dati sono letti qui, nella sessione della richiesta: includono le modifiche non ancora salvate
+        dati = dati_pdf_foglio(foglio)
+        pdf_path = percorso_pdf(dati)
+    except Exception as e:
+        app.logger.error(f"Errore accodamento PDF per foglio {foglio_id}: {str(e)}")
+        errore = f"Errore nella generazione del PDF: {str(e)}"
+        pdf_path = None
+
+    chiave = (foglio_id, pdf_path)
+    with _jobs_lock:
+        _pulisci_job_conclusi()
+        job_id = _job_per_foglio.get(chiave) if not errore else None
+        if job_id:
+            return job_id
+        job_id = uuid.uuid4().hex
+        _pdf_jobs[job_id] = {
+            'foglio_id': foglio_id,
+            'chiave': chiave,
+            'stato': 'In corso',
+            'pdf_path': None,
+            'errore': None,
+            'created_at': datetime.utcnow(),
+            'completed_at': None
+        }
+        if not errore:
+            _job_per_foglio[chiave] = job_id
+        _eventi[job_id] = threading.Event()
+
+    if errore:
+        _concludi(job_id, errore=errore)
+        return job_id
+
+    try:
+        if pdf_gia_registrato(foglio, pdf_path):
+            _concludi(job_id, pdf_path=pdf_path)
+            return job_id
+        future = _invia_al_pool(app, dati, pdf_path)
+    except Exception as e:
+        app.logger.error(f"Errore accodamento PDF per foglio {foglio_id}: {str(e)}")
+        _concludi(job_id, errore=f"Errore nella generazione del PDF: {str(e)}")
+        return job_id
+
+    future.add_done_callback(lambda f: _completa(app, job_id, foglio_id, pdf_path, f))
+    return job_id
+
+
+def get_pdf_job(job_id):
+    """Restituisce lo stato di un job PDF, o None se sconosciuto"""
+    with _jobs_lock:
+        job = _pdf_jobs.get(job_id)
+        return dict(job) if job else None
+
+
+def attendi_pdf(job_id, timeout=None):
+    """
+    Attende la fine di un job per al massimo `timeout` secondi (None = senza limite)
+
+    Returns:
+        dict | None: Stato del job (ancora 'In corso' se il tempo è scaduto)
+    """
+    with _jobs_lock:
+        evento = _eventi.get(job_id)
+    if evento:
+        evento.wait(timeout)
+    return get_pdf_job(job_id)
+
+
+def genera_pdf_in_coda(foglio_id, timeout=None):
+    """
+    Genera il PDF di un foglio tramite la coda e ne attende il completamento
+
+    Returns:
+        str: Path del file PDF generato
+
+    Raises:
+        Exception: Se il rendering fallisce o non termina entro il timeout
+    """
+    job = attendi_pdf(accoda_pdf_foglio(foglio_id), timeout)
+    if job['stato'] == 'Errore':
+        raise Exception(job['errore'])
+    if job['stato'] != 'Completato':
+        raise Exception("Generazione del PDF ancora in corso, riprovare tra qualche istante")
+    return job['pdf_path']
@@ -1,15 +1,21 @@
 """
 Servizio per l'invio di email dei fogli tecnici
-Gestisce l'invio automatico dei PDF dei fogli tecnici via email
+Gestisce l'invio automatico dei PDF dei fogli tecnici via email; i messaggi passano
+dall'outbox (app/services/outbox_email.py) e vengono spediti in background
 """
 
 from flask import current_app, render_template
 from flask_mail import Mail, Message
-import os
-from datetime import datetime
+from jinja2 import TemplateNotFound
+from datetime import datetime, timedelta
+from sqlalchemy import or_, update
+from sqlalchemy.orm import contains_eager, joinedload
 from app import db
 from app.models.foglio_tecnico import FoglioTecnico
-from app.services.pdf_generator import genera_pdf_foglio_tecnico, get_foglio_pdf_path
+from app.models.user import User
+from app.services.pdf_generator import get_foglio_pdf_path
+from app.services.coda_pdf import accoda_pdf_foglio
+from app.services.outbox_email import accoda_email, avvia_invio, TIPO_FOGLIO
 
 
 def init_mail(app):
@@ -30,19 +36,21 @@ def init_mail(app):
 
 def invia_foglio_per_email(foglio_id, email_destinatario, note_aggiuntive=None, genera_pdf_se_mancante=True):
     """
-    Invia un foglio tecnico per email
+    Accoda l'invio di un foglio tecnico per email (outbox): la richiesta non attende l'SMTP.
+    Il PDF viene generato o aggiornato dal sender al momento dell'invio; lo stato di
+    consegna è registrato sul foglio (stato_invio_email).
     
     Args:
         foglio_id (int): ID del foglio tecnico
         email_destinatario (str): Email del destinatario
         note_aggiuntive (str, optional): Note aggiuntive da includere nell'email
-        genera_pdf_se_mancante (bool): Se generare PDF automaticamente se non esiste
+        genera_pdf_se_mancante (bool): Se avviare subito la generazione del PDF se non esiste
         
     Returns:
-        bool: True se inviato con successo
+        EmailOutbox: Email accodata
         
     Raises:
-        Exception: Se errori nell'invio o configurazione email mancante
+        Exception: Se configurazione email mancante o errori nella preparazione
     """
     # Carica foglio dal database
     foglio = FoglioTecnico.query.get(foglio_id)
@@ -54,18 +62,10 @@ def invia_foglio_per_email(foglio_id, email_destinatario, note_aggiuntive=None,
         if not _is_email_configured():
             raise Exception("Configurazione email non presente. Configurare MAIL_SERVER, MAIL_USERNAME, etc. in .env")
         
-        # Ottieni o genera PDF
-        pdf_path = get_foglio_pdf_path(foglio_id)
-        if not pdf_path and genera_pdf_se_mancante:
+        # Il rendering parte subito in background, il sender attende il PDF prima dell'invio
+        if genera_pdf_se_mancante and not get_foglio_pdf_path(foglio_id):
             current_app.logger.info(f"Generando PDF per foglio {foglio.numero_foglio} prima dell'invio")
-            pdf_path = genera_pdf_foglio_tecnico(foglio_id)
-        
-        if not pdf_path:
-            raise Exception("Impossibile ottenere o generare il PDF del foglio tecnico")
-        
-        # Inizializza Flask-Mail
-        from flask_mail import Mail, Message
-        mail = Mail(current_app)
+            accoda_pdf_foglio(foglio_id)
         
         # Prepara oggetto email
         oggetto = f"Foglio Tecnico {foglio.numero_foglio} - {foglio.titolo}"
@@ -81,39 +81,18 @@ def invia_foglio_per_email(foglio_id, email_destinatario, note_aggiuntive=None,
         
         corpo_testo = _genera_corpo_testo_email(foglio, note_aggiuntive)
         
-        # Crea messaggio
-        msg = Message(
-            subject=oggetto,
-            recipients=[email_destinatario],
-            html=corpo_html,
-            body=corpo_testo
+        email = accoda_email(
+            TIPO_FOGLIO,
+            [email_destinatario],
+            oggetto,
+            corpo_testo,
+            corpo_html=corpo_html,
+            foglio=foglio,
+            allega_pdf=True
         )
         
-        # Aggiungi allegato PDF
-        if pdf_path and os.path.exists(pdf_path):
-            filename = f"FoglioTecnico_{foglio.numero_foglio}.pdf"
-            with open(pdf_path, 'rb') as f:
-                msg.attach(
-                    filename=filename,
-                    content_type='application/pdf',
-                    data=f.read()
-                )
-        
-        # Invia email
-        mail.send(msg)
-        
-        # Aggiorna stato nel database
-        foglio.inviato_online = True
-        foglio.email_invio = email_destinatario
-        foglio.data_invio = datetime.utcnow()
-        if foglio.stato == 'Completato':
-            foglio.stato = 'Inviato'
-        foglio.updated_at = datetime.utcnow()
-        
-        db.session.commit()
-        
-        current_app.logger.info(f"Email inviata con successo per foglio {foglio.numero_foglio} a {email_destinatario}")
-        return True
+        current_app.logger.info(f"Email per foglio {foglio.numero_foglio} a {email_destinatario} accodata (outbox {email.id})")
+        return email
         
     except Exception as e:
         current_app.logger.error(f"Errore invio email per foglio {foglio.numero_foglio}: {str(e)}")
@@ -122,14 +101,14 @@ def invia_foglio_per_email(foglio_id, email_destinatario, note_aggiuntive=None,
 
 def invia_notifica_nuovo_foglio(foglio_id, email_manager=None):
     """
-    Invia notifica di nuovo foglio tecnico creato al manager del reparto
+    Accoda la notifica di nuovo foglio tecnico creato al manager del reparto
     
     Args:
         foglio_id (int): ID del foglio tecnico
         email_manager (str, optional): Email del manager (se non specificato, usa quello del reparto)
         
     Returns:
-        bool: True se inviato con successo
+        bool: True se accodata con successo
     """
     try:
         # Carica foglio
@@ -162,14 +141,10 @@ def invia_notifica_nuovo_foglio(foglio_id, email_manager=None):
             current_app.logger.warning("Configurazione email mancante per notifica nuovo foglio")
             return False
         
-        # Inizializza Flask-Mail
-        from flask_mail import Mail, Message
-        mail = Mail(current_app)
-        
         # Prepara messaggio
         oggetto = f"Nuovo Foglio Tecnico: {foglio.numero_foglio} - {foglio.titolo}"
         
-        corpo_html = render_template(
+        corpo_html = _render_html_opzionale(
             'fogli_tecnici/notification_email.html',
             foglio=foglio
         )
@@ -189,17 +164,9 @@ Creato: {foglio.created_at.strftime('%d/%m/%Y %H:%M')}
 Per visualizzare i dettagli, accedi al sistema DB-Desk.
 """
         
-        msg = Message(
-            subject=oggetto,
-            recipients=[email_manager],
-            html=corpo_html,
-            body=corpo_testo
-        )
-        
-        # Invia
-        mail.send(msg)
+        accoda_email('notifica', [email_manager], oggetto, corpo_testo, corpo_html=corpo_html, foglio=foglio)
         
-        current_app.logger.info(f"Notifica inviata per nuovo foglio {foglio.numero_foglio} a {email_manager}")
+        current_app.logger.info(f"Notifica per nuovo foglio {foglio.numero_foglio} a {email_manager} accodata")
         return True
         
     except Exception as e:
@@ -207,90 +174,115 @@ Per visualizzare i dettagli, accedi al sistema DB-Desk.
         return False
 
 
-def invia_promemoria_fogli_incompleti(giorni_limite=7):
+def invia_promemoria_fogli_incompleti(giorni_limite=None):
     """
-    Invia promemoria per fogli tecnici rimasti incompleti oltre il limite di giorni
+    Accoda un riepilogo per ogni tecnico con fogli rimasti incompleti oltre il limite di giorni.
+    Un foglio già ricordato torna nel riepilogo solo dopo PROMEMORIA_FOGLI_RIPETI_GIORNI;
+    le email accodate partono insieme sulla stessa connessione SMTP dell'outbox.
     
     Args:
-        giorni_limite (int): Giorni dopo i quali considerare un foglio "vecchio"
+        giorni_limite (int, optional): Giorni dopo i quali considerare un foglio "vecchio"
+            (default PROMEMORIA_FOGLI_GIORNI)
         
     Returns:
-        int: Numero di promemoria inviati
+        int: Numero di promemoria accodati (uno per tecnico)
     """
     try:
         if not _is_email_configured():
             current_app.logger.warning("Configurazione email mancante per promemoria fogli")
             return 0
         
-        from datetime import timedelta
-        from sqlalchemy import and_
+        if giorni_limite is None:
+            giorni_limite = current_app.config.get('PROMEMORIA_FOGLI_GIORNI', 7)
+        adesso = datetime.utcnow()
+        data_limite = adesso - timedelta(days=giorni_limite)
+        ripeti_dopo = adesso - timedelta(days=current_app.config.get('PROMEMORIA_FOGLI_RIPETI_GIORNI', 7))
+        
+        # Fogli incompleti vecchi con tecnico e cliente in un'unica query
+        fogli_vecchi = FoglioTecnico.query.join(
+            FoglioTecnico.tecnico
+        ).filter(
+            FoglioTecnico.created_at < data_limite,
+            FoglioTecnico.stato.in_(['Bozza', 'In compilazione', 'In attesa firme']),
+            or_(
+                FoglioTecnico.promemoria_inviato_at.is_(None),
+                FoglioTecnico.promemoria_inviato_at < ripeti_dopo
+            ),
+            User.is_active.is_(True),
+            User.email.isnot(None),
+            User.email != ''
+        ).options(
+            contains_eager(FoglioTecnico.tecnico),
+            joinedload(FoglioTecnico.cliente)
+        ).order_by(FoglioTecnico.tecnico_id, FoglioTecnico.created_at).all()
+        
+        if not fogli_vecchi:
+            return 0
         
-        data_limite = datetime.utcnow() - timedelta(days=giorni_limite)
+        per_tecnico = {}
+        for foglio in fogli_vecchi:
+            per_tecnico.setdefault(foglio.tecnico, []).append(foglio)
         
-        # Trova fogli incompleti vecchi
-        fogli_vecchi = FoglioTecnico.query.filter(
-            and_(
-                FoglioTecnico.created_at < data_limite,
-                FoglioTecnico.stato.in_(['Bozza', 'In compilazione', 'In attesa firme'])
-            )
-        ).all()
+        for tecnico, fogli in per_tecnico.items():
+            _accoda_riepilogo_promemoria(tecnico, fogli, adesso)
         
-        promemoria_inviati = 0
+        # Promemoria registrati con un solo UPDATE, nella stessa transazione delle email
+        db.session.execute(
+            update(FoglioTecnico)
+            .where(FoglioTecnico.id.in_([foglio.id for foglio in fogli_vecchi]))
+            .values(promemoria_inviato_at=adesso, updated_at=FoglioTecnico.updated_at)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        avvia_invio()
         
-        for foglio in fogli_vecchi:
-            try:
-                # Invia promemoria al tecnico assegnato
-                if foglio.tecnico and foglio.tecnico.email:
-                    _invia_promemoria_singolo(foglio, foglio.tecnico.email)
-                    promemoria_inviati += 1
-                    
-            except Exception as e:
-                current_app.logger.error(f"Errore invio promemoria per foglio {foglio.numero_foglio}: {str(e)}")
-                continue
-        
-        return promemoria_inviati
+        current_app.logger.info(
+            f"Promemoria fogli incompleti accodati: {len(per_tecnico)} tecnici, {len(fogli_vecchi)} fogli"
+        )
+        return len(per_tecnico)
         
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"Errore invio promemoria fogli incompleti: {str(e)}")
         return 0
 
 
-def _invia_promemoria_singolo(foglio, email_tecnico):
-    """Invia un singolo promemoria per un foglio incompleto"""
-    from flask_mail import Mail, Message
-    mail = Mail(current_app)
-    
-    oggetto = f"Promemoria: Foglio Tecnico {foglio.numero_foglio} da completare"
+def _accoda_riepilogo_promemoria(tecnico, fogli, adesso):
+    """Aggiunge alla sessione il riepilogo dei fogli incompleti di un tecnico (commit al chiamante)"""
+    if len(fogli) == 1:
+        oggetto = f"Promemoria: Foglio Tecnico {fogli[0].numero_foglio} da completare"
+    else:
+        oggetto = f"Promemoria: {len(fogli)} fogli tecnici da completare"
     
-    corpo_html = render_template(
-        'fogli_tecnici/reminder_email.html',
-        foglio=foglio
-    )
-    
-    giorni_passati = (datetime.utcnow() - foglio.created_at).days
+    righe = []
+    for foglio in fogli:
+        giorni_passati = (adesso - foglio.created_at).days
+        righe.append(
+            f"- {foglio.numero_foglio} - {foglio.titolo}\n"
+            f"  Cliente: {foglio.cliente.ragione_sociale if foglio.cliente else 'N/A'} - "
+            f"Stato: {foglio.stato} - Step {foglio.step_corrente}\n"
+            f"  Creato: {foglio.created_at.strftime('%d/%m/%Y %H:%M')} ({giorni_passati} giorni fa)"
+        )
     
     corpo_testo = f"""
-Promemoria Foglio Tecnico da Completare
+Promemoria Fogli Tecnici da Completare
 
-Numero: {foglio.numero_foglio}
-Titolo: {foglio.titolo}
-Cliente: {foglio.cliente.ragione_sociale if foglio.cliente else 'N/A'}
-Stato Attuale: {foglio.stato}
+Ciao {tecnico.full_name}, hai {len(fogli)} fogli tecnici ancora da completare:
 
-Creato: {foglio.created_at.strftime('%d/%m/%Y %H:%M')} ({giorni_passati} giorni fa)
-Step Corrente: {foglio.step_corrente}
+{chr(10).join(righe)}
 
-Ti ricordiamo di completare questo foglio tecnico accedendo al sistema DB-Desk.
+Ti ricordiamo di completarli accedendo al sistema DB-Desk.
 """
     
-    msg = Message(
-        subject=oggetto,
-        recipients=[email_tecnico],
-        html=corpo_html,
-        body=corpo_testo
-    )
-    
-    mail.send(msg)
+    accoda_email('promemoria', [tecnico.email], oggetto, corpo_testo, salva=False)
+
+
+def _render_html_opzionale(template, **context):
+    """Corpo HTML dal template, o None se il template non esiste (si invia solo il testo)"""
+    try:
+        return render_template(template, **context)
+    except TemplateNotFound:
+        return None
 
 
 def _is_email_configured():
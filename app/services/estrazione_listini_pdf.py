@@ -0,0 +1,192 @@
+"""
+Servizio di estrazione dei listini ricambi dai PDF dei fornitori
+Le pagine vengono analizzate in parallelo su un pool di processi; ogni fornitore
+ha un profilo di layout che descrive colonne, formati e righe da ignorare.
+Le righe estratte alimentano direttamente importa_catalogo().
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+import re
+
+# Pagine assegnate a ogni processo per volta
+PAGINE_PER_TASK = 8
+
+# Profili di layout per fornitore.
+#   colonne: campi di una riga del listino, nell'ordine in cui compaiono
+#            (le colonne con nome None vengono scartate)
+#   separatore: regex che separa le colonne nel testo estratto
+#   regex_codice / regex_prezzo: formati validi per riconoscere una riga articolo
+#   regex_intestazione: righe che aprono una sezione (modello); se None ogni riga
+#                       breve che non è un articolo è considerata intestazione
+#   righe_da_ignorare: intestazioni di pagina, note, titoli di colonna
+PROFILI_LISTINO = {
+    'generico': {
+        'fornitore': None,
+        'colonne': ['codice', 'descrizione', 'prezzo'],
+        'separatore': r'\s{2,}',
+        'regex_codice': r'^[A-Za-z0-9][A-Za-z0-9\-\./]{2,49}$',
+        'regex_prezzo': r'^(€\s*)?\d{1,3}([\.\s]?\d{3})*([,\.]\d{1,2})?(\s*€)?$',
+        'regex_intestazione': None,
+        'righe_da_ignorare': [r'^pagina\s+\d+', r'^codice\s+descrizione'],
+    },
+    'dibal': {
+        'fornitore': 'Dibal',
+        'colonne': ['modello', None, 'descrizione', 'codice', 'prezzo'],
+        # Modelli e descrizioni contengono doppi spazi: le colonne sono separate da 3+ spazi
+        'separatore': r'\s{3,}',
+        'regex_codice': r'^[A-Za-z0-9][A-Za-z0-9\-]{2,49}$',
+        'regex_prezzo': r'^\d{1,3}(\.\d{3})*,\d{2}$',
+        'regex_intestazione': None,
+        'righe_da_ignorare': [r'^Foglio\d+$', r'^Modello\s+Assieme', r'^N\.B\.'],
+    },
+}
+
+# Lunghezza massima di una riga considerata intestazione di sezione
+_MAX_LUNGHEZZA_INTESTAZIONE = 80
+
+
+def get_profilo(nome):
+    """
+    Restituisce il profilo di layout di un fornitore.
+    I profili in PROFILI_LISTINO_PDF della configurazione hanno precedenza su quelli predefiniti.
+    """
+    from flask import current_app, has_app_context
+
+    profili = dict(PROFILI_LISTINO)
+    if has_app_context():
+        profili.update(current_app.config.get('PROFILI_LISTINO_PDF') or {})
+
+    if nome not in profili:
+        raise ValueError(f"Profilo listino sconosciuto: {nome} (disponibili: {', '.join(sorted(profili))})")
+    return dict(PROFILI_LISTINO['generico'], **profili[nome])
+
+
+def nomi_profili():
+    """Nomi dei profili disponibili, per CLI e interfaccia"""
+    from flask import current_app, has_app_context
+
+    nomi = set(PROFILI_LISTINO)
+    if has_app_context():
+        nomi |= set(current_app.config.get('PROFILI_LISTINO_PDF') or {})
+    return sorted(nomi)
+
+
+def _compila_profilo(profilo):
+    return {
+        'colonne': profilo['colonne'],
+        'separatore': re.compile(profilo['separatore']),
+        'codice': re.compile(profilo['regex_codice']),
+        'prezzo': re.compile(profilo['regex_prezzo']),
+        'intestazione': re.compile(profilo['regex_intestazione']) if profilo.get('regex_intestazione') else None,
+        'ignora': [re.compile(r, re.IGNORECASE) for r in profilo.get('righe_da_ignorare') or []],
+    }
+
+
+def _analizza_riga(linea, regole):
+    """
+    Classifica una riga di testo
+
+    Returns:
+        tuple: ('articolo', dict) | ('intestazione', str) | (None, None)
+    """
+    testo = linea.strip()
+    if not testo or any(r.search(testo) for r in regole['ignora']):
+        return None, None
+
+    parti = regole['separatore'].split(testo)
+    if len(parti) == len(regole['colonne']):
+        campi = {nome: ' '.join(valore.split()) for nome, valore in zip(regole['colonne'], parti) if nome}
+        if regole['codice'].match(campi.get('codice', '')) and regole['prezzo'].match(campi.get('prezzo', '')):
+            return 'articolo', campi
+
+    if regole['intestazione'] is not None:
+        if regole['intestazione'].search(testo):
+            return 'intestazione', testo
+    elif len(testo) <= _MAX_LUNGHEZZA_INTESTAZIONE and not regole['prezzo'].search(parti[-1]):
+        return 'intestazione', ' '.join(parti)
+
+    return None, None
+
+
+def _estrai_pagine(path, indici_pagine, profilo):
+    """
+    Estrae gli articoli da un gruppo di pagine (eseguita nei processi del pool)
+
+    Returns:
+        list: Per ogni pagina (indice, articoli, ultima intestazione trovata)
+    """
+    from pypdf import PdfReader
+
+    regole = _compila_profilo(profilo)
+    reader = PdfReader(path)
+    risultati = []
+
+    for indice in indici_pagine:
+        testo = reader.pages[indice].extract_text(extraction_mode='layout') or ''
+        articoli = []
+        modello_corrente = None
+        for linea in testo.splitlines():
+            tipo, valore = _analizza_riga(linea, regole)
+            if tipo == 'intestazione':
+                modello_corrente = valore
+            elif tipo == 'articolo':
+                valore['pagina'] = indice + 1
+                if not valore.get('modello'):
+                    # None = sezione aperta in una pagina precedente, risolta dopo l'unione
+                    valore['modello'] = modello_corrente
+                articoli.append(valore)
+        risultati.append((indice, articoli, modello_corrente))
+
+    return risultati
+
+
+def estrai_listino_pdf(path, profilo='generico', processi=None):
+    """
+    Estrae le righe articolo da un listino PDF
+
+    Args:
+        path (str): Percorso del PDF
+        profilo (str | dict): Nome del profilo di layout o profilo completo
+        processi (int): Numero di processi (default: numero di CPU)
+
+    Returns:
+        list: Dizionari con codice, descrizione, prezzo, modello, fornitore e pagina,
+              pronti per importa_catalogo()
+    """
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ValueError("Per estrarre listini PDF è necessario installare pypdf")
+
+    if isinstance(profilo, str):
+        profilo = get_profilo(profilo)
+
+    numero_pagine = len(PdfReader(path).pages)
+    gruppi = [
+        list(range(inizio, min(inizio + PAGINE_PER_TASK, numero_pagine)))
+        for inizio in range(0, numero_pagine, PAGINE_PER_TASK)
+    ]
+
+    if len(gruppi) <= 1:
+        pagine = _estrai_pagine(path, gruppi[0], profilo) if gruppi else []
+    else:
+        processi = processi or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=min(processi, len(gruppi))) as pool:
+            futures = [pool.submit(_estrai_pagine, path, gruppo, profilo) for gruppo in gruppi]
+            pagine = [pagina for future in futures for pagina in future.result()]
+
+    # Unione in ordine di pagina: le sezioni continuano da una pagina alla successiva
+    righe = []
+    modello_precedente = None
+    for _, articoli, ultimo_modello in sorted(pagine, key=lambda p: p[0]):
+        for articolo in articoli:
+            if articolo['modello'] is None:
+                articolo['modello'] = modello_precedente
+            if profilo.get('fornitore'):
+                articolo.setdefault('fornitore', profilo['fornitore'])
+            righe.append(articolo)
+        if ultimo_modello:
+            modello_precedente = ultimo_modello
+
+    return righe
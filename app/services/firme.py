@@ -0,0 +1,182 @@
+"""
+Servizio per le firme dei fogli tecnici
+Le firme arrivano dal canvas come PNG a tela intera, quasi tutti pixel trasparenti:
+vengono ritagliate sul tratto, ridotte a PNG a palette e salvate con il nome dato
+dall'hash del contenuto (firme identiche condividono lo stesso file, che non cambia mai).
+"""
+
+from flask import current_app
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import base64
+import hashlib
+import io
+import os
+import re
+from sqlalchemy import or_, update
+from app import db
+from app.models.foglio_tecnico import FoglioTecnico
+
+# Margine (px) lasciato attorno al tratto dopo il ritaglio
+MARGINE_RITAGLIO = 4
+
+# Colori della palette: il tratto è monocromatico, bastano per l'antialiasing
+COLORI_PALETTE = 16
+
+_NOME_INDIRIZZATO = re.compile(r'^[0-9a-f]{64}\.png$')
+
+
+def cartella_firme():
+    """Cartella delle firme (creata se manca)"""
+    cartella = os.path.join(current_app.config['UPLOAD_FOLDER'], 'signatures')
+    os.makedirs(cartella, exist_ok=True)
+    return cartella
+
+
+def is_indirizzata(path):
+    """True se il file è già salvato per contenuto (nome = hash SHA-256)"""
+    return bool(path) and bool(_NOME_INDIRIZZATO.match(os.path.basename(path)))
+
+
+def ottimizza_firma(dati_png):
+    """
+    Ritaglia la firma sul riquadro del tratto e la converte in PNG a palette con trasparenza
+
+    Args:
+        dati_png (bytes): Immagine originale
+
+    Returns:
+        bytes: PNG ottimizzato
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(dati_png)) as img:
+        img = img.convert('RGBA')
+
+    # Riquadro dei pixel non trasparenti (firma vuota: resta un pixel trasparente)
+    riquadro = img.getchannel('A').getbbox()
+    if riquadro:
+        sinistra, alto, destra, basso = riquadro
+        img = img.crop((
+            max(sinistra - MARGINE_RITAGLIO, 0),
+            max(alto - MARGINE_RITAGLIO, 0),
+            min(destra + MARGINE_RITAGLIO, img.width),
+            min(basso + MARGINE_RITAGLIO, img.height)
+        ))
+    else:
+        img = img.crop((0, 0, 1, 1))
+
+    palette = img.quantize(colors=COLORI_PALETTE, method=Image.Quantize.FASTOCTREE)
+    output = io.BytesIO()
+    palette.save(output, format='PNG', optimize=True)
+    return output.getvalue()
+
+
+def archivia_firma(dati_png, cartella):
+    """
+    Salva un PNG già ottimizzato con nome dato dall'hash del contenuto.
+    Non usa l'app context, così può girare nei processi del pool.
+
+    Returns:
+        str: Path del file (già esistente se la stessa firma era stata salvata)
+    """
+    path = os.path.join(cartella, f"{hashlib.sha256(dati_png).hexdigest()}.png")
+    if not os.path.exists(path):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(dati_png)
+        os.replace(tmp, path)
+    return path
+
+
+def salva_firma(signature_data):
+    """
+    Decodifica una firma inviata dal canvas (data URL o base64) e la salva ottimizzata
+
+    Args:
+        signature_data (str): PNG in base64, con o senza prefisso data:image/png;base64,
+
+    Returns:
+        str: Path del file firma
+    """
+    if signature_data.startswith('data:image/png;base64,'):
+        signature_data = signature_data[len('data:image/png;base64,'):]
+    return archivia_firma(ottimizza_firma(base64.b64decode(signature_data)), cartella_firme())
+
+
+def elimina_firma_se_inutilizzata(path, escludi_foglio_id=None):
+    """
+    Elimina il file di una firma se nessun altro foglio lo usa (i file sono condivisi
+    tra firme identiche)
+
+    Returns:
+        bool: True se il file è stato eliminato
+    """
+    if not path or not os.path.exists(path):
+        return False
+    query = FoglioTecnico.query.filter(or_(
+        FoglioTecnico.firma_tecnico_path == path,
+        FoglioTecnico.firma_cliente_path == path
+    ))
+    if escludi_foglio_id:
+        query = query.filter(FoglioTecnico.id != escludi_foglio_id)
+    if query.first():
+        return False
+    os.remove(path)
+    return True
+
+
+def _ottimizza_file(path, cartella):
+    """Task del pool per il backfill: restituisce (path, nuovo path, byte prima, byte dopo, errore)"""
+    try:
+        with open(path, 'rb') as f:
+            originale = f.read()
+        ottimizzato = ottimizza_firma(originale)
+        return path, archivia_firma(ottimizzato, cartella), len(originale), len(ottimizzato), None
+    except Exception as e:
+        return path, None, 0, 0, str(e)
+
+
+def backfill_firme(processi=None, progress=None):
+    """
+    Ottimizza le firme salvate prima dell'archiviazione per contenuto: ogni file viene
+    ritagliato e convertito, i fogli puntano al nuovo file e l'originale viene eliminato
+
+    Args:
+        processi (int): Numero di processi (default: numero di CPU)
+        progress (callable): Chiamata con (path, byte prima, byte dopo, errore) per ogni file
+
+    Returns:
+        dict: Conteggi di file elaborati, errori e byte prima/dopo
+    """
+    righe = db.session.query(FoglioTecnico.firma_tecnico_path, FoglioTecnico.firma_cliente_path).filter(or_(
+        FoglioTecnico.firma_tecnico_path.isnot(None),
+        FoglioTecnico.firma_cliente_path.isnot(None)
+    )).all()
+    paths = sorted({
+        path for riga in righe for path in riga
+        if path and not is_indirizzata(path) and os.path.exists(path)
+    })
+
+    totali = {'file': len(paths), 'errori': 0, 'byte_prima': 0, 'byte_dopo': 0}
+    if not paths:
+        return totali
+
+    task = partial(_ottimizza_file, cartella=cartella_firme())
+    with ProcessPoolExecutor(max_workers=processi or os.cpu_count() or 1) as pool:
+        for path, nuovo_path, prima, dopo, errore in pool.map(task, paths, chunksize=16):
+            if errore:
+                totali['errori'] += 1
+            else:
+                for colonna in (FoglioTecnico.firma_tecnico_path, FoglioTecnico.firma_cliente_path):
+                    db.session.execute(
+                        update(FoglioTecnico).where(colonna == path).values({colonna: nuovo_path})
+                    )
+                db.session.commit()
+                os.remove(path)
+                totali['byte_prima'] += prima
+                totali['byte_dopo'] += dopo
+            if progress:
+                progress(path, prima, dopo, errore)
+
+    return totali
@@ -0,0 +1,182 @@
+"""
+Servizio per le varianti ridimensionate delle foto (ricambi e macchine)
+Le varianti thumb/medium/full sono salvate accanto all'originale, generate al
+caricamento o alla prima richiesta, e servite con ETag e cache a lunga scadenza
+"""
+
+from flask import current_app, send_file, abort
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import os
+import uuid
+
+# Lato massimo (px) di ogni variante
+VARIANTI = {
+    'thumb': 160,
+    'medium': 640,
+    'full': 1600,
+}
+
+QUALITA_JPEG = 82
+
+# I nomi dei file caricati sono univoci (uuid): il contenuto di un URL non cambia mai
+CACHE_MAX_AGE = 365 * 24 * 3600
+
+ESTENSIONI_IMMAGINE = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')
+
+
+def cartella_foto(categoria):
+    """Cartella delle foto per categoria ('ricambi' o 'macchine')"""
+    if categoria == 'ricambi':
+        return os.path.join(current_app.config['UPLOAD_FOLDER'], 'ricambi')
+    if categoria == 'macchine':
+        return os.path.join(current_app.root_path, 'static', 'uploads', 'macchine')
+    raise ValueError(f"Categoria foto sconosciuta: {categoria}")
+
+
+def _is_variante(filename):
+    """True se il file è una variante generata (es. foto.thumb.jpg)"""
+    stem = os.path.splitext(filename)[0]
+    return os.path.splitext(stem)[1].lstrip('.') in VARIANTI
+
+
+def percorso_variante(path_originale, variante):
+    """Percorso della variante: stesso nome dell'originale con suffisso (foto.jpg -> foto.thumb.jpg)"""
+    stem, ext = os.path.splitext(path_originale)
+    # Le varianti sono JPEG, tranne per le immagini con trasparenza (PNG)
+    ext_variante = '.png' if ext.lower() in ('.png', '.gif') else '.jpg'
+    return f"{stem}.{variante}{ext_variante}"
+
+
+def genera_varianti(path_originale, forza=False):
+    """
+    Genera le varianti mancanti o più vecchie dell'originale.
+    Non usa l'app context, così può girare nei processi del pool.
+
+    Returns:
+        int: Numero di varianti scritte
+    """
+    from PIL import Image, ImageOps
+
+    mtime_originale = os.path.getmtime(path_originale)
+    da_generare = [
+        v for v in VARIANTI
+        if forza
+        or not os.path.exists(percorso_variante(path_originale, v))
+        or os.path.getmtime(percorso_variante(path_originale, v)) < mtime_originale
+    ]
+    if not da_generare:
+        return 0
+
+    with Image.open(path_originale) as img:
+        # Applica la rotazione EXIF delle foto da smartphone prima di ridimensionare
+        img = ImageOps.exif_transpose(img)
+        for variante in sorted(da_generare, key=lambda v: -VARIANTI[v]):
+            lato = VARIANTI[variante]
+            destinazione = percorso_variante(path_originale, variante)
+            copia = img.copy()
+            copia.thumbnail((lato, lato), Image.LANCZOS)
+
+            # File temporaneo proprio di questa scrittura: richieste concorrenti per la stessa
+            # variante non scrivono mai sullo stesso file, e nessuna vede un file parziale
+            tmp = f'{destinazione}.{os.getpid()}.{uuid.uuid4().hex}.tmp'
+            try:
+                if destinazione.endswith('.png'):
+                    copia.save(tmp, format='PNG', optimize=True)
+                else:
+                    if copia.mode not in ('RGB', 'L'):
+                        copia = copia.convert('RGB')
+                    copia.save(tmp, format='JPEG', quality=QUALITA_JPEG, optimize=True, progressive=True)
+                os.replace(tmp, destinazione)
+            except Exception:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+
+    return len(da_generare)
+
+
+def genera_varianti_sicuro(path_originale):
+    """Genera le varianti di un file appena caricato senza interrompere la richiesta in caso di errore"""
+    try:
+        genera_varianti(path_originale)
+    except Exception as e:
+        current_app.logger.warning(f"Impossibile generare le varianti di {path_originale}: {str(e)}")
+
+
+def elimina_foto(categoria, filename):
+    """Elimina la foto originale e tutte le sue varianti"""
+    if not filename:
+        return
+    path = os.path.join(cartella_foto(categoria), filename)
+    for file in [path] + [percorso_variante(path, v) for v in VARIANTI]:
+        if os.path.exists(file):
+            os.remove(file)
+
+
+def invia_foto(categoria, filename, variante=None):
+    """
+    Risposta HTTP con la foto richiesta, nella variante indicata (generata se manca).
+    Senza variante, o se l'originale non è un'immagine elaborabile, invia l'originale.
+    """
+    cartella = cartella_foto(categoria)
+    path = os.path.realpath(os.path.join(cartella, filename))
+    if not path.startswith(os.path.realpath(cartella) + os.sep) or not os.path.isfile(path):
+        abort(404)
+
+    if variante in VARIANTI:
+        try:
+            genera_varianti(path)
+            path = percorso_variante(path, variante)
+        except Exception as e:
+            current_app.logger.warning(f"Variante {variante} non disponibile per {filename}: {str(e)}")
+
+    response = send_file(path, etag=True, conditional=True, max_age=CACHE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def _genera_varianti_file(path, forza=False):
+    """Task del pool per il backfill: restituisce (path, varianti scritte, errore)"""
+    try:
+        return path, genera_varianti(path, forza=forza), None
+    except Exception as e:
+        return path, 0, str(e)
+
+
+def backfill_varianti(cartelle, processi=None, forza=False, progress=None):
+    """
+    Genera le varianti per tutte le foto esistenti usando un pool di processi
+
+    Args:
+        cartelle (list): Cartelle da scandire
+        processi (int): Numero di processi (default: numero di CPU)
+        forza (bool): Rigenera anche le varianti già aggiornate
+        progress (callable): Chiamata con (path, varianti scritte, errore) per ogni file
+
+    Returns:
+        dict: Conteggi di file elaborati, varianti scritte ed errori
+    """
+    originali = [
+        os.path.join(cartella, f)
+        for cartella in cartelle if os.path.isdir(cartella)
+        for f in sorted(os.listdir(cartella))
+        if f.lower().endswith(ESTENSIONI_IMMAGINE) and not _is_variante(f)
+    ]
+
+    totali = {'file': len(originali), 'varianti': 0, 'errori': 0}
+    if not originali:
+        return totali
+
+    task = partial(_genera_varianti_file, forza=forza)
+    with ProcessPoolExecutor(max_workers=processi or os.cpu_count() or 1) as pool:
+        for path, scritte, errore in pool.map(task, originali, chunksize=8):
+            totali['varianti'] += scritte
+            if errore:
+                totali['errori'] += 1
+            if progress:
+                progress(path, scritte, errore)
+
+    return totali
+
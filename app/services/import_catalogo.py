@@ -0,0 +1,428 @@
+"""
+Servizio di importazione listini ricambi dei fornitori (CSV/XLSX)
+Le righe vengono lette in streaming ed elaborate a blocchi: una sola query IN
+per risolvere i codici esistenti e inserimenti/aggiornamenti bulk per blocco
+"""
+
+from flask import current_app
+import csv
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import insert, select, update
+from app import db
+from app.models.ricambio import Ricambio
+from app.services.ricerca_ricambi import indicizza_ricambi
+
+CHUNK_SIZE = 1000
+
+# Stato delle importazioni avviate dall'interfaccia (job_id -> dizionario stato)
+_import_jobs = {}
+_import_lock = threading.Lock()
+
+# Un job concluso resta consultabile per questo tempo, poi viene rimosso
+DURATA_JOB_CONCLUSI = timedelta(hours=1)
+
+# Nomi di colonna riconosciuti nelle intestazioni dei listini (minuscolo)
+ALIAS_COLONNE = {
+    'codice': ('codice', 'cod', 'codice articolo', 'articolo', 'code', 'part number', 'sku'),
+    'descrizione': ('descrizione', 'desc', 'description', 'denominazione'),
+    'prezzo': ('prezzo', 'prezzo unitario', 'prezzo_unitario', 'listino', 'price'),
+    'fornitore': ('fornitore', 'supplier', 'marca'),
+    'modello': ('modello', 'model', 'gruppo'),
+}
+
+# Campi aggiornati sui ricambi già presenti
+CAMPI_AGGIORNABILI = ('descrizione', 'prezzo_unitario', 'fornitore')
+
+
+class RisultatoImport:
+    """Esito di un'importazione: contatori, errori per riga e differenze (dry-run)"""
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.righe_lette = 0
+        self.inseriti = 0
+        self.aggiornati = 0
+        self.invariati = 0
+        self.errori = []  # (numero riga, codice, messaggio)
+        self.differenze = []  # (codice, campo, valore attuale, nuovo valore)
+
+    def aggiungi_errore(self, riga, codice, messaggio):
+        self.errori.append((riga, codice, messaggio))
+
+    def to_dict(self, max_dettagli=500):
+        return {
+            'dry_run': self.dry_run,
+            'righe_lette': self.righe_lette,
+            'inseriti': self.inseriti,
+            'aggiornati': self.aggiornati,
+            'invariati': self.invariati,
+            'numero_errori': len(self.errori),
+            'errori': [
+                {'riga': r, 'codice': c, 'messaggio': m} for r, c, m in self.errori[:max_dettagli]
+            ],
+            'differenze': [
+                {'codice': c, 'campo': f, 'attuale': str(a) if a is not None else None, 'nuovo': str(n) if n is not None else None}
+                for c, f, a, n in self.differenze[:max_dettagli]
+            ]
+        }
+
+
+class _CsvPuntoEVirgola(csv.excel):
+    """Dialetto di default per i CSV esportati da Excel in italiano"""
+    delimiter = ';'
+
+
+def _mappa_intestazioni(intestazioni, alias_colonne=ALIAS_COLONNE, obbligatorie=('codice', 'descrizione')):
+    """Associa le colonne del file ai campi da importare"""
+    mappa = {}
+    normalizzate = [str(h).strip().lower() if h is not None else '' for h in intestazioni]
+    for campo, alias in alias_colonne.items():
+        for indice, nome in enumerate(normalizzate):
+            if nome in alias:
+                mappa[campo] = indice
+                break
+    mancanti = [campo for campo in obbligatorie if campo not in mappa]
+    if mancanti:
+        elenco = [f"'{campo}'" for campo in obbligatorie]
+        testo = ', '.join(elenco[:-1]) + ' e ' + elenco[-1] if len(elenco) > 1 else elenco[0]
+        raise ValueError(f"Il file deve contenere almeno le colonne {testo}")
+    return mappa
+
+
+def _righe_da_tabella(righe, alias_colonne=ALIAS_COLONNE, obbligatorie=('codice', 'descrizione')):
+    """Converte le righe di una tabella (prima riga intestazioni) in dizionari"""
+    righe = iter(righe)
+    mappa = _mappa_intestazioni(next(righe, []), alias_colonne, obbligatorie)
+    for valori in righe:
+        if not valori or all(v is None or str(v).strip() == '' for v in valori):
+            yield None  # Riga vuota: mantiene la numerazione delle righe
+            continue
+        yield {
+            campo: valori[indice] if indice < len(valori) else None
+            for campo, indice in mappa.items()
+        }
+
+
+def leggi_file_tabella(path, alias_colonne=ALIAS_COLONNE, obbligatorie=('codice', 'descrizione')):
+    """
+    Legge un file CSV o XLSX in streaming, con la prima riga di intestazioni
+
+    Args:
+        path (str): Percorso del file
+        alias_colonne (dict): Campo -> nomi di colonna riconosciuti (minuscolo)
+        obbligatorie (tuple): Campi che il file deve contenere
+
+    Yields:
+        dict | None: Campi della riga (None per le righe vuote)
+    """
+    estensione = os.path.splitext(path)[1].lower()
+
+    if estensione in ('.xlsx', '.xlsm'):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ValueError("Per importare file XLSX è necessario installare openpyxl")
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            yield from _righe_da_tabella(workbook.active.iter_rows(values_only=True), alias_colonne, obbligatorie)
+        finally:
+            workbook.close()
+    elif estensione in ('.csv', '.txt'):
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            campione = f.read(4096)
+            f.seek(0)
+            try:
+                dialetto = csv.Sniffer().sniff(campione, delimiters=';,\t')
+            except csv.Error:
+                dialetto = _CsvPuntoEVirgola
+            yield from _righe_da_tabella(csv.reader(f, dialetto), alias_colonne, obbligatorie)
+    else:
+        raise ValueError(f"Formato file non supportato: {estensione}")
+
+
+def leggi_file_listino(path, profilo_pdf='generico'):
+    """
+    Legge un listino CSV o XLSX in streaming, oppure estrae le righe da un listino PDF
+
+    Args:
+        path (str): Percorso del file
+        profilo_pdf (str): Profilo di layout del fornitore, usato solo per i PDF
+
+    Yields:
+        dict | None: Campi della riga (None per le righe vuote)
+    """
+    if os.path.splitext(path)[1].lower() == '.pdf':
+        from app.services.estrazione_listini_pdf import estrai_listino_pdf
+        yield from estrai_listino_pdf(path, profilo_pdf)
+    else:
+        yield from leggi_file_tabella(path)
+
+
+def _testo(valore):
+    return str(valore).strip() if valore is not None else ''
+
+
+def _prezzo(valore):
+    """Interpreta un prezzo in formato italiano o internazionale (es. '1.234,50', '€ 12.5')"""
+    if valore is None or valore == '':
+        return None
+    if isinstance(valore, (int, float, Decimal)):
+        return Decimal(str(valore)).quantize(Decimal('0.01'))
+
+    testo = str(valore).replace('€', '').replace(' ', '').strip()
+    if not testo:
+        return None
+    if ',' in testo:
+        testo = testo.replace('.', '').replace(',', '.')
+    try:
+        prezzo = Decimal(testo).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f"Prezzo non valido: {valore}")
+    if prezzo < 0:
+        raise ValueError(f"Prezzo negativo: {valore}")
+    return prezzo
+
+
+def _valida_riga(dati, fornitore_default):
+    """Normalizza una riga del listino nei campi del ricambio, sollevando ValueError se non valida"""
+    codice = _testo(dati.get('codice'))
+    if not codice:
+        raise ValueError("Codice mancante")
+    if len(codice) > 50:
+        raise ValueError("Codice più lungo di 50 caratteri")
+
+    descrizione = _testo(dati.get('descrizione'))
+    if not descrizione:
+        raise ValueError("Descrizione mancante")
+    modello = _testo(dati.get('modello'))
+    if modello:
+        descrizione = f"{descrizione} - {modello}"
+    if len(descrizione) > 200:
+        descrizione = descrizione[:200]
+
+    fornitore = _testo(dati.get('fornitore')) or fornitore_default or None
+    if fornitore and len(fornitore) > 100:
+        raise ValueError("Fornitore più lungo di 100 caratteri")
+
+    return {
+        'codice': codice,
+        'descrizione': descrizione,
+        'prezzo_unitario': _prezzo(dati.get('prezzo')),
+        'fornitore': fornitore
+    }
+
+
+def _scrivi_blocco(nuovi, modifiche, department_id):
+    """Scrive un blocco con un insert e un update bulk, poi aggiorna l'indice di ricerca"""
+    adesso = datetime.utcnow()
+    if nuovi:
+        db.session.execute(insert(Ricambio), [
+            dict(r, department_id=department_id, quantita_disponibile=0, quantita_prenotata=0,
+                 quantita_minima=0, created_at=adesso, updated_at=adesso)
+            for r in nuovi
+        ])
+    if modifiche:
+        db.session.execute(update(Ricambio), [dict(m, updated_at=adesso) for m in modifiche])
+
+    # Indice di ricerca: nuovi ricambi e quelli con descrizione cambiata
+    codici_indicizzare = [r['codice'] for r in nuovi] + [m['codice'] for m in modifiche if 'descrizione' in m]
+    if codici_indicizzare:
+        righe = db.session.execute(
+            select(Ricambio.id, Ricambio.codice, Ricambio.descrizione).where(Ricambio.codice.in_(codici_indicizzare))
+        ).all()
+        indicizza_ricambi(righe)
+
+
+def _elabora_blocco(blocco, department_id, aggiorna_esistenti, risultato):
+    """Risolve i codici esistenti con una query IN e scrive inserimenti/aggiornamenti del blocco"""
+    codici = [r['codice'] for _, r in blocco]
+    esistenti = {
+        row.codice: row for row in db.session.execute(
+            select(Ricambio.id, Ricambio.codice, Ricambio.descrizione, Ricambio.prezzo_unitario, Ricambio.fornitore)
+            .where(Ricambio.codice.in_(codici))
+        )
+    }
+
+    nuovi = []
+    modifiche = []
+    for numero_riga, riga in blocco:
+        attuale = esistenti.get(riga['codice'])
+        if attuale is None:
+            nuovi.append((numero_riga, riga))
+            if risultato.dry_run:
+                risultato.differenze.append((riga['codice'], 'nuovo', None, riga['descrizione']))
+            continue
+
+        if not aggiorna_esistenti:
+            risultato.invariati += 1
+            continue
+
+        cambiati = {
+            campo: riga[campo] for campo in CAMPI_AGGIORNABILI
+            if riga[campo] is not None and riga[campo] != getattr(attuale, campo)
+        }
+        if not cambiati:
+            risultato.invariati += 1
+            continue
+
+        modifiche.append((numero_riga, dict(cambiati, id=attuale.id, codice=riga['codice'])))
+        if risultato.dry_run:
+            for campo, valore in cambiati.items():
+                risultato.differenze.append((riga['codice'], campo, getattr(attuale, campo), valore))
+
+    if risultato.dry_run:
+        risultato.inseriti += len(nuovi)
+        risultato.aggiornati += len(modifiche)
+        return
+
+    try:
+        _scrivi_blocco([r for _, r in nuovi], [m for _, m in modifiche], department_id)
+        db.session.commit()
+        risultato.inseriti += len(nuovi)
+        risultato.aggiornati += len(modifiche)
+    except Exception:
+        db.session.rollback()
+        # Il blocco contiene almeno una riga non valida per il database:
+        # riprova riga per riga per isolarla senza interrompere l'import
+        for numero_riga, riga in nuovi:
+            try:
+                _scrivi_blocco([riga], [], department_id)
+                db.session.commit()
+                risultato.inseriti += 1
+            except Exception as e:
+                db.session.rollback()
+                risultato.aggiungi_errore(numero_riga, riga['codice'], str(e.__cause__ or e))
+        for numero_riga, modifica in modifiche:
+            try:
+                _scrivi_blocco([], [modifica], department_id)
+                db.session.commit()
+                risultato.aggiornati += 1
+            except Exception as e:
+                db.session.rollback()
+                risultato.aggiungi_errore(numero_riga, modifica['codice'], str(e.__cause__ or e))
+
+
+def importa_catalogo(righe, department_id, fornitore=None, dry_run=False, aggiorna_esistenti=True,
+                     chunk_size=CHUNK_SIZE, progress=None, riga_iniziale=2):
+    """
+    Importa un listino ricambi
+
+    Args:
+        righe: Iterabile di dizionari (codice, descrizione, prezzo, fornitore, modello),
+               ad esempio leggi_file_listino(path)
+        department_id (int): Reparto assegnato ai nuovi ricambi
+        fornitore (str): Fornitore da usare quando la riga non lo specifica
+        dry_run (bool): Calcola solo le differenze senza scrivere nel database
+        aggiorna_esistenti (bool): Aggiorna descrizione/prezzo/fornitore dei codici già presenti
+        chunk_size (int): Righe per blocco
+        progress (callable): Chiamata con (righe lette, risultato) dopo ogni blocco
+        riga_iniziale (int): Numero della prima riga dati nei messaggi di errore
+                             (2 per i file con intestazione)
+
+    Returns:
+        RisultatoImport: Esito dell'importazione
+    """
+    risultato = RisultatoImport(dry_run=dry_run)
+    codici_visti = set()
+    blocco = []
+
+    def chiudi_blocco():
+        if blocco:
+            _elabora_blocco(blocco, department_id, aggiorna_esistenti, risultato)
+            blocco.clear()
+        if progress:
+            progress(risultato.righe_lette, risultato)
+
+    for numero_riga, dati in enumerate(righe, start=riga_iniziale):
+        if dati is None:
+            continue
+        risultato.righe_lette += 1
+
+        try:
+            riga = _valida_riga(dati, fornitore)
+        except ValueError as e:
+            risultato.aggiungi_errore(numero_riga, _testo(dati.get('codice')), str(e))
+            continue
+
+        if riga['codice'] in codici_visti:
+            risultato.aggiungi_errore(numero_riga, riga['codice'], "Codice duplicato nel listino (mantenuta la prima riga)")
+            continue
+        codici_visti.add(riga['codice'])
+
+        blocco.append((numero_riga, riga))
+        if len(blocco) >= chunk_size:
+            chiudi_blocco()
+
+    chiudi_blocco()
+
+    current_app.logger.info(
+        f"Import listino{' (dry-run)' if dry_run else ''}: {risultato.righe_lette} righe, "
+        f"{risultato.inseriti} nuovi, {risultato.aggiornati} aggiornati, {len(risultato.errori)} errori"
+    )
+    return risultato
+
+
+def _pulisci_job_conclusi():
+    """Rimuove i job conclusi da più di DURATA_JOB_CONCLUSI (da chiamare con _import_lock)"""
+    limite = datetime.utcnow() - DURATA_JOB_CONCLUSI
+    for job_id in [j for j, job in _import_jobs.items() if job['completed_at'] and job['completed_at'] < limite]:
+        del _import_jobs[job_id]
+
+
+def avvia_import_in_background(path, department_id, profilo_pdf='generico', **opzioni):
+    """
+    Avvia l'importazione di un file listino in un thread separato
+
+    Returns:
+        str: ID del job da usare per controllarne avanzamento ed esito
+    """
+    app = current_app._get_current_object()
+    job_id = uuid.uuid4().hex
+
+    with _import_lock:
+        _pulisci_job_conclusi()
+        _import_jobs[job_id] = {
+            'stato': 'In corso',
+            'righe_elaborate': 0,
+            'risultato': None,
+            'errore': None,
+            'created_at': datetime.utcnow(),
+            'completed_at': None
+        }
+
+    def progress(righe, risultato):
+        with _import_lock:
+            _import_jobs[job_id]['righe_elaborate'] = righe
+
+    def target():
+        with app.app_context():
+            try:
+                risultato = importa_catalogo(leggi_file_listino(path, profilo_pdf), department_id, progress=progress, **opzioni)
+                aggiornamento = {'stato': 'Completato', 'risultato': risultato.to_dict()}
+            except Exception as e:
+                app.logger.error(f"Errore import listino {path}: {str(e)}")
+                aggiornamento = {'stato': 'Errore', 'errore': str(e)}
+            finally:
+                db.session.remove()
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            with _import_lock:
+                _import_jobs[job_id].update(aggiornamento, completed_at=datetime.utcnow())
+
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    return job_id
+
+
+def get_import_job(job_id):
+    """Restituisce lo stato di un'importazione, o None se sconosciuta"""
+    with _import_lock:
+        job = _import_jobs.get(job_id)
+        return dict(job) if job else None
@@ -0,0 +1,497 @@
+"""
+Servizio di importazione ed esportazione del parco macchine (CSV/XLSX)
+Tipi, reparti e clienti vengono risolti per nome con lookup in memoria, i duplicati su
+codice/matricola con una sola query IN per blocco e le macchine nuove inserite in bulk
+insieme ai movimenti di creazione. L'export legge le righe a blocchi senza oggetti ORM.
+"""
+
+from flask import current_app
+import csv
+import io
+import os
+import threading
+import uuid
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, or_, select
+from app import db
+from app.models.macchina import Macchina, MovimentoMacchina, TipoMacchina
+from app.models.cliente import Cliente
+from app.models.department import Department
+from app.services.import_catalogo import RisultatoImport, leggi_file_tabella, _testo, _prezzo
+from app.services.ricerca_macchine import indicizza_macchine
+
+CHUNK_SIZE = 500
+
+# Righe lette dal database per ogni blocco durante l'export
+CHUNK_EXPORT = 1000
+
+# Stato delle importazioni avviate dall'interfaccia (job_id -> dizionario stato)
+_import_jobs = {}
+_import_lock = threading.Lock()
+
+# Un job concluso resta consultabile per questo tempo, poi viene rimosso
+DURATA_JOB_CONCLUSI = timedelta(hours=1)
+
+STATI_MACCHINA = ('Disponibile', 'In prestito', 'In riparazione', 'Attiva', 'Dismessa')
+
+# Nomi di colonna riconosciuti nelle intestazioni (minuscolo); le intestazioni
+# dell'export sono comprese, così un file esportato può essere reimportato
+ALIAS_COLONNE = {
+    'codice': ('codice', 'cod', 'code', 'codice macchina'),
+    'numero_serie': ('numero serie', 'numero_serie', 'matricola', 'serial', 'serial number', 's/n'),
+    'marca': ('marca', 'brand', 'produttore'),
+    'modello': ('modello', 'model'),
+    'tipo': ('tipo', 'tipo macchina', 'tipo_macchina'),
+    'reparto': ('reparto', 'department'),
+    'cliente': ('cliente', 'ragione sociale'),
+    'stato': ('stato',),
+    'ubicazione': ('ubicazione',),
+    'anno_produzione': ('anno produzione', 'anno_produzione', 'anno'),
+    'alimentazione': ('alimentazione',),
+    'fornitore': ('fornitore', 'supplier'),
+    'data_acquisto': ('data acquisto', 'data_acquisto'),
+    'data_scadenza_garanzia': ('scadenza garanzia', 'data scadenza garanzia', 'data_scadenza_garanzia', 'garanzia'),
+    'prossima_manutenzione': ('prossima manutenzione', 'prossima_manutenzione'),
+    'intervallo_manutenzione_giorni': ('intervallo manutenzione', 'intervallo manutenzione giorni',
+                                       'intervallo_manutenzione_giorni'),
+    'prezzo_acquisto': ('prezzo acquisto', 'prezzo_acquisto'),
+    'prezzo_vendita': ('prezzo vendita', 'prezzo_vendita'),
+    'note': ('note',),
+}
+
+COLONNE_OBBLIGATORIE = ('codice', 'marca', 'modello')
+
+FORMATI_DATA = ('%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%d.%m.%Y', '%d/%m/%y')
+
+INTESTAZIONI_EXPORT = [
+    'Codice', 'Numero serie', 'Marca', 'Modello', 'Tipo', 'Reparto', 'Stato', 'Ubicazione',
+    'Cliente', 'Data assegnazione', 'Anno produzione', 'Alimentazione', 'Fornitore', 'Data acquisto',
+    'Scadenza garanzia', 'Prossima manutenzione', 'Intervallo manutenzione', 'Prezzo acquisto',
+    'Prezzo vendita', 'Note'
+]
+
+
+def leggi_file_macchine(path):
+    """Legge un file CSV o XLSX del parco macchine in streaming (vedi leggi_file_tabella)"""
+    return leggi_file_tabella(path, ALIAS_COLONNE, COLONNE_OBBLIGATORIE)
+
+
+class _Anagrafiche:
+    """
+    Lookup per nome di tipi, reparti e clienti, valide per tutta l'importazione.
+    Tipi e reparti sono pochi e vengono letti una volta sola; i clienti sono risolti
+    a blocchi con una query IN e memorizzati, compresi i nomi non trovati.
+    """
+
+    def __init__(self):
+        self.tipi = {
+            nome.casefold(): id_ for id_, nome in db.session.execute(select(TipoMacchina.id, TipoMacchina.nome))
+        }
+        self.reparti = {}
+        for id_, name, display_name in db.session.execute(
+                select(Department.id, Department.name, Department.display_name)):
+            self.reparti.setdefault(name.casefold(), id_)
+            self.reparti.setdefault(display_name.casefold(), id_)
+        self.clienti = {}
+
+    def carica_clienti(self, nomi):
+        """Risolve con una sola query i nomi cliente non ancora in cache"""
+        mancanti = {n.lower() for n in nomi if n} - self.clienti.keys()
+        if not mancanti:
+            return
+        for id_, nome in db.session.execute(
+                select(Cliente.id, func.lower(Cliente.ragione_sociale))
+                .where(func.lower(Cliente.ragione_sociale).in_(mancanti))
+                .order_by(Cliente.id)):
+            # Ragioni sociali omonime: vale il cliente creato per primo
+            self.clienti.setdefault(nome, id_)
+        for nome in mancanti:
+            self.clienti.setdefault(nome, None)
+
+    def cliente(self, nome):
+        return self.clienti.get(nome.lower())
+
+
+def _data(valore, campo):
+    """Interpreta una data (celle XLSX già convertite, oppure testo in formato italiano o ISO)"""
+    if valore is None or valore == '':
+        return None
+    if isinstance(valore, datetime):
+        return valore.date()
+    if isinstance(valore, date):
+        return valore
+
+    testo = str(valore).strip()
+    if not testo:
+        return None
+    for formato in FORMATI_DATA:
+        try:
+            return datetime.strptime(testo, formato).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Data non valida in '{campo}': {valore}")
+
+
+def _intero(valore, campo):
+    if valore is None or valore == '':
+        return None
+    try:
+        numero = int(float(str(valore).replace(',', '.')))
+    except ValueError:
+        raise ValueError(f"Valore non numerico in '{campo}': {valore}")
+    if numero < 0:
+        raise ValueError(f"Valore negativo in '{campo}': {valore}")
+    return numero
+
+
+def _lunghezza(valore, massimo, campo):
+    if valore and len(valore) > massimo:
+        raise ValueError(f"{campo} più lungo di {massimo} caratteri")
+    return valore or None
+
+
+def _valida_riga(dati, anagrafiche, tipo_default, department_default):
+    """Normalizza una riga nei campi della macchina, sollevando ValueError se non valida"""
+    codice = _lunghezza(_testo(dati.get('codice')).upper(), 50, 'Codice')
+    if not codice:
+        raise ValueError("Codice mancante")
+    marca = _lunghezza(_testo(dati.get('marca')), 100, 'Marca')
+    if not marca:
+        raise ValueError("Marca mancante")
+    modello = _lunghezza(_testo(dati.get('modello')), 200, 'Modello')
+    if not modello:
+        raise ValueError("Modello mancante")
+
+    nome_tipo = _testo(dati.get('tipo'))
+    tipo_id = anagrafiche.tipi.get(nome_tipo.casefold()) if nome_tipo else tipo_default
+    if not tipo_id:
+        raise ValueError(f"Tipo macchina non trovato: {nome_tipo}" if nome_tipo else "Tipo macchina mancante")
+
+    nome_reparto = _testo(dati.get('reparto'))
+    department_id = anagrafiche.reparti.get(nome_reparto.casefold()) if nome_reparto else department_default
+    if not department_id:
+        raise ValueError(f"Reparto non trovato: {nome_reparto}" if nome_reparto else "Reparto mancante")
+
+    nome_cliente = _testo(dati.get('cliente'))
+    cliente_id = None
+    if nome_cliente:
+        cliente_id = anagrafiche.cliente(nome_cliente)
+        if not cliente_id:
+            raise ValueError(f"Cliente non trovato: {nome_cliente}")
+
+    stato = _testo(dati.get('stato'))
+    if stato:
+        stato = next((s for s in STATI_MACCHINA if s.casefold() == stato.casefold()), None)
+        if not stato:
+            raise ValueError(f"Stato non valido: {_testo(dati.get('stato'))}")
+    # Come nella creazione manuale, una macchina disponibile con cliente viene data in prestito
+    if cliente_id and stato in ('', 'Disponibile'):
+        stato = 'In prestito'
+    stato = stato or 'Disponibile'
+
+    riga = {
+        'codice': codice,
+        'numero_serie': _lunghezza(_testo(dati.get('numero_serie')).upper(), 100, 'Numero serie'),
+        'marca': marca,
+        'modello': modello,
+        'tipo_macchina_id': tipo_id,
+        'department_id': department_id,
+        'cliente_id': cliente_id,
+        'stato': stato,
+        'ubicazione': _lunghezza(_testo(dati.get('ubicazione')), 200, 'Ubicazione'),
+        'anno_produzione': _intero(dati.get('anno_produzione'), 'anno produzione'),
+        'alimentazione': _lunghezza(_testo(dati.get('alimentazione')), 50, 'Alimentazione'),
+        'fornitore': _lunghezza(_testo(dati.get('fornitore')), 100, 'Fornitore'),
+        'data_acquisto': _data(dati.get('data_acquisto'), 'data acquisto'),
+        'data_scadenza_garanzia': _data(dati.get('data_scadenza_garanzia'), 'scadenza garanzia'),
+        'prossima_manutenzione': _data(dati.get('prossima_manutenzione'), 'prossima manutenzione'),
+        'intervallo_manutenzione_giorni': _intero(dati.get('intervallo_manutenzione_giorni'),
+                                                  'intervallo manutenzione') or 365,
+        'prezzo_acquisto': _prezzo(dati.get('prezzo_acquisto')),
+        'prezzo_vendita': _prezzo(dati.get('prezzo_vendita')),
+        'note': _testo(dati.get('note')) or None,
+    }
+    if cliente_id and not riga['ubicazione']:
+        riga['ubicazione'] = f"Cliente ID: {cliente_id}"
+    if not riga['prossima_manutenzione'] and riga['data_acquisto']:
+        riga['prossima_manutenzione'] = riga['data_acquisto'] + timedelta(days=riga['intervallo_manutenzione_giorni'])
+    return riga
+
+
+def _scrivi_blocco(nuove, user_id):
+    """Inserisce un blocco di macchine con i movimenti di creazione e aggiorna l'indice di ricerca"""
+    adesso = datetime.utcnow()
+    # Insert Core: l'insert ORM spezzerebbe l'executemany a ogni alternanza di valori NULL
+    db.session.execute(Macchina.__table__.insert(), [
+        dict(r, data_assegnazione=adesso if r['cliente_id'] else None, created_at=adesso, updated_at=adesso)
+        for r in nuove
+    ])
+
+    # Id generati: una query sui codici appena inseriti
+    righe = db.session.execute(
+        select(Macchina.id, Macchina.codice, Macchina.numero_serie, Macchina.marca, Macchina.modello,
+               Macchina.stato, Macchina.cliente_id)
+        .where(Macchina.codice.in_([r['codice'] for r in nuove]))
+    ).all()
+
+    db.session.execute(MovimentoMacchina.__table__.insert(), [
+        {
+            'macchina_id': r.id,
+            'tipo_movimento': 'Assegnazione' if r.cliente_id else 'Altro',
+            'stato_precedente': None,
+            'stato_nuovo': r.stato,
+            'cliente_id': r.cliente_id,
+            'user_id': user_id,
+            'note': 'Macchina creata da importazione',
+            'created_at': adesso,
+        }
+        for r in righe
+    ])
+    indicizza_macchine(righe, sostituisci=False)
+
+
+def _elabora_blocco(blocco, user_id, risultato):
+    """Scarta con una query IN i codici/matricole già presenti e inserisce il resto del blocco"""
+    codici = [r['codice'] for _, r in blocco]
+    matricole = [r['numero_serie'] for _, r in blocco if r['numero_serie']]
+    condizione = Macchina.codice.in_(codici)
+    if matricole:
+        condizione = or_(condizione, Macchina.numero_serie.in_(matricole))
+
+    codici_esistenti = set()
+    matricole_esistenti = set()
+    for codice, numero_serie in db.session.execute(select(Macchina.codice, Macchina.numero_serie).where(condizione)):
+        codici_esistenti.add(codice.upper())
+        if numero_serie:
+            matricole_esistenti.add(numero_serie.upper())
+
+    nuove = []
+    for numero_riga, riga in blocco:
+        if riga['codice'] in codici_esistenti:
+            risultato.aggiungi_errore(numero_riga, riga['codice'], "Codice già presente (macchina non importata)")
+        elif riga['numero_serie'] and riga['numero_serie'] in matricole_esistenti:
+            risultato.aggiungi_errore(numero_riga, riga['codice'],
+                                      f"Numero di serie {riga['numero_serie']} già presente (macchina non importata)")
+        else:
+            nuove.append((numero_riga, riga))
+            if risultato.dry_run:
+                risultato.differenze.append((riga['codice'], 'nuovo', None, f"{riga['marca']} {riga['modello']}"))
+
+    if risultato.dry_run:
+        risultato.inseriti += len(nuove)
+        return
+    if not nuove:
+        return
+
+    try:
+        _scrivi_blocco([r for _, r in nuove], user_id)
+        db.session.commit()
+        risultato.inseriti += len(nuove)
+    except Exception:
+        db.session.rollback()
+        # Il blocco contiene almeno una riga non valida per il database:
+        # riprova riga per riga per isolarla senza interrompere l'import
+        for numero_riga, riga in nuove:
+            try:
+                _scrivi_blocco([riga], user_id)
+                db.session.commit()
+                risultato.inseriti += 1
+            except Exception as e:
+                db.session.rollback()
+                risultato.aggiungi_errore(numero_riga, riga['codice'], str(e.__cause__ or e))
+
+
+def importa_macchine(righe, tipo_macchina_id=None, department_id=None, user_id=None, dry_run=False,
+                     chunk_size=CHUNK_SIZE, progress=None, riga_iniziale=2):
+    """
+    Importa macchine nuove dal parco di un file (le macchine già presenti non vengono modificate)
+
+    Args:
+        righe: Iterabile di dizionari (codice, numero_serie, marca, modello, tipo, reparto, cliente, ...),
+               ad esempio leggi_file_macchine(path)
+        tipo_macchina_id (int): Tipo da usare quando la riga non lo specifica
+        department_id (int): Reparto da usare quando la riga non lo specifica
+        user_id (int): Utente registrato nei movimenti di creazione
+        dry_run (bool): Valida le righe e mostra le macchine nuove senza scrivere nel database
+        chunk_size (int): Righe per blocco
+        progress (callable): Chiamata con (righe lette, risultato) dopo ogni blocco
+        riga_iniziale (int): Numero della prima riga dati nei messaggi di errore
+
+    Returns:
+        RisultatoImport: Esito dell'importazione (le macchine già presenti sono riportate tra gli errori)
+    """
+    risultato = RisultatoImport(dry_run=dry_run)
+    anagrafiche = _Anagrafiche()
+    codici_visti = set()
+    matricole_viste = set()
+    grezze = []
+
+    def chiudi_blocco():
+        # Clienti del blocco risolti con una sola query prima della validazione
+        anagrafiche.carica_clienti([_testo(dati.get('cliente')) for _, dati in grezze])
+        blocco = []
+        for numero_riga, dati in grezze:
+            try:
+                riga = _valida_riga(dati, anagrafiche, tipo_macchina_id, department_id)
+            except ValueError as e:
+                risultato.aggiungi_errore(numero_riga, _testo(dati.get('codice')), str(e))
+                continue
+
+            if riga['codice'] in codici_visti:
+                risultato.aggiungi_errore(numero_riga, riga['codice'], "Codice duplicato nel file (mantenuta la prima riga)")
+                continue
+            if riga['numero_serie'] and riga['numero_serie'] in matricole_viste:
+                risultato.aggiungi_errore(numero_riga, riga['codice'],
+                                          "Numero di serie duplicato nel file (mantenuta la prima riga)")
+                continue
+            codici_visti.add(riga['codice'])
+            if riga['numero_serie']:
+                matricole_viste.add(riga['numero_serie'])
+            blocco.append((numero_riga, riga))
+
+        grezze.clear()
+        if blocco:
+            _elabora_blocco(blocco, user_id, risultato)
+        if progress:
+            progress(risultato.righe_lette, risultato)
+
+    for numero_riga, dati in enumerate(righe, start=riga_iniziale):
+        if dati is None:
+            continue
+        risultato.righe_lette += 1
+        grezze.append((numero_riga, dati))
+        if len(grezze) >= chunk_size:
+            chiudi_blocco()
+
+    chiudi_blocco()
+
+    current_app.logger.info(
+        f"Import macchine{' (dry-run)' if dry_run else ''}: {risultato.righe_lette} righe, "
+        f"{risultato.inseriti} nuove, {len(risultato.errori)} scartate o con errori"
+    )
+    return risultato
+
+
+def _pulisci_job_conclusi():
+    """Rimuove i job conclusi da più di DURATA_JOB_CONCLUSI (da chiamare con _import_lock)"""
+    limite = datetime.utcnow() - DURATA_JOB_CONCLUSI
+    for job_id in [j for j, job in _import_jobs.items() if job['completed_at'] and job['completed_at'] < limite]:
+        del _import_jobs[job_id]
+
+
+def avvia_import_in_background(path, **opzioni):
+    """
+    Avvia l'importazione di un file macchine in un thread separato
+
+    Returns:
+        str: ID del job da usare per controllarne avanzamento ed esito
+    """
+    app = current_app._get_current_object()
+    job_id = uuid.uuid4().hex
+
+    with _import_lock:
+        _pulisci_job_conclusi()
+        _import_jobs[job_id] = {
+            'stato': 'In corso',
+            'righe_elaborate': 0,
+            'risultato': None,
+            'errore': None,
+            'created_at': datetime.utcnow(),
+            'completed_at': None
+        }
+
+    def progress(righe, risultato):
+        with _import_lock:
+            _import_jobs[job_id]['righe_elaborate'] = righe
+
+    def target():
+        with app.app_context():
+            try:
+                risultato = importa_macchine(leggi_file_macchine(path), progress=progress, **opzioni)
+                aggiornamento = {'stato': 'Completato', 'risultato': risultato.to_dict()}
+            except Exception as e:
+                app.logger.error(f"Errore import macchine {path}: {str(e)}")
+                aggiornamento = {'stato': 'Errore', 'errore': str(e)}
+            finally:
+                db.session.remove()
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            with _import_lock:
+                _import_jobs[job_id].update(aggiornamento, completed_at=datetime.utcnow())
+
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    return job_id
+
+
+def get_import_job(job_id):
+    """Restituisce lo stato di un'importazione, o None se sconosciuta"""
+    with _import_lock:
+        job = _import_jobs.get(job_id)
+        return dict(job) if job else None
+
+
+def _formatta(valore):
+    if valore is None:
+        return ''
+    if isinstance(valore, datetime):
+        return valore.strftime('%d/%m/%Y %H:%M')
+    if isinstance(valore, date):
+        return valore.strftime('%d/%m/%Y')
+    return valore
+
+
+def iter_righe_parco(*filtri):
+    """
+    Righe del parco macchine con stato attuale, tipo, reparto e cliente, lette a blocchi
+    senza istanziare oggetti ORM
+
+    Args:
+        *filtri: Condizioni SQL su Macchina (es. quelle dell'elenco macchine)
+
+    Yields:
+        list: Valori di una riga, nell'ordine di INTESTAZIONI_EXPORT
+    """
+    stmt = select(
+        Macchina.codice, Macchina.numero_serie, Macchina.marca, Macchina.modello,
+        TipoMacchina.nome, Department.display_name, Macchina.stato, Macchina.ubicazione,
+        Cliente.ragione_sociale, Macchina.data_assegnazione, Macchina.anno_produzione,
+        Macchina.alimentazione, Macchina.fornitore, Macchina.data_acquisto,
+        Macchina.data_scadenza_garanzia, Macchina.prossima_manutenzione,
+        Macchina.intervallo_manutenzione_giorni, Macchina.prezzo_acquisto,
+        Macchina.prezzo_vendita, Macchina.note
+    ).join(TipoMacchina, Macchina.tipo_macchina_id == TipoMacchina.id)\
+     .join(Department, Macchina.department_id == Department.id)\
+     .outerjoin(Cliente, Macchina.cliente_id == Cliente.id)\
+     .where(*filtri)\
+     .order_by(Macchina.codice)\
+     .execution_options(yield_per=CHUNK_EXPORT)
+
+    for row in db.session.execute(stmt):
+        yield [_formatta(valore) for valore in row]
+
+
+def genera_csv_parco(*filtri):
+    """
+    Generatore del CSV del parco macchine (separatore ';' per Excel italiano), da inviare
+    in streaming: ogni blocco di righe viene scritto e restituito appena letto
+
+    Yields:
+        str: Porzioni del file CSV
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    buffer.write('\ufeff')  # BOM: Excel riconosce l'UTF-8
+    writer.writerow(INTESTAZIONI_EXPORT)
+
+    for numero, riga in enumerate(iter_righe_parco(*filtri), start=1):
+        writer.writerow(riga)
+        if numero % CHUNK_EXPORT == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
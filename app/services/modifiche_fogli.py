@@ -0,0 +1,227 @@
+"""
+Modifiche parziali dei fogli tecnici (salvataggio automatico del wizard)
+Il client invia solo i campi cambiati: ogni campo è validato con il campo del form
+dello step a cui appartiene, vengono scritte solo le colonne con un valore diverso
+e le macchine/ricambi collegati sono aggiornati inserendo ed eliminando solo la differenza.
+"""
+
+from datetime import datetime
+from sqlalchemy import bindparam, select
+from werkzeug.datastructures import MultiDict
+from app import db
+from app.models.foglio_tecnico import foglio_macchine, foglio_ricambi
+from app.models.macchina import Macchina
+from app.models.ricambio import Ricambio
+from app.forms.foglio_tecnico import (
+    FoglioTecnicoStep1Form, FoglioTecnicoStep2Form, FoglioTecnicoStep3Form,
+    FoglioTecnicoStep4Form, FoglioTecnicoStep5Form
+)
+from app.utils.permissions import PermissionManager
+
+# Colonne modificabili e form dello step che le valida
+CAMPI_MODIFICABILI = {
+    'titolo': FoglioTecnicoStep1Form,
+    'categoria': FoglioTecnicoStep1Form,
+    'data_intervento': FoglioTecnicoStep1Form,
+    'indirizzo_intervento': FoglioTecnicoStep1Form,
+    'tipo_operazione_macchine': FoglioTecnicoStep2Form,
+    'macchina_manuale': FoglioTecnicoStep2Form,
+    'ricambio_manuale': FoglioTecnicoStep3Form,
+    'note_aggiuntive': FoglioTecnicoStep3Form,
+    'modalita_pagamento': FoglioTecnicoStep4Form,
+    'importo_intervento': FoglioTecnicoStep4Form,
+    'pagamento_immediato': FoglioTecnicoStep4Form,
+    'intervento_in_garanzia': FoglioTecnicoStep4Form,
+    'durata_intervento': FoglioTecnicoStep4Form,
+    'km_percorsi': FoglioTecnicoStep4Form,
+    'nome_firmatario_cliente': FoglioTecnicoStep5Form,
+}
+
+# Collegamenti modificabili (liste di ID, o stringa separata da virgole come nei campi nascosti)
+COLLEGAMENTI_MODIFICABILI = ('macchine', 'ricambi_utilizzati')
+
+
+def _ids(valore):
+    """ID interi da una lista o da una stringa separata da virgole, scartando i valori non numerici"""
+    if isinstance(valore, str):
+        valore = valore.split(',')
+    risultato = []
+    for elemento in valore or []:
+        if isinstance(elemento, dict):
+            elemento = elemento.get('id')
+        try:
+            risultato.append(int(elemento))
+        except (TypeError, ValueError):
+            continue
+    return risultato
+
+
+def _ricambi_richiesti(valore):
+    """Ricambi come {id: quantità}; quantità None se non indicata (resta quella registrata)"""
+    if isinstance(valore, str):
+        return dict.fromkeys(_ids(valore))
+    ricambi = {}
+    for elemento in valore or []:
+        quantita = None
+        if isinstance(elemento, dict):
+            quantita = elemento.get('quantita')
+            elemento = elemento.get('id')
+        try:
+            ricambi[int(elemento)] = max(int(quantita), 1) if quantita is not None else None
+        except (TypeError, ValueError):
+            continue
+    return ricambi
+
+
+def _uguali(attuale, nuovo):
+    """Confronto di colonna: None e stringa vuota sono lo stesso valore"""
+    if attuale in (None, '') and nuovo in (None, ''):
+        return True
+    return attuale == nuovo
+
+
+def _valida_campi(valori):
+    """
+    Valida i campi ricevuti con i campi dei form degli step (un form per step, solo i campi inviati)
+
+    Returns:
+        tuple: (valori convertiti per colonna, errori per campo)
+    """
+    per_form = {}
+    for nome, valore in valori.items():
+        if valore is None:
+            valore = ''
+        elif isinstance(valore, bool):
+            valore = 'y' if valore else 'false'
+        per_form.setdefault(CAMPI_MODIFICABILI[nome], MultiDict()).add(nome, str(valore))
+
+    convertiti, errori = {}, {}
+    for classe, formdata in per_form.items():
+        form = classe(formdata=formdata, meta={'csrf': False})
+        for nome in formdata:
+            campo = form[nome]
+            inline = getattr(classe, f'validate_{nome}', None)
+            if campo.validate(form, [inline] if inline else []):
+                convertiti[nome] = campo.data
+            else:
+                errori[nome] = campo.errors[0]
+    return convertiti, errori
+
+
+def aggiorna_macchine_collegate(foglio, macchina_ids, user):
+    """
+    Porta le macchine collegate al foglio all'insieme indicato, inserendo ed eliminando
+    solo le associazioni cambiate. Le macchine non visibili all'utente sono ignorate.
+
+    Returns:
+        tuple: (macchine selezionate e visibili, True se le associazioni sono cambiate)
+    """
+    macchine = [
+        macchina for macchina in Macchina.query.filter(Macchina.id.in_(macchina_ids)).all()
+        if PermissionManager.can_view_machine(user, macchina)
+    ] if macchina_ids else []
+    nuove = {macchina.id for macchina in macchine}
+    attuali = set(db.session.scalars(
+        select(foglio_macchine.c.macchina_id).where(foglio_macchine.c.foglio_id == foglio.id)
+    ))
+
+    da_rimuovere = attuali - nuove
+    if da_rimuovere:
+        db.session.execute(foglio_macchine.delete().where(
+            foglio_macchine.c.foglio_id == foglio.id,
+            foglio_macchine.c.macchina_id.in_(list(da_rimuovere))
+        ))
+    da_aggiungere = nuove - attuali
+    if da_aggiungere:
+        db.session.execute(foglio_macchine.insert(), [
+            {'foglio_id': foglio.id, 'macchina_id': macchina_id} for macchina_id in da_aggiungere
+        ])
+    return macchine, bool(da_rimuovere or da_aggiungere)
+
+
+def aggiorna_ricambi_utilizzati(foglio, ricambi):
+    """
+    Porta i ricambi del foglio all'insieme indicato, inserendo, eliminando o aggiornando
+    la quantità solo delle righe cambiate. I ricambi inesistenti sono ignorati.
+
+    Args:
+        ricambi (dict): {ricambio_id: quantità}; quantità None = invariata (1 per i nuovi)
+
+    Returns:
+        bool: True se i ricambi collegati sono cambiati
+    """
+    esistenti = set(db.session.scalars(
+        select(Ricambio.id).where(Ricambio.id.in_(list(ricambi)))
+    )) if ricambi else set()
+    attuali = dict(db.session.execute(
+        select(foglio_ricambi.c.ricambio_id, foglio_ricambi.c.quantita_utilizzata)
+        .where(foglio_ricambi.c.foglio_id == foglio.id)
+    ).all())
+
+    da_rimuovere = set(attuali) - esistenti
+    if da_rimuovere:
+        db.session.execute(foglio_ricambi.delete().where(
+            foglio_ricambi.c.foglio_id == foglio.id,
+            foglio_ricambi.c.ricambio_id.in_(list(da_rimuovere))
+        ))
+    da_aggiungere = esistenti - set(attuali)
+    if da_aggiungere:
+        db.session.execute(foglio_ricambi.insert(), [
+            {'foglio_id': foglio.id, 'ricambio_id': ricambio_id, 'quantita_utilizzata': ricambi[ricambio_id] or 1}
+            for ricambio_id in da_aggiungere
+        ])
+    da_aggiornare = [
+        {'f_id': foglio.id, 'r_id': ricambio_id, 'quantita': ricambi[ricambio_id]}
+        for ricambio_id in esistenti & set(attuali)
+        if ricambi[ricambio_id] is not None and ricambi[ricambio_id] != attuali[ricambio_id]
+    ]
+    if da_aggiornare:
+        db.session.execute(
+            foglio_ricambi.update()
+            .where(foglio_ricambi.c.foglio_id == bindparam('f_id'), foglio_ricambi.c.ricambio_id == bindparam('r_id'))
+            .values(quantita_utilizzata=bindparam('quantita')),
+            da_aggiornare
+        )
+    return bool(da_rimuovere or da_aggiungere or da_aggiornare)
+
+
+def applica_modifiche(foglio, modifiche, user):
+    """
+    Applica una modifica parziale al foglio senza salvare (il commit resta al chiamante).
+    I campi validi vengono applicati anche se altri campi della stessa richiesta sono errati.
+
+    Args:
+        foglio (FoglioTecnico): Foglio da modificare
+        modifiche (dict): Campi da modificare (CAMPI_MODIFICABILI o COLLEGAMENTI_MODIFICABILI)
+        user (User): Utente che modifica (visibilità delle macchine)
+
+    Returns:
+        tuple: (campi effettivamente cambiati, errori per campo)
+    """
+    errori = {
+        nome: 'Campo non modificabile'
+        for nome in modifiche
+        if nome not in CAMPI_MODIFICABILI and nome not in COLLEGAMENTI_MODIFICABILI
+    }
+    valori, errori_campi = _valida_campi({
+        nome: valore for nome, valore in modifiche.items() if nome in CAMPI_MODIFICABILI
+    })
+    errori.update(errori_campi)
+
+    modificati = []
+    for nome, valore in valori.items():
+        if not _uguali(getattr(foglio, nome), valore):
+            setattr(foglio, nome, valore)
+            modificati.append(nome)
+
+    if 'macchine' in modifiche:
+        _, cambiate = aggiorna_macchine_collegate(foglio, _ids(modifiche['macchine']), user)
+        if cambiate:
+            modificati.append('macchine')
+    if 'ricambi_utilizzati' in modifiche:
+        if aggiorna_ricambi_utilizzati(foglio, _ricambi_richiesti(modifiche['ricambi_utilizzati'])):
+            modificati.append('ricambi_utilizzati')
+
+    if modificati:
+        foglio.updated_at = datetime.utcnow()
+    return modificati, errori
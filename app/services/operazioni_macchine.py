@@ -0,0 +1,144 @@
+"""
+Operazioni sulle macchine collegate a un foglio tecnico (prestiti, riparazioni, rientri)
+Usate dallo step 2 del wizard e dalla sincronizzazione dei fogli compilati offline;
+i controlli di visibilità delle macchine restano a carico del chiamante.
+"""
+
+from flask import current_app
+from app import db
+from app.models.macchina import MovimentoMacchina
+
+TIPI_OPERAZIONE = (
+    'riparazione_cliente', 'prestito_semplice', 'riparazione_sede_con_prestito', 'riparazione_sede',
+    'consegna_riparata', 'ritiro_riparazione', 'rientro_prestito', 'rientro_riparazione', 'altro'
+)
+
+
+def _esegui_operazione(foglio, macchina, tipo_operazione):
+    """Esegue l'operazione su una macchina; restituisce il movimento creato o None se non applicabile"""
+    if tipo_operazione == 'prestito_semplice':
+        # Presta macchina al cliente (anche se attiva presso altro cliente)
+        if macchina.is_disponibile:
+            # Macchina disponibile - usa metodo standard
+            return macchina.assegna_a_cliente(
+                foglio.cliente_id,
+                'In prestito',
+                f'Prestito semplice per foglio tecnico {foglio.numero_foglio}'
+            )
+        if macchina.is_attiva:
+            # Macchina attiva - usa prestito temporaneo
+            return macchina.presta_temporaneamente(
+                foglio.cliente_id,
+                f'Prestito semplice per foglio tecnico {foglio.numero_foglio}'
+            )
+    elif tipo_operazione == 'riparazione_sede':
+        # Porta macchina in sede per riparazione (solo ritiro)
+        if not macchina.is_in_riparazione:
+            return macchina.invia_in_riparazione(
+                f'Riparazione in sede per foglio tecnico {foglio.numero_foglio}'
+            )
+    elif tipo_operazione == 'riparazione_sede_con_prestito':
+        # Porta macchina del cliente in riparazione (solo se non già in riparazione)
+        if not macchina.is_in_riparazione:
+            return macchina.invia_in_riparazione(
+                f'Riparazione in sede con prestito per foglio tecnico {foglio.numero_foglio}'
+            )
+    elif tipo_operazione == 'riparazione_cliente':
+        # Riparazione presso cliente - non cambia stato ma registra movimento
+        movimento = MovimentoMacchina(
+            macchina_id=macchina.id,
+            tipo_movimento='Riparazione presso cliente',
+            stato_precedente=macchina.stato,
+            stato_nuovo=macchina.stato,
+            cliente_id=foglio.cliente_id,
+            note=f'Riparazione presso cliente per foglio tecnico {foglio.numero_foglio}'
+        )
+        db.session.add(movimento)
+        return movimento
+    elif tipo_operazione == 'ritiro_riparazione':
+        # Ritira macchina per riparazione
+        if not macchina.is_in_riparazione:
+            return macchina.invia_in_riparazione(
+                f'Ritiro per riparazione - foglio tecnico {foglio.numero_foglio}'
+            )
+    elif tipo_operazione == 'consegna_riparata':
+        # Consegna macchina riparata
+        if macchina.is_in_riparazione:
+            return macchina.completa_riparazione(
+                f'Consegna macchina riparata - foglio tecnico {foglio.numero_foglio}'
+            )
+    elif tipo_operazione == 'rientro_prestito':
+        # Rientro da prestito - riporta in magazzino
+        if macchina.is_in_prestito:
+            return macchina.riporta_in_magazzino(
+                f'Rientro da prestito - foglio tecnico {foglio.numero_foglio}'
+            )
+    elif tipo_operazione == 'rientro_riparazione':
+        # Rientro da riparazione - macchina riparata torna disponibile
+        if macchina.is_in_riparazione:
+            return macchina.completa_riparazione(
+                f'Rientro da riparazione - foglio tecnico {foglio.numero_foglio}'
+            )
+    elif tipo_operazione == 'altro':
+        # Movimento generico
+        movimento = MovimentoMacchina(
+            macchina_id=macchina.id,
+            tipo_movimento='Altro',
+            stato_precedente=macchina.stato,
+            stato_nuovo=macchina.stato,
+            cliente_id=foglio.cliente_id,
+            note=f'Operazione per foglio tecnico {foglio.numero_foglio}'
+        )
+        db.session.add(movimento)
+        return movimento
+    return None
+
+
+def applica_operazione_macchine(foglio, macchine, tipo_operazione, user_id):
+    """
+    Applica l'operazione del foglio alle macchine collegate, registrando i movimenti
+
+    Args:
+        foglio (FoglioTecnico): Foglio già salvato (serve l'ID)
+        macchine (list): Macchine su cui operare
+        tipo_operazione (str): Uno dei TIPI_OPERAZIONE
+        user_id (int): Utente che esegue l'operazione
+
+    Returns:
+        list: Messaggi di errore delle macchine su cui l'operazione non è riuscita
+    """
+    errori = []
+    for macchina in macchine:
+        try:
+            movimento = _esegui_operazione(foglio, macchina, tipo_operazione)
+            if movimento:
+                movimento.foglio_id = foglio.id
+                movimento.user_id = user_id
+        except Exception as e:
+            errori.append(f'Errore nell\'operazione sulla macchina {macchina.codice}: {str(e)}')
+            current_app.logger.error(f'Errore operazione macchina {macchina.id}: {str(e)}')
+    return errori
+
+
+def presta_macchine_sostitutive(foglio, macchine, user_id):
+    """
+    Presta al cliente le macchine sostitutive disponibili (riparazione in sede con prestito)
+
+    Returns:
+        list: Messaggi di errore delle macchine non assegnate
+    """
+    errori = []
+    for macchina in macchine:
+        if not macchina.is_disponibile:
+            continue
+        try:
+            movimento = macchina.assegna_a_cliente(
+                foglio.cliente_id,
+                'In prestito',
+                f'Prestito sostitutivo durante riparazione per foglio tecnico {foglio.numero_foglio}'
+            )
+            movimento.foglio_id = foglio.id
+            movimento.user_id = user_id
+        except Exception as e:
+            errori.append(f'Errore nell\'assegnazione della macchina sostitutiva {macchina.codice}: {str(e)}')
+    return errori
@@ -0,0 +1,344 @@
+"""
+Outbox delle email
+Le richieste salvano l'email nella tabella email_outbox e rispondono subito; un thread in
+background la spedisce a blocchi, preparando prima i messaggi (PDF compresi) e poi riusando
+una sola connessione SMTP per tutto il blocco, rispettando un limite di invii al minuto. Gli errori vengono ritentati con attesa esponenziale e, per
+le email dei fogli tecnici, lo stato di consegna viene registrato sul foglio.
+Il job periodico dello scheduler riprende i tentativi rimandati e le code rimaste da un riavvio.
+"""
+
+from flask import current_app
+from flask_mail import Mail, Message, BadHeaderError, Connection
+import smtplib
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from app import db
+from app.models.email_outbox import EmailOutbox
+
+# Tipo delle email che consegnano un foglio al cliente (stato di consegna sul foglio)
+TIPO_FOGLIO = 'foglio'
+
+# Attesa massima tra due tentativi
+BACKOFF_MASSIMO = timedelta(hours=1)
+
+# Un'email presa in carico torna disponibile dopo questo tempo (processo terminato durante l'invio)
+DURATA_PRENOTAZIONE = timedelta(minutes=10)
+
+# Email lette dalla coda per ogni blocco (una connessione SMTP per blocco)
+BLOCCO_CODA = 50
+
+# Tempo massimo per preparare i messaggi di un blocco, entro la durata della prenotazione
+TEMPO_PREPARAZIONE = DURATA_PRENOTAZIONE / 2
+
+# Secondi di attesa del PDF del foglio prima di rimandare l'invio
+ATTESA_PDF_SECONDI = 120
+
+# Errori legati al singolo messaggio: la connessione resta utilizzabile per i successivi
+_ERRORI_MESSAGGIO = (
+    smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError, BadHeaderError
+)
+
+_invio_lock = threading.Lock()  # Un solo svuotamento della coda per processo
+_thread = None
+_thread_lock = threading.Lock()
+_richiesto = threading.Event()  # Email accodate mentre il thread stava già inviando
+_ultimo_invio = 0.0  # time.monotonic() dell'ultimo invio, per il limite al minuto
+
+
+def accoda_email(tipo, destinatari, oggetto, corpo_testo, corpo_html=None, foglio=None, allega_pdf=False,
+                 salva=True):
+    """
+    Salva un'email nell'outbox e sveglia l'invio in background
+
+    Args:
+        tipo (str): foglio, notifica, promemoria...
+        destinatari (list): Indirizzi email
+        oggetto (str): Oggetto
+        corpo_testo (str): Corpo in testo semplice
+        corpo_html (str, optional): Corpo HTML
+        foglio (FoglioTecnico, optional): Foglio collegato
+        allega_pdf (bool): Allega il PDF del foglio (generato o aggiornato al momento dell'invio)
+        salva (bool): False per accodare più email nella stessa transazione; commit e
+            avvia_invio() restano al chiamante
+
+    Returns:
+        EmailOutbox: Email accodata
+    """
+    email = EmailOutbox(
+        tipo=tipo,
+        destinatari=', '.join(destinatari),
+        oggetto=oggetto[:255],
+        corpo_testo=corpo_testo,
+        corpo_html=corpo_html,
+        foglio_id=foglio.id if foglio else None,
+        allega_pdf=allega_pdf,
+        stato='In coda',
+        tentativi=0,
+        prossimo_tentativo=datetime.utcnow()
+    )
+    db.session.add(email)
+
+    if foglio and tipo == TIPO_FOGLIO:
+        foglio.stato_invio_email = 'In coda'
+        foglio.errore_invio_email = None
+        foglio.email_invio = email.destinatari
+
+    if salva:
+        db.session.commit()
+        avvia_invio()
+    return email
+
+
+def avvia_invio(app=None):
+    """Sveglia l'invio in background, creando il thread se non è già attivo"""
+    global _thread
+    app = app or current_app._get_current_object()
+    with _thread_lock:
+        _richiesto.set()
+        if _thread is None:
+            _thread = threading.Thread(target=_esegui_invio, args=(app,), daemon=True, name='outbox-email')
+            _thread.start()
+
+
+def _esegui_invio(app):
+    """Thread di invio: svuota la coda finché arrivano nuove email, poi termina"""
+    global _thread
+    with app.app_context():
+        try:
+            while True:
+                with _thread_lock:
+                    if not _richiesto.is_set():
+                        _thread = None
+                        return
+                    _richiesto.clear()
+                try:
+                    svuota_outbox(attendi=True)
+                except Exception as e:
+                    app.logger.error(f"Errore invio outbox email: {str(e)}")
+                finally:
+                    db.session.remove()
+        except BaseException:
+            with _thread_lock:
+                _thread = None
+            raise
+
+
+def svuota_outbox(attendi=False):
+    """
+    Spedisce le email in coda il cui tentativo è scaduto, a blocchi su una connessione SMTP ciascuno
+
+    Args:
+        attendi (bool): Attende la fine di uno svuotamento già in corso invece di saltare
+
+    Returns:
+        int: Numero di email inviate
+    """
+    if not _invio_lock.acquire(blocking=attendi):
+        return 0
+    try:
+        from app.services.email_sender import _is_email_configured
+        if not _is_email_configured():
+            return 0
+
+        return _invia_coda(Mail(current_app))
+    finally:
+        _invio_lock.release()
+
+
+def _email_in_scadenza():
+    """ID del prossimo blocco di email in coda con il tentativo scaduto"""
+    return [email_id for (email_id,) in db.session.query(EmailOutbox.id).filter(
+        EmailOutbox.stato == 'In coda',
+        EmailOutbox.prossimo_tentativo <= datetime.utcnow()
+    ).order_by(EmailOutbox.id).limit(BLOCCO_CODA)]
+
+
+class _ConnessioneSMTP(Connection):
+    """Connessione Flask-Mail con MAIL_TIMEOUT già in apertura (Flask-Mail non passa il timeout a smtplib)"""
+
+    def configure_host(self):
+        timeout = current_app.config.get('MAIL_TIMEOUT') or socket.getdefaulttimeout()
+        if self.mail.use_ssl:
+            host = smtplib.SMTP_SSL(self.mail.server, self.mail.port, timeout=timeout)
+        else:
+            host = smtplib.SMTP(self.mail.server, self.mail.port, timeout=timeout)
+
+        host.set_debuglevel(int(self.mail.debug))
+
+        if self.mail.use_tls:
+            host.starttls()
+
+        if self.mail.username and self.mail.password:
+            host.login(self.mail.username, self.mail.password)
+
+        return host
+
+
+def _invia_coda(mail):
+    """
+    Spedisce la coda a blocchi: i messaggi di un blocco (PDF allegati compresi) vengono preparati
+    prima di aprire la connessione SMTP, che resta aperta solo per gli invii del blocco.
+    Se la connessione cade o non si apre, le email rimaste partono al prossimo giro dello scheduler.
+
+    Returns:
+        int: Numero di email inviate
+    """
+    inviate = 0
+    ids = _email_in_scadenza()
+    while ids:
+        pronti = _prepara_blocco(ids)
+        if not pronti:
+            ids = _email_in_scadenza()
+            continue
+
+        in_invio = None
+        tentate = 0
+        try:
+            with _ConnessioneSMTP(mail) as connessione:
+                for email, messaggio in pronti:
+                    _rispetta_limite()
+                    in_invio = email
+                    tentate += 1
+                    try:
+                        connessione.send(messaggio)
+                    except _ERRORI_MESSAGGIO as e:
+                        in_invio = None
+                        _registra_errore(email, e)
+                        continue
+                    in_invio = None
+                    _registra_invio(email)
+                    inviate += 1
+        except (smtplib.SMTPException, OSError) as e:
+            if in_invio is not None:
+                _registra_errore(in_invio, e)
+            elif not tentate:
+                # Connessione non aperta: il tentativo fallito vale per tutte le email del blocco
+                current_app.logger.warning(f"Connessione SMTP non riuscita: {str(e)}")
+                for email, _ in pronti:
+                    _registra_errore(email, e)
+            return inviate
+        ids = _email_in_scadenza()
+    return inviate
+
+
+def _prepara_blocco(ids):
+    """
+    Prende in carico le email del blocco e ne costruisce i messaggi, senza connessione aperta.
+    Smette di preparare dopo TEMPO_PREPARAZIONE, così le email prese in carico partono prima
+    che la prenotazione scada; le altre restano in coda per il blocco successivo.
+
+    Returns:
+        list: coppie (email, messaggio) pronte per l'invio
+    """
+    limite = time.monotonic() + TEMPO_PREPARAZIONE.total_seconds()
+    pronti = []
+    for email_id in ids:
+        if time.monotonic() > limite:
+            break
+        if not _prenota(email_id):
+            continue
+        email = db.session.get(EmailOutbox, email_id)
+        try:
+            pronti.append((email, _messaggio(email)))
+        except Exception as e:
+            _registra_errore(email, e)
+    return pronti
+
+
+def _prenota(email_id):
+    """Prende in carico un'email (UPDATE condizionale): False se già presa da un altro processo"""
+    adesso = datetime.utcnow()
+    risultato = db.session.execute(
+        update(EmailOutbox)
+        .where(
+            EmailOutbox.id == email_id,
+            EmailOutbox.stato == 'In coda',
+            EmailOutbox.prossimo_tentativo <= adesso
+        )
+        .values(prossimo_tentativo=adesso + DURATA_PRENOTAZIONE)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return risultato.rowcount == 1
+
+
+def _messaggio(email):
+    """Costruisce il messaggio Flask-Mail, allegando il PDF aggiornato del foglio se richiesto"""
+    messaggio = Message(
+        subject=email.oggetto,
+        recipients=email.lista_destinatari,
+        body=email.corpo_testo,
+        html=email.corpo_html
+    )
+    if email.allega_pdf:
+        if not email.foglio:
+            raise ValueError("Foglio tecnico eliminato: PDF non disponibile")
+        from app.services.archivio_pdf import leggi_documento
+        from app.services.coda_pdf import genera_pdf_in_coda
+        pdf_path = genera_pdf_in_coda(email.foglio_id, timeout=ATTESA_PDF_SECONDI)
+        messaggio.attach(
+            filename=f"FoglioTecnico_{email.foglio.numero_foglio}.pdf",
+            content_type='application/pdf',
+            data=leggi_documento(pdf_path)
+        )
+    return messaggio
+
+
+def _rispetta_limite():
+    """Attende quanto serve per non superare MAIL_RATE_PER_MINUTE invii al minuto"""
+    global _ultimo_invio
+    per_minuto = current_app.config.get('MAIL_RATE_PER_MINUTE')
+    if per_minuto:
+        attesa = _ultimo_invio + 60 / per_minuto - time.monotonic()
+        if attesa > 0:
+            time.sleep(attesa)
+    _ultimo_invio = time.monotonic()
+
+
+def _registra_invio(email):
+    adesso = datetime.utcnow()
+    email.stato = 'Inviata'
+    email.tentativi += 1
+    email.inviata_at = adesso
+    email.ultimo_errore = None
+
+    foglio = email.foglio
+    if foglio and email.tipo == TIPO_FOGLIO:
+        foglio.inviato_online = True
+        foglio.email_invio = email.destinatari
+        foglio.data_invio = adesso
+        foglio.stato_invio_email = 'Inviata'
+        foglio.errore_invio_email = None
+        if foglio.stato == 'Completato':
+            foglio.stato = 'Inviato'
+        foglio.updated_at = adesso
+
+    db.session.commit()
+    current_app.logger.info(f"Email {email.id} ({email.tipo}) inviata a {email.destinatari}")
+
+
+def _registra_errore(email, errore):
+    """Rimanda l'email con attesa esponenziale, o la chiude in Errore dopo l'ultimo tentativo"""
+    email.tentativi += 1
+    email.ultimo_errore = str(errore)
+    massimo = current_app.config.get('MAIL_OUTBOX_TENTATIVI') or 1
+    if email.tentativi >= massimo:
+        email.stato = 'Errore'
+    else:
+        attesa = timedelta(seconds=max(current_app.config.get('MAIL_OUTBOX_BACKOFF_SECONDS', 60), 1) * 2 ** (email.tentativi - 1))
+        email.prossimo_tentativo = datetime.utcnow() + min(attesa, BACKOFF_MASSIMO)
+
+    foglio = email.foglio
+    if foglio and email.tipo == TIPO_FOGLIO:
+        foglio.errore_invio_email = str(errore)[:500]
+        if email.stato == 'Errore':
+            foglio.stato_invio_email = 'Errore'
+
+    db.session.commit()
+    current_app.logger.warning(
+        f"Invio email {email.id} a {email.destinatari} fallito "
+        f"(tentativo {email.tentativi}/{massimo}): {str(errore)}"
+    )
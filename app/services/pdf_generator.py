@@ -1,118 +1,117 @@
 """
 Servizio per la generazione di PDF dai fogli tecnici usando ReportLab
-Design minimal e pulito
+Design minimal e pulito. Stili, colori e stili tabella sono costruiti una volta per
+processo nel registro qui sotto; intestazione aziendale e piè di pagina sono disegnati
+sul canvas da callback di pagina invece che come flowable di ogni documento.
+I file prendono il nome dall'impronta del contenuto: se nulla è cambiato il PDF esistente
+viene riusato, e le versioni superate vengono eliminate. I PDF sono salvati nelle cartelle
+anno/mese/reparto e registrati nel manifesto di app/services/archivio_pdf.py, che li sposta
+poi nei contenitori mensili di archivio.
 """
 
 from flask import current_app
+import glob
+import hashlib
+import json
 import os
 from datetime import datetime
+from functools import lru_cache
+from types import MappingProxyType
 from app import db
 from app.models.foglio_tecnico import FoglioTecnico
+from app.services.archivio_pdf import (
+    cartella_assoluta, cartella_documenti, documento_disponibile, percorsi_sciolti,
+    registra_documento, rimuovi_documenti
+)
 
 # Importazioni ReportLab
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image as RLImage
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Flowable
+from reportlab.lib.utils import ImageReader
 from reportlab.lib import colors
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+from reportlab.lib.enums import TA_CENTER
 
 
-def genera_pdf_foglio_tecnico(foglio_id):
-    """
-    Genera un PDF per il foglio tecnico usando SOLO ReportLab
-    Design minimal e pulito
-    
-    Args:
-        foglio_id (int): ID del foglio tecnico
-        
-    Returns:
-        str: Path del file PDF generato
-    """
-    # Carica foglio dal database
-    foglio = FoglioTecnico.query.get(foglio_id)
-    if not foglio:
-        raise ValueError(f"Foglio tecnico {foglio_id} non trovato")
+# === REGISTRO STILI E TEMPLATE (costruito all'import, da non modificare) ===
 
-    try:
-        # Crea cartella PDF se non esiste
-        pdf_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'fogli_tecnici_pdf')
-        os.makedirs(pdf_dir, exist_ok=True)
-
-        # Nome file PDF
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{foglio.numero_foglio}_{timestamp}.pdf"
-        pdf_path = os.path.join(pdf_dir, filename)
-
-        # Crea documento PDF - MINIMAL
-        doc = SimpleDocTemplate(
-            pdf_path,
-            pagesize=A4,
-            topMargin=2*cm,
-            bottomMargin=2*cm,
-            leftMargin=2*cm,
-            rightMargin=2*cm
-        )
-
-        # === STILI MINIMAL E PROFESSIONALI ===
-        styles = getSampleStyleSheet()
-        
-        # Colori minimal
-        COLOR_PRIMARY = colors.HexColor('#2c3e50')  # Grigio scuro
-        COLOR_SECONDARY = colors.HexColor('#7f8c8d')  # Grigio medio
-        COLOR_ACCENT = colors.HexColor('#3498db')  # Blu accent
-        COLOR_BG_LIGHT = colors.HexColor('#f8f9fa')  # Grigio molto chiaro
-        COLOR_BORDER = colors.HexColor('#dee2e6')  # Grigio bordi
-        
-        # Stile nome azienda (header)
-        company_name_style = ParagraphStyle(
-            'CompanyName',
-            parent=styles['Heading1'],
-            fontSize=18,
-            fontName='Helvetica-Bold',
-            textColor=COLOR_PRIMARY,
-            spaceAfter=3,
-            alignment=TA_LEFT
-        )
-        
-        # Stile dettagli azienda
-        company_detail_style = ParagraphStyle(
-            'CompanyDetail',
-            parent=styles['Normal'],
-            fontSize=9,
-            fontName='Helvetica',
-            textColor=COLOR_SECONDARY,
-            spaceAfter=2,
-            alignment=TA_LEFT
-        )
-        
+# Versione del layout: fa parte dell'impronta dei PDF, incrementarla a ogni modifica
+# del disegno perché i documenti già generati vengano rifatti
+VERSIONE_TEMPLATE = 3
+
+# Colori minimal
+COLOR_PRIMARY = colors.HexColor('#2c3e50')  # Grigio scuro
+COLOR_SECONDARY = colors.HexColor('#7f8c8d')  # Grigio medio
+COLOR_ACCENT = colors.HexColor('#3498db')  # Blu accent
+COLOR_BG_LIGHT = colors.HexColor('#f8f9fa')  # Grigio molto chiaro
+COLOR_BORDER = colors.HexColor('#dee2e6')  # Grigio bordi
+
+MARGINE = 2*cm
+LARGHEZZA_CONTENUTO = 17*cm
+META_CONTENUTO = 8.5*cm
+
+# Intestazione aziendale (prima pagina)
+# TODO: Inserire logo aziendale (per ora testo placeholder)
+INTESTAZIONE_NOME = "DB-Desk"
+INTESTAZIONE_SOTTOTITOLO = "Sistema Gestionale"
+INTESTAZIONE_AZIENDA = (
+    "Frigo Balance & Food Srl",
+    "Via Rosa Luxemburg 12/14",
+    "10093 Collegno (TO)",
+    "P.IVA: 12621510010",
+    "Tel: +39 011 092 2223 - Email: info@frigobalance.it",
+)
+# Spazio riservato all'intestazione in cima al frame della prima pagina
+ALTEZZA_INTESTAZIONE = 80
+
+LINEA_FIRMA = "_________________________"
+
+# Riquadro in cui la firma viene scalata mantenendo le proporzioni
+LARGHEZZA_FIRMA = 6*cm
+ALTEZZA_FIRMA = 3*cm
+
+# Firme decodificate tenute in memoria da ogni processo di rendering
+CACHE_FIRME = 64
+
+
+def _crea_stili():
+    """Stili di paragrafo del documento, in una mappa in sola lettura"""
+    base = getSampleStyleSheet()
+    field_value = ParagraphStyle(
+        'FieldValue',
+        parent=base['Normal'],
+        fontSize=10,
+        fontName='Helvetica',
+        textColor=COLOR_PRIMARY,
+        spaceAfter=0
+    )
+    return MappingProxyType({
         # Titolo foglio tecnico
-        doc_title_style = ParagraphStyle(
+        'doc_title': ParagraphStyle(
             'DocTitle',
-            parent=styles['Heading1'],
+            parent=base['Heading1'],
             fontSize=16,
             fontName='Helvetica-Bold',
             textColor=COLOR_PRIMARY,
             spaceAfter=8,
             spaceBefore=15,
             alignment=TA_CENTER
-        )
-        
+        ),
         # Numero foglio
-        doc_number_style = ParagraphStyle(
+        'doc_number': ParagraphStyle(
             'DocNumber',
-            parent=styles['Normal'],
+            parent=base['Normal'],
             fontSize=12,
             fontName='Helvetica-Bold',
             textColor=COLOR_ACCENT,
             spaceAfter=20,
             alignment=TA_CENTER
-        )
-        
+        ),
         # Titoli sezione con box colorato
-        section_title_style = ParagraphStyle(
+        'section_title': ParagraphStyle(
             'SectionTitle',
-            parent=styles['Heading2'],
+            parent=base['Heading2'],
             fontSize=11,
             fontName='Helvetica-Bold',
             textColor=colors.white,
@@ -120,509 +119,356 @@ def genera_pdf_foglio_tecnico(foglio_id):
             spaceAfter=0,
             leftIndent=8,
             rightIndent=8
-        )
-        
+        ),
         # Label campo
-        field_label_style = ParagraphStyle(
+        'field_label': ParagraphStyle(
             'FieldLabel',
-            parent=styles['Normal'],
+            parent=base['Normal'],
             fontSize=8,
             fontName='Helvetica-Bold',
             textColor=COLOR_SECONDARY,
             spaceAfter=2,
             textTransform='uppercase'
-        )
-        
+        ),
         # Valore campo
-        field_value_style = ParagraphStyle(
-            'FieldValue',
-            parent=styles['Normal'],
-            fontSize=10,
-            fontName='Helvetica',
-            textColor=COLOR_PRIMARY,
-            spaceAfter=0
-        )
-        
+        'field_value': field_value,
+        # Importo in evidenza
+        'importo': ParagraphStyle(
+            'ImportoStyle',
+            parent=field_value,
+            fontSize=12,
+            fontName='Helvetica-Bold',
+            textColor=COLOR_ACCENT
+        ),
         # Testo in box
-        box_text_style = ParagraphStyle(
+        'box_text': ParagraphStyle(
             'BoxText',
-            parent=styles['Normal'],
+            parent=base['Normal'],
             fontSize=10,
             fontName='Helvetica',
             textColor=COLOR_PRIMARY,
             leading=14
-        )
-        
+        ),
         # Stile firma (nome sotto firma)
-        signature_name_style = ParagraphStyle(
+        'signature_name': ParagraphStyle(
             'SignatureName',
-            parent=styles['Normal'],
+            parent=base['Normal'],
             fontSize=10,
             fontName='Helvetica-Bold',
             textColor=COLOR_PRIMARY,
             alignment=TA_CENTER,
             spaceAfter=2
-        )
-        
+        ),
         # Stile label firma
-        signature_label_style = ParagraphStyle(
+        'signature_label': ParagraphStyle(
             'SignatureLabel',
-            parent=styles['Normal'],
+            parent=base['Normal'],
             fontSize=8,
             fontName='Helvetica',
             textColor=COLOR_SECONDARY,
             alignment=TA_CENTER
-        )
-        
-        # Footer
-        footer_style = ParagraphStyle(
-            'Footer',
-            parent=styles['Normal'],
-            fontSize=8,
-            fontName='Helvetica',
-            textColor=COLOR_SECONDARY,
-            alignment=TA_CENTER
-        )
+        ),
+    })
 
-        # === CONTENUTO ===
-        story = []
 
-        # === HEADER: LOGO SINISTRA + DATI AZIENDA DESTRA ===
-        # TODO: Inserire logo aziendale (per ora testo placeholder)
-        logo_cell = [
-            Paragraph("DB-Desk", company_name_style),
-            Paragraph("Sistema Gestionale", company_detail_style)
-        ]
-        
-        # Dati azienda a destra
-        company_data_cell = [
-            Paragraph("Frigo Balance & Food Srl", company_detail_style),
-            Paragraph("Via Rosa Luxemburg 12/14", company_detail_style),
-            Paragraph("10093 Collegno (TO)", company_detail_style),
-            Paragraph("P.IVA: 12621510010", company_detail_style),
-            Paragraph("Tel: +39 011 092 2223 - Email: info@frigobalance.it", company_detail_style)
-        ]
-        
-        header_table = Table(
-            [[logo_cell, company_data_cell]],
-            colWidths=[8.5*cm, 8.5*cm]
-        )
-        header_table.setStyle(TableStyle([
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('ALIGN', (0, 0), (0, 0), 'LEFT'),
-            ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 0),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 0),
-        ]))
-        story.append(header_table)
-        
-        # Linea separatrice sotto header
-        story.append(Spacer(1, 10))
-        line = Table([['']], colWidths=[17*cm])
-        line.setStyle(TableStyle([
-            ('LINEBELOW', (0, 0), (-1, 0), 2, COLOR_ACCENT),
-        ]))
-        story.append(line)
-
-        # === TITOLO FOGLIO TECNICO ===
-        story.append(Paragraph("FOGLIO TECNICO DI INTERVENTO", doc_title_style))
-        story.append(Paragraph(f"N° {foglio.numero_foglio}", doc_number_style))
-
-        # === SEZIONE: INFORMAZIONI GENERALI ===
-        section_header = Table(
-            [[Paragraph("INFORMAZIONI GENERALI", section_title_style)]],
-            colWidths=[17*cm]
-        )
-        section_header.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), COLOR_ACCENT),
-            ('TOPPADDING', (0, 0), (-1, -1), 6),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-            ('LEFTPADDING', (0, 0), (-1, -1), 8),
-        ]))
-        story.append(section_header)
-        
-        # Campi informazioni generali in griglia 2 colonne
-        info_fields = []
-        
-        # Riga 1: Cliente | Tecnico
-        row1 = []
-        if foglio.cliente:
-            cliente_cell = [
-                Paragraph("CLIENTE", field_label_style),
-                Paragraph(foglio.cliente.ragione_sociale, field_value_style)
-            ]
-        else:
-            cliente_cell = [
-                Paragraph("CLIENTE", field_label_style),
-                Paragraph("N/A", field_value_style)
-            ]
-        
-        tecnico_cell = [
-            Paragraph("TECNICO", field_label_style),
-            Paragraph(f"{foglio.tecnico.first_name} {foglio.tecnico.last_name}", field_value_style)
-        ]
-        row1 = [cliente_cell, tecnico_cell]
-        info_fields.append(row1)
-        
-        # Riga 2: Data Intervento | Categoria
-        data_cell = [
-            Paragraph("DATA E ORA", field_label_style),
-            Paragraph(foglio.data_intervento.strftime('%d/%m/%Y alle %H:%M'), field_value_style)
-        ]
-        
-        categoria_cell = [
-            Paragraph("CATEGORIA", field_label_style),
-            Paragraph(foglio.categoria or 'Non specificata', field_value_style)
-        ]
-        info_fields.append([data_cell, categoria_cell])
-        
-        # Riga 3: Priorità | Stato
-        priorita_cell = [
-            Paragraph("PRIORITÀ", field_label_style),
-            Paragraph(foglio.priorita or 'Media', field_value_style)
-        ]
-        
-        stato_cell = [
-            Paragraph("STATO", field_label_style),
-            Paragraph(foglio.stato, field_value_style)
-        ]
-        info_fields.append([priorita_cell, stato_cell])
-        
-        # Riga 4 opzionale: Durata | Km percorsi
-        if foglio.durata_intervento or foglio.km_percorsi:
-            durata_cell = [
-                Paragraph("DURATA", field_label_style),
-                Paragraph(f"{foglio.durata_intervento} minuti" if foglio.durata_intervento else "N/A", field_value_style)
-            ]
-            
-            km_cell = [
-                Paragraph("KM PERCORSI", field_label_style),
-                Paragraph(f"{foglio.km_percorsi} km" if foglio.km_percorsi else "N/A", field_value_style)
-            ]
-            info_fields.append([durata_cell, km_cell])
-        
-        info_table = Table(info_fields, colWidths=[8.5*cm, 8.5*cm])
-        info_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), colors.white),
-            ('BOX', (0, 0), (-1, -1), 0.5, COLOR_BORDER),
-            ('INNERGRID', (0, 0), (-1, -1), 0.5, COLOR_BORDER),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('TOPPADDING', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-            ('LEFTPADDING', (0, 0), (-1, -1), 10),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-        ]))
-        story.append(info_table)
-        story.append(Spacer(1, 15))
+def _stile_riquadro(padding, valign='TOP', sfondo=colors.white, griglia=True, extra=()):
+    """Stile tabella dei riquadri con bordo sottile"""
+    comandi = [
+        ('BACKGROUND', (0, 0), (-1, -1), sfondo),
+        ('BOX', (0, 0), (-1, -1), 0.5, COLOR_BORDER),
+        ('VALIGN', (0, 0), (-1, -1), valign),
+        ('TOPPADDING', (0, 0), (-1, -1), padding),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), padding),
+        ('LEFTPADDING', (0, 0), (-1, -1), 10),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 10),
+    ]
+    if griglia:
+        comandi.insert(2, ('INNERGRID', (0, 0), (-1, -1), 0.5, COLOR_BORDER))
+    return TableStyle(comandi + list(extra))
 
-        # === SEZIONE: DETTAGLI INTERVENTO ===
-        if foglio.titolo or foglio.descrizione or foglio.indirizzo_intervento:
-            section_header = Table(
-                [[Paragraph("DETTAGLI INTERVENTO", section_title_style)]],
-                colWidths=[17*cm]
-            )
-            section_header.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), COLOR_ACCENT),
-                ('TOPPADDING', (0, 0), (-1, -1), 6),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-                ('LEFTPADDING', (0, 0), (-1, -1), 8),
-            ]))
-            story.append(section_header)
-            
-            details_content = []
-            
-            if foglio.titolo:
-                details_content.append([
-                    Paragraph("OGGETTO", field_label_style),
-                    Paragraph(foglio.titolo, field_value_style)
-                ])
-            
-            if foglio.descrizione:
-                details_content.append([
-                    Paragraph("DESCRIZIONE", field_label_style),
-                    Paragraph(foglio.descrizione.replace('\n', '<br/>'), box_text_style)
-                ])
-            
-            if foglio.indirizzo_intervento:
-                details_content.append([
-                    Paragraph("LUOGO INTERVENTO", field_label_style),
-                    Paragraph(foglio.indirizzo_intervento, field_value_style)
-                ])
-            
-            details_table = Table(details_content, colWidths=[4*cm, 13*cm])
-            details_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), colors.white),
-                ('BOX', (0, 0), (-1, -1), 0.5, COLOR_BORDER),
-                ('INNERGRID', (0, 0), (-1, -1), 0.5, COLOR_BORDER),
-                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                ('TOPPADDING', (0, 0), (-1, -1), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-                ('LEFTPADDING', (0, 0), (-1, -1), 10),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-            ]))
-            story.append(details_table)
-            story.append(Spacer(1, 15))
-
-        # === SEZIONE: MACCHINE ===
-        if foglio.macchine_collegate.count() > 0:
-            section_header = Table(
-                [[Paragraph("MACCHINE E ATTREZZATURE", section_title_style)]],
-                colWidths=[17*cm]
-            )
-            section_header.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), COLOR_ACCENT),
-                ('TOPPADDING', (0, 0), (-1, -1), 6),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-                ('LEFTPADDING', (0, 0), (-1, -1), 8),
-            ]))
-            story.append(section_header)
-            
-            macchine_data = []
-            for i, macchina in enumerate(foglio.macchine_collegate, 1):
-                macchina_text = f"{i}. {macchina.codice} - {macchina.marca} {macchina.modello}"
-                if macchina.numero_serie:
-                    macchina_text += f"<br/>S/N: {macchina.numero_serie}"
-                macchine_data.append([Paragraph(macchina_text, box_text_style)])
-            
-            macchine_table = Table(macchine_data, colWidths=[17*cm])
-            macchine_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), colors.white),
-                ('BOX', (0, 0), (-1, -1), 0.5, COLOR_BORDER),
-                ('INNERGRID', (0, 0), (-1, -1), 0.5, COLOR_BORDER),
-                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                ('TOPPADDING', (0, 0), (-1, -1), 8),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-                ('LEFTPADDING', (0, 0), (-1, -1), 10),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-            ]))
-            story.append(macchine_table)
-            story.append(Spacer(1, 15))
-
-        # === SEZIONE: RICAMBI ===
-        if foglio.ricambi_utilizzati.count() > 0:
-            section_header = Table(
-                [[Paragraph("RICAMBI E MATERIALI", section_title_style)]],
-                colWidths=[17*cm]
-            )
-            section_header.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), COLOR_ACCENT),
-                ('TOPPADDING', (0, 0), (-1, -1), 6),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-                ('LEFTPADDING', (0, 0), (-1, -1), 8),
-            ]))
-            story.append(section_header)
-            
-            ricambi_data = []
-            for i, ricambio in enumerate(foglio.ricambi_utilizzati, 1):
-                ricambio_text = f"{i}. {ricambio.codice} - {ricambio.descrizione}"
-                if ricambio.fornitore:
-                    ricambio_text += f"<br/>Fornitore: {ricambio.fornitore}"
-                ricambi_data.append([Paragraph(ricambio_text, box_text_style)])
-            
-            ricambi_table = Table(ricambi_data, colWidths=[17*cm])
-            ricambi_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), colors.white),
-                ('BOX', (0, 0), (-1, -1), 0.5, COLOR_BORDER),
-                ('INNERGRID', (0, 0), (-1, -1), 0.5, COLOR_BORDER),
-                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                ('TOPPADDING', (0, 0), (-1, -1), 8),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-                ('LEFTPADDING', (0, 0), (-1, -1), 10),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-            ]))
-            story.append(ricambi_table)
-            story.append(Spacer(1, 15))
-
-        # === SEZIONE: NOTE ===
-        if foglio.note_aggiuntive:
-            section_header = Table(
-                [[Paragraph("NOTE E OSSERVAZIONI", section_title_style)]],
-                colWidths=[17*cm]
-            )
-            section_header.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), COLOR_ACCENT),
-                ('TOPPADDING', (0, 0), (-1, -1), 6),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-                ('LEFTPADDING', (0, 0), (-1, -1), 8),
-            ]))
-            story.append(section_header)
-            
-            notes_table = Table(
-                [[Paragraph(foglio.note_aggiuntive.replace('\n', '<br/>'), box_text_style)]],
-                colWidths=[17*cm]
-            )
-            notes_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), COLOR_BG_LIGHT),
-                ('BOX', (0, 0), (-1, -1), 0.5, COLOR_BORDER),
-                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                ('TOPPADDING', (0, 0), (-1, -1), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-                ('LEFTPADDING', (0, 0), (-1, -1), 10),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-            ]))
-            story.append(notes_table)
-            story.append(Spacer(1, 15))
-
-        # === SEZIONE: INFORMAZIONI COMMERCIALI ===
-        if foglio.modalita_pagamento or foglio.importo_intervento:
-            section_header = Table(
-                [[Paragraph("INFORMAZIONI COMMERCIALI", section_title_style)]],
-                colWidths=[17*cm]
-            )
-            section_header.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), COLOR_ACCENT),
-                ('TOPPADDING', (0, 0), (-1, -1), 6),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-                ('LEFTPADDING', (0, 0), (-1, -1), 8),
-            ]))
-            story.append(section_header)
-            
-            comm_fields = []
-            
-            # Riga 1: Modalità pagamento | Importo
-            row1 = []
-            if foglio.modalita_pagamento:
-                pagamento_cell = [
-                    Paragraph("MODALITÀ DI PAGAMENTO", field_label_style),
-                    Paragraph(foglio.modalita_pagamento, field_value_style)
-                ]
-            else:
-                pagamento_cell = [
-                    Paragraph("MODALITÀ DI PAGAMENTO", field_label_style),
-                    Paragraph("N/A", field_value_style)
-                ]
-            
-            if foglio.importo_intervento:
-                importo_cell = [
-                    Paragraph("IMPORTO", field_label_style),
-                    Paragraph(f"€ {foglio.importo_intervento:.2f}", ParagraphStyle(
-                        'ImportoStyle',
-                        parent=field_value_style,
-                        fontSize=12,
-                        fontName='Helvetica-Bold',
-                        textColor=COLOR_ACCENT
-                    ))
-                ]
-            else:
-                importo_cell = [
-                    Paragraph("IMPORTO", field_label_style),
-                    Paragraph("N/A", field_value_style)
-                ]
-            
-            comm_fields.append([pagamento_cell, importo_cell])
-            
-            # Riga 2: Già pagato | In garanzia
-            pagato_cell = [
-                Paragraph("GIÀ PAGATO", field_label_style),
-                Paragraph('Sì' if foglio.pagamento_immediato else 'No', field_value_style)
-            ]
-            
-            garanzia_cell = [
-                Paragraph("IN GARANZIA", field_label_style),
-                Paragraph('Sì' if hasattr(foglio, 'intervento_in_garanzia') and foglio.intervento_in_garanzia else 'No', field_value_style)
-            ]
-            comm_fields.append([pagato_cell, garanzia_cell])
-            
-            comm_table = Table(comm_fields, colWidths=[8.5*cm, 8.5*cm])
-            comm_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), colors.white),
-                ('BOX', (0, 0), (-1, -1), 0.5, COLOR_BORDER),
-                ('INNERGRID', (0, 0), (-1, -1), 0.5, COLOR_BORDER),
-                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                ('TOPPADDING', (0, 0), (-1, -1), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-                ('LEFTPADDING', (0, 0), (-1, -1), 10),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-            ]))
-            story.append(comm_table)
-            story.append(Spacer(1, 15))
-
-        # === SEZIONE: FIRME ===
-        section_header = Table(
-            [[Paragraph("FIRME DI ACCETTAZIONE", section_title_style)]],
-            colWidths=[17*cm]
-        )
-        section_header.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), COLOR_ACCENT),
-            ('TOPPADDING', (0, 0), (-1, -1), 6),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-            ('LEFTPADDING', (0, 0), (-1, -1), 8),
-        ]))
-        story.append(section_header)
-        
-        # Box firme affiancate
-        firma_tecnico_content = []
-        firma_cliente_content = []
-        
-        # Firma tecnico
-        if foglio.firma_tecnico_path and os.path.exists(foglio.firma_tecnico_path):
-            try:
-                firma_img = RLImage(foglio.firma_tecnico_path, width=6*cm, height=3*cm)
-                firma_tecnico_content.append(firma_img)
-            except:
-                firma_tecnico_content.append(Paragraph("_________________________", signature_name_style))
-        else:
-            firma_tecnico_content.append(Paragraph("_________________________", signature_name_style))
-        
-        firma_tecnico_content.append(Spacer(1, 5))
-        firma_tecnico_content.append(Paragraph(f"{foglio.tecnico.first_name} {foglio.tecnico.last_name}", signature_name_style))
-        firma_tecnico_content.append(Paragraph("TECNICO", signature_label_style))
-        
-        # Firma cliente
-        if foglio.firma_cliente_path and os.path.exists(foglio.firma_cliente_path):
-            try:
-                firma_img = RLImage(foglio.firma_cliente_path, width=6*cm, height=3*cm)
-                firma_cliente_content.append(firma_img)
-            except:
-                firma_cliente_content.append(Paragraph("_________________________", signature_name_style))
-        else:
-            firma_cliente_content.append(Paragraph("_________________________", signature_name_style))
-        
-        firma_cliente_content.append(Spacer(1, 5))
-        if foglio.nome_firmatario_cliente:
-            firma_cliente_content.append(Paragraph(foglio.nome_firmatario_cliente, signature_name_style))
-        else:
-            firma_cliente_content.append(Paragraph("_________________________", signature_name_style))
-        firma_cliente_content.append(Paragraph("CLIENTE", signature_label_style))
-        
-        firme_table = Table(
-            [[firma_tecnico_content, firma_cliente_content]],
-            colWidths=[8.5*cm, 8.5*cm]
-        )
-        firme_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), colors.white),
-            ('BOX', (0, 0), (-1, -1), 0.5, COLOR_BORDER),
-            ('INNERGRID', (0, 0), (-1, -1), 0.5, COLOR_BORDER),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('TOPPADDING', (0, 0), (-1, -1), 15),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 15),
-            ('LEFTPADDING', (0, 0), (-1, -1), 10),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-        ]))
-        story.append(firme_table)
-
-        # === FOOTER ===
-        story.append(Spacer(1, 20))
-        footer_line = Table([['']], colWidths=[17*cm])
-        footer_line.setStyle(TableStyle([
-            ('LINEABOVE', (0, 0), (-1, 0), 1, COLOR_BORDER),
-        ]))
-        story.append(footer_line)
-        story.append(Spacer(1, 8))
-        story.append(Paragraph(f"Documento generato il {datetime.now().strftime('%d/%m/%Y alle %H:%M')}", footer_style))
-        story.append(Paragraph(f"DB-Desk - Foglio Tecnico N° {foglio.numero_foglio}", footer_style))
-
-        # Genera PDF
-        doc.build(story)
 
-        # Aggiorna database
-        foglio.pdf_generato = True
-        foglio.pdf_path = pdf_path
-        foglio.updated_at = datetime.utcnow()
-        db.session.commit()
+STILI = _crea_stili()
+
+# Stili tabella condivisi (setStyle ne copia i comandi: le istanze non vengono mai modificate)
+STILE_SEZIONE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, -1), COLOR_ACCENT),
+    ('TOPPADDING', (0, 0), (-1, -1), 6),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ('LEFTPADDING', (0, 0), (-1, -1), 8),
+])
+STILE_GRIGLIA = _stile_riquadro(10)
+STILE_ELENCO = _stile_riquadro(8)
+STILE_NOTE = _stile_riquadro(10, sfondo=COLOR_BG_LIGHT, griglia=False)
+STILE_FIRME = _stile_riquadro(15, valign='MIDDLE', extra=[('ALIGN', (0, 0), (-1, -1), 'CENTER')])
+
+
+def _disegna_pie_pagina(canvas, doc):
+    """Piè di pagina di ogni pagina: linea, data di generazione, numero foglio e pagina"""
+    generato_il, numero_foglio = doc.pie_pagina
+    centro = doc.leftMargin + doc.width / 2
+    y = doc.bottomMargin - 0.4*cm
+
+    canvas.saveState()
+    canvas.setStrokeColor(COLOR_BORDER)
+    canvas.setLineWidth(1)
+    canvas.line(doc.leftMargin, y, doc.leftMargin + doc.width, y)
+    canvas.setFillColor(COLOR_SECONDARY)
+    canvas.setFont('Helvetica', 8)
+    canvas.drawCentredString(centro, y - 12, f"Documento generato il {generato_il}")
+    canvas.drawCentredString(centro, y - 23, f"DB-Desk - Foglio Tecnico N° {numero_foglio} - Pagina {canvas.getPageNumber()}")
+    canvas.restoreState()
+
+
+def _disegna_prima_pagina(canvas, doc):
+    """Intestazione aziendale (logo a sinistra, dati azienda a destra) e piè di pagina"""
+    sinistra = doc.leftMargin
+    destra = doc.leftMargin + doc.width
+    alto = doc.pagesize[1] - doc.topMargin
+
+    canvas.saveState()
+    canvas.setFillColor(COLOR_PRIMARY)
+    canvas.setFont('Helvetica-Bold', 18)
+    canvas.drawString(sinistra, alto - 18, INTESTAZIONE_NOME)
+    canvas.setFillColor(COLOR_SECONDARY)
+    canvas.setFont('Helvetica', 9)
+    canvas.drawString(sinistra, alto - 33, INTESTAZIONE_SOTTOTITOLO)
+    for i, riga in enumerate(INTESTAZIONE_AZIENDA):
+        canvas.drawRightString(destra, alto - 9 - i * 12, riga)
+
+    # Linea separatrice sotto header
+    canvas.setStrokeColor(COLOR_ACCENT)
+    canvas.setLineWidth(2)
+    canvas.line(sinistra, alto - 72, destra, alto - 72)
+    canvas.restoreState()
+
+    _disegna_pie_pagina(canvas, doc)
+
+
+def _intestazione_sezione(titolo):
+    tabella = Table([[Paragraph(titolo, STILI['section_title'])]], colWidths=[LARGHEZZA_CONTENUTO])
+    tabella.setStyle(STILE_SEZIONE)
+    return tabella
+
+
+def _campo(etichetta, valore, stile='field_value'):
+    """Cella con label e valore"""
+    return [Paragraph(etichetta, STILI['field_label']), Paragraph(valore, STILI[stile])]
+
+
+def _riquadro(righe, larghezze, stile):
+    tabella = Table(righe, colWidths=larghezze)
+    tabella.setStyle(stile)
+    return tabella
+
+
+@lru_cache(maxsize=CACHE_FIRME)
+def _lettore_firma(path, mtime):
+    """Lettore ReportLab di una firma, già decodificato (la chiave include mtime: un file riscritto viene riletto)"""
+    lettore = ImageReader(path)
+    # Decodifica subito: i documenti successivi riusano pixel e canale alfa
+    lettore.getRGBData()
+    return lettore
 
-        current_app.logger.info(f"PDF generato con ReportLab per foglio {foglio.numero_foglio}: {pdf_path}")
+
+class _ImmagineFirma(Flowable):
+    """Firma scalata in proporzione nel riquadro firma, disegnata da un lettore in cache"""
+
+    def __init__(self, lettore):
+        super().__init__()
+        self.lettore = lettore
+        self.hAlign = 'CENTER'
+        larghezza, altezza = lettore.getSize()
+        scala = min(LARGHEZZA_FIRMA / larghezza, ALTEZZA_FIRMA / altezza)
+        self.width = larghezza * scala
+        self.height = altezza * scala
+
+    def wrap(self, larghezza_disponibile, altezza_disponibile):
+        return self.width, self.height
+
+    def draw(self):
+        self.canv.drawImage(self.lettore, 0, 0, self.width, self.height, mask='auto')
+
+
+def _firma(path, nome, etichetta):
+    """Contenuto della cella firma: immagine (o linea), nome e ruolo"""
+    contenuto = []
+    if path and os.path.exists(path):
+        try:
+            contenuto.append(_ImmagineFirma(_lettore_firma(path, os.path.getmtime(path))))
+        except Exception:
+            contenuto.append(Paragraph(LINEA_FIRMA, STILI['signature_name']))
+    else:
+        contenuto.append(Paragraph(LINEA_FIRMA, STILI['signature_name']))
+
+    contenuto.append(Spacer(1, 5))
+    contenuto.append(Paragraph(nome or LINEA_FIRMA, STILI['signature_name']))
+    contenuto.append(Paragraph(etichetta, STILI['signature_label']))
+    return contenuto
+
+
+def _in_ordine(oggetti):
+    """Macchine o ricambi in ordine di codice: le relazioni non hanno un ordine garantito dal database"""
+    return sorted(oggetti, key=lambda obj: (obj.codice or '', obj.id))
+
+
+def dati_pdf_foglio(foglio, macchine=None, ricambi=None):
+    """
+    Estrae dal foglio tutti i dati che compaiono nel PDF, come valori semplici:
+    il dizionario può essere passato a un altro processo per il rendering
+
+    Args:
+        foglio (FoglioTecnico): Foglio tecnico
+        macchine (list, optional): Macchine collegate già caricate (default: dalla relazione)
+        ricambi (list, optional): Ricambi utilizzati già caricati (default: dalla relazione)
+
+    Returns:
+        dict: Dati del documento
+    """
+    return {
+        'numero_foglio': foglio.numero_foglio,
+        'cliente': foglio.cliente.ragione_sociale if foglio.cliente else None,
+        'tecnico': f"{foglio.tecnico.first_name} {foglio.tecnico.last_name}",
+        'data_intervento': foglio.data_intervento.strftime('%d/%m/%Y alle %H:%M'),
+        'categoria': foglio.categoria,
+        'priorita': foglio.priorita,
+        'stato': foglio.stato,
+        'durata_intervento': foglio.durata_intervento,
+        'km_percorsi': foglio.km_percorsi,
+        'titolo': foglio.titolo,
+        'descrizione': foglio.descrizione,
+        'indirizzo_intervento': foglio.indirizzo_intervento,
+        'macchine': [
+            {'codice': m.codice, 'marca': m.marca, 'modello': m.modello, 'numero_serie': m.numero_serie}
+            for m in _in_ordine(foglio.macchine_collegate if macchine is None else macchine)
+        ],
+        'ricambi': [
+            {'codice': r.codice, 'descrizione': r.descrizione, 'fornitore': r.fornitore}
+            for r in _in_ordine(foglio.ricambi_utilizzati if ricambi is None else ricambi)
+        ],
+        'note_aggiuntive': foglio.note_aggiuntive,
+        'modalita_pagamento': foglio.modalita_pagamento,
+        'importo_intervento': f"{foglio.importo_intervento:.2f}" if foglio.importo_intervento else None,
+        'pagamento_immediato': bool(foglio.pagamento_immediato),
+        'intervento_in_garanzia': bool(getattr(foglio, 'intervento_in_garanzia', False)),
+        'firma_tecnico_path': foglio.firma_tecnico_path,
+        'firma_cliente_path': foglio.firma_cliente_path,
+        'nome_firmatario_cliente': foglio.nome_firmatario_cliente,
+        'cartella': cartella_documenti(foglio),  # Posizione del file, esclusa dall'impronta
+    }
+
+
+def _hash_file(path):
+    """SHA-256 del contenuto di un file, o None se il file non esiste"""
+    if not path or not os.path.exists(path):
+        return None
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for blocco in iter(lambda: f.read(65536), b''):
+            sha.update(blocco)
+    return sha.hexdigest()
+
+
+def impronta_pdf(dati):
+    """
+    Impronta di tutto ciò che compare nel PDF: campi del foglio, macchine e ricambi,
+    contenuto delle firme (non il loro percorso) e versione del template
+
+    Args:
+        dati (dict): Dati del documento (dati_pdf_foglio)
+
+    Returns:
+        str: Digest SHA-256 esadecimale
+    """
+    contenuto = dict(dati)
+    del contenuto['cartella']
+    contenuto['firma_tecnico_path'] = _hash_file(dati['firma_tecnico_path'])
+    contenuto['firma_cliente_path'] = _hash_file(dati['firma_cliente_path'])
+    contenuto['versione_template'] = VERSIONE_TEMPLATE
+    serializzato = json.dumps(contenuto, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serializzato.encode('utf-8')).hexdigest()
+
+
+def percorso_pdf(dati):
+    """
+    Percorso del PDF per questi dati nella cartella anno/mese/reparto del foglio:
+    uguale finché il contenuto non cambia, anche dopo l'archiviazione (cartella creata se manca)
+    """
+    return os.path.join(
+        cartella_assoluta('pdf', dati['cartella']), f"{dati['numero_foglio']}_{impronta_pdf(dati)[:16]}.pdf"
+    )
+
+
+def rimuovi_pdf_superati(numero_foglio, da_tenere=None):
+    """
+    Elimina i PDF di un foglio diversi da quello in uso: file nella cartella del foglio, voci
+    del manifesto e versioni con timestamp della vecchia cartella unica (commit al chiamante).
+    Le copie già archiviate nei contenitori mensili restano.
+
+    Args:
+        numero_foglio (str): Numero del foglio
+        da_tenere (str, optional): Path del PDF corrente, da non eliminare
+
+    Returns:
+        int: Numero di file eliminati
+    """
+    cartelle = {os.path.join(current_app.config['UPLOAD_FOLDER'], 'fogli_tecnici_pdf')}
+    if da_tenere:
+        cartelle.add(os.path.dirname(da_tenere))
+    candidati = set(percorsi_sciolti(numero_foglio))
+    for cartella in cartelle:
+        candidati.update(glob.glob(os.path.join(cartella, f"{glob.escape(numero_foglio)}_*.pdf")))
+
+    da_tenere = os.path.normcase(os.path.abspath(da_tenere)) if da_tenere else None
+    return rimuovi_documenti([
+        path for path in candidati if os.path.normcase(os.path.abspath(path)) != da_tenere
+    ])
+
+
+def pdf_gia_registrato(foglio, pdf_path):
+    """True se il foglio punta già a questo PDF e il documento esiste (anche archiviato)"""
+    return bool(foglio.pdf_generato and foglio.pdf_path == pdf_path and documento_disponibile(pdf_path))
+
+
+def registra_pdf_foglio(foglio_id, pdf_path):
+    """Collega al foglio il PDF appena generato ed elimina le versioni superate"""
+    foglio = FoglioTecnico.query.get(foglio_id)
+    if not foglio:
+        return
+    foglio.pdf_generato = True
+    foglio.pdf_path = pdf_path
+    foglio.updated_at = datetime.utcnow()
+    registra_documento(pdf_path, foglio.numero_foglio, foglio.id)
+    db.session.commit()
+    current_app.logger.info(f"PDF generato con ReportLab per foglio {foglio.numero_foglio}: {pdf_path}")
+    rimuovi_pdf_superati(foglio.numero_foglio, da_tenere=pdf_path)
+    db.session.commit()
+
+
+def genera_pdf_foglio_tecnico(foglio_id):
+    """
+    Genera un PDF per il foglio tecnico usando SOLO ReportLab, nel processo corrente
+    (le richieste web passano dalla coda di app/services/coda_pdf.py).
+    Se esiste già il PDF con la stessa impronta viene restituito senza ridisegnarlo.
+    
+    Args:
+        foglio_id (int): ID del foglio tecnico
+        
+    Returns:
+        str: Path del file PDF generato
+    """
+    # Carica foglio dal database
+    foglio = FoglioTecnico.query.get(foglio_id)
+    if not foglio:
+        raise ValueError(f"Foglio tecnico {foglio_id} non trovato")
+
+    try:
+        dati = dati_pdf_foglio(foglio)
+        pdf_path = percorso_pdf(dati)
+        if pdf_gia_registrato(foglio, pdf_path):
+            return pdf_path
+        if not os.path.exists(pdf_path):
+            disegna_pdf_foglio(dati, pdf_path)
+        registra_pdf_foglio(foglio.id, pdf_path)
         return pdf_path
 
     except Exception as e:
@@ -630,6 +476,143 @@ def genera_pdf_foglio_tecnico(foglio_id):
         raise Exception(f"Errore nella generazione del PDF: {str(e)}")
 
 
+def disegna_pdf_foglio(dati, pdf_path):
+    """
+    Disegna il PDF di un foglio tecnico - design minimal e pulito.
+    Non usa l'app context né il database, così può girare nei processi del pool.
+
+    Args:
+        dati (dict): Dati del documento (dati_pdf_foglio)
+        pdf_path (str): File da scrivere (sostituito in modo atomico a fine rendering)
+    """
+    # Crea documento PDF - MINIMAL (scritto su un file temporaneo per processo:
+    # due rendering dello stesso contenuto non si sovrascrivono a metà)
+    tmp_path = f"{pdf_path}.{os.getpid()}.tmp"
+    doc = SimpleDocTemplate(
+        tmp_path,
+        pagesize=A4,
+        topMargin=MARGINE,
+        bottomMargin=MARGINE,
+        leftMargin=MARGINE,
+        rightMargin=MARGINE
+    )
+    doc.pie_pagina = (datetime.now().strftime('%d/%m/%Y alle %H:%M'), dati['numero_foglio'])
+
+    # === CONTENUTO === (l'intestazione aziendale è disegnata da _disegna_prima_pagina)
+    story = [Spacer(1, ALTEZZA_INTESTAZIONE)]
+
+    # === TITOLO FOGLIO TECNICO ===
+    story.append(Paragraph("FOGLIO TECNICO DI INTERVENTO", STILI['doc_title']))
+    story.append(Paragraph(f"N° {dati['numero_foglio']}", STILI['doc_number']))
+
+    # === SEZIONE: INFORMAZIONI GENERALI ===
+    story.append(_intestazione_sezione("INFORMAZIONI GENERALI"))
+
+    # Campi informazioni generali in griglia 2 colonne
+    info_fields = [
+        [_campo("CLIENTE", dati['cliente'] or "N/A"), _campo("TECNICO", dati['tecnico'])],
+        [_campo("DATA E ORA", dati['data_intervento']), _campo("CATEGORIA", dati['categoria'] or 'Non specificata')],
+        [_campo("PRIORITÀ", dati['priorita'] or 'Media'), _campo("STATO", dati['stato'])],
+    ]
+    # Riga opzionale: Durata | Km percorsi
+    if dati['durata_intervento'] or dati['km_percorsi']:
+        info_fields.append([
+            _campo("DURATA", f"{dati['durata_intervento']} minuti" if dati['durata_intervento'] else "N/A"),
+            _campo("KM PERCORSI", f"{dati['km_percorsi']} km" if dati['km_percorsi'] else "N/A"),
+        ])
+    story.append(_riquadro(info_fields, [META_CONTENUTO, META_CONTENUTO], STILE_GRIGLIA))
+    story.append(Spacer(1, 15))
+
+    # === SEZIONE: DETTAGLI INTERVENTO ===
+    if dati['titolo'] or dati['descrizione'] or dati['indirizzo_intervento']:
+        story.append(_intestazione_sezione("DETTAGLI INTERVENTO"))
+
+        details_content = []
+        if dati['titolo']:
+            details_content.append(_campo("OGGETTO", dati['titolo']))
+        if dati['descrizione']:
+            details_content.append(_campo("DESCRIZIONE", dati['descrizione'].replace('\n', '<br/>'), 'box_text'))
+        if dati['indirizzo_intervento']:
+            details_content.append(_campo("LUOGO INTERVENTO", dati['indirizzo_intervento']))
+
+        story.append(_riquadro(details_content, [4*cm, 13*cm], STILE_GRIGLIA))
+        story.append(Spacer(1, 15))
+
+    # === SEZIONE: MACCHINE ===
+    if dati['macchine']:
+        story.append(_intestazione_sezione("MACCHINE E ATTREZZATURE"))
+
+        macchine_data = []
+        for i, macchina in enumerate(dati['macchine'], 1):
+            macchina_text = f"{i}. {macchina['codice']} - {macchina['marca']} {macchina['modello']}"
+            if macchina['numero_serie']:
+                macchina_text += f"<br/>S/N: {macchina['numero_serie']}"
+            macchine_data.append([Paragraph(macchina_text, STILI['box_text'])])
+
+        story.append(_riquadro(macchine_data, [LARGHEZZA_CONTENUTO], STILE_ELENCO))
+        story.append(Spacer(1, 15))
+
+    # === SEZIONE: RICAMBI ===
+    if dati['ricambi']:
+        story.append(_intestazione_sezione("RICAMBI E MATERIALI"))
+
+        ricambi_data = []
+        for i, ricambio in enumerate(dati['ricambi'], 1):
+            ricambio_text = f"{i}. {ricambio['codice']} - {ricambio['descrizione']}"
+            if ricambio['fornitore']:
+                ricambio_text += f"<br/>Fornitore: {ricambio['fornitore']}"
+            ricambi_data.append([Paragraph(ricambio_text, STILI['box_text'])])
+
+        story.append(_riquadro(ricambi_data, [LARGHEZZA_CONTENUTO], STILE_ELENCO))
+        story.append(Spacer(1, 15))
+
+    # === SEZIONE: NOTE ===
+    if dati['note_aggiuntive']:
+        story.append(_intestazione_sezione("NOTE E OSSERVAZIONI"))
+        story.append(_riquadro(
+            [[Paragraph(dati['note_aggiuntive'].replace('\n', '<br/>'), STILI['box_text'])]],
+            [LARGHEZZA_CONTENUTO],
+            STILE_NOTE
+        ))
+        story.append(Spacer(1, 15))
+
+    # === SEZIONE: INFORMAZIONI COMMERCIALI ===
+    if dati['modalita_pagamento'] or dati['importo_intervento']:
+        story.append(_intestazione_sezione("INFORMAZIONI COMMERCIALI"))
+
+        if dati['importo_intervento']:
+            importo_cell = _campo("IMPORTO", f"€ {dati['importo_intervento']}", 'importo')
+        else:
+            importo_cell = _campo("IMPORTO", "N/A")
+        comm_fields = [
+            [_campo("MODALITÀ DI PAGAMENTO", dati['modalita_pagamento'] or "N/A"), importo_cell],
+            [_campo("GIÀ PAGATO", 'Sì' if dati['pagamento_immediato'] else 'No'),
+             _campo("IN GARANZIA", 'Sì' if dati['intervento_in_garanzia'] else 'No')],
+        ]
+        story.append(_riquadro(comm_fields, [META_CONTENUTO, META_CONTENUTO], STILE_GRIGLIA))
+        story.append(Spacer(1, 15))
+
+    # === SEZIONE: FIRME ===
+    story.append(_intestazione_sezione("FIRME DI ACCETTAZIONE"))
+    story.append(_riquadro(
+        [[
+            _firma(dati['firma_tecnico_path'], dati['tecnico'], "TECNICO"),
+            _firma(dati['firma_cliente_path'], dati['nome_firmatario_cliente'], "CLIENTE"),
+        ]],
+        [META_CONTENUTO, META_CONTENUTO],
+        STILE_FIRME
+    ))
+
+    # Genera PDF: il file definitivo compare solo a documento completo
+    try:
+        doc.build(story, onFirstPage=_disegna_prima_pagina, onLaterPages=_disegna_pie_pagina)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, pdf_path)
+
+
 # Funzioni di utilità
 def get_foglio_pdf_path(foglio_id):
     """
@@ -639,13 +622,13 @@ def get_foglio_pdf_path(foglio_id):
         foglio_id (int): ID del foglio tecnico
         
     Returns:
-        str|None: Path del PDF o None se non esiste
+        str|None: Path del PDF (anche archiviato: leggerlo con archivio_pdf.apri_documento) o None se non esiste
     """
     foglio = FoglioTecnico.query.get(foglio_id)
     if not foglio or not foglio.pdf_generato or not foglio.pdf_path:
         return None
     
-    if os.path.exists(foglio.pdf_path):
+    if documento_disponibile(foglio.pdf_path):
         return foglio.pdf_path
     
     # Se il record dice che esiste ma il file no, aggiorna il database
@@ -671,9 +654,9 @@ def elimina_pdf_foglio_tecnico(foglio_id):
         if not foglio:
             return False
         
-        # Elimina file fisico se esiste
-        if foglio.pdf_path and os.path.exists(foglio.pdf_path):
-            os.remove(foglio.pdf_path)
+        # Elimina file fisico se esiste (le copie archiviate restano nel contenitore)
+        if foglio.pdf_path:
+            rimuovi_documenti([foglio.pdf_path])
         
         # Aggiorna database
         foglio.pdf_generato = False
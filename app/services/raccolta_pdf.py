@@ -0,0 +1,312 @@
+"""
+Raccolte PDF dei fogli tecnici (es. tutti i fogli del mese per la contabilità)
+I fogli sono selezionati per periodo, cliente, tecnico e reparto; i PDF mancanti o superati
+vengono disegnati in parallelo su un pool di processi dedicato, poi uniti in un unico PDF
+con segnalibri oppure raccolti in uno ZIP scaricabile.
+"""
+
+from flask import current_app
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import io
+import os
+import threading
+import uuid
+import zipfile
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models.foglio_tecnico import FoglioTecnico, foglio_macchine, foglio_ricambi
+from app.models.macchina import Macchina
+from app.models.ricambio import Ricambio
+from app.services.archivio_pdf import leggi_documento
+from app.services.pdf_generator import (
+    dati_pdf_foglio, disegna_pdf_foglio, percorso_pdf, pdf_gia_registrato, registra_pdf_foglio
+)
+
+FORMATI = ('pdf', 'zip')
+
+# Fogli letti dal database per blocco
+CHUNK_DATI = 200
+
+# Per quanto tempo restano scaricabili le raccolte generate
+DURATA_RACCOLTE = timedelta(days=1)
+
+# Stato delle raccolte avviate da interfaccia web (job_id -> dizionario stato)
+_raccolta_jobs = {}
+_raccolta_lock = threading.Lock()
+
+
+def filtra_fogli(query, data_da=None, data_a=None, cliente_id=None, tecnico_id=None, department_id=None):
+    """
+    Applica i filtri della raccolta a una query sui fogli tecnici
+
+    Args:
+        query: Query di partenza (es. già ristretta ai reparti accessibili)
+        data_da (date, optional): Primo giorno del periodo (data intervento)
+        data_a (date, optional): Ultimo giorno del periodo, incluso
+        cliente_id, tecnico_id, department_id (int, optional): Filtri per ID
+
+    Returns:
+        Query: Fogli selezionati, in ordine di data intervento e numero
+    """
+    if data_da:
+        query = query.filter(FoglioTecnico.data_intervento >= datetime.combine(data_da, datetime.min.time()))
+    if data_a:
+        query = query.filter(FoglioTecnico.data_intervento < datetime.combine(data_a + timedelta(days=1), datetime.min.time()))
+    if cliente_id:
+        query = query.filter(FoglioTecnico.cliente_id == cliente_id)
+    if tecnico_id:
+        query = query.filter(FoglioTecnico.tecnico_id == tecnico_id)
+    if department_id:
+        query = query.filter(FoglioTecnico.department_id == department_id)
+    return query.order_by(FoglioTecnico.data_intervento, FoglioTecnico.numero_foglio)
+
+
+def _collegati(tabella, modello, colonna, foglio_ids):
+    """Oggetti collegati a più fogli con una sola query (foglio_id -> lista)"""
+    per_foglio = {foglio_id: [] for foglio_id in foglio_ids}
+    righe = db.session.execute(
+        select(tabella.c.foglio_id, modello)
+        .join(modello, modello.id == colonna)
+        .where(tabella.c.foglio_id.in_(foglio_ids))
+    ).all()
+    for foglio_id, oggetto in righe:
+        per_foglio[foglio_id].append(oggetto)
+    return per_foglio
+
+
+def _carica_blocco(foglio_ids):
+    """Fogli di un blocco con cliente, tecnico, macchine e ricambi caricati in quattro query"""
+    fogli = FoglioTecnico.query.options(
+        joinedload(FoglioTecnico.cliente), joinedload(FoglioTecnico.tecnico)
+    ).filter(FoglioTecnico.id.in_(foglio_ids)).all()
+    macchine = _collegati(foglio_macchine, Macchina, foglio_macchine.c.macchina_id, foglio_ids)
+    ricambi = _collegati(foglio_ricambi, Ricambio, foglio_ricambi.c.ricambio_id, foglio_ids)
+    return {
+        foglio.id: (foglio, dati_pdf_foglio(foglio, macchine[foglio.id], ricambi[foglio.id]))
+        for foglio in fogli
+    }
+
+
+def _etichetta(dati):
+    """Titolo del segnalibro di un foglio nella raccolta"""
+    etichetta = f"{dati['numero_foglio']} - {dati['data_intervento'][:10]}"
+    if dati['cliente']:
+        etichetta += f" - {dati['cliente']}"
+    return etichetta
+
+
+def prepara_pdf_fogli(foglio_ids, processi=None, progress=None):
+    """
+    Garantisce che ogni foglio abbia il PDF aggiornato, disegnando in parallelo quelli
+    mancanti o superati
+
+    Args:
+        foglio_ids (list): ID dei fogli, nell'ordine della raccolta
+        processi (int, optional): Processi di rendering (default: PDF_RENDER_PROCESSES)
+        progress (callable, optional): Chiamata come progress(elaborati, totale)
+
+    Returns:
+        tuple: (voci, errori) con voci = [(numero_foglio, etichetta, pdf_path)] nell'ordine
+        richiesto ed errori = [(numero_foglio, messaggio)]
+    """
+    processi = processi or current_app.config.get('PDF_RENDER_PROCESSES') or os.cpu_count() or 1
+    totale = len(foglio_ids)
+    pronti = {}
+    da_disegnare = []
+    errori = []
+    elaborati = 0
+
+    for inizio in range(0, totale, CHUNK_DATI):
+        blocco = foglio_ids[inizio:inizio + CHUNK_DATI]
+        for foglio_id, (foglio, dati) in _carica_blocco(blocco).items():
+            pdf_path = percorso_pdf(dati)
+            voce = (dati['numero_foglio'], _etichetta(dati), pdf_path)
+            if pdf_gia_registrato(foglio, pdf_path):
+                pronti[foglio_id] = voce
+                elaborati += 1
+            elif os.path.exists(pdf_path):
+                registra_pdf_foglio(foglio_id, pdf_path)
+                pronti[foglio_id] = voce
+                elaborati += 1
+            else:
+                da_disegnare.append((foglio_id, dati, voce))
+        # Libera gli oggetti del blocco: restano solo i dizionari da disegnare
+        db.session.expunge_all()
+        if progress:
+            progress(elaborati, totale)
+
+    if da_disegnare:
+        with ProcessPoolExecutor(max_workers=min(processi, len(da_disegnare))) as pool:
+            futures = {
+                pool.submit(disegna_pdf_foglio, dati, voce[2]): (foglio_id, voce)
+                for foglio_id, dati, voce in da_disegnare
+            }
+            for future in as_completed(futures):
+                foglio_id, voce = futures[future]
+                try:
+                    future.result()
+                    registra_pdf_foglio(foglio_id, voce[2])
+                    pronti[foglio_id] = voce
+                except Exception as e:
+                    db.session.rollback()
+                    current_app.logger.error(f"Errore generazione PDF per foglio {voce[0]}: {str(e)}")
+                    errori.append((voce[0], str(e)))
+                elaborati += 1
+                if progress:
+                    progress(elaborati, totale)
+
+    return [pronti[foglio_id] for foglio_id in foglio_ids if foglio_id in pronti], errori
+
+
+def unisci_pdf(voci, destinazione):
+    """Unisce i PDF in un unico documento con un segnalibro per foglio (anche dai contenitori di archivio)"""
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for _, etichetta, pdf_path in voci:
+        sorgente = pdf_path if os.path.exists(pdf_path) else io.BytesIO(leggi_documento(pdf_path))
+        writer.append(sorgente, outline_item=etichetta)
+    with open(destinazione, 'wb') as f:
+        writer.write(f)
+    writer.close()
+
+
+def comprimi_zip(voci, destinazione):
+    """Raccoglie i PDF in uno ZIP, un file per foglio (già compressi: nessuna ricompressione)"""
+    with zipfile.ZipFile(destinazione, 'w', zipfile.ZIP_STORED) as archivio:
+        for numero_foglio, _, pdf_path in voci:
+            arcname = f"FoglioTecnico_{numero_foglio}.pdf"
+            if os.path.exists(pdf_path):
+                archivio.write(pdf_path, arcname=arcname)
+            else:
+                archivio.writestr(arcname, leggi_documento(pdf_path))
+
+
+def genera_raccolta(foglio_ids, formato, destinazione, processi=None, progress=None):
+    """
+    Genera la raccolta dei PDF dei fogli indicati
+
+    Args:
+        foglio_ids (list): ID dei fogli, nell'ordine della raccolta
+        formato (str): 'pdf' (documento unico con segnalibri) o 'zip'
+        destinazione (str): File da scrivere
+        processi (int, optional): Processi di rendering
+        progress (callable, optional): Chiamata come progress(elaborati, totale)
+
+    Returns:
+        dict: Fogli inclusi e fogli scartati con il motivo
+    """
+    if formato not in FORMATI:
+        raise ValueError(f"Formato non supportato: {formato}")
+    if not foglio_ids:
+        raise ValueError("Nessun foglio tecnico corrisponde ai filtri")
+
+    voci, errori = prepara_pdf_fogli(foglio_ids, processi=processi, progress=progress)
+    if not voci:
+        raise ValueError("Nessun PDF generato: " + '; '.join(f"{n}: {m}" for n, m in errori[:5]))
+
+    # Scrive su un file temporaneo: la raccolta compare solo se completa
+    tmp_path = destinazione + '.tmp'
+    try:
+        if formato == 'pdf':
+            unisci_pdf(voci, tmp_path)
+        else:
+            comprimi_zip(voci, tmp_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, destinazione)
+
+    return {
+        'inclusi': len(voci),
+        'errori': [{'numero_foglio': numero, 'messaggio': messaggio} for numero, messaggio in errori]
+    }
+
+
+def _cartella_raccolte():
+    cartella = os.path.join(current_app.config['UPLOAD_FOLDER'], 'raccolte_pdf')
+    os.makedirs(cartella, exist_ok=True)
+    return cartella
+
+
+def _pulisci_raccolte_scadute():
+    """Elimina file e job delle raccolte più vecchie di DURATA_RACCOLTE"""
+    limite = datetime.utcnow() - DURATA_RACCOLTE
+    with _raccolta_lock:
+        for job_id in [j for j, job in _raccolta_jobs.items() if job['created_at'] < limite]:
+            del _raccolta_jobs[job_id]
+
+    cartella = _cartella_raccolte()
+    for nome in os.listdir(cartella):
+        path = os.path.join(cartella, nome)
+        try:
+            if datetime.utcfromtimestamp(os.path.getmtime(path)) < limite:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def avvia_raccolta_in_background(foglio_ids, formato, user_id):
+    """
+    Avvia la generazione di una raccolta in un thread separato
+
+    Args:
+        foglio_ids (list): ID dei fogli, nell'ordine della raccolta
+        formato (str): 'pdf' o 'zip'
+        user_id (int): Utente che ha richiesto la raccolta (l'unico che può scaricarla)
+
+    Returns:
+        str: ID del job da usare per controllarne avanzamento ed esito
+    """
+    if formato not in FORMATI:
+        raise ValueError(f"Formato non supportato: {formato}")
+
+    app = current_app._get_current_object()
+    _pulisci_raccolte_scadute()
+    job_id = uuid.uuid4().hex
+    destinazione = os.path.join(_cartella_raccolte(), f"raccolta_{job_id}.{formato}")
+
+    with _raccolta_lock:
+        _raccolta_jobs[job_id] = {
+            'stato': 'In corso',
+            'formato': formato,
+            'user_id': user_id,
+            'elaborati': 0,
+            'totale': len(foglio_ids),
+            'path': None,
+            'risultato': None,
+            'errore': None,
+            'created_at': datetime.utcnow()
+        }
+
+    def progress(elaborati, totale):
+        with _raccolta_lock:
+            _raccolta_jobs[job_id]['elaborati'] = elaborati
+
+    def target():
+        with app.app_context():
+            try:
+                risultato = genera_raccolta(foglio_ids, formato, destinazione, progress=progress)
+                aggiornamento = {'stato': 'Completato', 'path': destinazione, 'risultato': risultato}
+            except Exception as e:
+                app.logger.error(f"Errore raccolta PDF fogli tecnici: {str(e)}")
+                aggiornamento = {'stato': 'Errore', 'errore': str(e)}
+            finally:
+                db.session.remove()
+            with _raccolta_lock:
+                _raccolta_jobs[job_id].update(aggiornamento)
+
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    return job_id
+
+
+def get_raccolta_job(job_id):
+    """Restituisce lo stato di una raccolta, o None se sconosciuta"""
+    with _raccolta_lock:
+        job = _raccolta_jobs.get(job_id)
+        return dict(job) if job else None
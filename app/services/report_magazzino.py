@@ -0,0 +1,299 @@
+"""
+Servizio per i report del magazzino
+Valorizzazione calcolata in SQL, righe lette a blocchi ed export CSV/PDF in background
+"""
+
+from flask import current_app
+import csv
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import case, select
+from app import db
+from app.models.ricambio import Ricambio
+from app.models.department import Department
+
+# Righe lette dal database per ogni blocco durante lo streaming
+CHUNK_RIGHE = 1000
+
+# Per quanto tempo restano scaricabili gli export generati
+DURATA_EXPORT = timedelta(days=1)
+
+# Stato dei job di export in background (job_id -> dizionario stato)
+_export_jobs = {}
+_export_lock = threading.Lock()
+
+
+def _quantita_effettiva():
+    return Ricambio.quantita_disponibile - Ricambio.quantita_prenotata
+
+
+def _valore_positivo():
+    """Espressione SQL del valore dei soli pezzi effettivamente disponibili"""
+    return case(
+        (_quantita_effettiva() > 0, _quantita_effettiva() * Ricambio.prezzo_unitario),
+        else_=0
+    )
+
+
+def valore_totale_magazzino():
+    """Valore totale del magazzino calcolato dal database"""
+    return db.session.query(
+        db.func.sum(_valore_positivo())
+    ).filter(Ricambio.prezzo_unitario.isnot(None)).scalar() or 0
+
+
+def valorizzazione_per_gruppo():
+    """
+    Valorizzazione del magazzino raggruppata per reparto, fornitore e ubicazione
+
+    Returns:
+        list: Righe con reparto, fornitore, ubicazione, numero ricambi, pezzi e valore
+    """
+    return db.session.query(
+        Department.display_name.label('reparto'),
+        Ricambio.fornitore,
+        Ricambio.ubicazione,
+        db.func.count(Ricambio.id).label('numero_ricambi'),
+        db.func.sum(_quantita_effettiva()).label('pezzi'),
+        db.func.sum(_valore_positivo()).label('valore')
+    ).join(Department, Ricambio.department_id == Department.id)\
+     .filter(Ricambio.prezzo_unitario.isnot(None))\
+     .group_by(Department.display_name, Ricambio.fornitore, Ricambio.ubicazione)\
+     .order_by(Department.display_name, Ricambio.fornitore, Ricambio.ubicazione)\
+     .all()
+
+
+def _stato_disponibilita(disponibile, prenotata, minima):
+    """Stessa logica di Ricambio.stato_disponibilita senza caricare l'oggetto ORM"""
+    if max(0, disponibile - prenotata) == 0:
+        return 'Esaurito'
+    if minima and minima > 0 and disponibile <= minima:
+        return 'Sotto scorta'
+    if prenotata > 0:
+        return 'Parzialmente prenotato'
+    return 'Disponibile'
+
+
+def iter_righe_report():
+    """
+    Generatore delle righe del report, lette a blocchi senza istanziare oggetti ORM
+
+    Yields:
+        dict: Dati di una riga del report
+    """
+    stmt = select(
+        Ricambio.codice,
+        Ricambio.descrizione,
+        Ricambio.quantita_disponibile,
+        Ricambio.quantita_prenotata,
+        Ricambio.quantita_minima,
+        Ricambio.prezzo_unitario,
+        Ricambio.fornitore,
+        Ricambio.ubicazione
+    ).where(
+        Ricambio.prezzo_unitario.isnot(None)
+    ).order_by(Ricambio.codice).execution_options(yield_per=CHUNK_RIGHE)
+
+    for row in db.session.execute(stmt):
+        effettiva = row.quantita_disponibile - row.quantita_prenotata
+        yield {
+            'codice': row.codice,
+            'descrizione': row.descrizione,
+            'disponibile': row.quantita_disponibile,
+            'prenotata': row.quantita_prenotata,
+            'effettiva': effettiva,
+            'minima': row.quantita_minima,
+            'prezzo': row.prezzo_unitario,
+            'valore': effettiva * row.prezzo_unitario,
+            'fornitore': row.fornitore,
+            'ubicazione': row.ubicazione,
+            'stato': _stato_disponibilita(row.quantita_disponibile, row.quantita_prenotata, row.quantita_minima)
+        }
+
+
+def conta_righe_report():
+    """Numero di ricambi inclusi nel report"""
+    return Ricambio.query.filter(Ricambio.prezzo_unitario.isnot(None)).count()
+
+
+def genera_report_csv(path):
+    """Scrive il report completo in CSV (separatore ';' per Excel italiano)"""
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(['Codice', 'Descrizione', 'Disponibile', 'Prenotata', 'Effettiva', 'Minima',
+                         'Prezzo', 'Valore', 'Fornitore', 'Ubicazione', 'Stato'])
+        for r in iter_righe_report():
+            writer.writerow([
+                r['codice'], r['descrizione'], r['disponibile'], r['prenotata'], r['effettiva'],
+                r['minima'], f"{r['prezzo']:.2f}", f"{r['valore']:.2f}",
+                r['fornitore'] or '', r['ubicazione'] or '', r['stato']
+            ])
+
+
+def genera_report_pdf(path):
+    """
+    Scrive il report in PDF disegnando le righe direttamente sul canvas,
+    così la memoria resta costante anche con decine di migliaia di ricambi
+    """
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.lib.units import cm
+    from reportlab.pdfgen import canvas
+
+    larghezza, altezza = landscape(A4)
+    margine = 1.2 * cm
+    riga_h = 0.45 * cm
+    # (intestazione, chiave, x, larghezza massima in caratteri, allineamento a destra)
+    colonne = [
+        ('Codice', 'codice', 0, 16, False),
+        ('Descrizione', 'descrizione', 3.2, 32, False),
+        ('Disp.', 'disponibile', 11.2, 0, True),
+        ('Pren.', 'prenotata', 12.5, 0, True),
+        ('Eff.', 'effettiva', 13.8, 0, True),
+        ('Min.', 'minima', 15.1, 0, True),
+        ('Prezzo', 'prezzo', 17.0, 0, True),
+        ('Valore', 'valore', 19.2, 0, True),
+        ('Fornitore', 'fornitore', 19.6, 12, False),
+        ('Ubicazione', 'ubicazione', 21.8, 10, False),
+        ('Stato', 'stato', 23.8, 24, False),
+    ]
+    generato_il = datetime.now().strftime('%d/%m/%Y %H:%M')
+
+    c = canvas.Canvas(path, pagesize=(larghezza, altezza))
+    pagina = 1
+
+    def intestazione():
+        c.setFont('Helvetica-Bold', 14)
+        c.drawString(margine, altezza - margine, 'Report Magazzino - DB-Desk')
+        c.setFont('Helvetica', 8)
+        c.drawRightString(larghezza - margine, altezza - margine, f'Generato il {generato_il} - Pagina {pagina}')
+        y = altezza - margine - 1 * cm
+        c.setFont('Helvetica-Bold', 8)
+        for titolo, _, x, _, destra in colonne:
+            if destra:
+                c.drawRightString(margine + x * cm, y, titolo)
+            else:
+                c.drawString(margine + x * cm, y, titolo)
+        c.line(margine, y - 0.15 * cm, larghezza - margine, y - 0.15 * cm)
+        c.setFont('Helvetica', 7.5)
+        return y - riga_h
+
+    y = intestazione()
+    for r in iter_righe_report():
+        if y < margine:
+            c.showPage()
+            pagina += 1
+            y = intestazione()
+        for _, chiave, x, max_car, destra in colonne:
+            valore = r[chiave]
+            if chiave in ('prezzo', 'valore'):
+                testo = f'€{valore:.2f}'
+            else:
+                testo = str(valore) if valore is not None else '-'
+                if max_car and len(testo) > max_car:
+                    testo = testo[:max_car - 1] + '…'
+            if destra:
+                c.drawRightString(margine + x * cm, y, testo)
+            else:
+                c.drawString(margine + x * cm, y, testo)
+        y -= riga_h
+
+    c.setFont('Helvetica-Bold', 9)
+    c.drawString(margine, max(y - riga_h, margine / 2),
+                 f'Valore totale magazzino: €{valore_totale_magazzino():.2f}')
+    c.save()
+
+
+def _cartella_export():
+    export_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'report_magazzino')
+    os.makedirs(export_dir, exist_ok=True)
+    return export_dir
+
+
+def pulisci_export_scaduti():
+    """
+    Elimina job e file degli export più vecchi di DURATA_EXPORT (gli export in corso restano)
+
+    Returns:
+        int: Numero di file eliminati
+    """
+    limite = datetime.utcnow() - DURATA_EXPORT
+    with _export_lock:
+        in_corso = {job['path'] for job in _export_jobs.values() if job['stato'] == 'In corso'}
+        for job_id in [j for j, job in _export_jobs.items() if job['stato'] != 'In corso' and job['created_at'] < limite]:
+            del _export_jobs[job_id]
+
+    eliminati = 0
+    cartella = _cartella_export()
+    for nome in os.listdir(cartella):
+        path = os.path.join(cartella, nome)
+        if path in in_corso:
+            continue
+        try:
+            if datetime.utcfromtimestamp(os.path.getmtime(path)) < limite:
+                os.remove(path)
+                eliminati += 1
+        except OSError:
+            pass
+    return eliminati
+
+
+def avvia_export_report(formato):
+    """
+    Avvia la generazione del report in un thread separato
+
+    Args:
+        formato (str): 'csv' oppure 'pdf'
+
+    Returns:
+        str: ID del job da usare per controllarne lo stato
+    """
+    if formato not in ('csv', 'pdf'):
+        raise ValueError(f"Formato non supportato: {formato}")
+
+    app = current_app._get_current_object()
+    pulisci_export_scaduti()
+    export_dir = _cartella_export()
+
+    job_id = uuid.uuid4().hex
+    filename = f"report_magazzino_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{formato}"
+    path = os.path.join(export_dir, filename)
+
+    with _export_lock:
+        _export_jobs[job_id] = {
+            'stato': 'In corso',
+            'formato': formato,
+            'filename': filename,
+            'path': path,
+            'errore': None,
+            'created_at': datetime.utcnow()
+        }
+
+    def target():
+        with app.app_context():
+            try:
+                if formato == 'csv':
+                    genera_report_csv(path)
+                else:
+                    genera_report_pdf(path)
+                stato, errore = 'Completato', None
+            except Exception as e:
+                app.logger.error(f"Errore export report magazzino ({formato}): {str(e)}")
+                stato, errore = 'Errore', str(e)
+            finally:
+                db.session.remove()
+            with _export_lock:
+                _export_jobs[job_id].update(stato=stato, errore=errore)
+
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    return job_id
+
+
+def get_export_job(job_id):
+    """Restituisce lo stato di un job di export, o None se sconosciuto"""
+    with _export_lock:
+        job = _export_jobs.get(job_id)
+        return dict(job) if job else None
@@ -0,0 +1,172 @@
+"""
+Servizio di ricerca macchine su codice/matricola normalizzati e indice trigrammi
+Ordinamento per rilevanza: codice o matricola esatti > prefisso > somiglianza trigrammi
+(codice, matricola, marca e modello). Usato dalle API di ricerca di macchine, ticket e fogli.
+"""
+
+import math
+from sqlalchemy import case, select, update
+from app import db
+from app.models.macchina import Macchina, MacchinaTrigramma, trigrammi_macchina
+from app.utils.ricerca import escape_like, normalizza_codice, trigrammi_termine
+
+# Frazione minima dei trigrammi del termine che una macchina deve contenere
+SOGLIA_SIMILARITA = 0.6
+
+PER_PAGE_DEFAULT = 20
+PER_PAGE_MASSIMO = 100
+
+
+def _subquery_trigrammi(termine):
+    """Subquery (macchina_id, hits) delle macchine simili al termine, o None se il termine è troppo corto"""
+    trigrammi = trigrammi_termine(termine)
+    if not trigrammi:
+        return None
+
+    minimo = max(1, math.ceil(len(trigrammi) * SOGLIA_SIMILARITA))
+    hits = db.func.count(MacchinaTrigramma.trigramma)
+    return select(
+        MacchinaTrigramma.macchina_id,
+        hits.label('hits')
+    ).where(
+        MacchinaTrigramma.trigramma.in_(trigrammi)
+    ).group_by(MacchinaTrigramma.macchina_id).having(hits >= minimo).subquery()
+
+
+def rilevanza(termine):
+    """Espressione SQL di ordinamento: 0 codice/matricola esatti, 1 prefisso, 2 altri risultati"""
+    normalizzato = normalizza_codice(termine)
+    return case(
+        (Macchina.codice_normalizzato == normalizzato, 0),
+        (Macchina.numero_serie_normalizzato == normalizzato, 0),
+        (Macchina.codice_normalizzato.like(f'{normalizzato}%'), 1),
+        (Macchina.numero_serie_normalizzato.like(f'{normalizzato}%'), 1),
+        else_=2
+    )
+
+
+def query_ricerca(termine, query=None):
+    """
+    Query delle macchine che corrispondono al termine, ordinata per rilevanza
+
+    Args:
+        termine (str): Testo digitato dall'utente (vuoto = tutte, in ordine di codice)
+        query: Query di partenza (es. già filtrata per reparto e stato)
+
+    Returns:
+        Query ordinata, da paginare
+    """
+    base = query if query is not None else Macchina.query
+    normalizzato = normalizza_codice(termine)
+    if not normalizzato:
+        return base.order_by(Macchina.codice)
+
+    prefisso = db.or_(
+        Macchina.codice_normalizzato.like(f'{normalizzato}%'),
+        Macchina.numero_serie_normalizzato.like(f'{normalizzato}%')
+    )
+
+    simili = _subquery_trigrammi(termine)
+    if simili is None:
+        # Termine di 1-2 caratteri: nessun trigramma, cerca marca e modello che iniziano così
+        termine = termine.strip()
+        iniziale = f'{escape_like(termine)}%'
+        return base.filter(db.or_(
+            prefisso,
+            Macchina.marca.ilike(iniziale, escape='\\'),
+            Macchina.modello.ilike(iniziale, escape='\\')
+        )).order_by(rilevanza(termine), Macchina.codice)
+
+    return base.outerjoin(simili, Macchina.id == simili.c.macchina_id).filter(
+        db.or_(prefisso, simili.c.macchina_id.isnot(None))
+    ).order_by(rilevanza(termine), simili.c.hits.desc(), Macchina.codice)
+
+
+def cerca_macchine(termine, query=None, page=1, per_page=PER_PAGE_DEFAULT):
+    """
+    Ricerca paginata e ordinata per rilevanza
+
+    Args:
+        termine (str): Testo digitato dall'utente
+        query: Query di partenza (es. già filtrata per reparto e stato)
+        page (int): Pagina richiesta
+        per_page (int): Risultati per pagina (limitati a PER_PAGE_MASSIMO)
+
+    Returns:
+        Pagination: pagina di macchine
+    """
+    per_page = max(1, min(per_page or PER_PAGE_DEFAULT, PER_PAGE_MASSIMO))
+    return query_ricerca(termine, query).paginate(page=page, per_page=per_page, error_out=False)
+
+
+def metadati_pagina(pagination):
+    """Metadati di paginazione comuni alle API di ricerca macchine"""
+    return {
+        'total': pagination.total,
+        'page': pagination.page,
+        'pages': pagination.pages,
+        'has_more': pagination.has_next,
+    }
+
+
+def indicizza_macchine(righe, sostituisci=True):
+    """
+    Scrive codici normalizzati e trigrammi per macchine inserite/aggiornate in blocco
+    (le scritture bulk non passano dagli eventi di flush della sessione)
+
+    Args:
+        righe (list): Elementi con attributi id, codice, numero_serie, marca e modello
+        sostituisci (bool): Rimuove prima i trigrammi esistenti delle macchine
+    """
+    if not righe:
+        return
+
+    tabella = MacchinaTrigramma.__table__
+    if sostituisci:
+        db.session.execute(tabella.delete().where(tabella.c.macchina_id.in_([r.id for r in righe])))
+
+    db.session.execute(update(Macchina), [
+        {
+            'id': r.id,
+            'codice_normalizzato': normalizza_codice(r.codice),
+            'numero_serie_normalizzato': normalizza_codice(r.numero_serie) or None,
+        }
+        for r in righe
+    ])
+    trigrammi = [
+        {'trigramma': t, 'macchina_id': r.id}
+        for r in righe
+        for t in trigrammi_macchina(r)
+    ]
+    if trigrammi:
+        db.session.execute(tabella.insert(), trigrammi)
+
+
+def ricostruisci_indice_ricerca(chunk_size=1000):
+    """
+    Ricalcola codici normalizzati e trigrammi di tutte le macchine, a blocchi
+
+    Returns:
+        int: Numero di macchine indicizzate
+    """
+    db.session.execute(MacchinaTrigramma.__table__.delete())
+
+    totale = 0
+    ultimo_id = 0
+    while True:
+        righe = db.session.execute(
+            select(Macchina.id, Macchina.codice, Macchina.numero_serie, Macchina.marca, Macchina.modello)
+            .where(Macchina.id > ultimo_id)
+            .order_by(Macchina.id)
+            .limit(chunk_size)
+        ).all()
+        if not righe:
+            break
+
+        indicizza_macchine(righe, sostituisci=False)
+        db.session.commit()
+
+        totale += len(righe)
+        ultimo_id = righe[-1].id
+
+    return totale
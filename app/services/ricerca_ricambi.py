@@ -0,0 +1,170 @@
+"""
+Servizio di ricerca ricambi su codice normalizzato e indice trigrammi
+Ordinamento per rilevanza: codice esatto > prefisso del codice > somiglianza trigrammi
+"""
+
+import math
+from sqlalchemy import case, select, update
+from app import db
+from app.models.ricambio import Ricambio, RicambioTrigramma
+from app.utils.ricerca import escape_like, normalizza_codice, trigrammi_termine, trigrammi_documento
+
+# Frazione minima dei trigrammi del termine che un ricambio deve contenere
+SOGLIA_SIMILARITA = 0.6
+
+
+def _subquery_trigrammi(termine):
+    """Subquery (ricambio_id, hits) dei ricambi simili al termine, o None se il termine è troppo corto"""
+    trigrammi = trigrammi_termine(termine)
+    if not trigrammi:
+        return None
+
+    minimo = max(1, math.ceil(len(trigrammi) * SOGLIA_SIMILARITA))
+    hits = db.func.count(RicambioTrigramma.trigramma)
+    return select(
+        RicambioTrigramma.ricambio_id,
+        hits.label('hits')
+    ).where(
+        RicambioTrigramma.trigramma.in_(trigrammi)
+    ).group_by(RicambioTrigramma.ricambio_id).having(hits >= minimo).subquery()
+
+
+def rilevanza(termine):
+    """Espressione SQL di ordinamento: 0 codice esatto, 1 prefisso, 2 altri risultati"""
+    normalizzato = normalizza_codice(termine)
+    return case(
+        (Ricambio.codice_normalizzato == normalizzato, 0),
+        (Ricambio.codice_normalizzato.like(f'{normalizzato}%'), 1),
+        else_=2
+    )
+
+
+def filtra_ricerca(query, termine):
+    """
+    Applica il filtro di ricerca a una query di ricambi (per elenchi paginati)
+
+    Args:
+        query: Query di Ricambio da filtrare
+        termine (str): Testo digitato dall'utente
+
+    Returns:
+        Query filtrata
+    """
+    normalizzato = normalizza_codice(termine)
+    if not normalizzato:
+        return query
+
+    condizioni = [Ricambio.codice_normalizzato.like(f'{normalizzato}%')]
+    simili = _subquery_trigrammi(termine)
+    if simili is not None:
+        condizioni.append(Ricambio.id.in_(select(simili.c.ricambio_id)))
+    else:
+        # Termine di 1-2 caratteri: nessun trigramma, cerca le parole della descrizione che iniziano così
+        parola = escape_like(termine.strip())
+        condizioni.append(Ricambio.descrizione.ilike(f'{parola}%', escape='\\'))
+        condizioni.append(Ricambio.descrizione.ilike(f'% {parola}%', escape='\\'))
+
+    return query.filter(db.or_(*condizioni))
+
+
+def cerca_ricambi(termine, limit=10, query=None):
+    """
+    Ricerca per autocomplete, ordinata per rilevanza
+
+    Args:
+        termine (str): Testo digitato dall'utente
+        limit (int): Numero massimo di risultati
+        query: Query di partenza (es. già filtrata per reparto)
+
+    Returns:
+        list: Ricambi trovati
+    """
+    normalizzato = normalizza_codice(termine)
+    if not normalizzato:
+        return []
+
+    base = query if query is not None else Ricambio.query
+
+    # 1-2. Codice esatto e prefisso del codice (range scan sull'indice)
+    risultati = base.filter(
+        Ricambio.codice_normalizzato.like(f'{normalizzato}%')
+    ).order_by(rilevanza(termine), Ricambio.codice_normalizzato).limit(limit).all()
+
+    if len(risultati) >= limit:
+        return risultati
+
+    # 3. Somiglianza trigrammi su codice e descrizione
+    trovati = [r.id for r in risultati]
+    simili = _subquery_trigrammi(termine)
+    if simili is not None:
+        fuzzy = base.join(simili, Ricambio.id == simili.c.ricambio_id)
+        if trovati:
+            fuzzy = fuzzy.filter(Ricambio.id.notin_(trovati))
+        risultati += fuzzy.order_by(
+            simili.c.hits.desc(), Ricambio.codice
+        ).limit(limit - len(risultati)).all()
+    else:
+        fuzzy = filtra_ricerca(base, termine)
+        if trovati:
+            fuzzy = fuzzy.filter(Ricambio.id.notin_(trovati))
+        risultati += fuzzy.order_by(Ricambio.codice).limit(limit - len(risultati)).all()
+
+    return risultati
+
+
+def indicizza_ricambi(righe, sostituisci=True):
+    """
+    Scrive codice normalizzato e trigrammi per ricambi inseriti/aggiornati in blocco
+    (le scritture bulk non passano dagli eventi di flush della sessione)
+
+    Args:
+        righe (list): Elementi con attributi id, codice e descrizione
+        sostituisci (bool): Rimuove prima i trigrammi esistenti dei ricambi
+    """
+    if not righe:
+        return
+
+    tabella = RicambioTrigramma.__table__
+    if sostituisci:
+        db.session.execute(tabella.delete().where(tabella.c.ricambio_id.in_([r.id for r in righe])))
+
+    db.session.execute(update(Ricambio), [
+        {'id': r.id, 'codice_normalizzato': normalizza_codice(r.codice)} for r in righe
+    ])
+    trigrammi = [
+        {'trigramma': t, 'ricambio_id': r.id}
+        for r in righe
+        for t in trigrammi_documento(r.codice, r.descrizione)
+    ]
+    if trigrammi:
+        db.session.execute(tabella.insert(), trigrammi)
+
+
+def ricostruisci_indice_ricerca(chunk_size=1000):
+    """
+    Ricalcola codice normalizzato e trigrammi di tutti i ricambi, a blocchi
+
+    Returns:
+        int: Numero di ricambi indicizzati
+    """
+    db.session.execute(RicambioTrigramma.__table__.delete())
+
+    totale = 0
+    ultimo_id = 0
+    while True:
+        righe = db.session.execute(
+            select(Ricambio.id, Ricambio.codice, Ricambio.descrizione)
+            .where(Ricambio.id > ultimo_id)
+            .order_by(Ricambio.id)
+            .limit(chunk_size)
+        ).all()
+        if not righe:
+            break
+
+        indicizza_ricambi(righe, sostituisci=False)
+        db.session.commit()
+
+        totale += len(righe)
+        ultimo_id = righe[-1].id
+
+    return totale
@@ -0,0 +1,140 @@
+"""
+Servizio per la scadenza automatica delle prenotazioni ricambi
+Eseguito dallo scheduler: marca come scadute in blocco le prenotazioni attive
+oltre la data di scadenza e libera le quantità prenotate con un UPDATE per ricambio
+"""
+
+from flask import current_app
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import bindparam, case, select, update
+from app import db
+from app.models.ricambio import Ricambio, MovimentoMagazzino, PrenotazioneRicambio
+
+# Dimensione dei blocchi di id nelle clausole IN
+CHUNK_IDS = 1000
+
+# Metriche dell'ultima esecuzione e totali dall'avvio del processo
+_metriche = {
+    'ultima_esecuzione': None,
+    'totale_esecuzioni': 0,
+    'totale_prenotazioni_scadute': 0,
+    'totale_pezzi_liberati': 0,
+}
+_metriche_lock = threading.Lock()
+
+
+def get_metriche_scadenze():
+    """Restituisce una copia delle metriche del job di scadenza"""
+    with _metriche_lock:
+        metriche = dict(_metriche)
+        if metriche['ultima_esecuzione']:
+            metriche['ultima_esecuzione'] = dict(metriche['ultima_esecuzione'])
+        return metriche
+
+
+def _registra_metriche(esecuzione):
+    with _metriche_lock:
+        _metriche['ultima_esecuzione'] = esecuzione
+        _metriche['totale_esecuzioni'] += 1
+        _metriche['totale_prenotazioni_scadute'] += esecuzione['prenotazioni_scadute']
+        _metriche['totale_pezzi_liberati'] += esecuzione['pezzi_liberati']
+
+
+def scadi_prenotazioni(adesso=None):
+    """
+    Marca come 'Scaduta' tutte le prenotazioni attive con data di scadenza passata
+
+    Args:
+        adesso (datetime): Istante di riferimento (default: ora UTC)
+
+    Returns:
+        dict: Metriche dell'esecuzione
+    """
+    adesso = adesso or datetime.utcnow()
+    inizio = time.perf_counter()
+    esecuzione = {
+        'eseguito_at': adesso.isoformat(),
+        'prenotazioni_scadute': 0,
+        'ricambi_aggiornati': 0,
+        'pezzi_liberati': 0,
+        'durata_ms': 0,
+        'errore': None,
+    }
+
+    try:
+        # Prenotazioni scadute (range scan su idx_prenotazioni_stato_scadenza), bloccate fino al commit
+        scadute = db.session.execute(
+            select(PrenotazioneRicambio.id, PrenotazioneRicambio.ricambio_id, PrenotazioneRicambio.quantita)
+            .where(
+                PrenotazioneRicambio.stato == 'Attiva',
+                PrenotazioneRicambio.data_scadenza.isnot(None),
+                PrenotazioneRicambio.data_scadenza < adesso
+            )
+            .with_for_update()
+        ).all()
+
+        if scadute:
+            # Quantità da liberare aggregate per ricambio
+            per_ricambio = {}
+            for p in scadute:
+                totale = per_ricambio.setdefault(p.ricambio_id, {'quantita': 0, 'prenotazioni': 0})
+                totale['quantita'] += p.quantita
+                totale['prenotazioni'] += 1
+
+            ids = [p.id for p in scadute]
+            for i in range(0, len(ids), CHUNK_IDS):
+                db.session.execute(
+                    update(PrenotazioneRicambio)
+                    .where(PrenotazioneRicambio.id.in_(ids[i:i + CHUNK_IDS]))
+                    .values(stato='Scaduta', updated_at=adesso)
+                    .execution_options(synchronize_session=False)
+                )
+
+            # Un solo UPDATE (executemany) con una riga di parametri per ricambio
+            ricambi = Ricambio.__table__
+            db.session.execute(
+                ricambi.update()
+                .where(ricambi.c.id == bindparam('r_id'))
+                .values(quantita_prenotata=case(
+                    (ricambi.c.quantita_prenotata > bindparam('r_quantita'),
+                     ricambi.c.quantita_prenotata - bindparam('r_quantita')),
+                    else_=0
+                )),
+                [{'r_id': ricambio_id, 'r_quantita': t['quantita']} for ricambio_id, t in per_ricambio.items()]
+            )
+
+            # Movimenti di audit (rettifica a quantità disponibile invariata)
+            db.session.execute(MovimentoMagazzino.__table__.insert(), [
+                {
+                    'ricambio_id': ricambio_id,
+                    'tipo_movimento': 'Rettifica',
+                    'quantita': 0,
+                    'motivo': f"Scadenza {t['prenotazioni']} prenotazioni: liberati {t['quantita']} pz",
+                    'created_at': adesso,
+                }
+                for ricambio_id, t in per_ricambio.items()
+            ])
+
+            esecuzione['prenotazioni_scadute'] = len(scadute)
+            esecuzione['ricambi_aggiornati'] = len(per_ricambio)
+            esecuzione['pezzi_liberati'] = sum(t['quantita'] for t in per_ricambio.values())
+
+        db.session.commit()
+
+        if scadute:
+            current_app.logger.info(
+                f"Scadenza prenotazioni: {esecuzione['prenotazioni_scadute']} scadute, "
+                f"{esecuzione['pezzi_liberati']} pezzi liberati su {esecuzione['ricambi_aggiornati']} ricambi"
+            )
+    except Exception as e:
+        db.session.rollback()
+        esecuzione['errore'] = str(e)
+        current_app.logger.error(f"Errore durante la scadenza delle prenotazioni: {str(e)}")
+        raise
+    finally:
+        esecuzione['durata_ms'] = round((time.perf_counter() - inizio) * 1000, 1)
+        _registra_metriche(esecuzione)
+
+    return esecuzione
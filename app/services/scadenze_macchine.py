@@ -0,0 +1,285 @@
+"""
+Servizio per la coda delle scadenze delle macchine (manutenzioni e garanzie)
+Il job giornaliero ricalcola la coda delle scadenze entro l'orizzonte configurato
+per reparto e tecnico, e può creare in blocco i ticket di manutenzione programmata.
+"""
+
+from flask import current_app
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, delete, select, update
+from app import db
+from app.models.macchina import Macchina, ScadenzaMacchina, ticket_macchine
+from app.models.ticket import Ticket
+from app.models.user import User
+
+# Colonna della macchina da cui nasce ogni tipo di scadenza
+TIPI_SCADENZA = {
+    'Manutenzione': Macchina.prossima_manutenzione,
+    'Garanzia': Macchina.data_scadenza_garanzia,
+}
+
+# Le macchine dismesse non entrano nella coda
+STATI_ESCLUSI = ('Dismessa',)
+
+
+def _tecnici_per_macchina(macchine_ids):
+    """Tecnico assegnato all'ultimo ticket collegato a ciascuna macchina"""
+    tecnici = {}
+    for i in range(0, len(macchine_ids), 1000):
+        righe = db.session.execute(
+            select(ticket_macchine.c.macchina_id, Ticket.assigned_to_id)
+            .join(Ticket, Ticket.id == ticket_macchine.c.ticket_id)
+            .where(
+                ticket_macchine.c.macchina_id.in_(macchine_ids[i:i + 1000]),
+                Ticket.assigned_to_id.isnot(None)
+            )
+            .order_by(Ticket.created_at.desc())
+        )
+        for macchina_id, tecnico_id in righe:
+            tecnici.setdefault(macchina_id, tecnico_id)
+    return tecnici
+
+
+def _aggiorna_tipo(tipo, colonna, limite, adesso):
+    """Allinea la coda di un tipo di scadenza alle date correnti delle macchine"""
+    # Range scan su idx_macchine_manutenzione_stato / idx_macchine_garanzia_stato
+    in_scadenza = {
+        r.id: r for r in db.session.execute(
+            select(Macchina.id, Macchina.department_id, colonna.label('data_scadenza'))
+            .where(colonna.isnot(None), colonna <= limite, Macchina.stato.not_in(STATI_ESCLUSI))
+        )
+    }
+    esistenti = {
+        r.macchina_id: r for r in db.session.execute(
+            select(ScadenzaMacchina.id, ScadenzaMacchina.macchina_id, ScadenzaMacchina.data_scadenza)
+            .where(ScadenzaMacchina.tipo == tipo)
+        )
+    }
+    tecnici = _tecnici_per_macchina(list(in_scadenza))
+
+    nuove, aggiornate = [], []
+    for macchina_id, m in in_scadenza.items():
+        valori = {
+            'department_id': m.department_id,
+            'tecnico_id': tecnici.get(macchina_id),
+            'data_scadenza': m.data_scadenza,
+            'calcolata_at': adesso,
+        }
+        esistente = esistenti.get(macchina_id)
+        if esistente is None:
+            nuove.append(dict(valori, macchina_id=macchina_id, tipo=tipo))
+        else:
+            # Una nuova data significa scadenza precedente gestita: il ticket non è più quello giusto
+            if esistente.data_scadenza != m.data_scadenza:
+                valori['ticket_id'] = None
+            aggiornate.append(dict(valori, s_id=esistente.id))
+
+    if nuove:
+        db.session.execute(ScadenzaMacchina.__table__.insert(), nuove)
+
+    # Un UPDATE executemany per gruppo di colonne (con e senza azzeramento del ticket)
+    tabella = ScadenzaMacchina.__table__
+    for gruppo in (
+        [a for a in aggiornate if 'ticket_id' not in a],
+        [a for a in aggiornate if 'ticket_id' in a],
+    ):
+        if not gruppo:
+            continue
+        colonne = [c for c in gruppo[0] if c != 's_id']
+        db.session.execute(
+            tabella.update()
+            .where(tabella.c.id == bindparam('s_id'))
+            .values({c: bindparam(f'v_{c}') for c in colonne}),
+            [{'s_id': a['s_id'], **{f'v_{c}': a[c] for c in colonne}} for a in gruppo]
+        )
+
+    rimosse = [e.id for macchina_id, e in esistenti.items() if macchina_id not in in_scadenza]
+    for i in range(0, len(rimosse), 1000):
+        db.session.execute(delete(ScadenzaMacchina).where(ScadenzaMacchina.id.in_(rimosse[i:i + 1000])))
+
+    return {'totale': len(in_scadenza), 'nuove': len(nuove), 'rimosse': len(rimosse)}
+
+
+def _utente_ticket_automatici():
+    """Autore dei ticket automatici: SCADENZE_MACCHINE_UTENTE_ID o il primo amministratore attivo"""
+    utente_id = current_app.config.get('SCADENZE_MACCHINE_UTENTE_ID')
+    if utente_id:
+        return utente_id
+    admin = User.query.filter_by(is_admin=True, is_active=True).order_by(User.id).first()
+    return admin.id if admin else None
+
+
+def _prossimi_numeri_ticket(quanti):
+    """Riserva `quanti` numeri ticket consecutivi con una sola query (stesso formato di Ticket)"""
+    oggi = datetime.now()
+    prefisso = f"TK{oggi.year}{oggi.month:02d}"
+    ultimo = db.session.query(Ticket.numero_ticket).filter(
+        Ticket.numero_ticket.like(f"{prefisso}%")
+    ).order_by(Ticket.id.desc()).first()
+    try:
+        primo = int(ultimo[0][-4:]) + 1 if ultimo else 1
+    except ValueError:
+        primo = 1
+    return [f"{prefisso}{n:04d}" for n in range(primo, primo + quanti)]
+
+
+def crea_ticket_scadenze(adesso=None):
+    """
+    Crea in blocco i ticket per le scadenze di manutenzione ancora senza ticket.
+    Le macchine senza cliente (in magazzino) restano in coda senza ticket.
+
+    Returns:
+        int: Ticket creati
+    """
+    adesso = adesso or datetime.utcnow()
+    autore_id = _utente_ticket_automatici()
+    if not autore_id:
+        current_app.logger.warning("Ticket di manutenzione non creati: nessun utente amministratore disponibile")
+        return 0
+
+    scadenze = db.session.execute(
+        select(ScadenzaMacchina.id, ScadenzaMacchina.macchina_id, ScadenzaMacchina.data_scadenza,
+               ScadenzaMacchina.department_id, ScadenzaMacchina.tecnico_id,
+               Macchina.codice, Macchina.marca, Macchina.modello, Macchina.cliente_id)
+        .join(Macchina, Macchina.id == ScadenzaMacchina.macchina_id)
+        .where(
+            ScadenzaMacchina.tipo == 'Manutenzione',
+            ScadenzaMacchina.ticket_id.is_(None),
+            Macchina.cliente_id.isnot(None)
+        )
+        .order_by(ScadenzaMacchina.data_scadenza)
+    ).all()
+    if not scadenze:
+        return 0
+
+    numeri = _prossimi_numeri_ticket(len(scadenze))
+    oggi = adesso.date()
+    db.session.execute(Ticket.__table__.insert(), [
+        {
+            'numero_ticket': numero,
+            'titolo': f"Manutenzione programmata {s.codice}",
+            'descrizione': (
+                f"Manutenzione periodica della macchina {s.codice} ({s.marca} {s.modello}) "
+                f"prevista per il {s.data_scadenza:%d/%m/%Y}."
+            ),
+            'categoria': 'Manutenzione',
+            'priorita': 'Alta' if s.data_scadenza < oggi else 'Media',
+            'stato': 'Aperto',
+            'cliente_id': s.cliente_id,
+            'created_by_id': autore_id,
+            'assigned_to_id': s.tecnico_id,
+            'department_id': s.department_id,
+            'due_date': datetime.combine(s.data_scadenza, datetime.min.time()),
+            'created_at': adesso,
+            'updated_at': adesso,
+        }
+        for s, numero in zip(scadenze, numeri)
+    ])
+
+    # Id dei ticket appena inseriti, recuperati per numero
+    ids_per_numero = dict(db.session.execute(
+        select(Ticket.numero_ticket, Ticket.id).where(Ticket.numero_ticket.in_(numeri))
+    ).all())
+
+    db.session.execute(ticket_macchine.insert(), [
+        {'ticket_id': ids_per_numero[numero], 'macchina_id': s.macchina_id, 'created_at': adesso}
+        for s, numero in zip(scadenze, numeri)
+    ])
+    db.session.execute(
+        update(ScadenzaMacchina.__table__)
+        .where(ScadenzaMacchina.__table__.c.id == bindparam('s_id'))
+        .values(ticket_id=bindparam('t_id')),
+        [{'s_id': s.id, 't_id': ids_per_numero[numero]} for s, numero in zip(scadenze, numeri)]
+    )
+    return len(scadenze)
+
+
+def aggiorna_coda_scadenze(adesso=None, crea_ticket=None):
+    """
+    Ricalcola la coda delle scadenze di manutenzione e garanzia (job giornaliero)
+
+    Args:
+        adesso (datetime): Istante di riferimento (default: ora UTC)
+        crea_ticket (bool): Crea i ticket di manutenzione mancanti (default: SCADENZE_MACCHINE_CREA_TICKET)
+
+    Returns:
+        dict: Conteggi per tipo e ticket creati
+    """
+    adesso = adesso or datetime.utcnow()
+    config = current_app.config
+    if crea_ticket is None:
+        crea_ticket = config.get('SCADENZE_MACCHINE_CREA_TICKET', False)
+    limite = adesso.date() + timedelta(days=config.get('SCADENZE_MACCHINE_ORIZZONTE_GIORNI', 30))
+
+    try:
+        risultato = {
+            tipo: _aggiorna_tipo(tipo, colonna, limite, adesso)
+            for tipo, colonna in TIPI_SCADENZA.items()
+        }
+        risultato['ticket_creati'] = crea_ticket_scadenze(adesso) if crea_ticket else 0
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Errore durante il calcolo delle scadenze macchine: {str(e)}")
+        raise
+
+    current_app.logger.info(
+        f"Scadenze macchine: {risultato['Manutenzione']['totale']} manutenzioni, "
+        f"{risultato['Garanzia']['totale']} garanzie entro il {limite:%d/%m/%Y}, "
+        f"{risultato['ticket_creati']} ticket creati"
+    )
+    return risultato
+
+
+def query_scadenze(tipo=None, department_id=None, tecnico_id=None, solo_scadute=False, tipi_macchina_ids=None):
+    """Query della coda con i filtri dell'API e del calendario, ordinata per data di scadenza"""
+    query = ScadenzaMacchina.query.join(Macchina, Macchina.id == ScadenzaMacchina.macchina_id)
+    if tipo:
+        query = query.filter(ScadenzaMacchina.tipo == tipo)
+    if department_id:
+        query = query.filter(ScadenzaMacchina.department_id == department_id)
+    if tecnico_id:
+        query = query.filter(ScadenzaMacchina.tecnico_id == tecnico_id)
+    if solo_scadute:
+        query = query.filter(ScadenzaMacchina.data_scadenza < datetime.now().date())
+    if tipi_macchina_ids is not None:
+        query = query.filter(Macchina.tipo_macchina_id.in_(tipi_macchina_ids))
+    return query.order_by(ScadenzaMacchina.data_scadenza, ScadenzaMacchina.id)
+
+
+def _testo_ics(valore):
+    return str(valore).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def genera_calendario_ics(scadenze, nome='Scadenze macchine'):
+    """Feed iCalendar (RFC 5545) con un evento di un giorno per ogni scadenza"""
+    adesso = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    righe = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//DB-Desk//Scadenze Macchine//IT',
+        'CALSCALE:GREGORIAN',
+        f'X-WR-CALNAME:{_testo_ics(nome)}',
+    ]
+    for s in scadenze:
+        macchina = s.macchina
+        descrizione = [f"Macchina: {macchina.nome_completo}", f"Stato: {macchina.stato}"]
+        if macchina.cliente:
+            descrizione.append(f"Cliente: {macchina.cliente.ragione_sociale}")
+        if s.tecnico:
+            descrizione.append(f"Tecnico: {s.tecnico.full_name}")
+        if s.ticket:
+            descrizione.append(f"Ticket: {s.ticket.numero_ticket}")
+        righe += [
+            'BEGIN:VEVENT',
+            f'UID:scadenza-{s.tipo.lower()}-{s.macchina_id}-{s.data_scadenza:%Y%m%d}@db-desk',
+            f'DTSTAMP:{adesso}',
+            f'DTSTART;VALUE=DATE:{s.data_scadenza:%Y%m%d}',
+            f'DTEND;VALUE=DATE:{s.data_scadenza + timedelta(days=1):%Y%m%d}',
+            f'SUMMARY:{_testo_ics(f"{s.tipo} {macchina.codice}")}',
+            f'DESCRIPTION:{_testo_ics(chr(10).join(descrizione))}',
+            f'CATEGORIES:{s.tipo}',
+            'END:VEVENT',
+        ]
+    righe.append('END:VCALENDAR')
+    return '\r\n'.join(righe) + '\r\n'
@@ -1,5 +1,6 @@
 """
 Servizio di schedulazione per l'import automatico delle email
+e per i job periodici di manutenzione (magazzino, macchine, fogli tecnici)
 """
 import logging
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -18,37 +19,148 @@ class EmailImportScheduler:
         self.app = app
     
     def start(self):
-        """Avvia lo scheduler se l'import automatico è abilitato"""
+        """Avvia lo scheduler con l'import email (se abilitato) e i job di manutenzione configurati"""
         if self.is_running:
             return
         
         try:
             # Controlla se l'import email è abilitato
-            if not current_app.config.get('EMAIL_IMPORT_ENABLED'):
-                logger.info("Email import scheduler: EMAIL_IMPORT_ENABLED è False, scheduler non avviato")
-                return
+            if current_app.config.get('EMAIL_IMPORT_ENABLED'):
+                # Ottieni l'intervallo di polling (default 5 minuti)
+                poll_seconds = current_app.config.get('EMAIL_POLL_SECONDS', 300)
+                
+                # Aggiungi il job allo scheduler
+                self.scheduler.add_job(
+                    func=self._import_emails_job,
+                    trigger=IntervalTrigger(seconds=poll_seconds),
+                    id=self.job_id,
+                    name='Import Email Automatico',
+                    replace_existing=True,
+                    max_instances=1  # Evita sovrapposizioni
+                )
+                logger.info(f"Email import scheduler: polling ogni {poll_seconds} secondi")
+            else:
+                logger.info("Email import scheduler: EMAIL_IMPORT_ENABLED è False, import email non schedulato")
             
-            # Ottieni l'intervallo di polling (default 5 minuti)
-            poll_seconds = current_app.config.get('EMAIL_POLL_SECONDS', 300)
+            self._add_maintenance_jobs()
             
-            # Aggiungi il job allo scheduler
-            self.scheduler.add_job(
-                func=self._import_emails_job,
-                trigger=IntervalTrigger(seconds=poll_seconds),
-                id=self.job_id,
-                name='Import Email Automatico',
-                replace_existing=True,
-                max_instances=1  # Evita sovrapposizioni
-            )
+            if not self.scheduler.get_jobs():
+                logger.info("Scheduler non avviato: nessun job configurato")
+                return
             
             self.scheduler.start()
             self.is_running = True
             
-            logger.info(f"Email import scheduler avviato - polling ogni {poll_seconds} secondi")
+            logger.info(f"Scheduler avviato con {len(self.scheduler.get_jobs())} job")
             
         except Exception as e:
             logger.error(f"Errore nell'avvio dello scheduler email: {e}")
     
+    def _add_maintenance_jobs(self):
+        """Registra i job periodici di manutenzione abilitati nella configurazione"""
+        config = current_app.config
+        
+        # Digest ricambi sotto scorta (solo se ci sono destinatari configurati)
+        if config.get('SCORTA_DIGEST_RECIPIENTS'):
+            from app.services.scorta_digest import invia_digest_sotto_scorta
+            self.add_periodic_job(
+                invia_digest_sotto_scorta,
+                job_id='scorta_digest_job',
+                name='Digest Ricambi Sotto Scorta',
+                seconds=config.get('SCORTA_DIGEST_HOURS', 24) * 3600
+            )
+        
+        # Pulizia degli export report magazzino scaduti
+        if config.get('REPORT_EXPORT_PULIZIA_HOURS'):
+            from app.services.report_magazzino import pulisci_export_scaduti
+            self.add_periodic_job(
+                pulisci_export_scaduti,
+                job_id='pulizia_export_report_job',
+                name='Pulizia Export Report Magazzino',
+                seconds=config.get('REPORT_EXPORT_PULIZIA_HOURS') * 3600
+            )
+        
+        # Scadenza automatica delle prenotazioni ricambi
+        if config.get('PRENOTAZIONI_SCADENZA_MINUTES'):
+            from app.services.scadenza_prenotazioni import scadi_prenotazioni
+            self.add_periodic_job(
+                scadi_prenotazioni,
+                job_id='scadenza_prenotazioni_job',
+                name='Scadenza Prenotazioni Ricambi',
+                seconds=config.get('PRENOTAZIONI_SCADENZA_MINUTES') * 60
+            )
+        
+        # Archiviazione dei movimenti oltre l'orizzonte configurato
+        if config.get('ARCHIVIO_MOVIMENTI_HOURS'):
+            from app.services.archivio_movimenti import archivia_movimenti
+            self.add_periodic_job(
+                archivia_movimenti,
+                job_id='archivio_movimenti_job',
+                name='Archiviazione Movimenti',
+                seconds=config.get('ARCHIVIO_MOVIMENTI_HOURS') * 3600
+            )
+        
+        # Archiviazione dei PDF dei fogli tecnici nei contenitori mensili
+        if config.get('ARCHIVIO_PDF_HOURS'):
+            from app.services.archivio_pdf import archivia_documenti
+            self.add_periodic_job(
+                archivia_documenti,
+                job_id='archivio_pdf_job',
+                name='Archiviazione PDF Fogli Tecnici',
+                seconds=config.get('ARCHIVIO_PDF_HOURS') * 3600
+            )
+        
+        # Coda giornaliera delle scadenze macchine (manutenzioni e garanzie)
+        if config.get('SCADENZE_MACCHINE_HOURS'):
+            from app.services.scadenze_macchine import aggiorna_coda_scadenze
+            self.add_periodic_job(
+                aggiorna_coda_scadenze,
+                job_id='scadenze_macchine_job',
+                name='Scadenze Macchine',
+                seconds=config.get('SCADENZE_MACCHINE_HOURS') * 3600
+            )
+        
+        # Promemoria giornaliero ai tecnici con fogli incompleti (un riepilogo per tecnico)
+        if config.get('PROMEMORIA_FOGLI_HOURS'):
+            from app.services.email_sender import invia_promemoria_fogli_incompleti
+            self.add_periodic_job(
+                invia_promemoria_fogli_incompleti,
+                job_id='promemoria_fogli_job',
+                name='Promemoria Fogli Incompleti',
+                seconds=config.get('PROMEMORIA_FOGLI_HOURS') * 3600
+            )
+        
+        # Outbox email: tentativi rimandati ed email rimaste in coda da un riavvio
+        if config.get('MAIL_OUTBOX_POLL_SECONDS'):
+            from app.services.outbox_email import svuota_outbox
+            self.add_periodic_job(
+                svuota_outbox,
+                job_id='outbox_email_job',
+                name='Outbox Email',
+                seconds=config.get('MAIL_OUTBOX_POLL_SECONDS')
+            )
+    
+    def add_periodic_job(self, func, job_id, name, seconds):
+        """Aggiunge un job periodico eseguito all'interno dell'app context"""
+        self.scheduler.add_job(
+            func=self._run_job,
+            args=[name, func],
+            trigger=IntervalTrigger(seconds=seconds),
+            id=job_id,
+            name=name,
+            replace_existing=True,
+            max_instances=1  # Evita sovrapposizioni
+        )
+        logger.info(f"Job '{name}' schedulato ogni {seconds} secondi")
+    
+    def _run_job(self, name, func):
+        """Esegue un job di manutenzione gestendo app context ed errori"""
+        try:
+            with self.app.app_context():
+                func()
+        except Exception as e:
+            logger.error(f"Errore durante il job '{name}': {e}")
+    
     def stop(self):
         """Ferma lo scheduler"""
         if self.is_running and self.scheduler.running:
@@ -0,0 +1,74 @@
+"""
+Servizio per il digest email dei ricambi sotto scorta
+Raggruppa in un'unica email tutti gli allarmi non ancora notificati
+"""
+
+from flask import current_app
+from datetime import datetime
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models.ricambio import AllarmeScorta
+from app.services.email_sender import _is_email_configured
+
+
+def invia_digest_sotto_scorta():
+    """
+    Invia un riepilogo dei nuovi allarmi sotto scorta ai destinatari configurati
+
+    Returns:
+        int: Numero di allarmi inclusi nel digest
+    """
+    destinatari = [d.strip() for d in current_app.config.get('SCORTA_DIGEST_RECIPIENTS', []) if d.strip()]
+    if not destinatari:
+        return 0
+
+    if not _is_email_configured():
+        current_app.logger.warning("Configurazione email mancante per digest sotto scorta")
+        return 0
+
+    allarmi = AllarmeScorta.query.filter(
+        AllarmeScorta.notificato_at.is_(None)
+    ).options(
+        joinedload(AllarmeScorta.ricambio)
+    ).order_by(AllarmeScorta.created_at).all()
+
+    if not allarmi:
+        return 0
+
+    righe = []
+    for allarme in allarmi:
+        ricambio = allarme.ricambio
+        righe.append(
+            f"- {ricambio.codice} - {ricambio.descrizione}: "
+            f"disponibili {ricambio.quantita_disponibile} (minimo {ricambio.quantita_minima})"
+            f"{' - Fornitore: ' + ricambio.fornitore if ricambio.fornitore else ''}"
+        )
+
+    corpo_testo = f"""
+Ricambi Sotto Scorta
+
+Sono stati rilevati {len(allarmi)} nuovi ricambi sotto la scorta minima:
+
+{chr(10).join(righe)}
+
+Per i dettagli accedi al magazzino di DB-Desk.
+"""
+
+    from flask_mail import Mail, Message
+    mail = Mail(current_app)
+
+    msg = Message(
+        subject=f"Ricambi sotto scorta: {len(allarmi)} nuovi allarmi",
+        recipients=destinatari,
+        body=corpo_testo
+    )
+    mail.send(msg)
+
+    # Marca gli allarmi come notificati con un solo UPDATE
+    AllarmeScorta.query.filter(
+        AllarmeScorta.id.in_([a.id for a in allarmi])
+    ).update({'notificato_at': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+
+    current_app.logger.info(f"Digest sotto scorta inviato a {', '.join(destinatari)} ({len(allarmi)} ricambi)")
+    return len(allarmi)
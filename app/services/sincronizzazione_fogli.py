@@ -0,0 +1,343 @@
+"""
+Sincronizzazione dei fogli tecnici compilati offline
+Il client invia uno o più fogli completi in JSON (macchine, ricambi, firme in base64),
+ognuno con una chiave di idempotenza generata localmente: un foglio già ricevuto non
+viene creato di nuovo, quindi l'invio può essere ripetuto dopo una connessione caduta.
+I campi sono validati con i form degli step del wizard, i numeri foglio sono assegnati
+in blocco e ogni foglio è salvato nella propria transazione.
+"""
+
+from flask import current_app
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import MultiDict
+from app import db
+from app.models.foglio_tecnico import FoglioTecnico, foglio_ricambi
+from app.models.sincronizzazione_foglio import SincronizzazioneFoglio
+from app.models.cliente import Cliente
+from app.models.macchina import Macchina
+from app.models.ricambio import Ricambio
+from app.forms.foglio_tecnico import (
+    FoglioTecnicoStep1Form, FoglioTecnicoStep2Form, FoglioTecnicoStep4Form, FoglioTecnicoStep5Form
+)
+from app.services.firme import salva_firma, elimina_firma_se_inutilizzata
+from app.services.operazioni_macchine import applica_operazione_macchine, presta_macchine_sostitutive
+from app.utils.permissions import PermissionManager
+
+# Fogli accettati in una singola richiesta
+MAX_FOGLI_PER_RICHIESTA = 50
+
+LUNGHEZZA_MAX_CHIAVE = 64
+
+
+def _form(classe, valori):
+    """Form di uno step compilato con i valori del JSON (senza CSRF: la richiesta è già protetta)"""
+    formdata = MultiDict()
+    for campo, valore in valori.items():
+        if valore is None or valore is False:
+            continue
+        formdata.add(campo, 'y' if valore is True else str(valore))
+    return classe(formdata=formdata, meta={'csrf': False})
+
+
+def _errori_form(form):
+    return [f"{getattr(form, campo).label.text}: {errore}" for campo, errori in form.errors.items() for errore in errori]
+
+
+def _data_intervento(valore):
+    """Accetta date ISO (con o senza secondi) e le porta al formato del campo dello step 1"""
+    if not valore:
+        return None
+    try:
+        return datetime.fromisoformat(str(valore)).strftime('%Y-%m-%dT%H:%M')
+    except ValueError:
+        return str(valore)
+
+
+def _ids(valori):
+    """Lista di ID interi, scartando i valori non numerici"""
+    risultato = []
+    for valore in valori or []:
+        if isinstance(valore, dict):
+            valore = valore.get('id')
+        try:
+            risultato.append(int(valore))
+        except (TypeError, ValueError):
+            continue
+    return risultato
+
+
+def _quantita_ricambi(valori):
+    """Ricambi come (id, quantità): accetta ID semplici o oggetti {"id": .., "quantita": ..}"""
+    ricambi = {}
+    for valore in valori or []:
+        quantita = 1
+        if isinstance(valore, dict):
+            quantita = valore.get('quantita') or 1
+            valore = valore.get('id')
+        try:
+            ricambi[int(valore)] = max(int(quantita), 1)
+        except (TypeError, ValueError):
+            continue
+    return ricambi
+
+
+class _Anagrafiche:
+    """Clienti, macchine e ricambi citati nella richiesta, caricati con una query per tabella"""
+
+    def __init__(self, fogli):
+        cliente_ids = set(_ids(f.get('cliente_id') for f in fogli))
+        macchina_ids = set()
+        ricambio_ids = set()
+        for foglio in fogli:
+            macchina_ids.update(_ids(foglio.get('macchine')))
+            macchina_ids.update(_ids(foglio.get('macchine_sostitutive')))
+            ricambio_ids.update(_quantita_ricambi(foglio.get('ricambi')))
+        self.clienti = self._carica(Cliente, cliente_ids)
+        self.macchine = self._carica(Macchina, macchina_ids)
+        self.ricambi = self._carica(Ricambio, ricambio_ids)
+
+    @staticmethod
+    def _carica(modello, ids):
+        if not ids:
+            return {}
+        return {obj.id: obj for obj in modello.query.filter(modello.id.in_(ids)).all()}
+
+
+def _valida(dati, anagrafiche, user):
+    """
+    Valida un foglio con i form degli step e controlla i riferimenti
+
+    Returns:
+        tuple: (errori, firme_presenti)
+    """
+    errori = []
+
+    chiave = dati.get('chiave')
+    if not chiave or not isinstance(chiave, str) or len(chiave) > LUNGHEZZA_MAX_CHIAVE:
+        errori.append(f"Chiave di idempotenza mancante o più lunga di {LUNGHEZZA_MAX_CHIAVE} caratteri")
+
+    cliente_ids = _ids([dati.get('cliente_id')])
+    cliente = anagrafiche.clienti.get(cliente_ids[0]) if cliente_ids else None
+    if not cliente:
+        errori.append("Cliente mancante o non valido")
+
+    step1 = _form(FoglioTecnicoStep1Form, {
+        'cliente': cliente.id if cliente else None,
+        'cliente_search': cliente.ragione_sociale if cliente else None,
+        'titolo': dati.get('titolo'),
+        'categoria': dati.get('categoria') or 'Intervento',
+        'data_intervento': _data_intervento(dati.get('data_intervento')),
+        'indirizzo_intervento': dati.get('indirizzo_intervento'),
+    })
+    step2 = _form(FoglioTecnicoStep2Form, {'tipo_operazione_macchine': dati.get('tipo_operazione_macchine')})
+    step4 = _form(FoglioTecnicoStep4Form, {
+        'modalita_pagamento': dati.get('modalita_pagamento') or 'Non specificato',
+        'importo_intervento': dati.get('importo_intervento'),
+        'pagamento_immediato': bool(dati.get('pagamento_immediato')),
+        'intervento_in_garanzia': bool(dati.get('intervento_in_garanzia')),
+        'durata_intervento': dati.get('durata_intervento'),
+        'km_percorsi': dati.get('km_percorsi'),
+    })
+    forms = [step1, step2, step4]
+
+    # Le firme sono facoltative: se presenti vale la validazione dello step 5
+    firme_presenti = bool(dati.get('firma_tecnico') or dati.get('firma_cliente') or dati.get('nome_firmatario_cliente'))
+    if firme_presenti:
+        forms.append(_form(FoglioTecnicoStep5Form, {'nome_firmatario_cliente': dati.get('nome_firmatario_cliente')}))
+
+    for form in forms:
+        if not form.validate():
+            errori.extend(_errori_form(form))
+
+    for campo, etichetta in (('macchine', 'Macchina'), ('macchine_sostitutive', 'Macchina sostitutiva')):
+        for macchina_id in _ids(dati.get(campo)):
+            macchina = anagrafiche.macchine.get(macchina_id)
+            if not macchina or not PermissionManager.can_view_machine(user, macchina):
+                errori.append(f"{etichetta} {macchina_id} non trovata o non accessibile")
+    for ricambio_id in _quantita_ricambi(dati.get('ricambi')):
+        if ricambio_id not in anagrafiche.ricambi:
+            errori.append(f"Ricambio {ricambio_id} non trovato")
+
+    return errori, firme_presenti
+
+
+def _crea_foglio(dati, numero_foglio, anagrafiche, user, firme_presenti, firme):
+    """Crea il foglio con collegamenti, operazioni sulle macchine e firme (senza commit); i file firma salvati finiscono in `firme`"""
+    importo = dati.get('importo_intervento')
+    foglio = FoglioTecnico(
+        titolo=dati.get('titolo'),
+        descrizione=dati.get('descrizione') or dati.get('titolo') or "Intervento Tecnico",
+        categoria=dati.get('categoria') or 'Intervento',
+        data_intervento=datetime.strptime(_data_intervento(dati['data_intervento']), '%Y-%m-%dT%H:%M'),
+        cliente_id=int(dati['cliente_id']),
+        tecnico_id=user.id,
+        department_id=user.department_id,
+        numero_foglio=numero_foglio,
+        indirizzo_intervento=dati.get('indirizzo_intervento'),
+        tipo_operazione_macchine=dati.get('tipo_operazione_macchine') or None,
+        macchina_manuale=dati.get('macchina_manuale'),
+        ricambio_manuale=dati.get('ricambio_manuale'),
+        note_aggiuntive=dati.get('note_aggiuntive'),
+        modalita_pagamento=dati.get('modalita_pagamento') or 'Non specificato',
+        importo_intervento=importo if importo not in (None, '') else None,
+        pagamento_immediato=bool(dati.get('pagamento_immediato')),
+        intervento_in_garanzia=bool(dati.get('intervento_in_garanzia')),
+        durata_intervento=dati.get('durata_intervento'),
+        km_percorsi=dati.get('km_percorsi'),
+        nome_firmatario_cliente=dati.get('nome_firmatario_cliente'),
+        step_completati=[1, 2, 3, 4, 5] if firme_presenti else [1, 2, 3, 4],
+        step_corrente=5
+    )
+    db.session.add(foglio)
+    db.session.flush()
+
+    macchine = [anagrafiche.macchine[i] for i in dict.fromkeys(_ids(dati.get('macchine')))]
+    for macchina in macchine:
+        foglio.macchine_collegate.append(macchina)
+    ricambi = _quantita_ricambi(dati.get('ricambi'))
+    if ricambi:
+        db.session.execute(foglio_ricambi.insert(), [
+            {'foglio_id': foglio.id, 'ricambio_id': ricambio_id, 'quantita_utilizzata': quantita,
+             'created_at': datetime.utcnow()}
+            for ricambio_id, quantita in ricambi.items()
+        ])
+
+    avvisi = []
+    if macchine and foglio.tipo_operazione_macchine:
+        avvisi.extend(applica_operazione_macchine(foglio, macchine, foglio.tipo_operazione_macchine, user.id))
+    if foglio.tipo_operazione_macchine == 'riparazione_sede_con_prestito':
+        sostitutive = [anagrafiche.macchine[i] for i in dict.fromkeys(_ids(dati.get('macchine_sostitutive')))]
+        avvisi.extend(presta_macchine_sostitutive(foglio, sostitutive, user.id))
+
+    if dati.get('firma_tecnico'):
+        foglio.firma_tecnico_path = salva_firma(dati['firma_tecnico'])
+        firme.append(foglio.firma_tecnico_path)
+    if dati.get('firma_cliente'):
+        foglio.firma_cliente_path = salva_firma(dati['firma_cliente'])
+        firme.append(foglio.firma_cliente_path)
+
+    if foglio.firma_tecnico_path and foglio.firma_cliente_path:
+        foglio.stato = 'Completato'
+        foglio.completed_at = datetime.utcnow()
+    else:
+        foglio.stato = 'In attesa firme'
+
+    db.session.add(SincronizzazioneFoglio(chiave=dati['chiave'], foglio_id=foglio.id, user_id=user.id))
+    return foglio, avvisi
+
+
+def _esito(chiave, esito, foglio=None, errori=None, avvisi=None):
+    return {
+        'chiave': chiave,
+        'esito': esito,
+        'foglio_id': foglio.id if foglio else None,
+        'numero_foglio': foglio.numero_foglio if foglio else None,
+        'errori': errori or [],
+        'avvisi': avvisi or []
+    }
+
+
+def _annulla(firme):
+    """Annulla la transazione del foglio ed elimina le firme salvate solo per lui"""
+    db.session.rollback()
+    for path in firme:
+        try:
+            elimina_firma_se_inutilizzata(path)
+        except OSError:
+            pass
+
+
+def sincronizza_fogli(fogli, user):
+    """
+    Salva i fogli compilati offline, uno per transazione
+
+    Args:
+        fogli (list): Fogli in formato JSON (dizionari)
+        user (User): Tecnico che sincronizza (diventa il tecnico dei fogli)
+
+    Returns:
+        list: Esito per foglio, nell'ordine ricevuto: 'creato', 'già sincronizzato' o 'errore'
+    """
+    if not user.department_id:
+        raise ValueError("L'utente non ha un reparto: impossibile numerare i fogli")
+    if len(fogli) > MAX_FOGLI_PER_RICHIESTA:
+        raise ValueError(f"Massimo {MAX_FOGLI_PER_RICHIESTA} fogli per richiesta")
+    if not all(isinstance(f, dict) for f in fogli):
+        raise ValueError("Ogni foglio deve essere un oggetto JSON")
+
+    # Chiavi già ricevute dall'utente (anche in richieste precedenti) con una sola query:
+    # le chiavi sono generate dai client e valgono solo per chi le ha inviate
+    chiavi = [f.get('chiave') for f in fogli if isinstance(f.get('chiave'), str)]
+    gia_sincronizzati = {
+        s.chiave: s.foglio for s in SincronizzazioneFoglio.query.filter(
+            SincronizzazioneFoglio.user_id == user.id,
+            SincronizzazioneFoglio.chiave.in_(chiavi)
+        ).all()
+    } if chiavi else {}
+
+    anagrafiche = _Anagrafiche(fogli)
+    risultati = []
+    da_creare = []
+    ripetuti = []
+    for indice, dati in enumerate(fogli):
+        chiave = dati.get('chiave')
+        # Una chiave non stringa (lista, oggetto) non è hashable: la segnala _valida
+        chiave_valida = isinstance(chiave, str)
+        if chiave_valida and chiave in gia_sincronizzati:
+            if gia_sincronizzati[chiave] is None:
+                # Stessa chiave ripetuta nella richiesta: vale il primo foglio
+                ripetuti.append((indice, chiave))
+                risultati.append(None)
+            else:
+                risultati.append(_esito(chiave, 'già sincronizzato', gia_sincronizzati[chiave]))
+            continue
+        errori, firme_presenti = _valida(dati, anagrafiche, user)
+        if errori:
+            risultati.append(_esito(chiave, 'errore', errori=errori))
+            continue
+        if chiave_valida:
+            gia_sincronizzati[chiave] = None
+        risultati.append(None)
+        da_creare.append((indice, dati, firme_presenti))
+
+    # Numeri assegnati in blocco; un numero preso nel frattempo da un'altra richiesta viene riassegnato
+    numeri = FoglioTecnico.alloca_numeri(user.department_id, len(da_creare)) if da_creare else []
+
+    for (indice, dati, firme_presenti), numero in zip(da_creare, numeri):
+        chiave = dati['chiave']
+        for tentativo in range(2):
+            firme = []
+            try:
+                foglio, avvisi = _crea_foglio(dati, numero, anagrafiche, user, firme_presenti, firme)
+                db.session.commit()
+                risultati[indice] = _esito(chiave, 'creato', foglio, avvisi=avvisi)
+                gia_sincronizzati[chiave] = foglio
+                current_app.logger.info(f"Foglio {foglio.numero_foglio} sincronizzato da {user.username} (chiave {chiave})")
+                break
+            except IntegrityError:
+                _annulla(firme)
+                esistente = SincronizzazioneFoglio.query.filter_by(user_id=user.id, chiave=chiave).first()
+                if esistente:
+                    # Stessa chiave salvata da una richiesta concorrente
+                    risultati[indice] = _esito(chiave, 'già sincronizzato', esistente.foglio)
+                    gia_sincronizzati[chiave] = esistente.foglio
+                    break
+                if tentativo:
+                    risultati[indice] = _esito(chiave, 'errore', errori=["Numero foglio non disponibile, riprovare"])
+                    break
+                numero = FoglioTecnico.alloca_numeri(user.department_id, 1)[0]
+            except Exception as e:
+                _annulla(firme)
+                current_app.logger.error(f"Errore sincronizzazione foglio (chiave {chiave}): {str(e)}")
+                risultati[indice] = _esito(chiave, 'errore', errori=[str(e)])
+                break
+
+    for indice, chiave in ripetuti:
+        foglio = gia_sincronizzati[chiave]
+        if foglio:
+            risultati[indice] = _esito(chiave, 'già sincronizzato', foglio)
+        else:
+            risultati[indice] = _esito(chiave, 'errore', errori=["Foglio con la stessa chiave non sincronizzato"])
+
+    return risultati
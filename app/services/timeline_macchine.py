@@ -0,0 +1,160 @@
+"""
+Servizio per la timeline unificata di una macchina
+Unisce movimenti, ticket collegati e fogli tecnici in un unico flusso ordinato dal più
+recente, con paginazione keyset: ogni pagina legge al massimo `limite + 1` righe per
+sorgente e le fonde con un k-way merge, indipendentemente dalla lunghezza dello storico.
+"""
+
+from flask import url_for
+from datetime import datetime
+import base64
+import heapq
+import json
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models.macchina import MovimentoMacchina, ticket_macchine
+from app.models.ticket import Ticket
+from app.models.foglio_tecnico import FoglioTecnico, foglio_macchine
+from app.services.archivio_movimenti import entita_movimenti
+
+LIMITE_DEFAULT = 25
+LIMITE_MASSIMO = 100
+
+# Ordine di precedenza tra sorgenti a parità di data (fa parte della chiave di ordinamento)
+RANGO_SORGENTE = {'foglio': 0, 'ticket': 1, 'movimento': 2}
+
+
+class CursoreNonValido(ValueError):
+    pass
+
+
+def codifica_cursore(chiave):
+    data, rango, id_ = chiave
+    testo = json.dumps([data.isoformat(), rango, id_])
+    return base64.urlsafe_b64encode(testo.encode()).decode().rstrip('=')
+
+
+def decodifica_cursore(cursore):
+    try:
+        testo = base64.urlsafe_b64decode(cursore + '=' * (-len(cursore) % 4)).decode()
+        data, rango, id_ = json.loads(testo)
+        return datetime.fromisoformat(data), int(rango), int(id_)
+    except (ValueError, TypeError) as e:
+        raise CursoreNonValido(f"Cursore non valido: {cursore}") from e
+
+
+def _dopo_cursore(colonna_data, colonna_id, rango, cursore):
+    """
+    Condizione keyset "chiave < cursore" per una sorgente, con chiave (data, rango, id)
+    e rango costante per sorgente
+    """
+    c_data, c_rango, c_id = cursore
+    if rango < c_rango:
+        return colonna_data <= c_data
+    if rango > c_rango:
+        return colonna_data < c_data
+    return or_(colonna_data < c_data, and_(colonna_data == c_data, colonna_id < c_id))
+
+
+def _movimenti(macchina_id, limite, cursore, completo):
+    Movimento = entita_movimenti(MovimentoMacchina, completo=completo)
+    query = db.session.query(Movimento).filter(Movimento.macchina_id == macchina_id).options(
+        joinedload(Movimento.cliente), joinedload(Movimento.user),
+        joinedload(Movimento.ticket), joinedload(Movimento.foglio)
+    )
+    if cursore:
+        query = query.filter(_dopo_cursore(Movimento.created_at, Movimento.id, RANGO_SORGENTE['movimento'], cursore))
+    # Scansione su idx_movimenti_macchine_macchina_created
+    for m in query.order_by(Movimento.created_at.desc(), Movimento.id.desc()).limit(limite):
+        yield (m.created_at, RANGO_SORGENTE['movimento'], m.id), {
+            'tipo': 'movimento',
+            'id': m.id,
+            'data': m.created_at.isoformat(),
+            'titolo': m.descrizione_movimento,
+            'sottotipo': m.tipo_movimento,
+            'stato_precedente': m.stato_precedente,
+            'stato_nuovo': m.stato_nuovo,
+            'note': m.note,
+            'utente': m.user.full_name if m.user else None,
+            'ticket_numero': m.ticket.numero_ticket if m.ticket else None,
+            'foglio_numero': m.foglio.numero_foglio if m.foglio else None,
+            'url': None,
+        }
+
+
+def _tickets(macchina_id, limite, cursore):
+    query = Ticket.query.join(ticket_macchine, ticket_macchine.c.ticket_id == Ticket.id)\
+        .filter(ticket_macchine.c.macchina_id == macchina_id)\
+        .options(joinedload(Ticket.assigned_to))
+    if cursore:
+        query = query.filter(_dopo_cursore(Ticket.created_at, Ticket.id, RANGO_SORGENTE['ticket'], cursore))
+    for t in query.order_by(Ticket.created_at.desc(), Ticket.id.desc()).limit(limite):
+        yield (t.created_at, RANGO_SORGENTE['ticket'], t.id), {
+            'tipo': 'ticket',
+            'id': t.id,
+            'data': t.created_at.isoformat(),
+            'titolo': f"Ticket {t.numero_ticket}: {t.titolo}",
+            'sottotipo': t.categoria,
+            'stato': t.stato,
+            'priorita': t.priorita,
+            'utente': t.assigned_to.full_name if t.assigned_to else None,
+            'url': url_for('tickets.view_ticket', id=t.id),
+        }
+
+
+def _fogli(macchina_id, limite, cursore):
+    query = FoglioTecnico.query.join(foglio_macchine, foglio_macchine.c.foglio_id == FoglioTecnico.id)\
+        .filter(foglio_macchine.c.macchina_id == macchina_id)\
+        .options(joinedload(FoglioTecnico.tecnico))
+    if cursore:
+        query = query.filter(_dopo_cursore(FoglioTecnico.data_intervento, FoglioTecnico.id, RANGO_SORGENTE['foglio'], cursore))
+    for f in query.order_by(FoglioTecnico.data_intervento.desc(), FoglioTecnico.id.desc()).limit(limite):
+        yield (f.data_intervento, RANGO_SORGENTE['foglio'], f.id), {
+            'tipo': 'foglio',
+            'id': f.id,
+            'data': f.data_intervento.isoformat(),
+            'titolo': f"Foglio {f.numero_foglio}" + (f": {f.titolo}" if f.titolo else ''),
+            'sottotipo': f.categoria,
+            'stato': f.stato,
+            'utente': f.tecnico.full_name if f.tecnico else None,
+            'url': url_for('fogli_tecnici.view', id=f.id),
+        }
+
+
+def timeline_macchina(macchina_id, cursore=None, limite=LIMITE_DEFAULT, completo=False):
+    """
+    Pagina della timeline di una macchina, dal più recente
+
+    Args:
+        macchina_id (int): Macchina
+        cursore (str): Cursore restituito dalla pagina precedente (None = prima pagina)
+        limite (int): Eventi per pagina
+        completo (bool): Include i movimenti archiviati
+
+    Returns:
+        dict: eventi e cursore della pagina successiva (None se finita)
+    """
+    limite = max(1, min(limite or LIMITE_DEFAULT, LIMITE_MASSIMO))
+    chiave_cursore = decodifica_cursore(cursore) if cursore else None
+
+    # Ogni sorgente è già ordinata per (data, id) decrescente: basta fondere le teste
+    sorgenti = [
+        _movimenti(macchina_id, limite + 1, chiave_cursore, completo),
+        _tickets(macchina_id, limite + 1, chiave_cursore),
+        _fogli(macchina_id, limite + 1, chiave_cursore),
+    ]
+    unione = heapq.merge(*sorgenti, key=lambda evento: evento[0], reverse=True)
+
+    pagina = []
+    for evento in unione:
+        pagina.append(evento)
+        if len(pagina) > limite:
+            break
+
+    altri = len(pagina) > limite
+    pagina = pagina[:limite]
+    return {
+        'eventi': [evento for _, evento in pagina],
+        'next_cursor': codifica_cursore(pagina[-1][0]) if altri else None,
+    }
@@ -0,0 +1,127 @@
+/**
+ * Salvataggio automatico degli step del wizard dei fogli tecnici
+ *
+ * Si attiva sui form con data-autosave (URL dell'API PATCH, fogli_tecnici.api_aggiorna_foglio)
+ * e data-autosave-fields (campi da salvare, separati da virgola). Dopo una pausa nella
+ * compilazione invia solo i campi cambiati dall'ultimo salvataggio; i campi nascosti
+ * aggiornati dagli script vanno segnalati con un evento 'change'.
+ * Lo stato del salvataggio compare nell'elemento [data-autosave-status] del form.
+ */
+(function () {
+    'use strict';
+
+    const DEBOUNCE_MS = 1200;
+
+    function initFoglioAutosave(form) {
+        if (form.dataset.autosaveInit) return;
+        form.dataset.autosaveInit = '1';
+
+        const url = form.dataset.autosave;
+        const fields = form.dataset.autosaveFields.split(',').map(f => f.trim()).filter(Boolean);
+        const status = form.querySelector('[data-autosave-status]');
+        const csrfInput = form.querySelector('input[name="csrf_token"]');
+        let saved = readValues();
+        let timer = null;
+        let inFlight = null;
+        let submitting = false;
+
+        function readValue(name) {
+            const element = form.elements[name];
+            if (!element) return undefined;
+            if (element.type === 'checkbox') return element.checked;
+            return element.value;
+        }
+
+        function readValues() {
+            const values = {};
+            fields.forEach(name => { values[name] = readValue(name); });
+            return values;
+        }
+
+        function changes() {
+            const current = readValues();
+            const diff = {};
+            fields.forEach(name => {
+                if (current[name] !== undefined && current[name] !== saved[name]) diff[name] = current[name];
+            });
+            return diff;
+        }
+
+        function setStatus(text, type) {
+            if (!status) return;
+            status.textContent = text;
+            status.className = 'small ' + (type === 'error' ? 'text-danger' : 'text-muted');
+        }
+
+        function markErrors(errors) {
+            fields.forEach(name => {
+                const element = form.elements[name];
+                if (element && element.classList) element.classList.toggle('is-invalid', name in errors);
+            });
+        }
+
+        function save(keepalive = false) {
+            clearTimeout(timer);
+            if (submitting) return Promise.resolve();
+            if (inFlight) {
+                // Un salvataggio alla volta: le modifiche arrivate nel frattempo partono dopo
+                return inFlight.then(() => save(keepalive));
+            }
+            const diff = changes();
+            if (!Object.keys(diff).length) return Promise.resolve();
+
+            setStatus('Salvataggio...');
+            inFlight = fetch(url, {
+                method: 'PATCH',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-CSRFToken': csrfInput ? csrfInput.value : ''
+                },
+                body: JSON.stringify(diff),
+                keepalive: keepalive
+            })
+                .then(response => response.json())
+                .then(data => {
+                    const errors = data.errori || {};
+                    Object.keys(diff).forEach(name => {
+                        if (!(name in errors)) saved[name] = diff[name];
+                    });
+                    markErrors(errors);
+                    if (data.success) {
+                        const time = new Date().toLocaleTimeString('it-IT', {hour: '2-digit', minute: '2-digit'});
+                        setStatus(`Salvato alle ${time}`);
+                    } else {
+                        setStatus('Non salvato: ' + (Object.values(errors)[0] || data.message || 'errore'), 'error');
+                    }
+                })
+                .catch(() => setStatus('Non salvato: errore di connessione', 'error'))
+                .finally(() => { inFlight = null; });
+            return inFlight;
+        }
+
+        function schedule(e) {
+            if (e && e.target && !fields.includes(e.target.name)) return;
+            clearTimeout(timer);
+            timer = setTimeout(save, DEBOUNCE_MS);
+        }
+
+        form.addEventListener('input', schedule);
+        form.addEventListener('change', schedule);
+        form.addEventListener('submit', () => {
+            // L'invio del form salva comunque tutti i campi
+            submitting = true;
+            clearTimeout(timer);
+        });
+        document.addEventListener('visibilitychange', () => {
+            if (document.visibilityState === 'hidden') save(true);
+        });
+
+        form.foglioAutosave = { save: save, schedule: schedule };
+    }
+
+    document.addEventListener('DOMContentLoaded', () => {
+        document.querySelectorAll('form[data-autosave]').forEach(initFoglioAutosave);
+    });
+
+    window.initFoglioAutosave = initFoglioAutosave;
+})();
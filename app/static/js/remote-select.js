@@ -0,0 +1,213 @@
+/**
+ * Select remote (RemoteSelectField / RemoteSelectMultipleField, app/forms/fields.py)
+ *
+ * La <select> originale resta nel form, nascosta, e contiene solo le opzioni selezionate.
+ * Le scelte arrivano dall'endpoint indicato in data-remote-select, con ricerca (q) e
+ * paginazione (page); la risposta è {results: [{id, text, subtitle?}], has_more, total}.
+ */
+(function () {
+    'use strict';
+
+    const DEBOUNCE_MS = 250;
+
+    function escapeHtml(text) {
+        const div = document.createElement('div');
+        div.textContent = text == null ? '' : String(text);
+        return div.innerHTML;
+    }
+
+    function initRemoteSelect(select) {
+        if (select.dataset.remoteSelectInit) return;
+        select.dataset.remoteSelectInit = '1';
+
+        const url = select.dataset.remoteSelect;
+        const multiple = select.multiple;
+        const emptyValue = select.dataset.emptyValue;
+        const emptyLabel = select.dataset.emptyLabel || '';
+        const small = select.classList.contains('form-select-sm');
+
+        const wrapper = document.createElement('div');
+        wrapper.className = 'remote-select position-relative';
+        const chips = document.createElement('div');
+        chips.className = 'd-flex flex-wrap gap-1 mb-1';
+        const input = document.createElement('input');
+        input.type = 'search';
+        input.autocomplete = 'off';
+        input.className = 'form-control' + (small ? ' form-control-sm' : '');
+        input.placeholder = select.dataset.placeholder || 'Cerca...';
+        if (select.classList.contains('is-invalid')) input.classList.add('is-invalid');
+        const menu = document.createElement('div');
+        menu.className = 'dropdown-menu w-100 overflow-auto';
+        menu.style.maxHeight = '18rem';
+
+        select.style.display = 'none';
+        select.parentNode.insertBefore(wrapper, select);
+        if (multiple) wrapper.appendChild(chips);
+        wrapper.appendChild(input);
+        wrapper.appendChild(menu);
+        wrapper.appendChild(select);
+
+        let page = 1;
+        let term = '';
+        let timeout = null;
+        let controller = null;
+
+        function selectedOptions() {
+            return Array.from(select.options).filter(o => o.selected && o.value !== emptyValue);
+        }
+
+        function renderSelection() {
+            if (multiple) {
+                chips.innerHTML = selectedOptions().map(o => `
+                    <span class="badge bg-primary bg-opacity-10 text-primary d-inline-flex align-items-center gap-1">
+                        ${escapeHtml(o.text)}
+                        <i class="bi bi-x" role="button" data-remove="${escapeHtml(o.value)}"></i>
+                    </span>
+                `).join('');
+            } else {
+                const current = selectedOptions()[0];
+                input.value = current ? current.text : '';
+            }
+        }
+
+        function setEmpty() {
+            if (emptyValue === undefined) {
+                select.value = '';
+                return;
+            }
+            let option = Array.from(select.options).find(o => o.value === emptyValue);
+            if (!option) {
+                option = new Option(emptyLabel, emptyValue);
+                select.add(option, 0);
+            }
+            option.selected = true;
+        }
+
+        function choose(id, text) {
+            const value = String(id);
+            let option = Array.from(select.options).find(o => o.value === value);
+            if (!multiple) {
+                // Una sola scelta: restano l'opzione vuota e quella scelta
+                Array.from(select.options).forEach(o => {
+                    if (o.value !== emptyValue && o.value !== value) o.remove();
+                });
+            }
+            if (!option) {
+                option = new Option(text, value);
+                select.add(option);
+            }
+            option.selected = true;
+            renderSelection();
+            hide();
+            if (multiple) input.value = '';
+            select.dispatchEvent(new Event('change', { bubbles: true }));
+        }
+
+        function remove(value) {
+            const option = Array.from(select.options).find(o => o.value === value);
+            if (option) option.remove();
+            renderSelection();
+            select.dispatchEvent(new Event('change', { bubbles: true }));
+        }
+
+        function hide() {
+            menu.classList.remove('show');
+        }
+
+        function load(append) {
+            if (controller) controller.abort();
+            controller = new AbortController();
+            const params = new URLSearchParams({ q: term, page: page });
+            fetch(`${url}${url.includes('?') ? '&' : '?'}${params}`, { signal: controller.signal })
+                .then(res => res.json())
+                .then(data => {
+                    const items = data.results.map(r => `
+                        <button type="button" class="dropdown-item" data-id="${escapeHtml(r.id)}" data-text="${escapeHtml(r.text)}">
+                            <div class="text-truncate">${escapeHtml(r.text)}</div>
+                            ${r.subtitle ? `<div class="small text-muted text-truncate">${escapeHtml(r.subtitle)}</div>` : ''}
+                        </button>
+                    `).join('');
+                    const more = data.has_more
+                        ? '<button type="button" class="dropdown-item text-primary small" data-more="1">Altri risultati...</button>'
+                        : '';
+                    const empty = !append && data.results.length === 0
+                        ? '<span class="dropdown-item-text small text-muted">Nessun risultato</span>'
+                        : '';
+
+                    const oldMore = menu.querySelector('[data-more]');
+                    if (oldMore) oldMore.remove();
+                    if (append) {
+                        menu.insertAdjacentHTML('beforeend', items + more);
+                    } else {
+                        const clear = !multiple && emptyValue !== undefined
+                            ? `<button type="button" class="dropdown-item small text-muted" data-clear="1">${escapeHtml(emptyLabel)}</button>`
+                            : '';
+                        menu.innerHTML = clear + items + empty + more;
+                    }
+                    menu.classList.add('show');
+                })
+                .catch(err => {
+                    if (err.name !== 'AbortError') hide();
+                });
+        }
+
+        function search() {
+            term = multiple || input.value !== (selectedOptions()[0] || {}).text ? input.value.trim() : '';
+            page = 1;
+            load(false);
+        }
+
+        input.addEventListener('focus', search);
+        input.addEventListener('input', () => {
+            clearTimeout(timeout);
+            timeout = setTimeout(search, DEBOUNCE_MS);
+        });
+        input.addEventListener('keydown', e => {
+            if (e.key === 'Escape') hide();
+        });
+        input.addEventListener('blur', () => {
+            // Campo svuotato a mano: torna all'opzione vuota
+            if (!multiple && input.value.trim() === '' && selectedOptions().length) {
+                setEmpty();
+                renderSelection();
+                select.dispatchEvent(new Event('change', { bubbles: true }));
+            }
+            setTimeout(() => {
+                if (!wrapper.contains(document.activeElement)) {
+                    hide();
+                    if (!multiple) renderSelection();
+                }
+            }, 150);
+        });
+
+        menu.addEventListener('mousedown', e => e.preventDefault());
+        menu.addEventListener('click', e => {
+            const target = e.target.closest('button');
+            if (!target) return;
+            if (target.dataset.more) {
+                page += 1;
+                load(true);
+            } else if (target.dataset.clear) {
+                setEmpty();
+                Array.from(select.options).forEach(o => { if (o.value !== emptyValue) o.remove(); });
+                renderSelection();
+                hide();
+                select.dispatchEvent(new Event('change', { bubbles: true }));
+            } else {
+                choose(target.dataset.id, target.dataset.text);
+            }
+        });
+        chips.addEventListener('click', e => {
+            const target = e.target.closest('[data-remove]');
+            if (target) remove(target.dataset.remove);
+        });
+
+        renderSelection();
+    }
+
+    document.addEventListener('DOMContentLoaded', () => {
+        document.querySelectorAll('select[data-remote-select]').forEach(initRemoteSelect);
+    });
+
+    window.initRemoteSelect = initRemoteSelect;
+})();
@@ -0,0 +1,64 @@
+"""
+Funzioni di normalizzazione per la ricerca testuale
+Usate per mantenere gli indici di ricerca e per interpretare i termini digitati
+"""
+
+import re
+
+_NON_ALFANUMERICO = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def normalizza_codice(testo):
+    """
+    Normalizza un codice per la ricerca: rimuove punteggiatura e spazi e
+    ignora maiuscole/minuscole (es. 'BL-P5478 bvmg6' -> 'blp5478bvmg6')
+    """
+    if not testo:
+        return ''
+    return _NON_ALFANUMERICO.sub('', testo.casefold())
+
+
+def escape_like(testo):
+    """Protegge i caratteri speciali di LIKE (%, _ e la barra rovesciata) da usare con escape='\\'"""
+    return testo.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def parole(testo):
+    """Suddivide un testo in parole normalizzate"""
+    if not testo:
+        return []
+    return [p for p in _NON_ALFANUMERICO.split(testo.casefold()) if p]
+
+
+def trigrammi(parola):
+    """Insieme dei trigrammi di una parola già normalizzata"""
+    return {parola[i:i + 3] for i in range(len(parola) - 2)}
+
+
+def trigrammi_documento(codice, descrizione, *altri_codici):
+    """
+    Trigrammi indicizzati per un elemento: codice normalizzato più parole della descrizione
+    (ed eventuali altri codici, es. matricola e modello di una macchina)
+    """
+    risultato = set()
+    for c in (codice,) + altri_codici:
+        risultato |= trigrammi(normalizza_codice(c))
+        for parola in parole(c):
+            risultato |= trigrammi(parola)
+    for parola in parole(descrizione):
+        risultato |= trigrammi(parola)
+    return risultato
+
+
+def trigrammi_termine(termine):
+    """
+    Trigrammi di un termine di ricerca.
+    Un termine unico viene trattato anche come codice (senza separatori),
+    più termini come parole della descrizione.
+    """
+    risultato = set()
+    if len(termine.split()) == 1:
+        risultato |= trigrammi(normalizza_codice(termine))
+    for parola in parole(termine):
+        risultato |= trigrammi(parola)
+    return risultato
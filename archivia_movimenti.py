@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Archiviazione dei movimenti di magazzino e macchine più vecchi dell'orizzonte configurato.
+I movimenti sono spostati nelle tabelle annuali di archivio e sommati nei riepiloghi.
+
+Esempi:
+    python archivia_movimenti.py --dry-run
+    python archivia_movimenti.py --mesi 36
+    python archivia_movimenti.py --elenco
+"""
+
+import argparse
+from app import create_app
+from app.models import ArchivioMovimenti
+from app.services.archivio_movimenti import archivia_movimenti, CHUNK_SIZE
+
+
+def stampa_archivi():
+    """Stampa le tabelle di archivio esistenti"""
+    archivi = ArchivioMovimenti.query.order_by(ArchivioMovimenti.tabella_origine, ArchivioMovimenti.anno).all()
+    if not archivi:
+        print("Nessun archivio presente")
+        return
+    for a in archivi:
+        periodo = f"{a.data_min:%d/%m/%Y} - {a.data_max:%d/%m/%Y}" if a.data_min else "-"
+        print(f"  {a.nome_tabella:<32} {a.righe:>10} righe   {periodo}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Archivia i movimenti di magazzino e macchine meno recenti')
+    parser.add_argument('--mesi', type=int, help='Mesi di movimenti da lasciare attivi (default: ARCHIVIO_MOVIMENTI_MESI)')
+    parser.add_argument('--chunk', type=int, default=CHUNK_SIZE, help='Movimenti spostati per transazione')
+    parser.add_argument('--dry-run', action='store_true', help='Conta i movimenti da archiviare senza spostarli')
+    parser.add_argument('--elenco', action='store_true', help='Mostra le tabelle di archivio esistenti')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.elenco:
+            stampa_archivi()
+            return
+
+        def progress(tabella, totale):
+            print(f"\r{tabella}: {totale} movimenti archiviati", end='', flush=True)
+
+        risultato = archivia_movimenti(mesi=args.mesi, chunk_size=args.chunk, dry_run=args.dry_run, progress=progress)
+
+        print()
+        print("=" * 60)
+        print("ARCHIVIAZIONE MOVIMENTI" + (" (DRY-RUN, nessuna modifica salvata)" if args.dry_run else ""))
+        print("=" * 60)
+        print(f"Movimenti precedenti al: {risultato['data_limite'][:10]}")
+        print(f"Magazzino:               {risultato['movimenti_magazzino']}")
+        print(f"Macchine:                {risultato['movimenti_macchine']}")
+        print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
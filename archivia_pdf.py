@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Archiviazione dei PDF (e vecchi HTML) dei fogli tecnici.
+Con --migra sposta i file della vecchia cartella unica nelle cartelle anno/mese/reparto e li
+registra nel manifesto; poi i mesi più vecchi dell'orizzonte configurato vengono spostati nei
+contenitori ZIP mensili.
+
+Esempi:
+    python archivia_pdf.py --migra
+    python archivia_pdf.py --dry-run
+    python archivia_pdf.py --mesi 6
+    python archivia_pdf.py --elenco
+"""
+
+import argparse
+import sys
+from sqlalchemy import func
+from app import create_app, db
+from app.models import DocumentoFoglio
+from app.services.archivio_pdf import archivia_documenti, migra_cartelle_piatte
+
+
+def stampa_contenitori():
+    """Stampa i contenitori di archivio con numero di documenti e spazio occupato"""
+    contenitori = db.session.query(
+        DocumentoFoglio.contenitore,
+        func.count(DocumentoFoglio.id),
+        func.sum(DocumentoFoglio.dimensione),
+        func.sum(DocumentoFoglio.dimensione_compressa)
+    ).filter(
+        DocumentoFoglio.contenitore.isnot(None)
+    ).group_by(DocumentoFoglio.contenitore).order_by(DocumentoFoglio.contenitore).all()
+    sciolti = DocumentoFoglio.query.filter(DocumentoFoglio.contenitore.is_(None)).count()
+
+    for contenitore, documenti, dimensione, compressa in contenitori:
+        print(f"  {contenitore:<48} {documenti:>6} documenti   {(dimensione or 0) / 1024:>9.0f} -> {(compressa or 0) / 1024:.0f} KiB")
+    if not contenitori:
+        print("Nessun contenitore di archivio presente")
+    print(f"Documenti non archiviati: {sciolti}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Archivia i PDF dei fogli tecnici meno recenti')
+    parser.add_argument('--migra', action='store_true', help='Sposta prima i file della vecchia cartella unica nelle cartelle anno/mese/reparto')
+    parser.add_argument('--mesi', type=int, help='Mesi di documenti da lasciare nelle cartelle (default: ARCHIVIO_PDF_MESI)')
+    parser.add_argument('--dry-run', action='store_true', help='Conta i documenti da spostare senza modificarli')
+    parser.add_argument('--elenco', action='store_true', help='Mostra i contenitori di archivio esistenti')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.elenco:
+            stampa_contenitori()
+            return
+
+        print("=" * 60)
+        print("ARCHIVIAZIONE PDF FOGLI TECNICI" + (" (DRY-RUN, nessuna modifica salvata)" if args.dry_run else ""))
+        print("=" * 60)
+
+        if args.migra:
+            migrati = migra_cartelle_piatte(
+                dry_run=args.dry_run,
+                progress=lambda spostati: print(f"\r{spostati} documenti spostati nelle cartelle", end='', flush=True)
+            )
+            print()
+            print(f"Spostati nelle cartelle:   {migrati['spostati']}")
+            print(f"Senza foglio:              {migrati['senza_foglio']}")
+            print(f"Errori:                    {migrati['errori']}")
+            print("-" * 60)
+
+        def progress(contenitore, documenti):
+            print(f"{contenitore}: {documenti} documenti archiviati")
+
+        risultato = archivia_documenti(mesi=args.mesi, dry_run=args.dry_run, progress=progress)
+
+        print(f"Documenti precedenti al:   {risultato['data_limite'][:10]}")
+        print(f"Contenitori:               {risultato['contenitori']}")
+        print(f"Documenti archiviati:      {risultato['documenti']}")
+        print(f"Spazio prima:              {risultato['byte_prima'] / 1024:.0f} KiB")
+        if not args.dry_run:
+            print(f"Spazio dopo:               {risultato['byte_dopo'] / 1024:.0f} KiB")
+        print(f"Errori:                    {risultato['errori']}")
+        print("=" * 60)
+        if risultato['errori'] or (args.migra and migrati['errori']):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
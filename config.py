@@ -64,6 +64,49 @@ class Config:
     
     # Timeout per connessioni email
     MAIL_TIMEOUT = 30
+    
+    # Outbox email: controllo periodico della coda (tentativi rimandati), tentativi massimi,
+    # attesa base del backoff esponenziale (raddoppia a ogni errore) e invii al minuto
+    MAIL_OUTBOX_POLL_SECONDS = int(os.environ.get('MAIL_OUTBOX_POLL_SECONDS') or 60)
+    MAIL_OUTBOX_TENTATIVI = int(os.environ.get('MAIL_OUTBOX_TENTATIVI') or 8)
+    MAIL_OUTBOX_BACKOFF_SECONDS = int(os.environ.get('MAIL_OUTBOX_BACKOFF_SECONDS') or 60)
+    MAIL_RATE_PER_MINUTE = int(os.environ.get('MAIL_RATE_PER_MINUTE') or 30)
+    
+    # Digest email ricambi sotto scorta (vuoto = disabilitato)
+    SCORTA_DIGEST_RECIPIENTS = os.environ.get('SCORTA_DIGEST_RECIPIENTS', '').split(',') if os.environ.get('SCORTA_DIGEST_RECIPIENTS') else []
+    SCORTA_DIGEST_HOURS = int(os.environ.get('SCORTA_DIGEST_HOURS') or 24)
+    
+    # Pulizia degli export report magazzino scaduti (0 = solo all'avvio di un nuovo export)
+    REPORT_EXPORT_PULIZIA_HOURS = int(os.environ.get('REPORT_EXPORT_PULIZIA_HOURS') or 6)
+    
+    # Scadenza automatica prenotazioni ricambi (0 = disabilitata)
+    PRENOTAZIONI_SCADENZA_MINUTES = int(os.environ.get('PRENOTAZIONI_SCADENZA_MINUTES') or 15)
+    
+    # Archiviazione movimenti: mesi lasciati nelle tabelle attive e intervallo del job (0 = solo manuale)
+    ARCHIVIO_MOVIMENTI_MESI = int(os.environ.get('ARCHIVIO_MOVIMENTI_MESI') or 24)
+    ARCHIVIO_MOVIMENTI_HOURS = int(os.environ.get('ARCHIVIO_MOVIMENTI_HOURS') or 0)
+    
+    # Coda scadenze macchine (manutenzioni e garanzie): intervallo del job (0 = disabilitato),
+    # orizzonte in giorni e creazione automatica dei ticket di manutenzione
+    SCADENZE_MACCHINE_HOURS = int(os.environ.get('SCADENZE_MACCHINE_HOURS') or 24)
+    SCADENZE_MACCHINE_ORIZZONTE_GIORNI = int(os.environ.get('SCADENZE_MACCHINE_ORIZZONTE_GIORNI') or 30)
+    SCADENZE_MACCHINE_CREA_TICKET = os.environ.get('SCADENZE_MACCHINE_CREA_TICKET', 'False').lower() == 'true'
+    SCADENZE_MACCHINE_UTENTE_ID = int(os.environ.get('SCADENZE_MACCHINE_UTENTE_ID') or 0) or None
+    
+    # Promemoria fogli incompleti: intervallo del job (0 = disabilitato), giorni dopo i quali
+    # un foglio è in ritardo e giorni prima di ripetere il promemoria sullo stesso foglio
+    PROMEMORIA_FOGLI_HOURS = int(os.environ.get('PROMEMORIA_FOGLI_HOURS') or 24)
+    PROMEMORIA_FOGLI_GIORNI = int(os.environ.get('PROMEMORIA_FOGLI_GIORNI') or 7)
+    PROMEMORIA_FOGLI_RIPETI_GIORNI = int(os.environ.get('PROMEMORIA_FOGLI_RIPETI_GIORNI') or 7)
+    
+    # Coda PDF fogli tecnici: processi di rendering e secondi di attesa del download prima di rispondere 202
+    PDF_RENDER_PROCESSES = int(os.environ.get('PDF_RENDER_PROCESSES') or 2)
+    PDF_ATTESA_DOWNLOAD_SECONDI = int(os.environ.get('PDF_ATTESA_DOWNLOAD_SECONDI') or 5)
+    
+    # Archivio PDF/HTML fogli tecnici: mesi lasciati come file nelle cartelle anno/mese/reparto
+    # e intervallo del job che sposta i mesi precedenti nei contenitori ZIP mensili (0 = solo manuale)
+    ARCHIVIO_PDF_MESI = int(os.environ.get('ARCHIVIO_PDF_MESI') or 12)
+    ARCHIVIO_PDF_HOURS = int(os.environ.get('ARCHIVIO_PDF_HOURS') or 24)
 
 
 class DevelopmentConfig(Config):
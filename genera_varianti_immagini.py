@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+Genera le varianti thumb/medium/full delle foto già caricate (ricambi e macchine).
+Le varianti già aggiornate vengono saltate, quindi lo script può essere rilanciato.
+
+Esempi:
+    python genera_varianti_immagini.py
+    python genera_varianti_immagini.py --categoria ricambi --processi 4
+    python genera_varianti_immagini.py --forza
+"""
+
+import argparse
+import os
+import sys
+from app import create_app
+from app.services.immagini import backfill_varianti, cartella_foto
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera le varianti ridimensionate delle foto esistenti')
+    parser.add_argument('--categoria', choices=['ricambi', 'macchine', 'tutte'], default='tutte',
+                        help='Foto da elaborare')
+    parser.add_argument('--processi', type=int, help='Numero di processi (default: numero di CPU)')
+    parser.add_argument('--forza', action='store_true', help='Rigenera anche le varianti già aggiornate')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        categorie = ['ricambi', 'macchine'] if args.categoria == 'tutte' else [args.categoria]
+        cartelle = [cartella_foto(c) for c in categorie]
+
+    elaborati = 0
+
+    def progress(path, scritte, errore):
+        nonlocal elaborati
+        elaborati += 1
+        if errore:
+            print(f"\n[ERRORE] {os.path.basename(path)}: {errore}")
+        print(f"\r{elaborati} foto elaborate", end='', flush=True)
+
+    totali = backfill_varianti(cartelle, processi=args.processi, forza=args.forza, progress=progress)
+
+    print()
+    print("=" * 60)
+    print(f"Foto trovate:       {totali['file']}")
+    print(f"Varianti generate:  {totali['varianti']}")
+    print(f"Errori:             {totali['errori']}")
+    print("=" * 60)
+    if totali['errori']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
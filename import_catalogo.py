@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+Importazione listini ricambi dei fornitori da file CSV, XLSX o PDF.
+
+Esempi:
+    python import_catalogo.py listino.csv --reparto 1 --fornitore Dibal --dry-run
+    python import_catalogo.py listino.xlsx --reparto 1 --errori errori.csv
+    python import_catalogo.py listino.pdf --reparto 1 --profilo dibal --esporta-csv estratto.csv
+"""
+
+import argparse
+import csv
+import sys
+from app import create_app
+from app.services.import_catalogo import importa_catalogo, leggi_file_listino, CHUNK_SIZE
+from app.services.estrazione_listini_pdf import nomi_profili
+
+
+def stampa_risultato(risultato):
+    """Stampa il riepilogo di un'importazione"""
+    print()
+    print("=" * 80)
+    print("RIEPILOGO IMPORTAZIONE" + (" (DRY-RUN, nessuna modifica salvata)" if risultato.dry_run else ""))
+    print("=" * 80)
+    print(f"Righe lette:        {risultato.righe_lette}")
+    print(f"[+] Nuovi:          {risultato.inseriti}")
+    print(f"[~] Aggiornati:     {risultato.aggiornati}")
+    print(f"[=] Invariati:      {risultato.invariati}")
+    print(f"[!] Errori:         {len(risultato.errori)}")
+
+    if risultato.dry_run and risultato.differenze:
+        print()
+        print("DIFFERENZE (prime 50):")
+        for codice, campo, attuale, nuovo in risultato.differenze[:50]:
+            if campo == 'nuovo':
+                print(f"  + {codice}: {nuovo}")
+            else:
+                print(f"  ~ {codice} {campo}: {attuale} -> {nuovo}")
+
+    if risultato.errori:
+        print()
+        print("ERRORI (primi 50):")
+        for riga, codice, messaggio in risultato.errori[:50]:
+            print(f"  - riga {riga} [{codice or '-'}]: {messaggio}")
+    print("=" * 80)
+
+
+def salva_errori(risultato, path):
+    """Scrive il report completo degli errori per riga in CSV"""
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(['Riga', 'Codice', 'Errore'])
+        writer.writerows(risultato.errori)
+
+
+def esporta_righe_csv(path_pdf, profilo, path_csv):
+    """Salva le righe estratte da un PDF in CSV, per controllarle prima dell'import"""
+    from app.services.estrazione_listini_pdf import estrai_listino_pdf
+
+    righe = estrai_listino_pdf(path_pdf, profilo)
+    with open(path_csv, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(['codice', 'descrizione', 'prezzo', 'modello', 'fornitore', 'pagina'])
+        for r in righe:
+            writer.writerow([r.get('codice'), r.get('descrizione'), r.get('prezzo'),
+                             r.get('modello') or '', r.get('fornitore') or '', r.get('pagina')])
+    return len(righe)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Importa un listino ricambi CSV/XLSX/PDF')
+    parser.add_argument('file', help='Percorso del listino (.csv, .xlsx o .pdf)')
+    parser.add_argument('--reparto', type=int, required=True, help='ID reparto dei nuovi ricambi')
+    parser.add_argument('--fornitore', help='Fornitore da usare se non presente nel file')
+    parser.add_argument('--dry-run', action='store_true', help='Mostra le differenze senza salvare')
+    parser.add_argument('--solo-nuovi', action='store_true', help='Non aggiorna i codici già presenti')
+    parser.add_argument('--chunk', type=int, default=CHUNK_SIZE, help='Righe per blocco')
+    parser.add_argument('--errori', help='Salva il report errori in questo file CSV')
+    parser.add_argument('--profilo', default='generico', help='Profilo di layout per i listini PDF')
+    parser.add_argument('--esporta-csv', help='Solo PDF: salva le righe estratte in CSV senza importarle')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.profilo not in nomi_profili():
+            print(f"[ERRORE] Profilo sconosciuto: {args.profilo} (disponibili: {', '.join(nomi_profili())})")
+            sys.exit(1)
+
+        if args.esporta_csv:
+            totale = esporta_righe_csv(args.file, args.profilo, args.esporta_csv)
+            print(f"{totale} righe estratte salvate in {args.esporta_csv}")
+            return
+
+        def progress(righe, risultato):
+            print(f"\r{righe} righe elaborate ({risultato.inseriti} nuovi, "
+                  f"{risultato.aggiornati} aggiornati, {len(risultato.errori)} errori)", end='', flush=True)
+
+        try:
+            risultato = importa_catalogo(
+                leggi_file_listino(args.file, args.profilo),
+                department_id=args.reparto,
+                fornitore=args.fornitore,
+                dry_run=args.dry_run,
+                aggiorna_esistenti=not args.solo_nuovi,
+                chunk_size=args.chunk,
+                progress=progress
+            )
+        except (ValueError, OSError) as e:
+            print(f"[ERRORE] {e}")
+            sys.exit(1)
+
+        stampa_risultato(risultato)
+        if args.errori and risultato.errori:
+            salva_errori(risultato, args.errori)
+            print(f"Report errori salvato in {args.errori}")
+
+
+if __name__ == '__main__':
+    main()
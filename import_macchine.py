@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Importazione ed esportazione del parco macchine in CSV/XLSX.
+Tipo, reparto e cliente si indicano per nome; le macchine già presenti
+(stesso codice o numero di serie) non vengono modificate.
+
+Esempi:
+    python import_macchine.py macchine.xlsx --dry-run
+    python import_macchine.py macchine.csv --tipo "Bilancia" --reparto "Meccanica" --errori errori.csv
+    python import_macchine.py --esporta parco.csv
+"""
+
+import argparse
+import sys
+from app import create_app
+from app.models.macchina import TipoMacchina
+from app.models.department import Department
+from app.services.import_macchine import importa_macchine, leggi_file_macchine, genera_csv_parco, CHUNK_SIZE
+from import_catalogo import salva_errori
+
+
+def stampa_risultato(risultato):
+    """Stampa il riepilogo di un'importazione"""
+    print()
+    print("=" * 80)
+    print("RIEPILOGO IMPORTAZIONE MACCHINE" + (" (DRY-RUN, nessuna modifica salvata)" if risultato.dry_run else ""))
+    print("=" * 80)
+    print(f"Righe lette:        {risultato.righe_lette}")
+    print(f"[+] Nuove:          {risultato.inseriti}")
+    print(f"[!] Scartate:       {len(risultato.errori)}")
+
+    if risultato.dry_run and risultato.differenze:
+        print()
+        print("MACCHINE DA IMPORTARE (prime 50):")
+        for codice, _, _, nuovo in risultato.differenze[:50]:
+            print(f"  + {codice}: {nuovo}")
+
+    if risultato.errori:
+        print()
+        print("RIGHE SCARTATE (prime 50):")
+        for riga, codice, messaggio in risultato.errori[:50]:
+            print(f"  - riga {riga} [{codice or '-'}]: {messaggio}")
+    print("=" * 80)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Importa o esporta il parco macchine (CSV/XLSX)')
+    parser.add_argument('file', nargs='?', help='Percorso del file da importare (.csv o .xlsx)')
+    parser.add_argument('--tipo', help='Nome del tipo macchina per le righe che non lo indicano')
+    parser.add_argument('--reparto', help='Nome del reparto per le righe che non lo indicano')
+    parser.add_argument('--dry-run', action='store_true', help='Valida il file senza salvare')
+    parser.add_argument('--chunk', type=int, default=CHUNK_SIZE, help='Righe per blocco')
+    parser.add_argument('--errori', help='Salva il report delle righe scartate in questo file CSV')
+    parser.add_argument('--esporta', help='Esporta il parco macchine in questo file CSV')
+    args = parser.parse_args()
+
+    if not args.file and not args.esporta:
+        parser.error('indicare il file da importare oppure --esporta')
+
+    app = create_app()
+    with app.app_context():
+        if args.esporta:
+            with open(args.esporta, 'w', newline='', encoding='utf-8') as f:
+                for parte in genera_csv_parco():
+                    f.write(parte)
+            print(f"Parco macchine esportato in {args.esporta}")
+            return
+
+        tipo_id = department_id = None
+        if args.tipo:
+            tipo = TipoMacchina.query.filter(TipoMacchina.nome.ilike(args.tipo)).first()
+            if not tipo:
+                print(f"[ERRORE] Tipo macchina sconosciuto: {args.tipo}")
+                sys.exit(1)
+            tipo_id = tipo.id
+        if args.reparto:
+            department = Department.query.filter(
+                (Department.name.ilike(args.reparto)) | (Department.display_name.ilike(args.reparto))
+            ).first()
+            if not department:
+                print(f"[ERRORE] Reparto sconosciuto: {args.reparto}")
+                sys.exit(1)
+            department_id = department.id
+
+        def progress(righe, risultato):
+            print(f"\r{righe} righe elaborate ({risultato.inseriti} nuove, "
+                  f"{len(risultato.errori)} scartate)", end='', flush=True)
+
+        try:
+            risultato = importa_macchine(
+                leggi_file_macchine(args.file),
+                tipo_macchina_id=tipo_id,
+                department_id=department_id,
+                dry_run=args.dry_run,
+                chunk_size=args.chunk,
+                progress=progress
+            )
+        except (ValueError, OSError) as e:
+            print(f"[ERRORE] {e}")
+            sys.exit(1)
+
+        stampa_risultato(risultato)
+        if args.errori and risultato.errori:
+            salva_errori(risultato, args.errori)
+            print(f"Report righe scartate salvato in {args.errori}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,12 @@
 """
 Script to import Dibal spare parts from PDF into the database.
 Extracts data from 'listino ricambi cs 1200 (1).pdf' and populates the ricambi table.
+
+Newer Dibal price lists can be imported directly from the PDF:
+    python import_catalogo.py listino.pdf --reparto 1 --profilo dibal
 """
 
-import re
-from app import create_app, db
-from app.models.ricambio import Ricambio
+from app import create_app
 
 # Parsed data from PDF
 RICAMBI_DATA = [
@@ -133,6 +134,9 @@ RICAMBI_DATA = [
 
 def main():
     """Main function to import spare parts."""
+    from import_catalogo import stampa_risultato
+    from app.services.import_catalogo import importa_catalogo
+    
     app = create_app()
     
     with app.app_context():
@@ -145,93 +149,19 @@ def main():
         FORNITORE = "Dibal"
         DEPARTMENT_ID = 1  # Assistenza IT (informatica)
         
-        # Statistics
-        total_items = len(RICAMBI_DATA)
-        added = 0
-        skipped = 0
-        errors = []
-        
-        print(f"Trovati {total_items} ricambi da importare")
+        print(f"Trovati {len(RICAMBI_DATA)} ricambi da importare")
         print(f"Fornitore: {FORNITORE}")
         print(f"Reparto: Assistenza IT (ID: {DEPARTMENT_ID})")
-        print()
-        print("-" * 80)
-        
-        for idx, item in enumerate(RICAMBI_DATA, 1):
-            codice = item['codice']
-            descrizione_base = item['descrizione']
-            prezzo = item['prezzo']
-            modello = item['modello']
-            
-            # Append model to description
-            descrizione_completa = f"{descrizione_base} - {modello}"
-            
-            try:
-                # Check if spare part already exists
-                existing = Ricambio.query.filter_by(codice=codice).first()
-                
-                if existing:
-                    print(f"[{idx}/{total_items}] SKIP - {codice}: Già esistente nel database")
-                    skipped += 1
-                    continue
-                
-                # Create new spare part
-                nuovo_ricambio = Ricambio(
-                    codice=codice,
-                    descrizione=descrizione_completa,
-                    prezzo_unitario=prezzo,
-                    fornitore=FORNITORE,
-                    department_id=DEPARTMENT_ID,
-                    quantita_disponibile=0,  # Start with 0 quantity
-                    quantita_prenotata=0,
-                    quantita_minima=0
-                )
-                
-                db.session.add(nuovo_ricambio)
-                print(f"[{idx}/{total_items}] OK - {codice}: {descrizione_base[:50]}... (€{prezzo:.2f})")
-                added += 1
-                
-            except Exception as e:
-                error_msg = f"[{idx}/{total_items}] ERROR - {codice}: {str(e)}"
-                print(error_msg)
-                errors.append(error_msg)
-                db.session.rollback()
-                continue
-        
-        # Commit all changes
-        if added > 0:
-            try:
-                db.session.commit()
-                print()
-                print("-" * 80)
-                print("[OK] Database aggiornato con successo!")
-            except Exception as e:
-                print()
-                print("-" * 80)
-                print(f"[ERRORE] durante il commit: {str(e)}")
-                db.session.rollback()
-                return
-        
-        # Print summary
-        print()
-        print("=" * 80)
-        print("RIEPILOGO IMPORTAZIONE")
-        print("=" * 80)
-        print(f"Totale ricambi processati: {total_items}")
-        print(f"[+] Aggiunti:               {added}")
-        print(f"[-] Saltati (gia' esistenti): {skipped}")
-        print(f"[!] Errori:                 {len(errors)}")
-        print()
         
-        if errors:
-            print("ERRORI RILEVATI:")
-            for error in errors:
-                print(f"  - {error}")
-            print()
-        
-        print("=" * 80)
-        print(f"Importazione completata!")
-        print("=" * 80)
+        # I codici già presenti vengono saltati, come nella prima importazione
+        risultato = importa_catalogo(
+            RICAMBI_DATA,
+            department_id=DEPARTMENT_ID,
+            fornitore=FORNITORE,
+            aggiorna_esistenti=False,
+            riga_iniziale=1
+        )
+        stampa_risultato(risultato)
 
 
 if __name__ == '__main__':
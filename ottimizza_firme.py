@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+Ottimizza le firme dei fogli tecnici salvate prima dell'archiviazione per contenuto:
+ritaglio sul tratto, PNG a palette e nome dato dall'hash. Le firme già ottimizzate
+vengono saltate, quindi lo script può essere rilanciato.
+
+Esempi:
+    python ottimizza_firme.py
+    python ottimizza_firme.py --processi 4
+"""
+
+import argparse
+import os
+import sys
+from app import create_app
+from app.services.firme import backfill_firme
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ottimizza le firme dei fogli tecnici esistenti')
+    parser.add_argument('--processi', type=int, help='Numero di processi (default: numero di CPU)')
+    args = parser.parse_args()
+
+    elaborati = 0
+
+    def progress(path, prima, dopo, errore):
+        nonlocal elaborati
+        elaborati += 1
+        if errore:
+            print(f"\n[ERRORE] {os.path.basename(path)}: {errore}")
+        print(f"\r{elaborati} firme elaborate", end='', flush=True)
+
+    app = create_app()
+    with app.app_context():
+        totali = backfill_firme(processi=args.processi, progress=progress)
+
+    print()
+    print("=" * 60)
+    print(f"Firme trovate:      {totali['file']}")
+    print(f"Errori:             {totali['errori']}")
+    print(f"Spazio prima:       {totali['byte_prima'] / 1024:.0f} KiB")
+    print(f"Spazio dopo:        {totali['byte_dopo'] / 1024:.0f} KiB")
+    print("=" * 60)
+    if totali['errori']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
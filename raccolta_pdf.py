@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Raccolta dei PDF dei fogli tecnici di un periodo, cliente, tecnico o reparto,
+in un unico PDF con segnalibri oppure in uno ZIP. I PDF mancanti o non aggiornati
+vengono generati in parallelo prima della raccolta.
+
+Esempi:
+    python raccolta_pdf.py --mese 2025-03 --output fogli_marzo.pdf
+    python raccolta_pdf.py --da 2025-01-01 --a 2025-03-31 --cliente "Supermercati Rossi" --formato zip --output rossi.zip
+    python raccolta_pdf.py --mese 2025-03 --reparto "Meccanica" --processi 4 --output meccanica.pdf
+"""
+
+import argparse
+import calendar
+import sys
+from datetime import date, datetime
+from app import create_app
+from app.models.foglio_tecnico import FoglioTecnico
+from app.models.cliente import Cliente
+from app.models.user import User
+from app.models.department import Department
+from app.services.raccolta_pdf import filtra_fogli, genera_raccolta, FORMATI
+
+
+def data_argomento(valore):
+    """Data in formato AAAA-MM-GG o GG/MM/AAAA"""
+    for formato in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(valore, formato).date()
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"data non valida: {valore}")
+
+
+def mese_argomento(valore):
+    """Mese in formato AAAA-MM, restituito come (primo giorno, ultimo giorno)"""
+    try:
+        inizio = datetime.strptime(valore, '%Y-%m').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"mese non valido: {valore}")
+    return inizio, date(inizio.year, inizio.month, calendar.monthrange(inizio.year, inizio.month)[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Raccolta dei PDF dei fogli tecnici (PDF unico o ZIP)')
+    parser.add_argument('--mese', type=mese_argomento, help='Mese degli interventi (AAAA-MM)')
+    parser.add_argument('--da', type=data_argomento, help='Primo giorno del periodo')
+    parser.add_argument('--a', type=data_argomento, help='Ultimo giorno del periodo (incluso)')
+    parser.add_argument('--cliente', help='Ragione sociale del cliente')
+    parser.add_argument('--tecnico', help='Username del tecnico')
+    parser.add_argument('--reparto', help='Nome del reparto')
+    parser.add_argument('--formato', choices=FORMATI, help='pdf (default) o zip; se omesso si usa l\'estensione di --output')
+    parser.add_argument('--processi', type=int, help='Processi di rendering (default: PDF_RENDER_PROCESSES)')
+    parser.add_argument('--output', required=True, help='File da scrivere')
+    args = parser.parse_args()
+
+    data_da, data_a = args.mese if args.mese else (args.da, args.a)
+    formato = args.formato or ('zip' if args.output.lower().endswith('.zip') else 'pdf')
+
+    app = create_app()
+    with app.app_context():
+        cliente_id = tecnico_id = department_id = None
+        if args.cliente:
+            cliente = Cliente.query.filter(Cliente.ragione_sociale.ilike(args.cliente)).first()
+            if not cliente:
+                print(f"[ERRORE] Cliente sconosciuto: {args.cliente}")
+                sys.exit(1)
+            cliente_id = cliente.id
+        if args.tecnico:
+            tecnico = User.query.filter(User.username.ilike(args.tecnico)).first()
+            if not tecnico:
+                print(f"[ERRORE] Tecnico sconosciuto: {args.tecnico}")
+                sys.exit(1)
+            tecnico_id = tecnico.id
+        if args.reparto:
+            department = Department.query.filter(
+                (Department.name.ilike(args.reparto)) | (Department.display_name.ilike(args.reparto))
+            ).first()
+            if not department:
+                print(f"[ERRORE] Reparto sconosciuto: {args.reparto}")
+                sys.exit(1)
+            department_id = department.id
+
+        query = filtra_fogli(
+            FoglioTecnico.query,
+            data_da=data_da,
+            data_a=data_a,
+            cliente_id=cliente_id,
+            tecnico_id=tecnico_id,
+            department_id=department_id
+        )
+        foglio_ids = [foglio_id for (foglio_id,) in query.with_entities(FoglioTecnico.id)]
+        print(f"Fogli selezionati: {len(foglio_ids)}")
+
+        def progress(elaborati, totale):
+            print(f"\r{elaborati}/{totale} PDF pronti", end='', flush=True)
+
+        try:
+            risultato = genera_raccolta(foglio_ids, formato, args.output, processi=args.processi, progress=progress)
+        except (ValueError, OSError) as e:
+            print()
+            print(f"[ERRORE] {e}")
+            sys.exit(1)
+
+        print()
+        print(f"Raccolta salvata in {args.output} ({risultato['inclusi']} fogli)")
+        for errore in risultato['errori']:
+            print(f"  - {errore['numero_foglio']}: {errore['messaggio']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark del rendering PDF di un foglio tecnico tipico (senza database).
+Misura tempo per documento e memoria allocata (tracemalloc) di disegna_pdf_foglio.
+Eseguire dalla root del progetto: python scripts/benchmark_pdf.py --documenti 50
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def foglio_tipico():
+    """Dati di un foglio con descrizione, tre macchine, cinque ricambi e note"""
+    return {
+        'numero_foglio': 'MEC-2025-0042',
+        'cliente': 'Supermercati Rossi Srl',
+        'tecnico': 'Mario Bianchi',
+        'data_intervento': '14/03/2025 alle 09:30',
+        'categoria': 'Manutenzione',
+        'priorita': 'Alta',
+        'stato': 'Completato',
+        'durata_intervento': 90,
+        'km_percorsi': 35,
+        'titolo': 'Manutenzione programmata bilance reparto gastronomia',
+        'descrizione': '\n'.join(f"Controllo e taratura della bilancia n. {i}, pulizia celle di carico." for i in range(1, 6)),
+        'indirizzo_intervento': 'Via Roma 10, 10100 Torino (TO)',
+        'macchine': [
+            {'codice': f'BIL-{i:04d}', 'marca': 'Dibal', 'modello': 'K-555', 'numero_serie': f'SN{i:08d}'}
+            for i in range(3)
+        ],
+        'ricambi': [
+            {'codice': f'RC-{i:05d}', 'descrizione': f'Cella di carico tipo {i}', 'fornitore': 'Dibal'}
+            for i in range(5)
+        ],
+        'note_aggiuntive': 'Cliente avvisato della prossima scadenza.\nSostituire rotolo etichette entro un mese.',
+        'modalita_pagamento': 'Bonifico',
+        'importo_intervento': '180.00',
+        'pagamento_immediato': False,
+        'intervento_in_garanzia': False,
+        'firma_tecnico_path': None,
+        'firma_cliente_path': None,
+        'nome_firmatario_cliente': 'Luca Rossi',
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmark del rendering PDF dei fogli tecnici')
+    parser.add_argument('--documenti', type=int, default=50, help='Documenti da generare')
+    parser.add_argument('--riscaldamento', type=int, default=3, help='Documenti iniziali esclusi dalle misure')
+    args = parser.parse_args()
+
+    from app.services.pdf_generator import disegna_pdf_foglio
+
+    dati = foglio_tipico()
+    tempi = []
+    allocazioni = []
+    with tempfile.TemporaryDirectory() as cartella:
+        path = os.path.join(cartella, 'foglio.pdf')
+        for _ in range(args.riscaldamento):
+            disegna_pdf_foglio(dati, path)
+
+        for _ in range(args.documenti):
+            tracemalloc.start()
+            inizio = time.perf_counter()
+            disegna_pdf_foglio(dati, path)
+            tempi.append(time.perf_counter() - inizio)
+            allocazioni.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+        dimensione = os.path.getsize(path)
+
+    # Il tempo con tracemalloc attivo è gonfiato: ripete la misura senza tracciamento
+    with tempfile.TemporaryDirectory() as cartella:
+        path = os.path.join(cartella, 'foglio.pdf')
+        tempi_puri = []
+        for _ in range(args.documenti):
+            inizio = time.perf_counter()
+            disegna_pdf_foglio(dati, path)
+            tempi_puri.append(time.perf_counter() - inizio)
+
+    print(f"Documenti:              {args.documenti}")
+    print(f"Tempo medio:            {statistics.mean(tempi_puri) * 1000:.2f} ms")
+    print(f"Tempo mediano:          {statistics.median(tempi_puri) * 1000:.2f} ms")
+    print(f"Tempo minimo:           {min(tempi_puri) * 1000:.2f} ms")
+    print(f"Picco memoria medio:    {statistics.mean(allocazioni) / 1024:.0f} KiB")
+    print(f"Dimensione PDF:         {dimensione / 1024:.1f} KiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+"""
+Migrazione: aggiunge la colonna calendario_token alla tabella users
+(token personale del feed iCalendar delle scadenze macchine).
+Eseguire dalla root del progetto: python scripts/migrate_add_calendario_token.py
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def run_migration():
+    from sqlalchemy import text
+    from app import create_app, db
+
+    app = create_app()
+    with app.app_context():
+        try:
+            db.session.execute(text(
+                "ALTER TABLE users ADD COLUMN calendario_token VARCHAR(64) NULL "
+                "COMMENT 'Token del feed calendario scadenze'"
+            ))
+            db.session.execute(text(
+                "CREATE UNIQUE INDEX ix_users_calendario_token ON users (calendario_token)"
+            ))
+            db.session.commit()
+            print("OK: Colonna 'calendario_token' aggiunta a users.")
+        except Exception as e:
+            if 'Duplicate column name' in str(e) or '1060' in str(e):
+                print("La colonna 'calendario_token' esiste già. Nessuna modifica.")
+                db.session.rollback()
+            else:
+                db.session.rollback()
+                raise
+
+
+if __name__ == '__main__':
+    run_migration()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""
+Migrazione: aggiunge l'indice su created_at alla tabella movimenti_macchine.
+Usato dai movimenti recenti della lista macchine (ORDER BY created_at DESC LIMIT n).
+Eseguire dalla root del progetto: python scripts/migrate_add_indice_movimenti_macchine.py
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def run_migration():
+    from sqlalchemy import text
+    from app import create_app, db
+
+    app = create_app()
+    with app.app_context():
+        try:
+            db.session.execute(text("""
+                CREATE INDEX idx_movimenti_macchine_created
+                ON movimenti_macchine (created_at)
+            """))
+            db.session.commit()
+            print("OK: Indice 'idx_movimenti_macchine_created' creato.")
+        except Exception as e:
+            if 'Duplicate key name' in str(e) or '1061' in str(e):
+                print("L'indice 'idx_movimenti_macchine_created' esiste già. Nessuna modifica.")
+                db.session.rollback()
+            else:
+                db.session.rollback()
+                raise
+
+
+if __name__ == '__main__':
+    run_migration()
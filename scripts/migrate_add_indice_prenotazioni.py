@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""
+Migrazione: aggiunge l'indice (stato, data_scadenza) alla tabella prenotazioni_ricambi.
+Usato dal job che fa scadere automaticamente le prenotazioni.
+Eseguire dalla root del progetto: python scripts/migrate_add_indice_prenotazioni.py
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def run_migration():
+    from sqlalchemy import text
+    from app import create_app, db
+
+    app = create_app()
+    with app.app_context():
+        try:
+            db.session.execute(text("""
+                CREATE INDEX idx_prenotazioni_stato_scadenza
+                ON prenotazioni_ricambi (stato, data_scadenza)
+            """))
+            db.session.commit()
+            print("OK: Indice 'idx_prenotazioni_stato_scadenza' creato.")
+        except Exception as e:
+            if 'Duplicate key name' in str(e) or '1061' in str(e):
+                print("L'indice 'idx_prenotazioni_stato_scadenza' esiste già. Nessuna modifica.")
+                db.session.rollback()
+            else:
+                db.session.rollback()
+                raise
+
+
+if __name__ == '__main__':
+    run_migration()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+"""
+Migrazione: aggiunge gli indici (prossima_manutenzione, stato) e (data_scadenza_garanzia, stato)
+alla tabella macchine, usati dal job che calcola la coda delle scadenze.
+La tabella scadenze_macchine viene creata da db.create_all() all'avvio.
+Eseguire dalla root del progetto: python scripts/migrate_add_indici_scadenze_macchine.py
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+INDICI = [
+    ('idx_macchine_manutenzione_stato', 'macchine (prossima_manutenzione, stato)'),
+    ('idx_macchine_garanzia_stato', 'macchine (data_scadenza_garanzia, stato)'),
+]
+
+
+def run_migration():
+    from sqlalchemy import text
+    from app import create_app, db
+
+    app = create_app()
+    with app.app_context():
+        for nome, definizione in INDICI:
+            try:
+                db.session.execute(text(f"CREATE INDEX {nome} ON {definizione}"))
+                db.session.commit()
+                print(f"OK: Indice '{nome}' creato.")
+            except Exception as e:
+                if 'Duplicate key name' in str(e) or '1061' in str(e):
+                    print(f"L'indice '{nome}' esiste già. Nessuna modifica.")
+                    db.session.rollback()
+                else:
+                    db.session.rollback()
+                    raise
+
+
+if __name__ == '__main__':
+    run_migration()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+"""
+Migrazione: aggiunge gli indici per la timeline delle macchine: (macchina_id, created_at)
+su movimenti_macchine e macchina_id sulle tabelle ticket_macchine e foglio_macchine.
+Eseguire dalla root del progetto: python scripts/migrate_add_indici_timeline_macchine.py
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+INDICI = [
+    ('idx_movimenti_macchine_macchina_created', 'movimenti_macchine (macchina_id, created_at)'),
+    ('idx_ticket_macchine_macchina', 'ticket_macchine (macchina_id)'),
+    ('idx_foglio_macchine_macchina', 'foglio_macchine (macchina_id)'),
+]
+
+
+def run_migration():
+    from sqlalchemy import text
+    from app import create_app, db
+
+    app = create_app()
+    with app.app_context():
+        for nome, definizione in INDICI:
+            try:
+                db.session.execute(text(f"CREATE INDEX {nome} ON {definizione}"))
+                db.session.commit()
+                print(f"OK: Indice '{nome}' creato.")
+            except Exception as e:
+                if 'Duplicate key name' in str(e) or '1061' in str(e):
+                    print(f"L'indice '{nome}' esiste già. Nessuna modifica.")
+                    db.session.rollback()
+                else:
+                    db.session.rollback()
+                    raise
+
+
+if __name__ == '__main__':
+    run_migration()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""
+Migrazione: aggiunge la colonna promemoria_inviato_at alla tabella fogli_tecnici
+(ultimo promemoria inviato al tecnico per un foglio incompleto, evita i promemoria ripetuti).
+Eseguire dalla root del progetto: python scripts/migrate_add_promemoria_fogli.py
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def run_migration():
+    from sqlalchemy import text
+    from app import create_app, db
+
+    app = create_app()
+    with app.app_context():
+        try:
+            db.session.execute(text(
+                "ALTER TABLE fogli_tecnici ADD COLUMN promemoria_inviato_at DATETIME NULL "
+                "COMMENT 'Ultimo promemoria al tecnico per foglio incompleto'"
+            ))
+            db.session.commit()
+            print("OK: Colonna 'promemoria_inviato_at' aggiunta a fogli_tecnici.")
+        except Exception as e:
+            if 'Duplicate column name' in str(e) or '1060' in str(e):
+                print("La colonna 'promemoria_inviato_at' esiste già. Nessuna modifica.")
+                db.session.rollback()
+            else:
+                db.session.rollback()
+                raise
+
+
+if __name__ == '__main__':
+    run_migration()
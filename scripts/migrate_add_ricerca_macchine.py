@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""
+Migrazione: aggiunge le colonne codice_normalizzato e numero_serie_normalizzato alla tabella macchine
+e costruisce l'indice trigrammi per la ricerca (tabella macchine_trigrammi).
+Eseguire dalla root del progetto: python scripts/migrate_add_ricerca_macchine.py
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def run_migration():
+    from sqlalchemy import text
+    from app import create_app, db
+    from app.services.ricerca_macchine import ricostruisci_indice_ricerca
+
+    app = create_app()
+    with app.app_context():
+        try:
+            db.session.execute(text("""
+                ALTER TABLE macchine
+                ADD COLUMN codice_normalizzato VARCHAR(50) NULL
+                COMMENT 'Codice senza punteggiatura, minuscolo (ricerca)',
+                ADD COLUMN numero_serie_normalizzato VARCHAR(100) NULL
+                COMMENT 'Matricola senza punteggiatura, minuscola (ricerca)',
+                ADD INDEX ix_macchine_codice_normalizzato (codice_normalizzato),
+                ADD INDEX ix_macchine_numero_serie_normalizzato (numero_serie_normalizzato)
+            """))
+            db.session.commit()
+            print("OK: Colonne di ricerca aggiunte a macchine.")
+        except Exception as e:
+            if 'Duplicate column name' in str(e) or '1060' in str(e):
+                print("Le colonne di ricerca esistono già. Nessuna modifica.")
+                db.session.rollback()
+            else:
+                db.session.rollback()
+                raise
+
+        # La tabella macchine_trigrammi è creata da db.create_all(): qui si popola l'indice
+        totale = ricostruisci_indice_ricerca()
+        print(f"OK: Indice di ricerca ricostruito per {totale} macchine.")
+
+
+if __name__ == '__main__':
+    run_migration()
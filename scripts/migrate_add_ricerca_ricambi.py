@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""
+Migrazione: aggiunge la colonna codice_normalizzato alla tabella ricambi
+e costruisce l'indice trigrammi per la ricerca (tabella ricambi_trigrammi).
+Eseguire dalla root del progetto: python scripts/migrate_add_ricerca_ricambi.py
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def run_migration():
+    from sqlalchemy import text
+    from app import create_app, db
+    from app.services.ricerca_ricambi import ricostruisci_indice_ricerca
+
+    app = create_app()
+    with app.app_context():
+        try:
+            db.session.execute(text("""
+                ALTER TABLE ricambi
+                ADD COLUMN codice_normalizzato VARCHAR(50) NULL
+                COMMENT 'Codice senza punteggiatura, minuscolo (ricerca)',
+                ADD INDEX ix_ricambi_codice_normalizzato (codice_normalizzato)
+            """))
+            db.session.commit()
+            print("OK: Colonna 'codice_normalizzato' aggiunta a ricambi.")
+        except Exception as e:
+            if 'Duplicate column name' in str(e) or '1060' in str(e):
+                print("La colonna 'codice_normalizzato' esiste già. Nessuna modifica.")
+                db.session.rollback()
+            else:
+                db.session.rollback()
+                raise
+
+        # La tabella ricambi_trigrammi è creata da db.create_all(): qui si popola l'indice
+        totale = ricostruisci_indice_ricerca()
+        print(f"OK: Indice di ricerca ricostruito per {totale} ricambi.")
+
+
+if __name__ == '__main__':
+    run_migration()
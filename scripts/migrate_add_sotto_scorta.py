@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+Migrazione: aggiunge la colonna generata sotto_scorta alla tabella ricambi
+e popola la coda allarmi_scorta con i ricambi già sotto scorta.
+Eseguire dalla root del progetto: python scripts/migrate_add_sotto_scorta.py
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def run_migration():
+    from sqlalchemy import text
+    from app import create_app, db
+
+    app = create_app()
+    with app.app_context():
+        try:
+            db.session.execute(text("""
+                ALTER TABLE ricambi
+                ADD COLUMN sotto_scorta TINYINT(1)
+                GENERATED ALWAYS AS (quantita_minima > 0 AND quantita_disponibile <= quantita_minima) STORED,
+                ADD INDEX idx_ricambi_sotto_scorta (sotto_scorta, quantita_disponibile)
+            """))
+            db.session.commit()
+            print("OK: Colonna 'sotto_scorta' aggiunta a ricambi.")
+        except Exception as e:
+            if 'Duplicate column name' in str(e) or '1060' in str(e):
+                print("La colonna 'sotto_scorta' esiste già. Nessuna modifica.")
+                db.session.rollback()
+            else:
+                db.session.rollback()
+                raise
+
+        # La tabella allarmi_scorta è creata da db.create_all(): qui si allinea lo stato iniziale
+        result = db.session.execute(text("""
+            INSERT INTO allarmi_scorta (ricambio_id, quantita_rilevata, created_at)
+            SELECT r.id, r.quantita_disponibile, NOW()
+            FROM ricambi r
+            LEFT JOIN allarmi_scorta a ON a.ricambio_id = r.id
+            WHERE r.sotto_scorta = 1 AND a.id IS NULL
+        """))
+        db.session.commit()
+        print(f"OK: {result.rowcount} allarmi sotto scorta inizializzati.")
+
+
+if __name__ == '__main__':
+    run_migration()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+"""
+Migrazione: aggiunge le colonne stato_invio_email ed errore_invio_email alla tabella
+fogli_tecnici (stato di consegna dell'outbox email). La tabella email_outbox è creata
+da db.create_all().
+Eseguire dalla root del progetto: python scripts/migrate_add_stato_invio_email.py
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def run_migration():
+    from sqlalchemy import text
+    from app import create_app, db
+
+    app = create_app()
+    with app.app_context():
+        colonne = [
+            ('stato_invio_email', "VARCHAR(20) NULL COMMENT 'Consegna email: In coda, Inviata, Errore'"),
+            ('errore_invio_email', "VARCHAR(500) NULL COMMENT 'Ultimo errore di consegna email'"),
+        ]
+        for nome, definizione in colonne:
+            try:
+                db.session.execute(text(f"ALTER TABLE fogli_tecnici ADD COLUMN {nome} {definizione}"))
+                db.session.commit()
+                print(f"OK: Colonna '{nome}' aggiunta a fogli_tecnici.")
+            except Exception as e:
+                if 'Duplicate column name' in str(e) or '1060' in str(e):
+                    print(f"La colonna '{nome}' esiste già. Nessuna modifica.")
+                    db.session.rollback()
+                else:
+                    db.session.rollback()
+                    raise
+
+
+if __name__ == '__main__':
+    run_migration()
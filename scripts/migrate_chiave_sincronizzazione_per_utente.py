@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+"""
+Migrazione: la chiave di idempotenza della sincronizzazione fogli diventa univoca per utente
+(indice univoco su user_id, chiave al posto di quello globale su chiave).
+Eseguire dalla root del progetto: python scripts/migrate_chiave_sincronizzazione_per_utente.py
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def run_migration():
+    from sqlalchemy import text
+    from app import create_app, db
+
+    app = create_app()
+    with app.app_context():
+        try:
+            db.session.execute(text(
+                "ALTER TABLE sincronizzazioni_fogli "
+                "DROP INDEX ix_sincronizzazioni_fogli_chiave, "
+                "ADD CONSTRAINT uq_sincronizzazioni_fogli_utente_chiave UNIQUE (user_id, chiave)"
+            ))
+            db.session.commit()
+            print("OK: Chiave di sincronizzazione ora univoca per utente.")
+        except Exception as e:
+            if "Can't DROP" in str(e) or '1091' in str(e):
+                print("L'indice globale su 'chiave' non esiste più. Nessuna modifica.")
+                db.session.rollback()
+            else:
+                db.session.rollback()
+                raise
+
+
+if __name__ == '__main__':
+    run_migration()
@@ -0,0 +1,91 @@
+import os
+import sys
+
+import pytest
+from flask import g, has_app_context
+from flask.testing import FlaskClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['EMAIL_IMPORT_ENABLED'] = 'False'
+os.environ.setdefault('SECRET_KEY', 'chiave-di-test-' + 'x' * 32)
+
+import config as app_config
+
+
+class ClientDiTest(FlaskClient):
+    """
+    Le richieste riusano il contesto applicativo aperto dal test, quindi anche g:
+    l'utente che Flask-Login memorizza in g va dimenticato a ogni richiesta
+    """
+
+    def open(self, *args, **kwargs):
+        if has_app_context():
+            g.pop('_login_user', None)
+        return super().open(*args, **kwargs)
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """Applicazione su database sqlite temporaneo e cartella upload dedicata"""
+    cartella = tmp_path_factory.mktemp('dbdesk')
+
+    class TestConfig(app_config.DevelopmentConfig):
+        TESTING = True
+        DEBUG = False
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{cartella / 'test.db'}"
+        WTF_CSRF_ENABLED = False
+        UPLOAD_FOLDER = str(cartella / 'uploads')
+        ATTACHMENTS_FOLDER = str(cartella / 'uploads' / 'attachments')
+        DOCS_FOLDER = str(cartella / 'uploads' / 'docs')
+
+    app_config.config['testing'] = TestConfig
+
+    from app import create_app
+    app = create_app('testing')
+    app.test_client_class = ClientDiTest
+    return app
+
+
+@pytest.fixture
+def db(app):
+    """Database vuoto per ogni test"""
+    from app import db as _db
+
+    with app.app_context():
+        _db.drop_all()
+        _db.create_all()
+        yield _db
+        _db.session.remove()
+
+
+@pytest.fixture
+def reparto(db):
+    from app.models import Department
+
+    department = Department(name='meccanica', display_name='Meccanica')
+    db.session.add(department)
+    db.session.commit()
+    return department
+
+
+@pytest.fixture
+def admin(db, reparto):
+    from app.models import User
+
+    user = User('admin', 'admin@example.com', 'password', 'Mario', 'Rossi',
+                is_admin=True, department_id=reparto.id)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def client_for(app):
+    """Client di test già autenticato come l'utente indicato"""
+    def _client(user):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+        return client
+    return _client
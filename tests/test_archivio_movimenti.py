@@ -0,0 +1,21 @@
+import pytest
+
+AVVISO = 'sono in archivio'
+
+
+@pytest.mark.parametrize('url, tabella_origine', [
+    ('/magazzino/movimenti', 'movimenti_magazzino'),
+    ('/macchine/movimenti', 'movimenti_macchine'),
+])
+def test_avviso_archivio_solo_con_movimenti_archiviati(db, admin, client_for, url, tabella_origine):
+    from app.models.archivio import ArchivioMovimenti
+
+    client = client_for(admin)
+    risposta = client.get(url)
+    assert risposta.status_code == 200
+    assert AVVISO not in risposta.get_data(as_text=True)
+
+    db.session.add(ArchivioMovimenti(tabella_origine=tabella_origine, anno=2020,
+                                     nome_tabella=f'{tabella_origine}_2020', righe=10))
+    db.session.commit()
+    assert AVVISO in client.get(url).get_data(as_text=True)
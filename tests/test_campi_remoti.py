@@ -0,0 +1,75 @@
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from app.forms.fields import RemoteSelectField, int_or_none
+
+
+@pytest.fixture
+def clienti(db, reparto):
+    from app.models import Cliente
+
+    attivo = Cliente('Attivo', 'attivo@example.com', reparto.id)
+    disattivato = Cliente('Disattivato', 'off@example.com', reparto.id, is_active=False)
+    db.session.add_all([attivo, disattivato])
+    db.session.commit()
+    return attivo, disattivato
+
+
+def _errori_cliente(app, cliente_id):
+    from app.forms.macchina import MacchinaForm
+
+    with app.test_request_context(method='POST'):
+        form = MacchinaForm(formdata=MultiDict({'cliente_id': str(cliente_id)}))
+        form.cliente_id.validate(form)
+        return form.cliente_id.errors
+
+
+def test_macchina_accetta_solo_clienti_attivi(app, clienti):
+    attivo, disattivato = clienti
+
+    assert _errori_cliente(app, attivo.id) == []
+    assert _errori_cliente(app, disattivato.id) == ['Scelta non valida']
+    assert _errori_cliente(app, 999) == ['Scelta non valida']
+    assert _errori_cliente(app, '') == []
+
+
+def test_scelta_remota_richiede_ids_selezionati():
+    from app.forms.fields import _SceltaRemota
+
+    class SenzaIds(_SceltaRemota):
+        pass
+
+    with pytest.raises(TypeError):
+        SenzaIds()
+    assert issubclass(RemoteSelectField, _SceltaRemota)
+
+
+@pytest.mark.parametrize('valore, atteso', [('12', 12), (7, 7), ('', None), (None, None), ('abc', None)])
+def test_int_or_none(valore, atteso):
+    assert int_or_none(valore) == atteso
+
+
+def test_modifica_ticket_con_cliente_disattivato(app, db, admin, clienti, client_for):
+    from app.models import Ticket
+
+    attivo, disattivato = clienti
+    ticket = Ticket('Guasto', 'Non si accende', disattivato.id, admin.id, department_id=admin.department_id)
+    db.session.add(ticket)
+    db.session.commit()
+
+    dati = {'titolo': 'Guasto aggiornato', 'descrizione': 'Non si accende', 'categoria': 'Generale',
+            'priorita': 'Media', 'stato': 'Aperto', 'assigned_to': '0', 'cliente': str(disattivato.id)}
+    risposta = client_for(admin).post(f'/tickets/{ticket.id}/edit', data=dati)
+
+    assert risposta.status_code == 302
+    db.session.refresh(ticket)
+    assert ticket.titolo == 'Guasto aggiornato'
+    assert ticket.cliente_id == disattivato.id
+
+    # Il cliente disattivato resta escluso per gli altri ticket
+    with app.test_request_context(method='POST'):
+        from app.forms.ticket import TicketForm
+
+        form = TicketForm(formdata=MultiDict({'cliente': str(disattivato.id)}))
+        form.cliente.validate(form)
+        assert form.cliente.errors == ['Scelta non valida']
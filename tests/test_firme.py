@@ -0,0 +1,47 @@
+import base64
+import io
+import os
+from datetime import datetime
+
+from PIL import Image, ImageDraw
+
+
+def _firma_png(larghezza):
+    """Firma di prova in base64: un tratto nero su sfondo trasparente"""
+    immagine = Image.new('RGBA', (400, 150), (255, 255, 255, 0))
+    ImageDraw.Draw(immagine).line((20, 75, 20 + larghezza, 100), fill=(0, 0, 0, 255), width=4)
+    buffer = io.BytesIO()
+    immagine.save(buffer, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def test_sostituire_una_firma_non_elimina_il_file_usato_dall_altra(app, db, reparto, admin):
+    from app.models import Cliente, FoglioTecnico
+    from app.routes.fogli_tecnici import _save_signature
+
+    cliente = Cliente('Cliente A', 'a@example.com', reparto.id)
+    db.session.add(cliente)
+    db.session.commit()
+    foglio = FoglioTecnico('Intervento', datetime(2026, 10, 1, 9, 30), cliente.id, admin.id, reparto.id)
+    db.session.add(foglio)
+    db.session.commit()
+
+    # Firme identiche: tecnico e cliente condividono lo stesso file
+    with app.test_request_context():
+        condivisa = _save_signature(foglio, 'tecnico', _firma_png(200))
+        assert _save_signature(foglio, 'cliente', _firma_png(200)) == condivisa
+        db.session.commit()
+
+        nuova = _save_signature(foglio, 'tecnico', _firma_png(300))
+        db.session.commit()
+
+    assert nuova != condivisa
+    assert (foglio.firma_tecnico_path, foglio.firma_cliente_path) == (nuova, condivisa)
+    assert os.path.exists(condivisa)
+
+    # Quando anche l'altra firma cambia, il file non più usato viene eliminato
+    with app.test_request_context():
+        _save_signature(foglio, 'cliente', _firma_png(300))
+        db.session.commit()
+    assert not os.path.exists(condivisa)
+    assert os.path.exists(nuova)
@@ -0,0 +1,53 @@
+import time
+from datetime import datetime, timedelta
+
+
+def _attendi(get_import_job, job_id):
+    for _ in range(100):
+        job = get_import_job(job_id)
+        if job['stato'] != 'In corso':
+            return job
+        time.sleep(0.05)
+    raise AssertionError('Importazione non conclusa')
+
+
+def test_import_listino_rimuove_i_job_conclusi(db, reparto, tmp_path):
+    from app.services import import_catalogo
+
+    vecchio = datetime.utcnow() - import_catalogo.DURATA_JOB_CONCLUSI - timedelta(minutes=1)
+    import_catalogo._import_jobs.update({
+        'concluso': {'stato': 'Completato', 'created_at': vecchio, 'completed_at': vecchio},
+        'in_corso': {'stato': 'In corso', 'created_at': vecchio, 'completed_at': None},
+    })
+    listino = tmp_path / 'listino.csv'
+    listino.write_text('codice;descrizione\nR001;Molla\n', encoding='utf-8')
+
+    job_id = import_catalogo.avvia_import_in_background(str(listino), reparto.id)
+
+    assert import_catalogo.get_import_job('concluso') is None
+    assert import_catalogo.get_import_job('in_corso') is not None
+    job = _attendi(import_catalogo.get_import_job, job_id)
+    assert job['stato'] == 'Completato' and job['completed_at'] is not None
+    import_catalogo._import_jobs.pop('in_corso')
+
+
+def test_import_macchine_rimuove_i_job_conclusi(db, reparto, tmp_path):
+    from app.models.macchina import TipoMacchina
+    from app.services import import_macchine
+
+    tipo = TipoMacchina(nome='Bilancia')
+    db.session.add(tipo)
+    db.session.commit()
+
+    vecchio = datetime.utcnow() - import_macchine.DURATA_JOB_CONCLUSI - timedelta(minutes=1)
+    import_macchine._import_jobs['concluso'] = {'stato': 'Errore', 'created_at': vecchio, 'completed_at': vecchio}
+    file_macchine = tmp_path / 'macchine.csv'
+    file_macchine.write_text('codice;marca;modello\nM001;Dibal;K-410\n', encoding='utf-8')
+
+    job_id = import_macchine.avvia_import_in_background(
+        str(file_macchine), tipo_macchina_id=tipo.id, department_id=reparto.id
+    )
+
+    assert import_macchine.get_import_job('concluso') is None
+    job = _attendi(import_macchine.get_import_job, job_id)
+    assert job['stato'] == 'Completato' and job['completed_at'] is not None
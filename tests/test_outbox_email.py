@@ -0,0 +1,58 @@
+from flask_mail import Mail
+
+from app.services import outbox_email
+
+
+def test_messaggi_preparati_prima_di_aprire_la_connessione(app, db, monkeypatch):
+    from app.models.email_outbox import EmailOutbox
+
+    monkeypatch.setitem(app.config, 'MAIL_DEFAULT_SENDER', 'dbdesk@example.com')
+    monkeypatch.setitem(app.config, 'MAIL_RATE_PER_MINUTE', 0)
+    for numero in range(3):
+        outbox_email.accoda_email('notifica', [f'cliente{numero}@example.com'], 'Oggetto', 'Testo', salva=False)
+    db.session.commit()
+
+    eventi = []
+    messaggio = outbox_email._messaggio
+    entra = outbox_email._ConnessioneSMTP.__enter__
+
+    def _messaggio(email):
+        eventi.append('messaggio')
+        return messaggio(email)
+
+    def _entra(connessione):
+        eventi.append('connessione')
+        return entra(connessione)
+
+    monkeypatch.setattr(outbox_email, '_messaggio', _messaggio)
+    monkeypatch.setattr(outbox_email._ConnessioneSMTP, '__enter__', _entra)
+
+    mail = Mail(app)
+    with mail.record_messages() as spediti:
+        assert outbox_email._invia_coda(mail) == 3
+
+    assert eventi == ['messaggio'] * 3 + ['connessione']
+    assert [m.recipients for m in spediti] == [[f'cliente{numero}@example.com'] for numero in range(3)]
+    assert {e.stato for e in EmailOutbox.query.all()} == {'Inviata'}
+
+
+def test_timeout_impostato_in_apertura(app, monkeypatch):
+    aperture = []
+
+    class SMTPFinto:
+        def __init__(self, host, port, timeout):
+            aperture.append((host, port, timeout))
+
+        def set_debuglevel(self, livello):
+            pass
+
+        def login(self, username, password):
+            pass
+
+    monkeypatch.setattr(outbox_email.smtplib, 'SMTP_SSL', SMTPFinto)
+    monkeypatch.setitem(app.config, 'MAIL_TIMEOUT', 12)
+
+    with app.app_context():
+        outbox_email._ConnessioneSMTP(Mail(app)).configure_host()
+
+    assert aperture == [(app.config['MAIL_SERVER'], app.config['MAIL_PORT'], 12)]
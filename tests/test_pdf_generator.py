@@ -0,0 +1,66 @@
+from datetime import datetime
+
+
+def test_impronta_indipendente_dall_ordine_di_macchine_e_ricambi(db, reparto, admin):
+    from app.models import Cliente, FoglioTecnico, Ricambio
+    from app.models.macchina import Macchina, TipoMacchina
+    from app.services.pdf_generator import dati_pdf_foglio, impronta_pdf
+
+    cliente = Cliente('Cliente A', 'a@example.com', reparto.id)
+    tipo = TipoMacchina(nome='Bilancia')
+    db.session.add_all([cliente, tipo])
+    db.session.commit()
+
+    macchine = [
+        Macchina(codice=codice, marca='Dibal', modello='K-410', tipo_macchina_id=tipo.id, department_id=reparto.id)
+        for codice in ('M003', 'M001', 'M002')
+    ]
+    ricambi = [
+        Ricambio(codice=codice, descrizione=f'Ricambio {codice}', department_id=reparto.id)
+        for codice in ('R2', 'R1')
+    ]
+    foglio = FoglioTecnico('Intervento', datetime(2026, 10, 1, 9, 30), cliente.id, admin.id, reparto.id)
+    db.session.add_all(macchine + ricambi + [foglio])
+    db.session.flush()
+    for m in macchine:
+        foglio.macchine_collegate.append(m)
+    for r in ricambi:
+        foglio.ricambi_utilizzati.append(r)
+    db.session.commit()
+
+    dati = dati_pdf_foglio(foglio)
+    assert [m['codice'] for m in dati['macchine']] == ['M001', 'M002', 'M003']
+    assert [r['codice'] for r in dati['ricambi']] == ['R1', 'R2']
+
+    # Stessi oggetti in ordine diverso (es. caricati in blocco dalla raccolta PDF): stessa impronta
+    invertiti = dati_pdf_foglio(foglio, list(reversed(macchine)), list(reversed(ricambi)))
+    assert impronta_pdf(invertiti) == impronta_pdf(dati)
+
+
+def test_coda_pdf_nuovo_job_se_il_foglio_cambia(db, reparto, admin, monkeypatch):
+    from concurrent.futures import Future
+    from app.models import Cliente, FoglioTecnico
+    from app.services import coda_pdf
+
+    # Rendering mai concluso: i job restano in corso
+    monkeypatch.setattr(coda_pdf, '_invia_al_pool', lambda app, dati, pdf_path: Future())
+    monkeypatch.setattr(coda_pdf, '_pdf_jobs', {})
+    monkeypatch.setattr(coda_pdf, '_job_per_foglio', {})
+    monkeypatch.setattr(coda_pdf, '_eventi', {})
+
+    cliente = Cliente('Cliente A', 'a@example.com', reparto.id)
+    db.session.add(cliente)
+    db.session.commit()
+    foglio = FoglioTecnico('Intervento', datetime(2026, 10, 1, 9, 30), cliente.id, admin.id, reparto.id)
+    db.session.add(foglio)
+    db.session.commit()
+
+    primo = coda_pdf.accoda_pdf_foglio(foglio.id)
+    assert coda_pdf.accoda_pdf_foglio(foglio.id) == primo
+
+    # Dopo una modifica la richiesta non si aggancia al job con i dati vecchi
+    foglio.titolo = 'Intervento modificato'
+    db.session.commit()
+    secondo = coda_pdf.accoda_pdf_foglio(foglio.id)
+    assert secondo != primo
+    assert coda_pdf.get_pdf_job(secondo)['stato'] == 'In corso'
@@ -0,0 +1,32 @@
+import pytest
+
+
+@pytest.fixture
+def macchine(db, reparto):
+    from app.models.macchina import Macchina, TipoMacchina
+
+    tipo = TipoMacchina(nome='Bilancia')
+    db.session.add(tipo)
+    db.session.flush()
+    for codice, marca, modello in (
+        ('M001', 'Abc', 'K-410'),
+        ('M002', 'A%Z', 'K-410'),
+        ('M003', 'A_Z', 'K-410'),
+        ('M004', 'Dibal', 'A\\1'),
+    ):
+        db.session.add(Macchina(codice=codice, marca=marca, modello=modello,
+                                tipo_macchina_id=tipo.id, department_id=reparto.id))
+    db.session.commit()
+
+
+@pytest.mark.parametrize('termine, attesi', [
+    ('a%', ['M002']),
+    ('a_', ['M003']),
+    ('a\\', ['M004']),
+    ('ab', ['M001']),
+    ('a', ['M001', 'M002', 'M003', 'M004']),
+])
+def test_termini_corti_non_usano_caratteri_jolly(macchine, termine, attesi):
+    from app.services.ricerca_macchine import query_ricerca
+
+    assert [m.codice for m in query_ricerca(termine).all()] == attesi
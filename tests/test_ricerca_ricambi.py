@@ -0,0 +1,29 @@
+import pytest
+
+
+@pytest.fixture
+def ricambi(db, reparto):
+    from app.models import Ricambio
+
+    for codice, descrizione in (
+        ('R001', 'Abbattitore'),
+        ('R002', 'Sconto a% fisso'),
+        ('R003', 'Kit a_b'),
+        ('R004', 'Molla A'),
+    ):
+        db.session.add(Ricambio(codice=codice, descrizione=descrizione, department_id=reparto.id))
+    db.session.commit()
+
+
+@pytest.mark.parametrize('termine, attesi', [
+    ('a%', ['R002']),
+    ('a_', ['R003']),
+    ('ab', ['R001']),
+    ('a', ['R001', 'R002', 'R003', 'R004']),
+])
+def test_termini_corti_non_usano_caratteri_jolly(ricambi, termine, attesi):
+    from app.models import Ricambio
+    from app.services.ricerca_ricambi import filtra_ricerca
+
+    risultati = filtra_ricerca(Ricambio.query, termine).order_by(Ricambio.codice).all()
+    assert [r.codice for r in risultati] == attesi
@@ -0,0 +1,178 @@
+from datetime import date
+
+import pytest
+from flask_login import login_user
+
+
+@pytest.fixture
+def scenario(db, reparto, admin):
+    """Clienti, tipo macchina e un costruttore di macchine per i casi di ripristino"""
+    from app.models import Cliente
+    from app.models.macchina import Macchina, TipoMacchina
+
+    cliente_a = Cliente('Cliente A', 'a@example.com', reparto.id)
+    cliente_b = Cliente('Cliente B', 'b@example.com', reparto.id)
+    tipo = TipoMacchina(nome='Bilancia')
+    db.session.add_all([cliente_a, cliente_b, tipo])
+    db.session.commit()
+
+    contatore = iter(range(1, 1000))
+
+    def macchina(stato='Disponibile', cliente_id=None, ubicazione='Magazzino'):
+        m = Macchina(
+            codice=f'M{next(contatore):03d}', marca='Dibal', modello='K-410',
+            tipo_macchina_id=tipo.id, department_id=reparto.id,
+            stato=stato, cliente_id=cliente_id, ubicazione=ubicazione,
+        )
+        db.session.add(m)
+        db.session.flush()
+        return m
+
+    return {'cliente_a': cliente_a, 'cliente_b': cliente_b, 'macchina': macchina}
+
+
+def _collega(movimento, admin, **campi):
+    movimento.user_id = admin.id
+    for campo, valore in campi.items():
+        setattr(movimento, campo, valore)
+
+
+def _movimenti(macchina, tipo):
+    from app.models.macchina import MovimentoMacchina
+    return MovimentoMacchina.query.filter_by(macchina_id=macchina.id, tipo_movimento=tipo).all()
+
+
+def test_chiusura_ticket_ripristina_macchine(app, db, admin, scenario):
+    from app.models import Ticket
+    from app.routes.tickets import _ripristina_stati_macchine_ticket
+
+    cliente_a, cliente_b = scenario['cliente_a'], scenario['cliente_b']
+    ticket = Ticket('Bilancia guasta', 'Non pesa', cliente_b.id, admin.id, department_id=admin.department_id)
+    db.session.add(ticket)
+    db.session.flush()
+
+    # Riparazione di macchine attive presso un cliente (cliente_originale)
+    in_riparazione = []
+    for _ in range(3):
+        m = scenario['macchina']('Attiva', cliente_a.id, 'Sede Cliente A')
+        m.prossima_manutenzione = date(2027, 1, 15)
+        _collega(m.invia_in_riparazione(), admin, ticket_id=ticket.id)
+        in_riparazione.append(m)
+
+    # Macchine sostitutive in prestito
+    sostitutive = []
+    for _ in range(3):
+        m = scenario['macchina']()
+        _collega(m.assegna_a_cliente(cliente_b.id, 'In prestito', 'Prestito sostitutivo durante riparazione'),
+                 admin, ticket_id=ticket.id)
+        sostitutive.append(m)
+
+    # Riparazione di macchine di magazzino: solo stato_precedente
+    da_magazzino = []
+    for _ in range(3):
+        m = scenario['macchina']()
+        _collega(m.invia_in_riparazione(), admin, ticket_id=ticket.id)
+        da_magazzino.append(m)
+
+    # Prima sostitutiva, poi rientrata e mandata in riparazione: conta il movimento che
+    # corrisponde allo stato attuale, non il primo del ticket
+    riutilizzata = scenario['macchina']()
+    _collega(riutilizzata.assegna_a_cliente(cliente_b.id, 'In prestito', 'Prestito sostitutivo'),
+             admin, ticket_id=ticket.id)
+    _collega(riutilizzata.riporta_in_magazzino(), admin, ticket_id=ticket.id)
+    _collega(riutilizzata.invia_in_riparazione(), admin, ticket_id=ticket.id)
+    db.session.commit()
+
+    with app.test_request_context():
+        login_user(admin)
+        ticket.chiudi_ticket()
+        _ripristina_stati_macchine_ticket(ticket)
+        db.session.commit()
+
+    for m in in_riparazione:
+        assert (m.stato, m.cliente_id, m.ubicazione) == ('Attiva', cliente_a.id, 'Sede Cliente A')
+        assert m.prossima_manutenzione == date(2027, 1, 15)
+        [ripristino] = _movimenti(m, 'Ripristino')
+        assert (ripristino.stato_precedente, ripristino.stato_nuovo) == ('In riparazione', 'Attiva')
+        assert (ripristino.cliente_id, ripristino.ticket_id, ripristino.user_id) == (cliente_a.id, ticket.id, admin.id)
+
+    for m in sostitutive:
+        assert (m.stato, m.cliente_id, m.ubicazione, m.data_assegnazione) == ('Disponibile', None, 'Magazzino', None)
+        [rientro] = _movimenti(m, 'Rientro')
+        assert (rientro.stato_precedente, rientro.stato_nuovo, rientro.ticket_id) == ('In prestito', 'Disponibile', ticket.id)
+
+    for m in da_magazzino + [riutilizzata]:
+        assert (m.stato, m.cliente_id, m.ubicazione) == ('Disponibile', None, 'Magazzino')
+        [ripristino] = _movimenti(m, 'Ripristino')
+        assert (ripristino.stato_precedente, ripristino.stato_nuovo) == ('In riparazione', 'Disponibile')
+
+
+def test_eliminazione_foglio_ripristina_macchine(db, admin, scenario, client_for):
+    from app.models import FoglioTecnico
+    from app.models.macchina import Macchina
+
+    cliente_a, cliente_b = scenario['cliente_a'], scenario['cliente_b']
+    foglio = FoglioTecnico('Intervento', date(2026, 10, 1), cliente_b.id, admin.id, admin.department_id)
+    db.session.add(foglio)
+    db.session.flush()
+
+    in_riparazione = [scenario['macchina']('Attiva', cliente_a.id, 'Sede Cliente A') for _ in range(3)]
+    for m in in_riparazione:
+        _collega(m.invia_in_riparazione(), admin, foglio_id=foglio.id)
+
+    sostitutive = [scenario['macchina']() for _ in range(3)]
+    for m in sostitutive:
+        _collega(m.assegna_a_cliente(cliente_b.id, 'In prestito', 'Prestito sostitutivo'), admin, foglio_id=foglio.id)
+
+    # Attive senza cliente: si ripristina solo lo stato
+    solo_stato = [scenario['macchina']('Attiva', None, 'Sede') for _ in range(3)]
+    for m in solo_stato:
+        _collega(m.invia_in_riparazione(), admin, foglio_id=foglio.id)
+    db.session.commit()
+    ids = {m.id: gruppo for gruppo, macchine in
+           (('riparazione', in_riparazione), ('sostitutiva', sostitutive), ('solo_stato', solo_stato))
+           for m in macchine}
+
+    risposta = client_for(admin).post(f'/fogli-tecnici/delete/{foglio.id}')
+    assert risposta.status_code == 302
+    db.session.expire_all()
+    assert FoglioTecnico.query.get(foglio.id) is None
+
+    for macchina_id, gruppo in ids.items():
+        m = Macchina.query.get(macchina_id)
+        [ripristino] = _movimenti(m, 'Ripristino automatico')
+        assert ripristino.user_id == admin.id
+        if gruppo == 'riparazione':
+            assert (m.stato, m.cliente_id, m.ubicazione) == ('Attiva', cliente_a.id, 'Sede Cliente A')
+            assert (ripristino.stato_precedente, ripristino.stato_nuovo, ripristino.cliente_id) == \
+                ('In riparazione', 'Attiva', cliente_a.id)
+        elif gruppo == 'sostitutiva':
+            assert (m.stato, m.cliente_id, m.ubicazione) == ('Disponibile', None, 'Magazzino')
+            assert (ripristino.stato_precedente, ripristino.stato_nuovo) == ('In prestito', 'Disponibile')
+        else:
+            assert (m.stato, m.cliente_id, m.ubicazione) == ('Attiva', None, 'Riparazione')
+            assert (ripristino.stato_precedente, ripristino.stato_nuovo) == ('In riparazione', 'Attiva')
+        # I movimenti del foglio vengono eliminati, resta solo il ripristino
+        assert m.movimenti.count() == 1
+
+
+def test_applica_ripristini_scrive_prima_le_modifiche_in_sospeso(db, scenario):
+    from app.models.macchina import Macchina, MovimentoMacchina
+
+    m = scenario['macchina']('In riparazione', None, 'Riparazione')
+    db.session.commit()
+
+    with db.session.no_autoflush:
+        m.note = 'Verificata in laboratorio'
+        m.ubicazione = 'Banco 3'
+        MovimentoMacchina.applica_ripristini({m.id: {'stato': 'Disponibile'}}, [])
+
+        # Le colonne non ripristinate sono già sul database insieme al nuovo stato
+        tabella = Macchina.__table__
+        riga = db.session.execute(
+            tabella.select().where(tabella.c.id == m.id)
+        ).one()
+    assert (riga.stato, riga.note, riga.ubicazione) == ('Disponibile', 'Verificata in laboratorio', 'Banco 3')
+
+    db.session.commit()
+    assert (m.stato, m.note, m.ubicazione) == ('Disponibile', 'Verificata in laboratorio', 'Banco 3')
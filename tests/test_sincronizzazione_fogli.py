@@ -0,0 +1,56 @@
+import pytest
+
+
+@pytest.fixture
+def cliente(db, reparto):
+    from app.models import Cliente
+
+    cliente = Cliente('Cliente A', 'a@example.com', reparto.id)
+    db.session.add(cliente)
+    db.session.commit()
+    return cliente
+
+
+def _sincronizza(client, cliente, chiave):
+    risposta = client.post('/fogli-tecnici/api/sincronizza', json={'fogli': [{
+        'chiave': chiave,
+        'cliente_id': cliente.id,
+        'titolo': 'Taratura bilancia',
+        'data_intervento': '2026-10-01T09:30',
+    }]})
+    assert risposta.status_code == 200
+    [risultato] = risposta.get_json()['risultati']
+    return risultato
+
+
+def test_stessa_chiave_da_utenti_diversi(db, reparto, admin, cliente, client_for):
+    from app.models import FoglioTecnico, User
+
+    collega = User('collega', 'collega@example.com', 'password', 'Luca', 'Bianchi',
+                   is_admin=True, department_id=reparto.id)
+    db.session.add(collega)
+    db.session.commit()
+
+    primo = _sincronizza(client_for(admin), cliente, 'chiave-1')
+    secondo = _sincronizza(client_for(collega), cliente, 'chiave-1')
+
+    # La chiave dell'altro utente non restituisce il suo foglio: ne viene creato uno nuovo
+    assert (primo['esito'], secondo['esito']) == ('creato', 'creato')
+    assert primo['foglio_id'] != secondo['foglio_id']
+    assert FoglioTecnico.query.get(secondo['foglio_id']).tecnico_id == collega.id
+
+    # Ripetere l'invio resta idempotente per ciascun utente
+    ripetuto = _sincronizza(client_for(admin), cliente, 'chiave-1')
+    assert (ripetuto['esito'], ripetuto['foglio_id']) == ('già sincronizzato', primo['foglio_id'])
+    assert FoglioTecnico.query.count() == 2
+
+
+@pytest.mark.parametrize('chiave', [['a'], {}])
+def test_chiave_non_stringa(db, admin, cliente, client_for, chiave):
+    from app.models import FoglioTecnico
+
+    risultato = _sincronizza(client_for(admin), cliente, chiave)
+
+    assert risultato['esito'] == 'errore'
+    assert any('Chiave di idempotenza' in errore for errore in risultato['errori'])
+    assert FoglioTecnico.query.count() == 0